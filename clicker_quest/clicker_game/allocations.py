@@ -0,0 +1,320 @@
+# coding=utf-8
+import gc
+import weakref
+from collections import OrderedDict
+from threading import Lock
+
+from django.core.exceptions import ImproperlyConfigured
+
+from clicker_game.timing import PhaseTimer
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+
+"""
+Allocation profiling for game requests, with tracemalloc and the garbage collector's callbacks.
+
+The game engine makes a lot of short-lived dicts (copies of costs, client state entries, the
+Dicted resources), and garbage collections they set off show up as latency. With CLICKER_TIMING
+on, two timers can be set as the CLICKER_PHASE_TIMER:
+
+'clicker_game.allocations.GCTimer' records how long garbage collections paused each request.
+    This costs next to nothing, and can be left on.
+
+'clicker_game.allocations.AllocationTimer' also traces allocations, and records for each phase
+    the memory allocated during it that was still allocated at its end, in bytes and blocks; the
+    source lines that allocated it; and the request's peak traced memory. Tracing makes requests
+    several times slower, and the snapshots it takes set off many garbage collections of their
+    own, so that its collection figures are too high; requests running in other threads of the
+    same process get mixed up with each other too. It is for profiling, not for production, and
+    needs Python 3.4 or later.
+
+The time of the pauses is sent as a 'gc' phase, so it is in the Server-Timing header and the phase
+histograms too, and everything else is added up in the process-wide AllocationProfile that
+/debug/allocations/ dumps.
+
+GCTimer(histograms=None, profile=profile):
+    A PhaseTimer that also records garbage collections.
+
+    gc_seconds, gc_collections:
+        The time spent in garbage collections during the request, and how many there were of
+        each generation.
+
+AllocationTimer(histograms=None, profile=profile):
+    A GCTimer that also records allocations.
+
+    allocations:
+        {phase: [bytes, blocks]} allocated during each phase and still allocated at its end.
+
+    lines:
+        {(file name, line number): [bytes, blocks]} allocated and still allocated at the end of
+        the outermost phases, by the line that allocated them.
+
+    peak_bytes:
+        The most memory traced at once during the request, over what there was at its start,
+        counting short-lived objects (None before Python 3.9, which can't count it from a
+        request's start without clearing every trace).
+
+AllocationProfile:
+    The totals of requests' allocations by phase and source line, and their garbage
+    collections. The module-level `profile` is the one the timers add to.
+
+measure_allocations(function, calls=1):
+    Call a function and return an AllocationResult of the peak memory the calls took at once and
+    the blocks they left allocated, as the benchmarks' allocation budgets do (see
+    clicker_game.benchmarks).
+
+AllocationBudgetExceeded:
+    The AssertionError that AllocationResult.check(max_bytes, max_blocks) raises.
+"""
+
+
+TRACE_FRAMES = 1  # frames of traceback kept for each allocation; the allocating line is enough
+TOP_LINES = 50  # lines kept in the profile's dump
+
+
+def ensure_tracing():
+    if tracemalloc is None:  # pragma: no cover
+        raise ImproperlyConfigured("Allocation profiling needs tracemalloc, from Python 3.4 on")
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+
+
+def take_snapshot():
+    # a snapshot is a lot of objects, which would set off collections that the request didn't
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # leave out what tracing itself allocates
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def reset_peak():
+    """Start counting the peak of traced memory from now, if this version of Python can"""
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+        return True
+    return False
+
+
+def allocated_since(before, after):
+    """{(file name, line number): [bytes, blocks]} allocated between two snapshots and not freed"""
+    result = {}
+    for stat in after.compare_to(before, 'lineno'):
+        if stat.size_diff > 0:
+            frame = stat.traceback[0]
+            result[(frame.filename, frame.lineno)] = [stat.size_diff, max(stat.count_diff, 0)]
+    return result
+
+
+# ~~~ garbage collections ~~~
+
+# timers of requests in progress, which every garbage collection is added to
+_collecting = weakref.WeakSet()
+_collection_started = []
+
+
+def _gc_callback(phase, info):
+    if not _collecting:
+        return
+    if phase == 'start':
+        _collection_started[:] = [PhaseTimer.clock()]
+    elif _collection_started:
+        seconds = PhaseTimer.clock() - _collection_started.pop()
+        for timer in list(_collecting):
+            timer.collected(info['generation'], seconds)
+
+
+if hasattr(gc, 'callbacks'):
+    gc.callbacks.append(_gc_callback)
+
+
+# ~~~ requests ~~~
+
+class AllocationProfile(object):
+    """Thread safe, process-wide totals of requests' allocations and garbage collections."""
+    def __init__(self):
+        self._lock = Lock()
+        self._clear()
+
+    def observe(self, timer):
+        with self._lock:
+            self.requests += 1
+            for name, (size, count) in timer.allocations.items():
+                totals = self.phases.setdefault(name, [0, 0])
+                totals[0] += size
+                totals[1] += count
+            for line, (size, count) in timer.lines.items():
+                totals = self.lines.setdefault(line, [0, 0])
+                totals[0] += size
+                totals[1] += count
+            if timer.peak_bytes is not None:
+                self.max_peak_bytes = max(self.max_peak_bytes, timer.peak_bytes)
+            self.gc_seconds += timer.gc_seconds
+            self.max_gc_seconds = max(self.max_gc_seconds, timer.gc_seconds)
+            self.gc_collections = [a + b for a, b in zip(self.gc_collections, timer.gc_collections)]
+
+    def snapshot(self, top=TOP_LINES):
+        """Return a json-friendly copy of the totals, with the lines that allocated the most"""
+        with self._lock:
+            lines = sorted(self.lines.items(), key=lambda item: -item[1][0])[:top]
+            return OrderedDict([
+                ('requests', self.requests),
+                ('phases', OrderedDict(
+                    (name, {'bytes': size, 'blocks': count}) for name, (size, count) in self.phases.items()
+                )),
+                ('lines', [
+                    OrderedDict([('line', '{0}:{1}'.format(*line)), ('bytes', size), ('blocks', count)])
+                    for line, (size, count) in lines
+                ]),
+                ('max_peak_bytes', self.max_peak_bytes),
+                ('gc', OrderedDict([
+                    ('seconds', self.gc_seconds),
+                    ('max_seconds', self.max_gc_seconds),
+                    ('collections', list(self.gc_collections)),
+                ])),
+            ])
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.requests = 0
+        self.phases = OrderedDict()
+        self.lines = {}
+        self.max_peak_bytes = 0
+        self.gc_seconds = 0.0
+        self.max_gc_seconds = 0.0
+        self.gc_collections = [0, 0, 0]
+
+
+profile = AllocationProfile()
+
+
+class _AllocationPhase(object):
+    __slots__ = ('timer', 'name', 'start', 'snapshot')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = None
+        self.snapshot = None
+
+    def __enter__(self):
+        self.snapshot = take_snapshot()
+        self.timer.depth += 1
+        self.start = self.timer.clock()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # timed without the snapshots
+        self.timer.record(self.name, self.timer.clock() - self.start)
+        self.timer.depth -= 1
+        self.timer.record_allocations(self.name, allocated_since(self.snapshot, take_snapshot()))
+        return False
+
+
+class GCTimer(PhaseTimer):
+    """Records how long each phase of a request took, and how long garbage collections paused it."""
+    def __init__(self, histograms=None, profile=profile):
+        super(GCTimer, self).__init__(histograms)
+        self.profile = profile
+        self.allocations = OrderedDict()
+        self.lines = {}
+        self.peak_bytes = None
+        self.gc_seconds = 0.0
+        self.gc_collections = [0, 0, 0]
+        _collecting.add(self)
+
+    def collected(self, generation, seconds):
+        self.gc_seconds += seconds
+        self.gc_collections[generation] += 1
+
+    def finish(self, response):
+        _collecting.discard(self)
+        self.phases['gc'] = self.gc_seconds
+        if self.profile is not None:
+            self.profile.observe(self)
+        return super(GCTimer, self).finish(response)
+
+
+class AllocationTimer(GCTimer):
+    """Records how long each phase of a request took, what it allocated, and its garbage collections."""
+    def __init__(self, histograms=None, profile=profile):
+        ensure_tracing()
+        super(AllocationTimer, self).__init__(histograms, profile)
+        self.depth = 0
+        self.start_bytes = tracemalloc.get_traced_memory()[0]
+        self.tracks_peak = reset_peak()
+
+    def phase(self, name):
+        return _AllocationPhase(self, name)
+
+    def record_allocations(self, name, lines):
+        totals = self.allocations.setdefault(name, [0, 0])
+        for size, count in lines.values():
+            totals[0] += size
+            totals[1] += count
+        # nested phases' allocations are counted again in the phase around them
+        if self.depth == 0:
+            for line, (size, count) in lines.items():
+                line_totals = self.lines.setdefault(line, [0, 0])
+                line_totals[0] += size
+                line_totals[1] += count
+
+    def finish(self, response):
+        if self.tracks_peak:
+            self.peak_bytes = max(tracemalloc.get_traced_memory()[1] - self.start_bytes, 0)
+        return super(AllocationTimer, self).finish(response)
+
+
+# ~~~ budgets ~~~
+
+class AllocationBudgetExceeded(AssertionError):
+    pass
+
+
+class AllocationResult(object):
+    def __init__(self, calls, peak_bytes, blocks):
+        self.calls = calls
+        self.peak_bytes = peak_bytes  # the most memory the calls took at once
+        self.blocks = blocks  # blocks the calls left allocated, which grows with the calls if they leak
+
+    def check(self, max_bytes=None, max_blocks=None, name="Call"):
+        if max_bytes is not None and self.peak_bytes > max_bytes:
+            raise AllocationBudgetExceeded("{0} took {1} bytes at once, over its budget of {2}".format(
+                name, self.peak_bytes, max_bytes))
+        if max_blocks is not None and self.blocks > max_blocks:
+            raise AllocationBudgetExceeded("{0} left {1} blocks allocated, over its budget of {2}".format(
+                name, self.blocks, max_blocks))
+        return self
+
+
+def measure_allocations(function, calls=1):
+    """
+    Call a function and measure its allocations. Each call's result is dropped before the next
+    one, so the peak is the most any one call took at once, short-lived objects included. The
+    traces are cleared to measure the peak before Python 3.9, so this is not for running
+    alongside profiled requests.
+    """
+    ensure_tracing()
+    gc.collect()
+    before = take_snapshot()
+    if not reset_peak():
+        tracemalloc.clear_traces()
+        before = take_snapshot()
+    start_bytes = tracemalloc.get_traced_memory()[0]
+    for _ in range(calls):
+        function()
+    peak_bytes = tracemalloc.get_traced_memory()[1] - start_bytes
+    blocks = sum(count for size, count in allocated_since(before, take_snapshot()).values())
+    return AllocationResult(calls, max(peak_bytes, 0), blocks)
@@ -1,7 +1,29 @@
 from __future__ import unicode_literals
 
+import json
+
 from django.apps import AppConfig
 
 
+# customize json form field dump inside django to make it readable in forms
+def prepare_value(self, value):
+    from django.contrib.postgres.forms.jsonb import InvalidJSONInput
+    if isinstance(value, InvalidJSONInput):
+        return value
+    return json.dumps(value, sort_keys=True, indent=4)
+
+
 class ClickerGameConfig(AppConfig):
     name = 'clicker_game'
+
+    def ready(self):
+        # deferred until the app registry is ready, rather than done on importing the models
+        from django.contrib.postgres.forms.jsonb import JSONField as JSONField_form
+        JSONField_form.prepare_value = prepare_value
+
+        # connects the registry's, listener's and user cache's signal receivers, and loads compiled
+        # models if there's a snapshot
+        from clicker_game.snapshots import snapshot
+        import clicker_game.invalidation  # noqa
+        import clicker_game.auth_cache  # noqa
+        snapshot.load()
@@ -0,0 +1,134 @@
+# coding=utf-8
+import json
+import zlib
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from clicker_game.models import ArchivedGameInstance, GameInstance
+from clicker_game.registry import registry
+from clicker_game.routers import pin_to_primary
+from clicker_game.sharding import iterate_game_instances, shard_for_user
+
+
+"""
+Cold storage for game instances whose games have stopped for good.
+
+A game keeps running while its player is away, slower and slower along its model's decay curve;
+with a curve that comes to a stop (like the default, after 7 days) a game left alone longer than
+that has reached a final state that later visits can't change. Those game instances are
+fast forwarded to their final state once and moved out of the GameInstance table, compressed,
+into ArchivedGameInstance on the same database, so that the hot table only holds games people are
+playing. When their player comes back, fetch_user_game (see clicker_game.sharding) puts the game
+back, as it was when it stopped, and it carries on from there.
+
+A game is archived under the model it was last played with; if the model is edited meanwhile,
+the new one takes over from the final state when the game is restored, rather than replaying the
+time away under the new rules.
+
+is_saturated(db_instance, model, now):
+    Whether a game instance has been left alone for longer than its game's decay takes to stop.
+
+archive_game_instance(db_instance, now=None):
+    Move a saturated game instance to the archive, fast forwarded to its final state. Returns
+    False if the player played it meanwhile, or it isn't saturated.
+
+archive_saturated(now=None, game=None, dry_run=False, batch_size=1000):
+    Archive every saturated game instance (of one game, or all of them), as the archive_games
+    command does, and return how many there were.
+
+restore_user_game(user_id, game_id):
+    Move a user's archived instance of a game back into the GameInstance table, returning
+    whether there was one.
+
+archived_user_games(user_id):
+    A queryset of a user's archived game instances, on their shard.
+"""
+
+
+def compress(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def decompress(compressed):
+    return json.loads(zlib.decompress(bytes(compressed)).decode('utf-8'))
+
+
+def user_database(user_id):
+    return shard_for_user(user_id) or DEFAULT_DB_ALIAS
+
+
+def archived_user_games(user_id):
+    return ArchivedGameInstance.objects.using(user_database(user_id)).filter(user_id=user_id)
+
+
+def is_saturated(db_instance, model, now):
+    saturation = model.decay.saturation_seconds
+    return saturation is not None and (now - db_instance.modified).total_seconds() >= saturation
+
+
+def archive_game_instance(db_instance, now=None):
+    now = now or timezone.now()
+    entry = registry.get(str(db_instance.game_id))
+    if entry is None:
+        return False
+    alias = user_database(db_instance.user_id)
+    with transaction.atomic(using=alias):
+        try:
+            # locked, and read again, in case the player came back since it was found
+            row = GameInstance.objects.using(alias).select_for_update().get(
+                pk=db_instance.pk, modified=db_instance.modified)
+        except GameInstance.DoesNotExist:
+            return False
+        if not is_saturated(row, entry.model, now):
+            return False
+        final_state, client_state = entry.model.load_game_instance(row.data, row.modified).get_current_state(now)
+        ArchivedGameInstance.objects.using(alias).create(
+            user_id=row.user_id, game_id=row.game_id, model_version_id=entry.content_hash,
+            compressed_data=compress(final_state), created=row.created,
+        )
+        row.delete()
+    return True
+
+
+def archive_saturated(now=None, game=None, dry_run=False, batch_size=1000):
+    now = now or timezone.now()
+    archived = 0
+    # from the primary, since a replica may be missing games and game instances
+    with pin_to_primary():
+        registry.load()
+    entries = registry.entries() if game is None else [registry.get(str(game.pk))]
+    for entry in entries:
+        if entry is None:  # deleted since it was looked up
+            continue
+        saturation = entry.model.decay.saturation_seconds
+        if saturation is None:
+            continue
+        queryset = GameInstance.objects.using(DEFAULT_DB_ALIAS).filter(
+            game_id=entry.game.pk, modified__lte=now - timedelta(seconds=saturation))
+        for db_instance in iterate_game_instances(queryset.defer('data'), batch_size):
+            if dry_run or archive_game_instance(db_instance, now):
+                archived += 1
+    return archived
+
+
+def restore_user_game(user_id, game_id):
+    alias = user_database(user_id)
+    with transaction.atomic(using=alias):
+        archived = list(
+            ArchivedGameInstance.objects.using(alias).select_for_update()
+            .filter(user_id=user_id, game_id=game_id).order_by('-archived')
+        )
+        if not archived:
+            return False
+        # the game stopped when it was archived, so it carries on from now; modified is set on
+        # creation, and created goes in afterwards
+        if not GameInstance.objects.using(alias).filter(user_id=user_id, game_id=game_id).exists():
+            restored = GameInstance.objects.using(alias).create(
+                user_id=user_id, game_id=game_id, data=decompress(archived[0].compressed_data),
+                model_version_id=archived[0].model_version_id,
+            )
+            GameInstance.objects.using(alias).filter(pk=restored.pk).update(created=archived[0].created)
+        ArchivedGameInstance.objects.using(alias).filter(pk__in=[row.pk for row in archived]).delete()
+    return True
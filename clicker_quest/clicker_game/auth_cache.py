@@ -0,0 +1,139 @@
+# coding=utf-8
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, get_user_model, user_logged_out
+from django.contrib.auth.middleware import get_user
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db.models.query_utils import deferred_class_factory
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+
+"""
+Logged in users kept in the cache, so that game requests don't query the database for them.
+
+Every request of a logged in player reads their session and their user row before the game is
+even looked at. With SESSION_ENGINE set to cached_db (or signed_cookies) sessions are read
+without a query; CachedAuthenticationMiddleware, in place of Django's AuthenticationMiddleware,
+does the same for users, keeping the values of each user's fields in the cache named by
+CLICKER_AUTH_CACHE for CLICKER_AUTH_CACHE_SECONDS. A game request then only queries for its game
+instance (besides, on Postgres, the advisory lock that queues a player's actions; see
+clicker_game.coalescing).
+
+The password hash isn't cached: a cached user has it deferred, and loads it from the database if
+anything asks for it. The user's session authentication hash, which is derived from it, is cached
+instead, and checked against the session's like one from the database would be, so sessions
+still end when their user's password changes. Saving or deleting a user, and logging
+out, drops the user from the cache; that only reaches other processes through a shared cache
+(like memcached), and changes made without saving the user (like QuerySet.update()) aren't
+noticed until the entry times out. Without CLICKER_AUTH_CACHE the middleware does just what
+Django's does.
+
+CachedAuthenticationMiddleware:
+    Sets request.user, from the cache when it can. Put it in MIDDLEWARE_CLASSES after the
+    SessionMiddleware.
+
+forget_user(user_id):
+    Drop a user from the cache.
+"""
+
+
+KEY_PREFIX = 'clicker_user:'
+UNCACHED_FIELDS = ('password',)
+
+# what cached users are made as, which saves only the fields it was made with
+CachedUser = deferred_class_factory(get_user_model(), UNCACHED_FIELDS)
+
+
+def auth_cache():
+    alias = getattr(settings, 'CLICKER_AUTH_CACHE', None)
+    return None if alias is None else caches[alias]
+
+
+def cache_seconds():
+    return getattr(settings, 'CLICKER_AUTH_CACHE_SECONDS', 300)
+
+
+def user_fields(model):
+    return [field.attname for field in model._meta.concrete_fields if field.attname not in UNCACHED_FIELDS]
+
+
+def pack_user(user):
+    """
+    The user's database alias, session authentication hash and field values but the password,
+    which are all it takes to make it again
+    """
+    return (user._state.db, user.get_session_auth_hash()) + tuple(
+        getattr(user, name) for name in user_fields(type(user)))
+
+
+def unpack_user(packed):
+    """A packed user and their session authentication hash, or (None, None)"""
+    names = user_fields(get_user_model())
+    if len(packed) != len(names) + 2:  # cached before the user model changed
+        return None, None
+    return CachedUser.from_db(packed[0], names, packed[2:]), packed[1]
+
+
+def forget_user(user_id):
+    cache = auth_cache()
+    if cache is not None:
+        cache.delete(KEY_PREFIX + str(user_id))
+
+
+def get_cached_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = load_user(request)
+    return request._cached_user
+
+
+def load_user(request):
+    cache = auth_cache()
+    if cache is None:
+        return get_user(request)
+    try:
+        user_id = auth._get_user_session_key(request)
+        backend_path = request.session[BACKEND_SESSION_KEY]
+    except KeyError:
+        return AnonymousUser()
+    if backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return AnonymousUser()
+    key = KEY_PREFIX + str(user_id)
+    packed = cache.get(key)
+    user, auth_hash = (None, None) if packed is None else unpack_user(packed)
+    if user is None:
+        # checks the session, and flushes it if it doesn't match the user
+        user = auth.get_user(request)
+        if isinstance(user, get_user_model()):
+            cache.set(key, pack_user(user), cache_seconds())
+        return user
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if not (session_hash and constant_time_compare(session_hash, auth_hash)):
+        request.session.flush()
+        return AnonymousUser()
+    return user
+
+
+class CachedAuthenticationMiddleware(object):
+    def process_request(self, request):
+        assert hasattr(request, 'session'), (
+            "CachedAuthenticationMiddleware needs the SessionMiddleware before it in MIDDLEWARE_CLASSES"
+        )
+        request.user = SimpleLazyObject(lambda: get_cached_user(request))
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+@receiver(post_save, sender=CachedUser)
+@receiver(post_delete, sender=CachedUser)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def user_left(sender, request, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
@@ -0,0 +1,433 @@
+# coding=utf-8
+import json
+import os
+import pickle
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from timeit import default_timer
+
+from clicker_game.allocations import measure_allocations
+from clicker_game.bignum import BigNumber
+from clicker_game.decay import decay_curve
+from clicker_game.encoding import FragmentEncoder
+from clicker_game.game_model import is_click_building, validate_game_model
+from clicker_game.simulator import EPOCH, GreedyROI, simulate
+from clicker_game.snapshots import compile_model
+
+
+"""
+Micro-benchmarks for the hot paths of the game engine. Run them with `manage.py benchmark`.
+
+benchmark(name, per=1, max_bytes=None, max_blocks=None):
+    Decorator that registers a benchmark. The decorated function is given the game model
+    description (a json data dict) and returns a function taking no arguments to be timed.
+    Give per when each call does several of the things being measured (like a batch of
+    clicks), to report the time for each one. max_bytes and max_blocks are its allocation
+    budget for the example game model: the most memory one call may take at once, and the
+    most blocks ALLOCATION_CALLS calls may leave allocated (see clicker_game.allocations).
+
+BENCHMARKS:
+    Registered benchmarks by name, in the order they were registered.
+
+run_benchmark(name, json_data, min_seconds=0.2, repeat=5):
+    Time a benchmark and return a BenchmarkResult with the best time of several runs.
+
+measure_benchmark(name, json_data):
+    Measure a benchmark's allocations, returning an AllocationResult; check_budget(name, result)
+    raises an AllocationBudgetExceeded if they are over its budget.
+
+example_game_data(), played_state(model, seconds):
+    The example game model, and the save state of a game played well for some time, for
+    benchmarks that want something realistic to work on.
+"""
+
+
+EXAMPLE_MODEL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'example_game_model.json'
+)
+
+CLICK_BATCH = 20  # clicks per batch, the most a client sends in a second by default
+ALLOCATION_CALLS = 10  # calls measured for a benchmark's allocations
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, per=1, max_bytes=None, max_blocks=None):
+    def register(setup):
+        setup.per = per
+        setup.max_bytes = max_bytes
+        setup.max_blocks = max_blocks
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+class BenchmarkResult(object):
+    def __init__(self, name, calls, seconds, per=1):
+        self.name = name
+        self.calls = calls
+        self.seconds = seconds  # best time for one call
+        self.per = per
+
+    @property
+    def seconds_each(self):
+        return self.seconds / self.per
+
+    def as_json(self):
+        return OrderedDict([
+            ('name', self.name),
+            ('calls', self.calls),
+            ('seconds_per_call', self.seconds),
+            ('seconds_each', self.seconds_each),
+        ])
+
+
+def time_calls(function, number):
+    start = default_timer()
+    for _ in range(number):
+        function()
+    return default_timer() - start
+
+
+def run_benchmark(name, json_data, min_seconds=0.2, repeat=5):
+    """Time a registered benchmark, calling it enough times that each run takes at least min_seconds"""
+    setup = BENCHMARKS[name]
+    function = setup(json_data)
+    number = 1
+    while True:
+        elapsed = time_calls(function, number)
+        if elapsed >= min_seconds:
+            break
+        number *= 2 if elapsed * 10 >= min_seconds else 10
+    best = elapsed
+    for _ in range(repeat - 1):
+        best = min(best, time_calls(function, number))
+    return BenchmarkResult(name, number, best / number, setup.per)
+
+
+def measure_benchmark(name, json_data, calls=ALLOCATION_CALLS):
+    function = BENCHMARKS[name](json_data)
+    function()  # caches filled on the first call aren't counted
+    return measure_allocations(function, calls)
+
+
+def check_budget(name, result):
+    setup = BENCHMARKS[name]
+    return result.check(setup.max_bytes, setup.max_blocks, name)
+
+
+def example_game_data():
+    with open(EXAMPLE_MODEL) as f:
+        return json.load(f)
+
+
+def played_state(model, seconds, clicks_per_second=1.0):
+    """The save state of a game of a model played by the greedy strategy for some time"""
+    state = simulate(model, GreedyROI(), seconds, clicks_per_second).final_state
+    # the simulator counts clicks as income, so count them on the click buildings here
+    for building in model.buildings.values():
+        if is_click_building(building):
+            state.setdefault('buildings', {})[building.name] = int(seconds * clicks_per_second)
+    return state
+
+
+def click_building_name(model):
+    for building in model.buildings.values():
+        if is_click_building(building):
+            return building.name
+    raise KeyError("The game model has no click building")
+
+
+#
+# ~~~ Benchmarks ~~~
+#
+
+@benchmark('clicks.purchase', per=CLICK_BATCH)
+def bench_clicks_as_purchases(json_data):
+    """Every click as its own building purchase request, the way clicks used to be sent"""
+    model = validate_game_model(json_data)
+    state = played_state(model, 3600.0)
+    name = click_building_name(model)
+    encoder = FragmentEncoder()
+
+    def run():
+        for _ in range(CLICK_BATCH):
+            instance = model.load_game_instance(state, EPOCH)
+            save, client = instance.purchase_building(EPOCH + timedelta(seconds=0.05), name, 1)
+            encoder.encode(model, client)
+    return run
+
+
+@benchmark('clicks.batch', per=CLICK_BATCH, max_bytes=64000, max_blocks=300)
+def bench_click_batch(json_data):
+    """A second's worth of clicks in one request"""
+    model = validate_game_model(json_data)
+    state = played_state(model, 3600.0)
+    name = click_building_name(model)
+    encoder = FragmentEncoder()
+
+    def run():
+        instance = model.load_game_instance(state, EPOCH)
+        save, client = instance.record_clicks(EPOCH + timedelta(seconds=1), name, CLICK_BATCH, CLICK_BATCH)
+        encoder.encode(model, client)
+    return run
+
+
+@benchmark('clicks.try_click', max_bytes=2000, max_blocks=20)
+def bench_try_click(json_data):
+    """Applying a batch of clicks alone, without the fast forward and encoding around it"""
+    model = validate_game_model(json_data)
+    instance = model.load_game_instance(played_state(model, 3600.0), EPOCH)
+    instance.calculate_values()
+    name = click_building_name(model)
+
+    def run():
+        instance.try_click(name, CLICK_BATCH)
+    return run
+
+
+DECAY_BATCH = 10000  # instances in a batch recomputation
+
+EXAMPLE_CURVES = OrderedDict([
+    ('linear', None),
+    ('exponential', {'type': "exponential", 'full_speed': 86400, 'half_life': 86400}),
+    ('piecewise', {'type': "piecewise", 'points': [[0, 1], [86400, 1], [172800, 0.5], [604800, 0]]}),
+    ('step', {'type': "step", 'points': [[0, 1], [86400, 0.5], [604800, 0]]}),
+    ('table', {'type': "table", 'interval': 3600, 'speeds': [max(0.0, 1.0 - hour / 168.0) for hour in range(169)]}),
+])
+
+
+def register_decay_benchmarks(curve_name, curve_data):
+    @benchmark('decay.{0}.scalar'.format(curve_name))
+    def scalar(json_data):
+        """Effective seconds for one fast forward"""
+        curve = decay_curve(curve_data)
+        return lambda: curve.effective_seconds(200000.0)
+
+    @benchmark('decay.{0}.batch'.format(curve_name), per=DECAY_BATCH)
+    def batch(json_data):
+        """Effective seconds for a batch of instances at once"""
+        curve = decay_curve(curve_data)
+        seconds = [i * 97.0 for i in range(DECAY_BATCH)]
+        return lambda: curve.effective_seconds_many(seconds)
+
+
+for _name, _data in EXAMPLE_CURVES.items():
+    register_decay_benchmarks(_name, _data)
+
+
+NUMBER_BATCH = 1000  # operations per call of the number benchmarks
+
+NUMBER_TYPES = OrderedDict([
+    ('float', float),
+    ('bignum', BigNumber),
+    ('decimal', lambda value: Decimal(repr(value))),
+])
+
+
+def register_number_benchmarks(type_name, make):
+    values = [make(1.0 + i * 0.37) for i in range(NUMBER_BATCH)]
+
+    @benchmark('numbers.{0}.add'.format(type_name), per=NUMBER_BATCH)
+    def add_numbers(json_data):
+        """Adding one number to another"""
+        def run():
+            total = values[0]
+            for value in values:
+                total = total + value
+        return run
+
+    @benchmark('numbers.{0}.multiply'.format(type_name), per=NUMBER_BATCH)
+    def multiply_numbers(json_data):
+        """Multiplying by a number close to 1, like a cost factor"""
+        factor = make(1.15)
+
+        def run():
+            for value in values:
+                value * factor
+        return run
+
+    @benchmark('numbers.{0}.compare'.format(type_name), per=NUMBER_BATCH)
+    def compare_numbers(json_data):
+        """Comparing an amount with a cost"""
+        cost = make(100.0)
+
+        def run():
+            for value in values:
+                value >= cost
+        return run
+
+
+for _name, _make in NUMBER_TYPES.items():
+    register_number_benchmarks(_name, _make)
+
+
+@benchmark('numbers.bignum.add_float', per=NUMBER_BATCH)
+def add_floats_to_bignum(json_data):
+    """Adding float amounts, like a second's income, to a BigNumber"""
+    values = [1.0 + i * 0.37 for i in range(NUMBER_BATCH)]
+    start = BigNumber(1e300) * 1e300
+
+    def run():
+        total = start
+        for value in values:
+            total = total + value
+    return run
+
+
+def register_cost_benchmark(owned):
+    @benchmark('costs.owned_{0}'.format(owned), max_bytes=2000, max_blocks=20)
+    def building_cost(json_data):
+        """cost_of_building for ten buildings, once the player owns some"""
+        model = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "cookies"}],
+            'buildings': [{'name': "farm", 'cost': {"cookies": 10.0}, 'cost_factor': 1.15}],
+            'upgrades': [],
+            'new_game': {},
+        })
+        instance = model.load_game_instance({'buildings': {"farm": owned}}, EPOCH)
+        instance.calculate_values()
+        return lambda: instance.cost_of_building("farm", 10)
+
+
+# 5060 is where the cost of one building, but not the cost factor's power, overflows a float
+for _owned in (100, 5060, 6000):
+    register_cost_benchmark(_owned)
+
+
+def without_effects(json_data):
+    """A copy of a game model description with every upgrade and building effect taken out"""
+    json_data = json.loads(json.dumps(json_data))
+    for upgrade in json_data['upgrades']:
+        for key in ('buildings', 'upgrades', 'global'):
+            upgrade.pop(key, None)
+    for building in json_data['buildings']:
+        building.pop('effects', None)
+    return json_data
+
+
+def register_effect_benchmarks(label, prepare):
+    @benchmark('effects.{0}.calculate_values'.format(label), max_bytes=12000, max_blocks=60)
+    def calculate_values(json_data):
+        """calculate_values for a freshly loaded game an hour in"""
+        model = validate_game_model(prepare(json_data))
+        state = played_state(model, 3600.0)
+
+        def run():
+            model.load_game_instance(state, EPOCH).calculate_values()
+        return run
+
+    @benchmark('effects.{0}.recalculate'.format(label), per=2, max_bytes=2000, max_blocks=20)
+    def recalculate(json_data):
+        """calculate_values again after an upgrade (if any) or a building is bought"""
+        model = validate_game_model(prepare(json_data))
+        instance = model.load_game_instance(played_state(model, 3600.0), EPOCH)
+        instance.calculate_values()
+        if instance.upgrades:
+            name = sorted(instance.upgrades)[-1]
+
+            def run():
+                instance.upgrades.discard(name)
+                instance.calculate_values()
+                instance.upgrades.add(name)
+                instance.calculate_values()
+        else:
+            building = instance.buildings[sorted(instance.buildings)[-1]]
+
+            def run():
+                building.owned += 1
+                instance.calculate_values()
+                building.owned -= 1
+                instance.calculate_values()
+        return run
+
+
+register_effect_benchmarks('model', lambda json_data: json_data)
+register_effect_benchmarks('none', without_effects)
+
+
+CHAIN_LENGTH = 100  # buildings in the production chain benchmarks
+
+
+def chain_game_data(length):
+    """
+    A game model with a production chain: a well makes half a unit of water a second, and each of
+    length buildings after it turns a unit a second of the previous building's product into one of
+    its own, so every link is short of what it needs once the stock before it runs out
+    """
+    resources = [{'name': "water"}] + [{'name': "product {0}".format(i)} for i in range(length)]
+    buildings = [{'name': "well", 'cost': {}, 'cost_factor': 1.0, 'income': {"water": 0.5}}]
+    for i in range(length):
+        buildings.append({
+            'name': "building {0}".format(i),
+            'cost': {},
+            'cost_factor': 1.0,
+            'income': {resources[i]['name']: -1.0, resources[i + 1]['name']: 1.0},
+        })
+    return {
+        'name': "chain",
+        'description': "a production chain",
+        'resources': resources,
+        'buildings': buildings,
+        'upgrades': [],
+        'new_game': {'buildings': {building['name']: 1 for building in buildings}},
+    }
+
+
+@benchmark('production.chain.calculate_values', max_bytes=200000, max_blocks=800)
+def bench_chain_calculate_values(json_data):
+    """calculate_values with every stock of a 100 building chain run out"""
+    model = validate_game_model(chain_game_data(CHAIN_LENGTH))
+
+    def run():
+        model.load_game_instance(model.new_game, EPOCH).calculate_values()
+    return run
+
+
+@benchmark('production.chain.fast_forward', per=CHAIN_LENGTH + 1, max_bytes=200000, max_blocks=600)
+def bench_chain_fast_forward(json_data):
+    """A day of fast forward over which the stocks of a 100 building chain run out one by one"""
+    model = validate_game_model(chain_game_data(CHAIN_LENGTH))
+    state = dict(model.new_game)
+    state['resources'] = {resource: 300.0 * (i + 1) for i, resource in enumerate(model.resources)}
+
+    def run():
+        model.load_game_instance(state, EPOCH).fast_forward(EPOCH + timedelta(days=1))
+    return run
+
+
+@benchmark('startup.compile')
+def bench_compile(json_data):
+    """Compiling a game model, which a worker without a snapshot does for each game"""
+    return lambda: compile_model(json_data)
+
+
+@benchmark('startup.snapshot')
+def bench_snapshot(json_data):
+    """Loading a compiled game model from a snapshot instead"""
+    data = pickle.dumps(compile_model(json_data), pickle.HIGHEST_PROTOCOL)
+    return lambda: pickle.loads(data)
+
+
+def register_first_request_benchmark(label, prepare):
+    @benchmark('startup.first_request.{0}'.format(label))
+    def first_request(json_data):
+        """A new worker's first request for a game: getting its model, then a poll with it"""
+        state = played_state(compile_model(json_data), 3600.0)
+        get_model = prepare(json_data)
+        encoder = FragmentEncoder()
+
+        def run():
+            model = get_model()
+            save, client = model.load_game_instance(state, EPOCH).get_current_state(EPOCH + timedelta(seconds=1))
+            encoder.encode(model, client)
+        return run
+    return first_request
+
+
+register_first_request_benchmark('cold', bench_compile)
+register_first_request_benchmark('snapshot', bench_snapshot)
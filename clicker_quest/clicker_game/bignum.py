@@ -0,0 +1,377 @@
+# coding=utf-8
+import math
+import re
+from decimal import Decimal, localcontext
+
+from django.utils import six
+
+
+"""
+Numbers too big for a float, for late game resource amounts and building costs.
+
+Floats run out at about 1.8e308, which an incremental game can pass: a building with a cost factor
+of 1.15 costs more than that after about 5000 of them. The game engine keeps using plain floats
+for speed, and only a value that would overflow becomes a BigNumber; the two mix freely in
+arithmetic and comparisons, so code working on amounts does not need to care which it has.
+
+BigNumber(value) or BigNumber(mantissa, exponent):
+    mantissa * 2 ** exponent, with the mantissa a float kept between 0.5 and 1 (or 0) by
+    math.frexp, and the exponent any int. Supports +, -, *, /, ** (with a float power), abs(),
+    comparisons, float() (inf when too big), log10() and log2(). Immutable.
+
+power(base, exponent):
+    base ** exponent, as a float if it fits in one and a BigNumber otherwise.
+
+add(a, b), multiply(a, b):
+    a + b and a * b, as floats while they fit in one, and a BigNumber once floats would overflow;
+    a BigNumber result that fits in a float again becomes one.
+
+Arithmetic with a float doesn't make a BigNumber of it first, and adding numbers with the same
+exponent, or multiplying, doesn't need them normalized again by frexp; still, a BigNumber
+operation takes tens of times as long as a float one, which is why amounts stay floats until
+they can't (see the numbers.* benchmarks).
+
+to_json(value), from_json(value):
+    Convert numbers for storing in json: BigNumbers that fit in a float become floats, and bigger
+    ones become strings like "1.2345678901234567e512". from_json turns those strings back
+    into BigNumbers and leaves everything else alone.
+"""
+
+
+LOG2_10 = math.log(10, 2)
+LOG10_2 = math.log10(2)
+FLOAT_MAX_EXPONENT = 1024  # frexp exponents above this do not fit in a float
+FLOAT_MIN_EXPONENT = -1021  # and below this lose precision
+INFINITY = float('inf')
+NUMBER_STRING = re.compile(r'^(-?[0-9.]+)e([-+]?[0-9]+)$')
+NUMBER_TYPES = (float,) + six.integer_types
+
+frexp = math.frexp
+ldexp = math.ldexp
+isinf = math.isinf
+new = object.__new__
+
+
+class BigNumber(object):
+    __slots__ = ('mantissa', 'exponent')
+
+    def __init__(self, mantissa, exponent=0):
+        if isinstance(mantissa, BigNumber):
+            mantissa, exponent = mantissa.mantissa, mantissa.exponent + exponent
+        elif math.isinf(mantissa) or math.isnan(mantissa):
+            raise ValueError("BigNumber cannot hold {0}".format(mantissa))
+        mantissa, shift = math.frexp(mantissa)
+        self.mantissa = mantissa
+        self.exponent = exponent + shift if mantissa else 0
+
+    @classmethod
+    def from_log2(cls, log2, negative=False):
+        """The number whose base 2 logarithm is given"""
+        exponent = int(math.floor(log2))
+        mantissa = 2.0 ** (log2 - exponent)
+        return cls(-mantissa if negative else mantissa, exponent)
+
+    @classmethod
+    def parse(cls, text):
+        if not NUMBER_STRING.match(text):
+            raise ValueError("Not a number: {0!r}".format(text))
+        with localcontext() as context:
+            context.prec = 30
+            value = Decimal(text)
+            if not value:
+                return cls(0.0)
+            exponent = int(value.adjusted() * LOG2_10)
+            return cls(float(value / Decimal(2) ** exponent), exponent)
+
+    # ~~~ conversion ~~~
+
+    def __float__(self):
+        if self.exponent > FLOAT_MAX_EXPONENT:
+            return math.copysign(float('inf'), self.mantissa)
+        return math.ldexp(self.mantissa, self.exponent)
+
+    def fits_float(self):
+        return FLOAT_MIN_EXPONENT <= self.exponent <= FLOAT_MAX_EXPONENT or not self.mantissa
+
+    def log2(self):
+        return math.log(abs(self.mantissa), 2) + self.exponent
+
+    def log10(self):
+        return math.log10(abs(self.mantissa)) + self.exponent * LOG10_2
+
+    def __str__(self):
+        if self.fits_float():
+            return repr(float(self))
+        # the fewest digits that read back as the same number, since this is what gets saved
+        with localcontext() as context:
+            context.prec = 40
+            value = Decimal(int(math.ldexp(self.mantissa, 53))) * Decimal(2) ** (self.exponent - 53)
+        for digits in (15, 16, 17):
+            with localcontext() as context:
+                context.prec = digits
+                text = format((+value).normalize(), 'g').replace('e+', 'e')
+            if digits == 17 or BigNumber.parse(text) == self:
+                return text
+
+    def __repr__(self):
+        return "BigNumber({0!r}, {1!r})".format(self.mantissa, self.exponent)
+
+    def __bool__(self):
+        return self.mantissa != 0.0
+
+    __nonzero__ = __bool__
+
+    def __hash__(self):
+        if self.fits_float():
+            return hash(float(self))
+        return hash((self.mantissa, self.exponent))
+
+    # ~~~ arithmetic ~~~
+    # The hot operations take floats apart with frexp rather than making BigNumbers of them,
+    # and make their results with make(), skipping the checks of __init__.
+
+    def __neg__(self):
+        return make(-self.mantissa, self.exponent)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return make(abs(self.mantissa), self.exponent)
+
+    def __add__(self, other):
+        if type(other) is float or isinstance(other, six.integer_types):
+            if other - other != 0.0:
+                if other != other:
+                    raise ValueError("BigNumber cannot hold {0}".format(other))
+                return other  # adding an infinity
+            if self.exponent >= 0 and self.mantissa:
+                # scaled to this number's exponent, which can't overflow since it is at least 0
+                return normalized(self.mantissa + ldexp(other, -self.exponent), self.exponent)
+            mantissa, exponent = frexp(other)
+        elif type(other) is BigNumber:
+            mantissa, exponent = other.mantissa, other.exponent
+        else:
+            return NotImplemented
+        if not mantissa:
+            return self
+        own = self.mantissa
+        if not own:
+            return make(mantissa, exponent)
+        difference = self.exponent - exponent
+        if not difference:
+            if (own > 0.0) == (mantissa > 0.0):
+                # both mantissas are in [0.5, 1), so their sum is in [1, 2)
+                number = new(BigNumber)
+                number.mantissa = (own + mantissa) * 0.5
+                number.exponent = exponent + 1
+                return number
+            return normalized(own + mantissa, exponent)
+        if difference > 64:
+            return self
+        if difference < -64:
+            return make(mantissa, exponent)
+        if difference > 0:
+            return normalized(own + ldexp(mantissa, -difference), self.exponent)
+        return normalized(mantissa + ldexp(own, difference), exponent)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if type(other) is BigNumber:
+            return self + make(-other.mantissa, other.exponent)
+        if isinstance(other, NUMBER_TYPES):
+            return self + (-other)
+        return NotImplemented
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __mul__(self, other):
+        if type(other) is float or isinstance(other, six.integer_types):
+            if other - other != 0.0:
+                if other != other:
+                    raise ValueError("BigNumber cannot hold {0}".format(other))
+                return other * self.mantissa  # an infinity, signed
+            mantissa, exponent = frexp(other)
+        elif type(other) is BigNumber:
+            mantissa, exponent = other.mantissa, other.exponent
+        else:
+            return NotImplemented
+        # the product of two mantissas is in [0.25, 1), so it is off by one bit at most
+        number = new(BigNumber)
+        product = self.mantissa * mantissa
+        if not product:
+            number.mantissa, number.exponent = 0.0, 0
+        elif -0.5 < product < 0.5:
+            number.mantissa, number.exponent = product * 2.0, self.exponent + exponent - 1
+        else:
+            number.mantissa, number.exponent = product, self.exponent + exponent
+        return number
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        other = coerce(other)
+        if other is None:
+            return NotImplemented
+        if not isinstance(other, BigNumber):
+            return 0.0  # divided by an infinity
+        if not other.mantissa:
+            raise ZeroDivisionError("BigNumber division by zero")
+        return BigNumber(self.mantissa / other.mantissa, self.exponent - other.exponent)
+
+    def __rtruediv__(self, other):
+        other = coerce(other)
+        if other is None:
+            return NotImplemented
+        if not isinstance(other, BigNumber):
+            return other * self.mantissa
+        return other / self
+
+    __div__ = __truediv__
+    __rdiv__ = __rtruediv__
+
+    def __pow__(self, power):
+        if not isinstance(power, (int, float)):
+            return NotImplemented
+        if not self.mantissa:
+            return BigNumber(0.0 ** power)
+        if self.mantissa < 0 and power != int(power):
+            raise ValueError("Fractional power of a negative BigNumber")
+        negative = self.mantissa < 0 and int(power) % 2 == 1
+        return BigNumber.from_log2(self.log2() * power, negative)
+
+    # ~~~ comparison ~~~
+
+    def compare(self, other):
+        """-1, 0 or 1 as this is less than, equal to or greater than another number"""
+        if type(other) is BigNumber:
+            b, exponent = other.mantissa, other.exponent
+        else:
+            if isinf(other):
+                return -1 if other > 0 else 1
+            if other != other:
+                raise ValueError("Cannot compare a BigNumber with nan")
+            b, exponent = frexp(other)
+        a = self.mantissa
+        if (a < 0) != (b < 0) or not a or not b:
+            return (a > b) - (a < b)
+        if self.exponent != exponent:
+            greater = self.exponent > exponent
+            if a < 0:
+                greater = not greater
+            return 1 if greater else -1
+        return (a > b) - (a < b)
+
+    def __eq__(self, other):
+        if not isinstance(other, (BigNumber, int, float)):
+            return NotImplemented
+        return self.compare(other) == 0
+
+    def __ne__(self, other):
+        if not isinstance(other, (BigNumber, int, float)):
+            return NotImplemented
+        return self.compare(other) != 0
+
+    def __lt__(self, other):
+        if not isinstance(other, (BigNumber, int, float)):
+            return NotImplemented
+        return self.compare(other) < 0
+
+    def __le__(self, other):
+        if not isinstance(other, (BigNumber, int, float)):
+            return NotImplemented
+        return self.compare(other) <= 0
+
+    def __gt__(self, other):
+        if not isinstance(other, (BigNumber, int, float)):
+            return NotImplemented
+        return self.compare(other) > 0
+
+    def __ge__(self, other):
+        if not isinstance(other, (BigNumber, int, float)):
+            return NotImplemented
+        return self.compare(other) >= 0
+
+
+def make(mantissa, exponent):
+    """A BigNumber of a mantissa that is already in [0.5, 1) (or 0), without checking it"""
+    number = new(BigNumber)
+    number.mantissa = mantissa
+    number.exponent = exponent if mantissa else 0
+    return number
+
+
+def normalized(mantissa, exponent):
+    """A BigNumber of any finite mantissa"""
+    mantissa, shift = frexp(mantissa)
+    number = new(BigNumber)
+    number.mantissa = mantissa
+    number.exponent = exponent + shift if mantissa else 0
+    return number
+
+
+def coerce(value):
+    """A BigNumber for another number, the number itself for infinities, or None if it is not a number"""
+    if isinstance(value, BigNumber):
+        return value
+    if isinstance(value, (int, float)):
+        if math.isinf(value):
+            return value
+        return BigNumber(value)
+    return None
+
+
+def power(base, exponent):
+    """base ** exponent, as a float if it fits and a BigNumber if it does not"""
+    try:
+        return float(base) ** exponent
+    except OverflowError:
+        return BigNumber.from_log2(math.log(abs(base), 2) * exponent, base < 0 and exponent % 2 == 1)
+
+
+def overflowed(result, a, b):
+    """Whether a float result is infinite only because floats ran out"""
+    return type(result) is float and (result == INFINITY or result == -INFINITY) and not (
+        isinstance(a, float) and isinf(a) or isinstance(b, float) and isinf(b)
+    )
+
+
+def demoted(value):
+    """A float for a BigNumber that fits in one, and anything else as it is"""
+    if type(value) is BigNumber and value.fits_float():
+        return float(value)
+    return value
+
+
+def add(a, b):
+    """a + b, moving to a BigNumber if floats run out, and back to a float once it fits again"""
+    total = a + b
+    if type(total) is not float:
+        return demoted(total)
+    if overflowed(total, a, b):
+        return BigNumber(a) + b
+    return total
+
+
+def multiply(a, b):
+    """a * b, moving to a BigNumber if floats run out, and back to a float once it fits again"""
+    product = a * b
+    if type(product) is not float:
+        return demoted(product)
+    if overflowed(product, a, b):
+        return BigNumber(a) * b
+    return product
+
+
+def to_json(value):
+    if isinstance(value, BigNumber):
+        return float(value) if value.fits_float() else str(value)
+    return value
+
+
+def from_json(value):
+    if isinstance(value, six.string_types):
+        return BigNumber.parse(value)
+    return value
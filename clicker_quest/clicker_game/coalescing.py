@@ -0,0 +1,116 @@
+# coding=utf-8
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from clicker_game.sharding import shard_for_user
+
+
+"""
+Single-flight execution of game requests.
+
+Fast clicking and double submits send several requests for the same game instance at once. Rather
+than each of them loading, fast forwarding and saving the instance on its own (and racing each
+other), the requests for one instance in a worker process are coalesced: one of them (the leader)
+loads the instance, applies every action queued for it in the order they arrived, saves once, and
+every caller gets the same result.
+
+SingleFlight:
+    run(key, action, execute):
+        Queue an action for a key (such as (user id, game id)). If no request for that key is
+        being loaded yet, this caller becomes the leader and execute(close_batch) is called: it
+        should load whatever it needs, then call close_batch() to get the list of queued actions,
+        apply them, save, and return the result that every caller in the batch is given.
+        Requests that arrive once the batch is closed start the next batch, whose leader waits
+        for the previous one to finish before it loads anything.
+
+    Set CLICKER_SINGLE_FLIGHT to False to run every request on its own.
+
+instance_lock(user_id, game_id):
+    Context manager for a transaction on the user's shard (see clicker_game.sharding) that holds
+    a Postgres advisory lock on one game instance, so that requests in different worker processes
+    also take turns. Does nothing but start a transaction on other databases, or when
+    CLICKER_ADVISORY_LOCKS is False.
+"""
+
+
+class Batch(object):
+    """Actions queued for one key while its leader gets ready"""
+    def __init__(self):
+        self.actions = []
+        self.open = True
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key: the batch for that key still taking actions
+        self._open = {}
+        # key: [lock held by the leader that is running, number of leaders using it]
+        self._running = {}
+
+    def run(self, key, action, execute):
+        if not getattr(settings, 'CLICKER_SINGLE_FLIGHT', True):
+            return execute(lambda: [action])
+        with self._lock:
+            batch = self._open.get(key)
+            if batch is not None:
+                batch.actions.append(action)
+                leader = False
+            else:
+                batch = self._open[key] = Batch()
+                batch.actions.append(action)
+                leader = True
+                running = self._running.setdefault(key, [threading.Lock(), 0])
+                running[1] += 1
+        if not leader:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            return batch.result
+
+        try:
+            # wait for the previous batch for this key to be saved
+            with running[0]:
+                batch.result = execute(lambda: self._close(key, batch))
+        except Exception as ex:
+            batch.error = ex
+            raise
+        finally:
+            with self._lock:
+                if batch.open:  # execute failed before closing the batch
+                    self._close_locked(key, batch)
+                running[1] -= 1
+                if not running[1]:
+                    del self._running[key]
+            batch.done.set()
+        return batch.result
+
+    def _close(self, key, batch):
+        with self._lock:
+            return self._close_locked(key, batch)
+
+    def _close_locked(self, key, batch):
+        if batch.open:
+            batch.open = False
+            del self._open[key]
+        return list(batch.actions)
+
+
+single_flight = SingleFlight()
+
+
+@contextmanager
+def instance_lock(user_id, game_id):
+    alias = shard_for_user(user_id) or DEFAULT_DB_ALIAS
+    connection = connections[alias]
+    with transaction.atomic(using=alias):
+        if connection.vendor == 'postgresql' and getattr(settings, 'CLICKER_ADVISORY_LOCKS', True):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [game_id, user_id])
+        yield
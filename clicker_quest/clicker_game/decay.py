@@ -0,0 +1,250 @@
+# coding=utf-8
+import math
+from bisect import bisect_right
+
+from django.core.exceptions import ValidationError
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+"""
+Offline decay curves: how fast a game keeps running while nobody is playing it.
+
+A curve gives the game speed (between 0 and 1) after some number of real seconds without an
+update, and effective_seconds() integrates it: the number of seconds of income to collect for a
+given number of real seconds away. Every curve integrates in closed form, so fast forwarding over
+any length of time costs the same.
+
+A game model picks its curve with an optional "decay" object in its json description:
+
+    {"type": "linear", "full_speed": 86400, "decay": 518400}
+        Full speed for full_speed seconds, then slowing linearly to a stop over decay seconds.
+        This is the default, and the values shown are the defaults for leaving them out.
+
+    {"type": "exponential", "full_speed": 86400, "half_life": 86400}
+        Full speed for full_speed seconds, then halving every half_life seconds.
+
+    {"type": "piecewise", "points": [[0, 1.0], [86400, 1.0], [172800, 0.25]]}
+        Speeds at given times (the first at time 0), joined by straight lines. The last speed
+        carries on forever.
+
+    {"type": "step", "points": [[0, 1.0], [86400, 0.5], [172800, 0]]}
+        Speeds that each hold from their time until the next one.
+
+    {"type": "table", "interval": 3600, "speeds": [1.0, 1.0, 0.9, ...]}
+        Speeds sampled every interval seconds, joined by straight lines; the last one carries
+        on forever. The running integral is tabulated up front, so a lookup is one index.
+
+decay_curve(json_data):
+    Make a curve from the "decay" value of a game model description (None for the default),
+    raising a ValidationError if it is not valid.
+
+DecayCurve:
+    effective_seconds(seconds):
+        Effective seconds for a number of real seconds away, as a float.
+
+    effective_seconds_many(seconds):
+        The same for a sequence of numbers of seconds, for batch jobs. With numpy installed this
+        is evaluated as whole-array operations and returns a numpy array; without it, a list.
+
+    saturation_seconds:
+        The number of real seconds away after which the game has stopped for good, so that
+        effective_seconds() no longer grows; None for curves that never stop.
+"""
+
+
+FULL_SPEED_TIME = 86400.0  # full game speed for 1 day without being updated
+DECAY_TIME = 86400.0 * 6  # decay speed linearly to zero for 6 days after that
+
+
+def positive_number(data, key, default=None):
+    value = data.get(key, default)
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or not value > 0:
+        raise ValidationError("Decay {0} must be a positive number".format(key))
+    return float(value)
+
+
+def speed_value(value):
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or not 0 <= value <= 1:
+        raise ValidationError("Decay speeds must be numbers from 0 to 1")
+    return float(value)
+
+
+class DecayCurve(object):
+    saturation_seconds = None
+
+    def effective_seconds(self, seconds):  # pragma: no cover
+        raise NotImplementedError
+
+    def effective_seconds_array(self, seconds):  # pragma: no cover
+        """effective_seconds() for a numpy array of real seconds, already clipped to be non-negative"""
+        raise NotImplementedError
+
+    def effective_seconds_many(self, seconds):
+        if numpy is None:  # pragma: no cover
+            return [self.effective_seconds(value) for value in seconds]
+        return self.effective_seconds_array(numpy.maximum(numpy.asarray(seconds, dtype=float), 0.0))
+
+
+class LinearDecay(DecayCurve):
+    def __init__(self, full_speed=FULL_SPEED_TIME, decay=DECAY_TIME):
+        self.full_speed = full_speed
+        self.decay = decay
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            positive_number(data, 'full_speed', FULL_SPEED_TIME),
+            positive_number(data, 'decay', DECAY_TIME)
+        )
+
+    @property
+    def saturation_seconds(self):
+        return self.full_speed + self.decay
+
+    def effective_seconds(self, seconds):
+        actual = max(0.0, seconds)
+        effective = min(actual, self.full_speed)
+        extra = max(0.0, actual - self.full_speed)
+        extra = min(self.decay, extra)
+        effective += extra - extra**2 / (2 * self.decay)
+        return effective
+
+    def effective_seconds_array(self, seconds):
+        extra = numpy.clip(seconds - self.full_speed, 0.0, self.decay)
+        return numpy.minimum(seconds, self.full_speed) + extra - extra**2 / (2 * self.decay)
+
+
+class ExponentialDecay(DecayCurve):
+    def __init__(self, full_speed, half_life):
+        self.full_speed = full_speed
+        self.rate = math.log(2) / half_life
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(positive_number(data, 'full_speed'), positive_number(data, 'half_life'))
+
+    def effective_seconds(self, seconds):
+        actual = max(0.0, seconds)
+        extra = max(0.0, actual - self.full_speed)
+        return min(actual, self.full_speed) - math.expm1(-self.rate * extra) / self.rate
+
+    def effective_seconds_array(self, seconds):
+        extra = numpy.maximum(seconds - self.full_speed, 0.0)
+        return numpy.minimum(seconds, self.full_speed) - numpy.expm1(-self.rate * extra) / self.rate
+
+
+class PiecewiseLinearDecay(DecayCurve):
+    """Speeds at given times joined by straight lines, with the running integral tabulated at each time"""
+    def __init__(self, times, speeds, interpolate=True):
+        self.times = times
+        self.speeds = speeds
+        # slope of the speed after each point; the last speed carries on
+        self.slopes = [
+            (speeds[i + 1] - speeds[i]) / (times[i + 1] - times[i]) if interpolate else 0.0
+            for i in range(len(times) - 1)
+        ] + [0.0]
+        self.integrals = [0.0]
+        for i in range(len(times) - 1):
+            span = times[i + 1] - times[i]
+            self.integrals.append(self.integrals[-1] + speeds[i] * span + self.slopes[i] * span**2 / 2)
+        if numpy is not None:
+            self.array_times = numpy.array(times)
+            self.array_speeds = numpy.array(speeds)
+            self.array_slopes = numpy.array(self.slopes)
+            self.array_integrals = numpy.array(self.integrals)
+
+    @classmethod
+    def from_json(cls, data, interpolate=True):
+        points = data.get('points')
+        if not isinstance(points, list) or not points:
+            raise ValidationError("Decay points must be a list of [seconds, speed] pairs")
+        times = []
+        speeds = []
+        for point in points:
+            if not isinstance(point, list) or len(point) != 2:
+                raise ValidationError("Decay points must be a list of [seconds, speed] pairs")
+            seconds, speed = point
+            if not isinstance(seconds, (int, float)) or isinstance(seconds, bool):
+                raise ValidationError("Decay point times must be numbers")
+            if times and not seconds > times[-1]:
+                raise ValidationError("Decay point times must increase")
+            times.append(float(seconds))
+            speeds.append(speed_value(speed))
+        if times[0] != 0:
+            raise ValidationError("The first decay point must be at 0 seconds")
+        return cls(times, speeds, interpolate)
+
+    @property
+    def saturation_seconds(self):
+        # the last speed carries on forever
+        return self.times[-1] if self.speeds[-1] == 0 else None
+
+    def segment(self, seconds):
+        return bisect_right(self.times, seconds) - 1
+
+    def effective_seconds(self, seconds):
+        actual = max(0.0, seconds)
+        i = self.segment(actual)
+        elapsed = actual - self.times[i]
+        return self.integrals[i] + self.speeds[i] * elapsed + self.slopes[i] * elapsed**2 / 2
+
+    def segments_array(self, seconds):
+        return numpy.searchsorted(self.array_times, seconds, side='right') - 1
+
+    def effective_seconds_array(self, seconds):
+        i = self.segments_array(seconds)
+        elapsed = seconds - self.array_times[i]
+        return self.array_integrals[i] + self.array_speeds[i] * elapsed + self.array_slopes[i] * elapsed**2 / 2
+
+
+class StepDecay(PiecewiseLinearDecay):
+    @classmethod
+    def from_json(cls, data):
+        return super(StepDecay, cls).from_json(data, interpolate=False)
+
+
+class TableDecay(PiecewiseLinearDecay):
+    """Evenly spaced speeds, so the segment for a time is found by division instead of searching"""
+    def __init__(self, interval, speeds):
+        self.interval = interval
+        super(TableDecay, self).__init__([interval * i for i in range(len(speeds))], speeds)
+
+    @classmethod
+    def from_json(cls, data):
+        interval = positive_number(data, 'interval')
+        speeds = data.get('speeds')
+        if not isinstance(speeds, list) or not speeds:
+            raise ValidationError("Decay speeds must be a list of numbers")
+        return cls(interval, [speed_value(speed) for speed in speeds])
+
+    def segment(self, seconds):
+        return min(int(seconds // self.interval), len(self.times) - 1)
+
+    def segments_array(self, seconds):
+        return numpy.minimum((seconds // self.interval).astype(int), len(self.times) - 1)
+
+
+DECAY_CURVES = {
+    'linear': LinearDecay,
+    'exponential': ExponentialDecay,
+    'piecewise': PiecewiseLinearDecay,
+    'step': StepDecay,
+    'table': TableDecay,
+}
+
+DEFAULT_DECAY = LinearDecay()
+
+
+def decay_curve(json_data):
+    if json_data is None:
+        return DEFAULT_DECAY
+    if not isinstance(json_data, dict):
+        raise ValidationError("Decay must be a json object with keys and values")
+    curve_type = json_data.get('type')
+    if curve_type not in DECAY_CURVES:
+        raise ValidationError("Unknown decay type: {0}".format(curve_type))
+    return DECAY_CURVES[curve_type].from_json(json_data)
@@ -0,0 +1,547 @@
+# coding=utf-8
+import json
+import math
+import random
+from collections import OrderedDict
+from datetime import timedelta
+from timeit import default_timer
+
+import six
+
+from clicker_game.bignum import BigNumber, from_json
+from clicker_game.decay import DECAY_CURVES
+from clicker_game.game_model import GameModel, validate_game_model
+from clicker_game.reference_engine import ReferenceModel
+from clicker_game.simulator import EPOCH
+
+
+"""
+Differential testing of the game engine against the reference engine in
+clicker_game.reference_engine. Run it with `manage.py difftest`.
+
+Random game models are played with random sequences of actions and time, by each engine, and
+the save states and client states after every action are compared, numbers within a tolerance.
+A failing case is shrunk to the fewest actions, shortest waits and smallest model that still
+fail, so that it can be read. Each engine's time to play the cases is reported too, as a speedup
+over the reference engine, since being faster is what the other engines are for.
+
+register_engine(name):
+    Decorator that registers an engine. The decorated function is given a game model
+    description and returns something with a load_game_instance(data, time) method, like a
+    GameModel.
+
+ENGINES:
+    Registered engines by name, in the order they were registered; 'reference' first.
+
+random_model(rng, resources=3, buildings=5, upgrades=4):
+    A random valid game model description, with limited and unlimited resources, consumers,
+    click buildings, unlocks, effects of all kinds and a random decay curve.
+
+random_actions(rng, json_data, number):
+    A random list of actions for a game model: each is a list of the action's name (poll,
+    building, upgrade, clicks, order or cancel, for the GameInstance method of that kind), the
+    seconds waited before it, from none to days, and the method's arguments.
+
+run_sequence(engine_name, json_data, actions):
+    Play the actions with an engine, the way the views do (saving and loading the game instance
+    around each one), and return [(save state, client state)] after each.
+
+first_difference(expected, actual, tolerance=1e-9):
+    The first place two results differ by more than the tolerance, as (path, expected value,
+    actual value), or None.
+
+shrink(json_data, actions, fails):
+    The smallest (json_data, actions) that fails(json_data, actions) still finds failing.
+
+run_differential(cases=100, actions=30, seed=0, engines=None, tolerance=1e-9, shrink_failures=True,
+                 resources=3, buildings=5, upgrades=4):
+    Test the engines against the reference on random cases of models of the given size, and
+    return a DifferentialReport of each engine's time and speedup, and its first failure.
+"""
+
+
+REFERENCE = 'reference'
+MAX_CLICKS_PER_SECOND = 20
+
+ENGINES = OrderedDict()
+
+
+def register_engine(name):
+    def register(load):
+        ENGINES[name] = load
+        return load
+    return register
+
+
+@register_engine(REFERENCE)
+def reference_engine(json_data):
+    """The frozen, unoptimized engine"""
+    return ReferenceModel(GameModel(json_data))
+
+
+@register_engine('game_model')
+def game_model_engine(json_data):
+    """The game engine the site runs"""
+    return GameModel(json_data)
+
+
+# ~~~ random cases ~~~
+
+def random_amounts(rng, names, low, high, most=2):
+    chosen = rng.sample(names, rng.randint(1, min(most, len(names))))
+    return {name: round(rng.uniform(low, high), 3) for name in chosen}
+
+
+def random_modifier(rng, stages=('add', 'add_multiplier', 'multiplier')):
+    stage = rng.choice(stages)
+    if stage == 'add':
+        return {stage: round(rng.uniform(0.1, 5.0), 3)}
+    if stage == 'add_multiplier':
+        return {stage: round(rng.uniform(-0.2, 0.5), 3)}
+    return {stage: round(rng.uniform(0.8, 1.5), 3)}
+
+
+def random_effects(rng, model_data, limited):
+    """Effects on a random building or upgrade, or a global group"""
+    resources = [resource['name'] for resource in model_data['resources']]
+    kind = rng.choice(('buildings', 'upgrades', 'global'))
+    if kind == 'buildings':
+        building = rng.choice(model_data['buildings'])
+        effect = rng.choice(('income', 'cost', 'storage') if limited else ('income', 'cost'))
+        choices = limited if effect == 'storage' else list(building.get(effect, {})) or resources
+        return {kind: {building['name']: {effect: {rng.choice(choices): random_modifier(rng)}}}}
+    if kind == 'upgrades' and model_data['upgrades']:
+        upgrade = rng.choice(model_data['upgrades'])
+        return {kind: {upgrade['name']: {'cost': {rng.choice(resources): random_modifier(rng)}}}}
+    group = rng.choice(('income', 'building_cost', 'upgrade_cost') + (('storage',) if limited else ()))
+    choices = limited if group == 'storage' else resources
+    return {'global': {group: {rng.choice(choices): random_modifier(rng, ('add_multiplier', 'multiplier'))}}}
+
+
+def random_unlock(rng, buildings, upgrades):
+    unlock = {}
+    if buildings and rng.random() < 0.5:
+        unlock['buildings'] = {rng.choice(buildings): rng.randint(1, 3)}
+    if upgrades and rng.random() < 0.3:
+        unlock['upgrades'] = [rng.choice(upgrades)]
+    return unlock
+
+
+def random_decay(rng):
+    curve_type = rng.choice([None] + sorted(DECAY_CURVES))
+    if curve_type == 'linear':
+        return {'type': curve_type, 'full_speed': rng.uniform(60, 86400), 'decay': rng.uniform(60, 86400 * 3)}
+    if curve_type == 'exponential':
+        return {'type': curve_type, 'full_speed': rng.uniform(60, 86400), 'half_life': rng.uniform(60, 86400)}
+    if curve_type in ('piecewise', 'step'):
+        times = sorted(rng.uniform(1, 86400 * 3) for _ in range(rng.randint(1, 3)))
+        speeds = [round(rng.uniform(0, 1), 3) for _ in times]
+        return {'type': curve_type, 'points': [[0, 1.0]] + [list(point) for point in zip(times, speeds)]}
+    if curve_type == 'table':
+        return {'type': curve_type, 'interval': rng.uniform(60, 86400),
+                'speeds': [1.0] + [round(rng.uniform(0, 1), 3) for _ in range(rng.randint(1, 5))]}
+    return None
+
+
+def random_model(rng, resources=3, buildings=5, upgrades=4):
+    resource_names = ['r{0}'.format(i) for i in range(resources)]
+    model_data = {
+        'name': "Random",
+        'description': "",
+        'resources': [
+            # the first resource is never limited, so that there is always something to earn
+            {'name': name, 'maximum': round(rng.uniform(50, 5000), 3)} if i and rng.random() < 0.4 else {'name': name}
+            for i, name in enumerate(resource_names)
+        ],
+        'buildings': [],
+        'upgrades': [],
+    }
+    limited = [resource['name'] for resource in model_data['resources'] if 'maximum' in resource]
+
+    building_names = []
+    for i in range(buildings):
+        name = 'b{0}'.format(i)
+        if i and rng.random() < 0.15:
+            # a click building, which pays out when clicked
+            building = {'name': name, 'cost': {rng.choice(resource_names): -round(rng.uniform(1, 10), 3)},
+                        'cost_factor': 1}
+        else:
+            building = {
+                'name': name,
+                'cost': random_amounts(rng, resource_names, 1, 100),
+                'cost_factor': round(rng.uniform(1.01, 1.3), 3),
+                'income': random_amounts(rng, resource_names, 0.1, 10),
+            }
+            if building_names and rng.random() < 0.3:
+                # a consumer, turning one resource into another
+                consumed = rng.choice(resource_names)
+                building['income'][consumed] = -round(rng.uniform(0.1, 5), 3)
+            if limited and rng.random() < 0.4:
+                building['storage'] = random_amounts(rng, limited, 10, 1000)
+        unlock = random_unlock(rng, building_names, [])
+        if unlock:
+            building['unlock'] = unlock
+        model_data['buildings'].append(building)
+        building_names.append(name)
+
+    upgrade_names = []
+    for i in range(upgrades):
+        upgrade = {
+            'name': 'u{0}'.format(i),
+            'cost': random_amounts(rng, resource_names, 10, 500),
+        }
+        unlock = random_unlock(rng, building_names, upgrade_names)
+        if unlock:
+            upgrade['unlock'] = unlock
+        model_data['upgrades'].append(upgrade)
+        upgrade_names.append(upgrade['name'])
+
+    # effects, once everything they could aim at exists
+    for source in model_data['buildings'] + model_data['upgrades']:
+        if rng.random() < 0.5:
+            effects = random_effects(rng, model_data, limited)
+            target = source.setdefault('effects', {}) if source['name'].startswith('b') else source
+            for key, value in effects.items():
+                target.setdefault(key, {}).update(value)
+
+    model_data['new_game'] = {'resources': random_amounts(rng, resource_names, 10, 100, most=resources)}
+    if rng.random() < 0.5:
+        model_data['new_game']['buildings'] = {building_names[0]: 1}
+    decay = random_decay(rng)
+    if decay is not None:
+        model_data['decay'] = decay
+    validate_game_model(model_data)
+    return model_data
+
+
+def random_seconds(rng):
+    """Time between actions, from the same second to days away"""
+    return rng.choice((0.0, round(rng.uniform(0, 5), 3), round(rng.uniform(5, 3600), 3),
+                       round(rng.uniform(3600, 86400 * 4), 3)))
+
+
+def random_actions(rng, json_data, number):
+    buildings = [building['name'] for building in json_data['buildings']]
+    upgrades = [upgrade['name'] for upgrade in json_data['upgrades']]
+    actions = []
+    for _ in range(number):
+        seconds = random_seconds(rng)
+        action = rng.choice(('poll', 'building', 'building', 'clicks', 'click_batch', 'upgrade', 'order', 'cancel'))
+        if action == 'building':
+            actions.append([action, seconds, rng.choice(buildings), rng.choice((1, 1, 1, 10))])
+        elif action == 'clicks':
+            actions.append([action, seconds, rng.choice(buildings), rng.randint(1, 40)])
+        elif action == 'click_batch':
+            actions.append([action, seconds, [
+                [rng.choice(buildings), rng.randint(1, 40)] for _ in range(rng.randint(1, 3))
+            ]])
+        elif action == 'upgrade' and upgrades:
+            actions.append([action, seconds, rng.choice(upgrades)])
+        elif action in ('order', 'cancel'):
+            if upgrades and rng.random() < 0.3:
+                order = {'upgrade': rng.choice(upgrades)}
+            else:
+                order = {'building': rng.choice(buildings), 'up_to': rng.randint(1, 20)}
+            actions.append([action, seconds, order])
+        else:
+            actions.append(['poll', seconds])
+    return actions
+
+
+# ~~~ playing and comparing ~~~
+
+def play(model, state, time, action):
+    name, seconds = action[:2]
+    now = time + timedelta(seconds=seconds)
+    instance = model.load_game_instance(state, time)
+    if name == 'building':
+        result = instance.purchase_building(now, action[2], action[3])
+    elif name == 'upgrade':
+        result = instance.purchase_upgrade(now, action[2])
+    elif name == 'clicks':
+        result = instance.record_clicks(now, action[2], action[3], MAX_CLICKS_PER_SECOND)
+    elif name == 'click_batch':
+        result = instance.record_click_batch(now, action[2], MAX_CLICKS_PER_SECOND)
+    elif name == 'order':
+        result = instance.place_order(now, action[2])
+    elif name == 'cancel':
+        result = instance.cancel_order(now, action[2])
+    else:
+        result = instance.get_current_state(now)
+    return result, now
+
+
+def run_sequence(engine_name, json_data, actions, model=None):
+    if model is None:
+        model = ENGINES[engine_name](json_data)
+    state, time = json.loads(json.dumps(json_data['new_game'])), EPOCH
+    results = []
+    for action in actions:
+        (state, client_state), time = play(model, state, time, action)
+        # stored as json in between, as the views do
+        state = json.loads(json.dumps(state))
+        results.append((state, client_state))
+    return results
+
+
+def number_value(value):
+    """A number from the engines' results, or None for anything else"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, BigNumber)):
+        return value
+    if isinstance(value, six.string_types):
+        try:
+            return from_json(value)
+        except ValueError:
+            return None
+    return None
+
+
+def log2_magnitude(value):
+    if isinstance(value, BigNumber):
+        return math.log(abs(value.mantissa), 2) + value.exponent
+    return math.log(abs(value), 2)
+
+
+def numbers_close(a, b, tolerance):
+    fa, fb = float(a), float(b)
+    if not (math.isinf(fa) or math.isinf(fb)):
+        return fa == fb or abs(fa - fb) <= tolerance * max(abs(fa), abs(fb), 1.0)
+    if isinstance(a, float) and isinstance(b, float):
+        return fa == fb
+    # beyond floats, compare the magnitudes; a relative difference d is a log difference of about d
+    if (fa < 0) != (fb < 0):
+        return False
+    return abs(log2_magnitude(a) - log2_magnitude(b)) <= tolerance * 2
+
+
+def first_difference(expected, actual, tolerance=1e-9, path=()):
+    a, b = number_value(expected), number_value(actual)
+    if a is not None and b is not None:
+        return None if numbers_close(a, b, tolerance) else (path, expected, actual)
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected).union(actual), key=str):
+            # a number left out is zero, as save states leave out what is not owned
+            difference = first_difference(expected.get(key, 0), actual.get(key, 0), tolerance, path + (key,))
+            if difference is not None:
+                return difference
+        return None
+    if isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)):
+        if all(isinstance(item, six.string_types) for item in list(expected) + list(actual)):
+            # upgrade names come out of a set, in no particular order
+            expected, actual = sorted(expected), sorted(actual)
+        if len(expected) != len(actual):
+            return path + ('len',), len(expected), len(actual)
+        for i, (x, y) in enumerate(zip(expected, actual)):
+            difference = first_difference(x, y, tolerance, path + (i,))
+            if difference is not None:
+                return difference
+        return None
+    return None if expected == actual else (path, expected, actual)
+
+
+def without_rounding_errors(client_state, tolerance):
+    """
+    A client state without what only rounding errors show: where consumers use up exactly what is
+    made, one engine may come to an income of 0 and another to -3.6e-15, showing the resource
+    and that it runs out in a moment
+    """
+    client_state = dict(client_state)
+    client_state['resources'] = [
+        resource for resource in client_state['resources']
+        if not (numbers_close(resource['owned'], 0.0, tolerance) and numbers_close(resource['income'], 0.0, tolerance))
+    ]
+    production = client_state.get('production')
+    if production and production['runs_out'] and numbers_close(production['runs_out']['seconds'], 0.0, tolerance):
+        client_state['production'] = dict(production, runs_out=None)
+    return client_state
+
+
+def result_difference(expected, actual, tolerance=1e-9):
+    """The first difference between two run_sequence results, as (step, 'save' or 'client', path, a, b)"""
+    for step, (expected_states, actual_states) in enumerate(zip(expected, actual)):
+        expected_states = expected_states[0], without_rounding_errors(expected_states[1], tolerance)
+        actual_states = actual_states[0], without_rounding_errors(actual_states[1], tolerance)
+        for which, x, y in zip(('save', 'client'), expected_states, actual_states):
+            difference = first_difference(x, y, tolerance)
+            if difference is not None:
+                return (step, which) + difference
+    return None
+
+
+def error_difference(ex):
+    return None, 'error', (), None, '{0}: {1}'.format(type(ex).__name__, ex)
+
+
+def engine_difference(engine_name, json_data, actions, tolerance=1e-9):
+    """The first difference between an engine and the reference for one case, or an exception it raised"""
+    expected = run_sequence(REFERENCE, json_data, actions)
+    try:
+        actual = run_sequence(engine_name, json_data, actions)
+    except Exception as ex:
+        return error_difference(ex)
+    return result_difference(expected, actual, tolerance)
+
+
+# ~~~ shrinking ~~~
+
+def shrink_actions(json_data, actions, fails):
+    """Delta debugging: drop ever smaller chunks of actions while it still fails"""
+    chunk = len(actions) // 2
+    while chunk >= 1:
+        start, dropped = 0, False
+        while start < len(actions):
+            candidate = actions[:start] + actions[start + chunk:]
+            if candidate and fails(json_data, candidate):
+                actions, dropped = candidate, True
+            else:
+                start += chunk
+        if not dropped:
+            chunk //= 2
+    return actions
+
+
+def shrink_waits(json_data, actions, fails):
+    """Make each wait zero, or else as short as it can be, while it still fails"""
+    for i in range(len(actions)):
+        for seconds in (0.0, 1.0, 60.0, 3600.0, 86400.0):
+            if seconds >= actions[i][1]:
+                break
+            candidate = [list(action) for action in actions]
+            candidate[i][1] = seconds
+            if fails(json_data, candidate):
+                actions = candidate
+                break
+    return actions
+
+
+def model_variants(json_data):
+    """Simpler versions of a game model: without each effect, unlock, upgrade or the decay"""
+    for key in ('decay',):
+        if key in json_data:
+            variant = dict(json_data)
+            del variant[key]
+            yield variant
+    for kind in ('upgrades', 'buildings'):
+        for i, item in enumerate(json_data[kind]):
+            for key in ('effects', 'buildings', 'upgrades', 'global', 'unlock', 'storage'):
+                if key in item and not (kind == 'upgrades' and key == 'upgrades' and 'cost' not in item):
+                    variant = json.loads(json.dumps(json_data))
+                    del variant[kind][i][key]
+                    yield variant
+    for i in range(len(json_data['upgrades'])):
+        variant = json.loads(json.dumps(json_data))
+        del variant['upgrades'][i]
+        yield variant
+
+
+def valid(json_data):
+    try:
+        validate_game_model(json_data)
+    except Exception:
+        return False
+    return True
+
+
+def shrink(json_data, actions, fails):
+    actions = shrink_actions(json_data, actions, fails)
+    changed = True
+    while changed:
+        changed = False
+        for variant in model_variants(json_data):
+            if valid(variant) and fails(variant, actions):
+                json_data, changed = variant, True
+                break
+    actions = shrink_waits(json_data, shrink_actions(json_data, actions, fails), fails)
+    return json_data, actions
+
+
+# ~~~ the whole run ~~~
+
+class Failure(object):
+    def __init__(self, engine_name, case, json_data, actions, difference):
+        self.engine_name = engine_name
+        self.case = case
+        self.json_data = json_data
+        self.actions = actions
+        self.difference = difference  # (step, 'save' | 'client' | 'error', path, expected, actual)
+
+    def as_json(self):
+        step, which, path, expected, actual = self.difference
+        return OrderedDict([
+            ('engine', self.engine_name),
+            ('case', self.case),
+            ('step', step),
+            ('state', which),
+            ('path', list(path)),
+            ('expected', repr(expected)),
+            ('actual', repr(actual)),
+            ('model', self.json_data),
+            ('actions', self.actions),
+        ])
+
+
+class DifferentialReport(object):
+    def __init__(self, cases, actions):
+        self.cases = cases
+        self.actions = actions
+        self.seconds = OrderedDict()  # engine: seconds to play every case
+        self.failures = []
+
+    def speedup(self, engine_name):
+        seconds = self.seconds[engine_name]
+        return self.seconds[REFERENCE] / seconds if seconds else float('inf')
+
+    def as_json(self):
+        return OrderedDict([
+            ('cases', self.cases),
+            ('actions', self.actions),
+            ('engines', [
+                OrderedDict([('name', name), ('seconds', seconds), ('speedup', self.speedup(name))])
+                for name, seconds in self.seconds.items()
+            ]),
+            ('failures', [failure.as_json() for failure in self.failures]),
+        ])
+
+
+def run_differential(cases=100, actions=30, seed=0, engines=None, tolerance=1e-9, shrink_failures=True,
+                     resources=3, buildings=5, upgrades=4):
+    engines = [name for name in engines or ENGINES if name != REFERENCE]
+    report = DifferentialReport(cases, actions)
+    for name in [REFERENCE] + engines:
+        report.seconds[name] = 0.0
+    failed = set()
+    for case in range(cases):
+        rng = random.Random('{0}-{1}'.format(seed, case))
+        json_data = random_model(rng, resources, buildings, upgrades)
+        sequence = random_actions(rng, json_data, actions)
+        results = {}
+        for name in [REFERENCE] + engines:
+            model = ENGINES[name](json_data)
+            start = default_timer()
+            try:
+                results[name] = run_sequence(name, json_data, sequence, model)
+            except Exception as ex:
+                if name == REFERENCE:
+                    raise
+                results[name] = ex
+            report.seconds[name] += default_timer() - start
+        for name in engines:
+            if name in failed:
+                continue
+            if isinstance(results[name], Exception):
+                difference = error_difference(results[name])
+            else:
+                difference = result_difference(results[REFERENCE], results[name], tolerance)
+            if difference is None:
+                continue
+            failed.add(name)
+            failing_data, failing_actions = json_data, sequence
+            if shrink_failures:
+                def fails(data, steps, name=name):
+                    return engine_difference(name, data, steps, tolerance) is not None
+                failing_data, failing_actions = shrink(json_data, sequence, fails)
+                difference = engine_difference(name, failing_data, failing_actions, tolerance)
+            report.failures.append(Failure(name, case, failing_data, failing_actions, difference))
+    return report
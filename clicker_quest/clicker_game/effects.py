@@ -0,0 +1,242 @@
+# coding=utf-8
+from clicker_game.bignum import power
+
+
+"""
+Compiled effects of upgrades and buildings on the values of a game model.
+
+An effect changes one target value, named by a (kind, name, resource) tuple:
+
+    ('income', building, resource)          what one of a building produces each second
+    ('storage', building, resource)         how much more of a resource one of a building can hold
+    ('cost', building, resource)            the base cost of a building, before its cost factor
+    ('upgrade_cost', upgrade, resource)     the cost of an upgrade
+
+Modifier objects in the game model say how, with any of these keys:
+
+    add:            added to the base value from the game model
+    add_multiplier: added to a common multiplier, which starts at 1 and is shared by every effect
+                    on the target, so two effects of 0.5 make the value twice as big
+    multiplier:     multiplies the value, compounding, so two effects of 2 make it four times as big
+
+and every target is worked out in the same stages:
+
+    (base + adds) * (1 + add_multipliers) * multipliers
+
+Upgrades have their effects while they are owned. Buildings have theirs once for each building
+owned: adds and add_multipliers are counted that many times, and multipliers compounded that many
+times. Both describe effects on particular buildings and upgrades:
+
+    "buildings": {building: {"income" | "storage" | "cost": {resource: modifier}}}
+    "upgrades": {upgrade: {"cost": {resource: modifier}}}
+
+or on a global group of targets, which are every building or upgrade that has that value at all
+(from the game model or from an add effect aimed at it):
+
+    "global": {"income" | "storage" | "building_cost" | "upgrade_cost": {resource: modifier}}
+
+Global effects cannot add, because that would give every building in the game the value.
+
+EffectPipeline(model):
+    Every effect in a GameModel compiled down to, for each target, the contributions of each
+    source (('upgrade', name) or ('building', name)) to each stage. A GameModel compiles its
+    pipeline the first time it is needed; see GameModel.effects.
+
+EffectState(pipeline):
+    The values of the targets for one game instance.
+
+    update(upgrades, buildings):
+        Bring the values up to date with the upgrades owned (a collection of names) and the
+        buildings owned (a dict of names to objects with an owned count). Only the stages that
+        the sources which changed since the last update contribute to are evaluated again, so
+        after buying something this costs about as much as the effects of that one thing. The
+        pipeline also remembers the values for the last thousand or so combinations of levels
+        seen by any instance, so loading a game whose upgrades have been seen before costs no
+        evaluation at all. Models without effects skip all of this.
+
+    lookup(kind, name, base):
+        The {resource: value} dict for one building's or upgrade's income, storage or cost, or
+        the base dict from the game model when no effect targets it. Values that come out as
+        zero are left out. The dicts are shared, and must not be changed.
+"""
+
+
+STAGES = ('add', 'add_multiplier', 'multiplier')
+ADD, ADD_MULTIPLIER, MULTIPLIER = range(len(STAGES))
+IDENTITY = (0.0, 0.0, 1.0)  # stage values when nothing contributes
+KNOWN_LEVELS = 1000  # combinations of levels a pipeline remembers the values for
+
+BUILDING_EFFECTS = ('income', 'storage', 'cost')
+UPGRADE_EFFECTS = ('cost',)
+# global group: the kind of target it covers
+GLOBAL_GROUPS = {
+    'income': 'income',
+    'storage': 'storage',
+    'building_cost': 'cost',
+    'upgrade_cost': 'upgrade_cost',
+}
+
+
+def source_effects(effects):
+    """Yield (target, modifier) for each effect aimed at a particular building or upgrade"""
+    for building_name, building_effects in effects.get('buildings', {}).items():
+        for kind, modifiers in building_effects.items():
+            for resource_name, modifier in modifiers.items():
+                yield (kind, building_name, resource_name), modifier
+    for upgrade_name, upgrade_effects in effects.get('upgrades', {}).items():
+        for resource_name, modifier in upgrade_effects.get('cost', {}).items():
+            yield ('upgrade_cost', upgrade_name, resource_name), modifier
+
+
+class EffectPipeline(object):
+    def __init__(self, model):
+        described = [
+            (('upgrade', upgrade.name), upgrade.effects) for upgrade in model.upgrades.values()
+        ] + [
+            (('building', building.name), building.effects) for building in model.buildings.values()
+        ]
+
+        # base values of everything that could be a target
+        bases = {}
+        for building in model.buildings.values():
+            for kind in BUILDING_EFFECTS:
+                for resource_name, amount in getattr(building, kind).items():
+                    bases[(kind, building.name, resource_name)] = amount
+        for upgrade in model.upgrades.values():
+            for resource_name, amount in upgrade.cost.items():
+                bases[('upgrade_cost', upgrade.name, resource_name)] = amount
+
+        effects = []
+        for source, source_data in described:
+            for target, modifier in source_effects(source_data):
+                effects.append((source, target, modifier))
+        existing = set(bases).union(target for source, target, modifier in effects)
+        for source, source_data in described:
+            for group, modifiers in source_data.get('global', {}).items():
+                kind = GLOBAL_GROUPS[group]
+                for resource_name, modifier in modifiers.items():
+                    effects.extend(
+                        (source, target, modifier)
+                        for target in sorted(existing)
+                        if target[0] == kind and target[2] == resource_name
+                    )
+
+        # sources with any effects, upgrades first, as indexes into a tuple of levels
+        sources = []
+        for source, target, modifier in effects:
+            if source not in sources and any(key in modifier for key in STAGES):
+                sources.append(source)
+        sources.sort(key=lambda source: source[0] != 'upgrade')
+        self.upgrade_sources = [name for kind, name in sources if kind == 'upgrade']
+        self.building_sources = [name for kind, name in sources if kind == 'building']
+        index = {source: i for i, source in enumerate(sources)}
+
+        # target: ([(source index, amount)] for each stage)
+        self.contributions = {}
+        # [(target, stage)] each source contributes to
+        self.source_targets = [[] for _ in sources]
+        for source, target, modifier in effects:
+            stages = self.contributions.setdefault(target, ([], [], []))
+            for stage, key in enumerate(STAGES):
+                if key in modifier:
+                    stages[stage].append((index[source], modifier[key]))
+                    self.source_targets[index[source]].append((target, stage))
+        self.base = {target: bases.get(target, 0.0) for target in self.contributions}
+        # (kind, name): resources with effects on them
+        self.table_resources = {}
+        for kind, name, resource_name in self.contributions:
+            self.table_resources.setdefault((kind, name), []).append(resource_name)
+        self.base_tables = {}
+        for kind, name in self.table_resources:
+            if kind == 'upgrade_cost':
+                self.base_tables[(kind, name)] = model.upgrades[name].cost
+            else:
+                self.base_tables[(kind, name)] = getattr(model.buildings[name], kind)
+
+        self.no_levels = (0,) * len(sources)
+        # levels: (stages, tables) for recently seen combinations of levels, shared by every instance
+        self.known = {self.no_levels: ({}, {})}
+
+
+class EffectState(object):
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        # level of each source: 1 for an owned upgrade, the number owned for a building
+        self.levels = pipeline.no_levels
+        # target: (add, add_multiplier, multiplier)
+        self.stages = {}
+        # (kind, name): {resource: value}
+        self.tables = {}
+
+    def update(self, upgrades, buildings):
+        pipeline = self.pipeline
+        if not pipeline.no_levels:
+            return
+        levels = tuple(
+            [1 if name in upgrades else 0 for name in pipeline.upgrade_sources] +
+            [buildings[name].owned if name in buildings else 0 for name in pipeline.building_sources]
+        )
+        if levels == self.levels:
+            return
+        known = pipeline.known.get(levels)
+        if known is None:
+            known = self.evaluate_changes(levels)
+            if len(pipeline.known) >= KNOWN_LEVELS:
+                pipeline.known.clear()
+            pipeline.known[levels] = known
+        self.levels = levels
+        self.stages, self.tables = known
+
+    def evaluate_changes(self, levels):
+        """New stages and tables for new levels, evaluating only the stages whose sources changed"""
+        pipeline = self.pipeline
+        # target: stages to evaluate again
+        dirty = {}
+        for index, (old, new) in enumerate(zip(self.levels, levels)):
+            if old != new:
+                for target, stage in pipeline.source_targets[index]:
+                    dirty.setdefault(target, set()).add(stage)
+
+        stages = dict(self.stages)
+        keys = set()
+        for target, changed in dirty.items():
+            values = list(stages.get(target, IDENTITY))
+            for stage in changed:
+                values[stage] = evaluate(pipeline.contributions[target][stage], stage, levels)
+            stages[target] = tuple(values)
+            keys.add(target[:2])
+
+        tables = dict(self.tables)
+        for key in keys:
+            table = dict(pipeline.base_tables[key])
+            for resource_name in pipeline.table_resources[key]:
+                target = key + (resource_name,)
+                # targets of the same table whose sources have never had a level are at identity
+                add, add_multiplier, multiplier = stages.get(target, IDENTITY)
+                value = (pipeline.base[target] + add) * (1.0 + add_multiplier) * multiplier
+                if value:
+                    table[resource_name] = value
+                else:
+                    table.pop(resource_name, None)
+            tables[key] = table
+        return stages, tables
+
+    def lookup(self, kind, name, base):
+        return self.tables.get((kind, name), base)
+
+
+def evaluate(contributions, stage, levels):
+    """The value of one stage of a target for the levels of its sources"""
+    if stage == MULTIPLIER:
+        result = 1.0
+        for index, amount in contributions:
+            level = levels[index]
+            if level == 1:
+                result = result * amount
+            elif level:
+                result = result * power(amount, level)
+        return result
+    result = 0.0
+    for index, amount in contributions:
+        result += amount * levels[index]
+    return result
@@ -0,0 +1,250 @@
+# coding=utf-8
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils import six
+from django.utils.safestring import mark_safe
+from django.utils.module_loading import import_string
+
+from clicker_game.bignum import BigNumber, to_json
+
+
+"""
+Encoders for the client state json that game responses carry.
+
+game_response(model, client_state):
+    Make the HttpResponse for a client state with the encoder named by the
+    CLICKER_RESPONSE_ENCODER setting.
+
+page_json(model, client_state):
+    The same json, escaped to be put in a <script> element of the game page, which the front
+    end starts from instead of asking for it again.
+
+StandardEncoder:
+    Encodes the whole client state with the standard library json encoder, exactly like
+    JsonResponse does.
+
+FragmentEncoder:
+    Encodes the client state by splicing together pieces of json text that are encoded once
+    per game model: the names and descriptions of resources and buildings, every resource name
+    used as a key, and whole upgrade entries (whose costs client_state_json copies unchanged
+    from the model). Only the numbers that change from request to request are encoded each
+    time, so the cost of encoding does not grow with the amount of text in the model.
+
+    Anything in the client state that is not known to be static (checked by identity against
+    the model's own objects) is encoded normally, so the output always means the same thing
+    as the standard encoder's.
+"""
+
+
+INFINITY = float('inf')
+
+
+class GameJSONEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, BigNumber):
+            return to_json(o)
+        return super(GameJSONEncoder, self).default(o)
+
+
+def _dumps(value):
+    return json.dumps(value, cls=GameJSONEncoder)
+
+
+def encode_float(value):
+    if value - value == 0.0:  # finite
+        return repr(value)
+    if value != value:
+        return 'NaN'
+    return 'Infinity' if value > 0 else '-Infinity'
+
+
+# number encoders by exact type; anything else is encoded by the json module
+NUMBER_ENCODERS = {
+    float: encode_float,
+    bool: lambda value: 'true' if value else 'false',
+    type(None): lambda value: 'null',
+    BigNumber: lambda value: _dumps(to_json(value)),
+}
+for _integer_type in six.integer_types:
+    NUMBER_ENCODERS[_integer_type] = str
+
+
+class ModelFragments(object):
+    """Pre-encoded json text for the static parts of a game model's client state"""
+    def __init__(self, model):
+        # the start of each resource and building object, up to its first dynamic value
+        self.resources = {}
+        self.buildings = {}
+        # whole upgrade objects, which have nothing dynamic besides whether they are owned
+        self.upgrades = {}
+        # encoded dict keys
+        self.keys = {}
+
+        for resource in model.resources.values():
+            self.resources[resource.name] = self.static_text(resource) + ', "owned": '
+            self.key(resource.name)
+        for building in model.buildings.values():
+            self.buildings[building.name] = self.static_text(building) + ', "owned": '
+        for upgrade in model.upgrades.values():
+            self.upgrades[upgrade.name] = tuple(
+                '{0}, "owned": {1}, "cost": {2}}}'.format(
+                    self.static_text(upgrade), owned, _dumps(upgrade.cost)
+                )
+                for owned in ('false', 'true')
+            )
+
+    @staticmethod
+    def static_text(thing):
+        return '{{"name": {0}, "description": {1}'.format(_dumps(thing.name), _dumps(thing.description))
+
+    def key(self, name):
+        try:
+            return self.keys[name]
+        except KeyError:
+            encoded = self.keys[name] = _dumps(name) + ': '
+            return encoded
+
+
+def model_fragments(model):
+    """Get the pre-encoded fragments of a model, encoding them the first time they are needed"""
+    fragments = getattr(model, '_client_fragments', None)
+    if fragments is None:
+        fragments = model._client_fragments = ModelFragments(model)
+    return fragments
+
+
+class StandardEncoder(object):
+    def encode(self, model, client_state):
+        return _dumps(client_state).encode('utf-8')
+
+
+class FragmentEncoder(object):
+    def encode(self, model, client_state):
+        fragments = model_fragments(model)
+        parts = []
+        for section, entries in client_state.items():
+            if section == 'resources':
+                encoded = self.encode_resources(model, fragments, entries)
+            elif section == 'buildings':
+                encoded = self.encode_buildings(model, fragments, entries)
+            elif section == 'upgrades':
+                encoded = self.encode_upgrades(model, fragments, entries)
+            else:
+                encoded = self.encode_value(entries, fragments)
+            parts.append(fragments.key(section) + encoded)
+        return ('{' + ', '.join(parts) + '}').encode('utf-8')
+
+    # Each of these encodes entries that look exactly like the ones client_state_json makes
+    # from pre-encoded fragments, and anything else with encode_value.
+
+    def encode_resources(self, model, fragments, entries):
+        encoded = []
+        for entry in entries:
+            try:
+                if len(entry) == 5 and entry['description'] is model.resources[entry['name']].description:
+                    owned, income, maximum = entry['owned'], entry['income'], entry['maximum']
+                    encoded.append(''.join((
+                        fragments.resources[entry['name']], NUMBER_ENCODERS[type(owned)](owned),
+                        ', "income": ', NUMBER_ENCODERS[type(income)](income),
+                        ', "maximum": ', NUMBER_ENCODERS[type(maximum)](maximum),
+                        '}',
+                    )))
+                    continue
+            except (KeyError, TypeError):
+                pass
+            encoded.append(self.encode_value(entry, fragments))
+        return '[' + ', '.join(encoded) + ']'
+
+    def encode_buildings(self, model, fragments, entries):
+        encoded = []
+        encode_amounts = self.encode_amounts
+        keys = fragments.keys
+        for entry in entries:
+            try:
+                if len(entry) == 6 and entry['description'] is model.buildings[entry['name']].description:
+                    owned = entry['owned']
+                    encoded.append(''.join((
+                        fragments.buildings[entry['name']], NUMBER_ENCODERS[type(owned)](owned),
+                        ', "cost": ', encode_amounts(entry['cost'], keys),
+                        ', "cost10": ', encode_amounts(entry['cost10'], keys),
+                        ', "income": ', encode_amounts(entry['income'], keys),
+                        '}',
+                    )))
+                    continue
+            except (KeyError, TypeError):
+                pass
+            encoded.append(self.encode_value(entry, fragments))
+        return '[' + ', '.join(encoded) + ']'
+
+    def encode_upgrades(self, model, fragments, entries):
+        encoded = []
+        for entry in entries:
+            try:
+                upgrade = model.upgrades[entry['name']]
+                owned = entry['owned']
+                if (
+                    len(entry) == 4 and
+                    entry['description'] is upgrade.description and
+                    entry['cost'] is upgrade.cost and
+                    (owned is True or owned is False)
+                ):
+                    encoded.append(fragments.upgrades[entry['name']][owned])
+                    continue
+            except (KeyError, TypeError):
+                pass
+            encoded.append(self.encode_value(entry, fragments))
+        return '[' + ', '.join(encoded) + ']'
+
+    @staticmethod
+    def encode_amounts(amounts, keys):
+        """Encode a dict of {resource name: number}"""
+        if len(amounts) == 1:
+            for resource, amount in amounts.items():
+                return '{' + keys[resource] + NUMBER_ENCODERS[type(amount)](amount) + '}'
+        return '{' + ', '.join([
+            keys[resource] + NUMBER_ENCODERS[type(amount)](amount)
+            for resource, amount in amounts.items()
+        ]) + '}'
+
+    def encode_value(self, value, fragments):
+        """Encode any other value, using pre-encoded dict keys where possible"""
+        encode_number = NUMBER_ENCODERS.get(type(value))
+        if encode_number is not None:
+            return encode_number(value)
+        if isinstance(value, dict):
+            return '{' + ', '.join([
+                fragments.key(key) + self.encode_value(item, fragments)
+                for key, item in value.items()
+            ]) + '}'
+        if isinstance(value, (list, tuple)):
+            return '[' + ', '.join([self.encode_value(item, fragments) for item in value]) + ']'
+        return _dumps(value)
+
+
+_encoder = None
+
+
+def get_encoder():
+    global _encoder
+    path = getattr(settings, 'CLICKER_RESPONSE_ENCODER', 'clicker_game.encoding.FragmentEncoder')
+    if _encoder is None or _encoder[0] != path:
+        _encoder = (path, import_string(path)())
+    return _encoder[1]
+
+
+def game_response(model, client_state):
+    """Make a json HttpResponse carrying the client state of a game"""
+    return HttpResponse(get_encoder().encode(model, client_state), content_type='application/json')
+
+
+# the characters that could end the <script> element or start a comment in it, which json can
+# only have inside strings, where they can be escaped
+_SCRIPT_ESCAPES = {ord('<'): '\\u003c', ord('>'): '\\u003e', ord('&'): '\\u0026'}
+
+
+def page_json(model, client_state):
+    """The json text of the client state of a game, safe to put in a <script> element"""
+    return mark_safe(get_encoder().encode(model, client_state).decode('utf-8').translate(_SCRIPT_ESCAPES))
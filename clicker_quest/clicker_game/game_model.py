@@ -2,6 +2,12 @@
 from collections import OrderedDict
 from django.core.exceptions import ValidationError
 
+from clicker_game.bignum import INFINITY, add, from_json, multiply, power, to_json
+from clicker_game.decay import DEFAULT_DECAY, decay_curve
+from clicker_game.effects import BUILDING_EFFECTS, GLOBAL_GROUPS, STAGES, UPGRADE_EFFECTS, EffectPipeline, EffectState
+from clicker_game.production import ProductionGraph, seconds_until_depleted
+from clicker_game.timing import NULL_TIMER
+
 
 """
 Provides modular incremental game model functionality.
@@ -18,10 +24,22 @@ GameModel(json_data):
         Attribute containing the starting game-state value for new games
         played with this model.
 
-    load_game_instance(instance_data, instance_time):
+    decay:
+        The curve of how fast games of this model run while they are not being played, from the
+        optional "decay" key of the model description (see clicker_game.decay).
+
+    effects:
+        The effects of the model's upgrades and buildings on incomes, storage and costs, compiled
+        into a clicker_game.effects.EffectPipeline, which explains how they are described.
+
+    production:
+        The clicker_game.production.ProductionGraph of which buildings feed which.
+
+    load_game_instance(instance_data, instance_time, timer=NULL_TIMER):
         Returns a new GameInstance object that can perform actions on a game instance being
         played with this game model. Warranty does not cover giving instances that belong to
-        another game.
+        another game. The timer (see clicker_game.timing) is told about each phase of work the
+        instance does.
 
 GameInstance:
     Calculates the state of a game being played. Get this from GameModel.load_game_instance()
@@ -39,6 +57,41 @@ GameInstance:
     purchase_upgrade(current_time, upgrade_name):
         Again like get_current_state, but also attempts to purchase an upgrade at the current time.
 
+    try_purchase_building(building_name, number_purchased), try_purchase_upgrade(upgrade_name):
+        Attempt a purchase at the instance's current time without fast forwarding, and return
+        whether it succeeded.
+
+    advance(seconds):
+        Collect income for a number of effective seconds, for code that keeps its own clock
+        (like the balance simulator). Buildings consuming a resource that runs out slow down
+        from the moment it does (see clicker_game.production); their speeds are in the speeds
+        attribute, and in the "production" part of the client state along with when the next
+        resource will run out.
+
+    seconds_until_affordable(cost):
+        How long until the current incomes make a cost affordable.
+
+    place_order(current_time, order), cancel_order(current_time, order):
+        Like get_current_state, but also add or remove a standing order. Orders are kept in the
+        save state and look like {"building": name, "up_to": count} (keep buying the building
+        whenever it is affordable until this many are owned) or {"upgrade": name} (buy the
+        upgrade as soon as it is affordable). fast_forward settles them exactly as it goes.
+
+    record_clicks(current_time, building_name, clicks, max_clicks_per_second):
+        Like get_current_state, but also click a click building (a building that costs nothing and
+        gives resources instead, see is_click_building) many times at once. The client counts clicks
+        and reports them in batches; no more are accepted than max_clicks_per_second allows for the
+        time since the instance was last saved.
+
+    record_click_batch(current_time, clicks, max_clicks_per_second):
+        Like record_clicks, for a list of (building name, clicks) pairs on any number of click
+        buildings. The game is fast forwarded once for the whole batch, and the derived values are
+        only calculated again after clicks that change them.
+
+
+    Amounts of resources and costs are floats, or clicker_game.bignum.BigNumbers once they are too
+    big for floats. Save states store those as strings.
+
 
     ~~~ Other methods that probably aren't needed outside this module: ~~~
 
@@ -50,8 +103,11 @@ GameInstance:
 """
 
 
-FULL_SPEED_TIME = 86400.0  # full game speed for 1 day without being updated
-DECAY_TIME = 86400.0 * 6  # decay speed linearly to zero for 6 days after that
+MAX_ORDERS = 20  # standing orders one game instance may have
+MAX_ORDER_UP_TO = 100000  # most buildings a standing order may keep buying up to
+MAX_ORDER_PURCHASES = 10000  # most standing order purchases settled in one fast forward
+MAX_PRODUCTION_CHANGES = 1000  # most times resources run out in one advance
+ROUNDING_ERROR = 1e-9  # incomes this small next to what was added up to make them are taken as zero
 
 
 class Dicted(object):
@@ -65,6 +121,24 @@ class Dicted(object):
         return "Dicted(**{0})".format(self.__dict__)
 
 
+def clear_rounding_errors(resources, flows):
+    """
+    Make the income of each resource that has run out exactly zero where it is only a rounding
+    error of the incomes (of the given sizes) added up for it. A resource whose consumers use up
+    exactly what is made could otherwise be left earning 1e-15 a second, and would not count as
+    having run out when loaded again.
+    """
+    for resource_name, flow in flows.items():
+        resource = resources[resource_name]
+        if not resource.owned and abs(resource.income) <= flow * ROUNDING_ERROR:
+            resource.income = 0.0
+
+
+def is_click_building(building):
+    """Whether a building is really a button to click, which pays out rather than costing anything"""
+    return building.cost_factor == 1 and all(amount <= 0 for amount in building.cost.values())
+
+
 def validate_game_model(json_data):
     """Validate a game model data wad and return the GameModel object if the game model is OK,
     or raise a ValidationError if there is a problem with the game model (some descriptive
@@ -75,7 +149,7 @@ def validate_game_model(json_data):
 
         difference = set(json_data).symmetric_difference(
             {'name', 'description', 'resources', 'buildings', 'upgrades', 'new_game'}
-        )
+        ) - {'decay'}  # decay is optional
         if difference:
             raise ValidationError("Missing or extra keys in game model description: {0}".format(difference,))
 
@@ -127,11 +201,74 @@ def validate_game_model(json_data):
             if not isinstance(modifier, dict):
                 raise ValidationError("Modifier of a value must be a json object with keys and values")
             for modify_type, value in modifier.items():
-                if modify_type not in ('multiplier',):
+                if modify_type not in STAGES:
                     raise ValidationError("Unknown key in value modifier: {0}".format(modify_type,))
                 if not isinstance(value, (int, float)):
                     raise ValidationError("Non-numeric modifier value: {0} = {1}".format(modify_type, value))
 
+        # noinspection PyShadowingNames
+        def validate_effects(source_type, source_name, effects):
+            """Validates the effects of an upgrade or a building"""
+            for building_name, building_effects in effects.get('buildings', {}).items():
+                if building_name not in model.buildings:
+                    raise ValidationError("{0} {1} affects nonexistent building {2}".format(
+                        source_type, source_name, building_name
+                    ))
+                for effect_type in building_effects:
+                    if effect_type not in BUILDING_EFFECTS:
+                        raise ValidationError(
+                            "Unknown effect specified for {0}: {1} specifies {3} on {2}"
+                            .format(source_type.lower(), source_name, building_name, effect_type)
+                        )
+                for effect_type in BUILDING_EFFECTS:
+                    for resource_name, modifier in building_effects.get(effect_type, {}).items():
+                        if resource_name not in model.resources:
+                            raise ValidationError(
+                                "{0} affects {1} for nonexistent resource: {2} affects {4} {1} for {3}"
+                                .format(source_type, effect_type, source_name, building_name, resource_name)
+                            )
+                        validate_modifier(modifier)
+                        if effect_type == 'storage' and model.resources[resource_name].maximum is None:
+                            raise ValidationError(
+                                "{0} {1} affects storage for an unlimited resource: {2}"
+                                .format(source_type, source_name, resource_name)
+                            )
+            for upgrade_name, upgrade_effects in effects.get('upgrades', {}).items():
+                if upgrade_name not in model.upgrades:
+                    raise ValidationError("{0} {1} affects nonexistent upgrade {2}".format(
+                        source_type, source_name, upgrade_name
+                    ))
+                for effect_type in upgrade_effects:
+                    if effect_type not in UPGRADE_EFFECTS:
+                        raise ValidationError(
+                            "Unknown effect specified for {0}: {1} specifies {3} on upgrade {2}"
+                            .format(source_type.lower(), source_name, upgrade_name, effect_type)
+                        )
+                for resource_name, modifier in upgrade_effects.get('cost', {}).items():
+                    if resource_name not in model.resources:
+                        raise ValidationError(
+                            "{0} affects cost for nonexistent resource: {1} affects {3} cost of upgrade {2}"
+                            .format(source_type, source_name, upgrade_name, resource_name)
+                        )
+                    validate_modifier(modifier)
+            for group, modifiers in effects.get('global', {}).items():
+                if group not in GLOBAL_GROUPS:
+                    raise ValidationError("Unknown global effect group for {0} {1}: {2}".format(
+                        source_type.lower(), source_name, group
+                    ))
+                for resource_name, modifier in modifiers.items():
+                    if resource_name not in model.resources:
+                        raise ValidationError(
+                            "{0} affects {1} for nonexistent resource: {2} affects {3}"
+                            .format(source_type, group, source_name, resource_name)
+                        )
+                    validate_modifier(modifier)
+                    if 'add' in modifier:
+                        raise ValidationError(
+                            "Global effects cannot add to values: {0} adds to {1} {2}"
+                            .format(source_name, resource_name, group)
+                        )
+
         if len(json_data['resources']) != len(model.resources):
             raise ValidationError("Two resources share the same name")
         if len(json_data['buildings']) != len(model.buildings):
@@ -163,6 +300,12 @@ def validate_game_model(json_data):
                     raise ValidationError("Building {0} has storage for an unlimited resource: {1}".format(
                         building.name, resource_name
                     ))
+            if not isinstance(building.effects, dict):
+                raise ValidationError("Effects of building {0} must be a json object".format(building.name))
+            for key in building.effects:
+                if key not in ('buildings', 'upgrades', 'global'):
+                    raise ValidationError("Unknown key in effects of building {0}: {1}".format(building.name, key))
+            validate_effects("Building", building.name, building.effects)
 
         #
         # UPGRADES
@@ -170,34 +313,7 @@ def validate_game_model(json_data):
         for upgrade in model.upgrades.values():
             validate_unlock(upgrade.unlock)
             validate_resource_amounts(upgrade.cost)
-            for building_name, effects in upgrade.buildings.items():
-                if building_name not in model.buildings:
-                    raise ValidationError("Upgrade {0} affects nonexistent building {1}".format(
-                        upgrade.name, building_name
-                    ))
-                for effect_type in effects:
-                    if effect_type not in ('cost', 'income'):
-                        raise ValidationError(
-                            "Unknown effect specified for upgrade: {0} specifies {2} on {1}"
-                            .format(upgrade.name, building_name, effect_type)
-                        )
-                if 'cost' in effects:
-                    for resource_name, cost_modifier in effects['cost'].items():
-                        if resource_name not in model.resources:
-                            raise ValidationError(
-                                "Upgrade affects cost for nonexistent resource: {0} affects {2} cost of {1}"
-                                .format(upgrade.name, building_name, resource_name)
-                            )
-                        validate_modifier(cost_modifier)
-
-                if 'income' in effects:
-                    for resource_name, income_modifier in effects['income'].items():
-                        if resource_name not in model.resources:
-                            raise ValidationError(
-                                "Upgrade affects income for nonexistent resource: {0} affects {2} income for {1}"
-                                .format(upgrade.name, building_name, resource_name)
-                            )
-                        validate_modifier(income_modifier)
+            validate_effects("Upgrade", upgrade.name, upgrade.effects)
 
         #
         # NEW GAME STATE
@@ -267,6 +383,7 @@ class GameModel(object):
                 cost_factor=building['cost_factor'],
                 income=building.get('income', {}),
                 storage=building.get('storage', {}),
+                effects=building.get('effects', {}),
             )
             self.buildings[building.name] = building
 
@@ -279,39 +396,68 @@ class GameModel(object):
                 unlock=upgrade.get('unlock', ()),
                 cost=upgrade['cost'],
                 buildings=upgrade.get('buildings', {}),
+                effects={key: upgrade[key] for key in ('buildings', 'upgrades', 'global') if key in upgrade},
             )
             self.upgrades[upgrade.name] = upgrade
 
         # new game game-state
         self.new_game = json_data['new_game']
 
-    def load_game_instance(self, game_instance, game_instance_time):
-        return GameInstance(self, game_instance, game_instance_time)
+        # offline decay curve
+        self.decay = decay_curve(json_data.get('decay'))
+
+        self._effects = None
+        self._production = None
+
+    @property
+    def effects(self):
+        """The compiled EffectPipeline, made when it is first needed since it relies on the model being valid"""
+        if self._effects is None:
+            self._effects = EffectPipeline(self)
+        return self._effects
+
+    @property
+    def production(self):
+        """The ProductionGraph of the buildings, made when it is first needed like effects"""
+        if self._production is None:
+            self._production = ProductionGraph(self)
+        return self._production
+
+    def load_game_instance(self, game_instance, game_instance_time, timer=NULL_TIMER):
+        with timer.phase('load'):
+            return GameInstance(self, game_instance, game_instance_time, timer)
 
 
-def seconds_to_fast_forward(time):
+def seconds_to_fast_forward(time, decay=DEFAULT_DECAY):
     """
-    Calculate the effective number of seconds to fast forward for a given wait period.
+    Calculate the effective number of seconds to fast forward for a given wait period, by the
+    given decay curve (see clicker_game.decay).
 
     Accepts a timedelta and returns a float.
     """
-    actual = max(0.0, time.total_seconds())
-    effective = min(actual, FULL_SPEED_TIME)
-    extra = max(0.0, actual - FULL_SPEED_TIME)
-    extra = min(DECAY_TIME, extra)
-    effective += extra - extra**2 / (2 * DECAY_TIME)
-    return effective
+    return decay.effective_seconds(time.total_seconds())
 
 
 class GameInstance(object):
-    def __init__(self, model, instance_data, instance_time):
+    def __init__(self, model, instance_data, instance_time, timer=NULL_TIMER):
         self.model = model
         self.time = instance_time
+        self.timer = timer
         self.resources = instance_data.get('resources') or {}
         self.buildings = instance_data.get('buildings') or {}
         self.upgrades = set(instance_data.get('upgrades', ()))
+        self.orders = [dict(order) for order in instance_data.get('orders', ())]
+        self.effects = EffectState(model.effects)
+        # building: speed, for buildings slowed down by a shortage of what they consume
+        self.speeds = {}
+        # clicks are limited by the time since the state was saved, however many actions follow
+        self.saved_time = instance_time
+        # whether the derived values (incomes, costs, storage, speeds) match the state, so that a
+        # fast forward needn't calculate them again; cleared by anything that changes them
+        self.values_current = False
+        self.clicks_since_saved = 0
         # convert to python objects
-        self.resources = {name: Dicted(owned=count) for name, count in self.resources.items()}
+        self.resources = {name: Dicted(owned=from_json(count)) for name, count in self.resources.items()}
         self.buildings = {name: Dicted(owned=count) for name, count in self.buildings.items()}
 
     def get_current_state(self, current_time):
@@ -328,6 +474,92 @@ class GameInstance(object):
         buildings if possible, and return the (modified game state, and data to pass to the client) in a tuple
         """
         self.fast_forward(current_time)
+        self.try_purchase_building(building_name, number_purchased)
+        return self.save_state_json(), self.client_state_json()
+
+    def purchase_upgrade(self, current_time, upgrade_name):
+        """
+        Read a game state object, advance it forwards in time to the current time, purchase the specified
+        upgrade if possible, and return the (modified game state, and data to pass to the client) in a tuple
+        """
+        self.fast_forward(current_time)
+        self.try_purchase_upgrade(upgrade_name)
+        return self.save_state_json(), self.client_state_json()
+
+    def record_clicks(self, current_time, building_name, clicks, max_clicks_per_second):
+        """
+        Read a game state object, advance it forwards in time to the current time, apply a batch of
+        clicks on a click building, and return the (modified game state, and data to pass to the client)
+        in a tuple. Clicks beyond max_clicks_per_second for the time since the instance was loaded are
+        ignored, counting the clicks already recorded on this instance.
+        """
+        return self.record_click_batch(current_time, [(building_name, clicks)], max_clicks_per_second)
+
+    def record_click_batch(self, current_time, clicks, max_clicks_per_second):
+        """
+        Like record_clicks, but for a list of (building name, clicks) pairs, applied in order in one
+        step. The clicks allowed for the time since the instance was loaded are shared by the batch.
+        """
+        elapsed = (current_time - self.saved_time).total_seconds()
+        allowed = int(max_clicks_per_second * elapsed) - self.clicks_since_saved
+        self.fast_forward(current_time)
+        for building_name, count in clicks:
+            count = min(count, allowed)
+            if self.try_click(building_name, count):
+                self.clicks_since_saved += count
+                allowed -= count
+        return self.save_state_json(), self.client_state_json()
+
+    def place_order(self, current_time, order):
+        """
+        Read a game state object, advance it forwards in time to the current time, add a standing order
+        if it is valid, and return the (modified game state, and data to pass to the client) in a tuple.
+        An order for the same building or upgrade as an existing one replaces it.
+        """
+        self.fast_forward(current_time)
+        order = self.clean_order(order)
+        if order is not None:
+            self.orders = [existing for existing in self.orders if not self.same_order(existing, order)]
+            if len(self.orders) < MAX_ORDERS:
+                self.orders.append(order)
+                # the order may be affordable already
+                self.fill_orders(0.0)
+        return self.save_state_json(), self.client_state_json()
+
+    def cancel_order(self, current_time, order):
+        """
+        Like place_order, but removes the standing order for the same building or upgrade as the one
+        given instead.
+        """
+        self.fast_forward(current_time)
+        self.orders = [existing for existing in self.orders if not self.same_order(existing, order)]
+        return self.save_state_json(), self.client_state_json()
+
+    def clean_order(self, order):
+        """Return a standing order in its stored form, or None if it is not a valid order"""
+        if not isinstance(order, dict):
+            return None
+        if 'building' in order:
+            building = self.model.buildings.get(order['building'])
+            try:
+                up_to = int(order.get('up_to'))
+            except (TypeError, ValueError):
+                return None
+            if building is None or is_click_building(building) or not 0 < up_to <= MAX_ORDER_UP_TO:
+                return None
+            return {'building': building.name, 'up_to': up_to}
+        if 'upgrade' in order:
+            if order['upgrade'] not in self.model.upgrades:
+                return None
+            return {'upgrade': order['upgrade']}
+        return None
+
+    @staticmethod
+    def same_order(a, b):
+        return a.get('building') == b.get('building') and a.get('upgrade') == b.get('upgrade')
+
+    def try_purchase_building(self, building_name, number_purchased):
+        """Purchase some buildings right now if possible, and return whether they were purchased"""
         if (
             building_name in self.model.buildings and
             self.requirement_is_met(self.model.buildings[building_name].unlock) and
@@ -335,30 +567,63 @@ class GameInstance(object):
         ):
             self.acquire_building(building_name, number_purchased)
             self.calculate_values()
-        return self.save_state_json(), self.client_state_json()
+            return True
+        return False
 
-    def purchase_upgrade(self, current_time, upgrade_name):
+    def try_click(self, building_name, clicks):
         """
-        Read a game state object, advance it forwards in time to the current time, purchase the specified
-        upgrade if possible, and return the (modified game state, and data to pass to the client) in a tuple
+        Click a click building a number of times right now, and return whether it was clicked. Every
+        click costs the same, so this takes the same time for any number of clicks.
         """
-        self.fast_forward(current_time)
+        building = self.model.buildings.get(building_name)
+        if (
+            building is None or
+            clicks <= 0 or
+            not is_click_building(building) or
+            not self.requirement_is_met(building.unlock)
+        ):
+            return False
+        owned = self.buildings.get(building_name)
+        values_current = self.values_current
+        known_resources = len(self.resources)
+        for resource_name, amount in self.cost_of_building(building_name, 1).items():
+            self.acquire_resource(resource_name, -amount * clicks)
+        self.acquire_building(building_name, clicks)
+        # the owned count only feeds into the derived values through incomes and storage (with
+        # those that effects give it) and effects, and the payout may be of something that slowed
+        # production had run out of, or of a resource the state didn't have yet
+        if (
+            owned is None or
+            getattr(owned, 'income', True) or
+            getattr(owned, 'storage', True) or
+            building.effects or
+            self.speeds or
+            len(self.resources) != known_resources
+        ):
+            self.calculate_values()
+        else:
+            self.values_current = values_current
+        return True
+
+    def try_purchase_upgrade(self, upgrade_name):
+        """Purchase an upgrade right now if possible, and return whether it was purchased"""
         if (
             upgrade_name in self.model.upgrades and
             upgrade_name not in self.upgrades and
             self.requirement_is_met(self.model.upgrades[upgrade_name].unlock) and
-            self.pay_cost(self.model.upgrades[upgrade_name].cost)
+            self.pay_cost(self.cost_of_upgrade(upgrade_name))
         ):
             self.acquire_upgrade(upgrade_name)
             self.calculate_values()
-        return self.save_state_json(), self.client_state_json()
+            return True
+        return False
 
     def save_state_json(self):
         """Return the save state json object for this game state, boiled down to its minimum"""
         result = {}
         if self.resources:
             result['resources'] = {
-                name: resource.owned
+                name: to_json(resource.owned)
                 for name, resource in self.resources.items()
                 if resource.owned
             }
@@ -370,6 +635,8 @@ class GameInstance(object):
             }
         if self.upgrades:
             result['upgrades'] = list(self.upgrades)
+        if self.orders:
+            result['orders'] = [dict(order) for order in self.orders]
         return result
 
     def client_state_json(self):
@@ -377,100 +644,120 @@ class GameInstance(object):
         Return the information about the game state suitable for the client side JS to render
         the page we want the user to see
         """
-        result = {
-            'resources': [],
-            'buildings': [],
-            'upgrades': [],
-        }
-        # resources
-        for resource in self.model.resources.values():
-            owned = self.resources.get(resource.name)
-            if owned and (owned.owned or owned.income) and (not owned.maximum == 0):
-                result['resources'].append({
-                    'name': resource.name,
-                    'description': resource.description,
-                    'owned': owned.owned,
-                    'income': owned.income,
-                    'maximum': owned.maximum,
-                })
-
-        # buildings
-        for building in self.model.buildings.values():
-            owned = building.name in self.buildings and self.buildings[building.name].owned or 0
-            income = owned and self.buildings[building.name].income or building.income
-            if owned or self.requirement_is_met(building.unlock):
-                result['buildings'].append({
-                    'name': building.name,
-                    'description': building.description,
-                    'owned': owned,
-                    'cost': self.cost_of_building(building.name, 1),
-                    'cost10': self.cost_of_building(building.name, 10),
-                    'income': income,
-                })
-
-        # upgrades
-        for upgrade in self.model.upgrades.values():
-            if upgrade.name in self.upgrades or self.requirement_is_met(upgrade.unlock):
-                result['upgrades'].append({
-                    'name': upgrade.name,
-                    'description': upgrade.description,
-                    'owned': upgrade.name in self.upgrades,
-                    'cost': upgrade.cost,
-                })
-
-        return result
+        with self.timer.phase('client_state'):
+            result = {
+                'resources': [],
+                'buildings': [],
+                'upgrades': [],
+            }
+            # resources
+            for resource in self.model.resources.values():
+                owned = self.resources.get(resource.name)
+                if owned and (owned.owned or owned.income) and (not owned.maximum == 0):
+                    result['resources'].append({
+                        'name': resource.name,
+                        'description': resource.description,
+                        'owned': owned.owned,
+                        'income': owned.income,
+                        'maximum': owned.maximum,
+                    })
+
+            # buildings
+            for building in self.model.buildings.values():
+                owned = building.name in self.buildings and self.buildings[building.name].owned or 0
+                income = owned and self.buildings[building.name].income or building.income
+                if owned or self.requirement_is_met(building.unlock):
+                    result['buildings'].append({
+                        'name': building.name,
+                        'description': building.description,
+                        'owned': owned,
+                        'cost': self.cost_of_building(building.name, 1),
+                        'cost10': self.cost_of_building(building.name, 10),
+                        'income': income,
+                    })
+
+            # upgrades
+            for upgrade in self.model.upgrades.values():
+                if upgrade.name in self.upgrades or self.requirement_is_met(upgrade.unlock):
+                    result['upgrades'].append({
+                        'name': upgrade.name,
+                        'description': upgrade.description,
+                        'owned': upgrade.name in self.upgrades,
+                        'cost': self.cost_of_upgrade(upgrade.name),
+                    })
+
+            # standing orders
+            if self.orders:
+                result['orders'] = [dict(order) for order in self.orders]
+
+            # production slowed by shortages, and how long until the next resource runs out
+            if self.model.production.has_consumers:
+                until, resource_name = seconds_until_depleted(self.resources)
+                result['production'] = {
+                    'speeds': dict(self.speeds),
+                    'runs_out': {'resource': resource_name, 'seconds': until} if resource_name else None,
+                }
+
+            return result
 
     def calculate_values(self):
-        # calculate resource incomes per building type
-        for name, building in self.buildings.items():
-            # incomes are per resource
-            building.income = self.model.buildings[name].income.copy()
-            building.multiplier = {resource: 1.0 for resource in building.income}
-            building.cost = self.model.buildings[name].cost.copy()
-            building.storage = self.model.buildings[name].storage.copy()
-
-        # calculate upgrades
-        for upgrade in self.upgrades:
-            # effects on buildings
-            for building, effects in self.model.upgrades[upgrade].buildings.items():
-                # cost modifiers
-                if 'cost' in effects:
-                    for resource, cost_modifier in effects['cost'].items():
-                        new_cost = (
-                            self.buildings[building].cost.pop(resource, 0.0) *
-                            cost_modifier['multiplier']
-                        )
-                        if new_cost:
-                            self.buildings[building].cost[resource] = new_cost
-                # income modifiers
-                if 'income' in effects:
-                    for resource, income_modifier in effects['income'].items():
-                        new_income = (
-                            self.buildings[building].income[resource] *
-                            income_modifier['multiplier']
-                        )
-                        if new_income:
-                            self.buildings[building].income[resource] = new_income
-
-        # reset resources maximums and incomes
-        for name, resource in self.resources.items():
-            resource.income = 0.0
-            resource.maximum = self.model.resources[name].maximum
-
-        # calculate total storage and income right now
-        for building in self.buildings.values():
-            for resource, storage in building.storage.items():
-                self.acquire_storage(resource, storage * building.owned)
-            for resource, income in building.income.items():
-                self.acquire_income(resource, income * building.owned)
+        with self.timer.phase('calculate_values'):
+            # evaluate the effects of whatever changed since last time
+            effects = self.effects
+            effects.update(self.upgrades, self.buildings)
+
+            # resource incomes, costs and storage per building type, shared with the model and the
+            # effects, so these are never changed in place
+            for name, building in self.buildings.items():
+                model_building = self.model.buildings[name]
+                building.income = effects.lookup('income', name, model_building.income)
+                building.cost = effects.lookup('cost', name, model_building.cost)
+                building.storage = effects.lookup('storage', name, model_building.storage)
+
+            # reset resources maximums and incomes
+            for name, resource in self.resources.items():
+                resource.income = 0.0
+                resource.maximum = self.model.resources[name].maximum
+
+            # slow down buildings consuming resources that have run out
+            production = self.model.production
+            self.speeds = production.solve(self.buildings, self.resources) if production.has_consumers else {}
+
+            # calculate total storage and income right now
+            speeds = self.speeds
+            for name, building in self.buildings.items():
+                for resource, storage in building.storage.items():
+                    self.acquire_storage(resource, storage * building.owned)
+                speed = speeds.get(name, 1.0)
+                for resource, income in building.income.items():
+                    self.acquire_income(resource, income * building.owned * speed)
+            self.values_current = True
+
+    def change_speeds(self):
+        """
+        Solve the building speeds again after a resource has run out, and change the incomes to match.
+        Only the incomes of the buildings whose speed changed are touched.
+        """
+        old = self.speeds
+        self.speeds = self.model.production.solve(self.buildings, self.resources)
+        changes = {}  # resource: size of the changes to its income
+        for name in set(old).union(self.speeds):
+            change = self.speeds.get(name, 1.0) - old.get(name, 1.0)
+            if change:
+                building = self.buildings[name]
+                for resource, income in building.income.items():
+                    self.acquire_income(resource, income * building.owned * change)
+                    changes[resource] = changes.get(resource, 0.0) + abs(income * building.owned * change)
+        clear_rounding_errors(self.resources, changes)
 
     def acquire_resource(self, resource_name, amount):
         """Add an amount of a resource to the state"""
         if resource_name not in self.resources:
             self.resources[resource_name] = Dicted(owned=0.0, maximum=self.model.resources[resource_name].maximum)
+            self.values_current = False
         cap = self.resources[resource_name].maximum
         self.resources[resource_name].owned = max(0.0, min(
-            self.resources[resource_name].owned + amount,
+            add(self.resources[resource_name].owned, amount),
             float('inf') if cap is None else cap
         ))
 
@@ -499,18 +786,101 @@ class GameInstance(object):
         if building_name not in self.buildings:
             self.buildings[building_name] = Dicted(owned=0)
         self.buildings[building_name].owned += number
+        self.values_current = False
 
     def acquire_upgrade(self, upgrade_name):
         """Add an upgrade to this game state"""
         self.upgrades.add(upgrade_name)
+        self.values_current = False
 
     def fast_forward(self, current_time):
         """Fast forward the time of the game state to the given time"""
-        self.calculate_values()
-        seconds = seconds_to_fast_forward(current_time - self.time)
+        with self.timer.phase('fast_forward'):
+            if not self.values_current:
+                self.calculate_values()
+            seconds = seconds_to_fast_forward(current_time - self.time, self.model.decay)
+            if self.orders:
+                seconds = self.fill_orders(seconds)
+            self.advance(seconds)
+            self.time = current_time
+
+    def fill_orders(self, seconds):
+        """
+        Advance through up to a number of effective seconds of game time, buying whatever the standing
+        orders call for at the exact moment it becomes affordable. Incomes only change when something is
+        bought, so this jumps from one purchase to the next instead of stepping through time. Finished
+        orders are removed. Returns the number of seconds left over after the last purchase.
+        """
+        for _ in range(MAX_ORDER_PURCHASES):
+            next_order = None
+            for order in list(self.orders):
+                if 'upgrade' in order:
+                    if order['upgrade'] in self.upgrades:
+                        self.orders.remove(order)
+                        continue
+                    unlock = self.model.upgrades[order['upgrade']].unlock
+                    cost = self.cost_of_upgrade(order['upgrade'])
+                else:
+                    building = self.buildings.get(order['building'])
+                    if building and building.owned >= order['up_to']:
+                        self.orders.remove(order)
+                        continue
+                    unlock = self.model.buildings[order['building']].unlock
+                    cost = self.cost_of_building(order['building'], 1)
+                if not self.requirement_is_met(unlock):
+                    continue
+                wait = self.seconds_until_affordable(cost)
+                if wait <= seconds and (next_order is None or wait < next_order[0]):
+                    next_order = (wait, order, cost)
+            if next_order is None:
+                break
+            wait, order, cost = next_order
+            if self.model.production.has_consumers:
+                # incomes change when something runs out, so look again from there
+                until, resource_name = seconds_until_depleted(self.resources)
+                if until < wait:
+                    self.advance(until)
+                    seconds -= until
+                    continue
+            self.advance_to_afford(cost, wait)
+            seconds -= wait
+            if 'upgrade' in order:
+                bought = self.try_purchase_upgrade(order['upgrade'])
+            else:
+                bought = self.try_purchase_building(order['building'], 1)
+            if not bought:  # pragma: no cover
+                self.orders.remove(order)
+        return seconds
+
+    def advance_to_afford(self, cost, seconds):
+        """
+        Advance by the number of seconds that seconds_until_affordable() gave for a cost, forgiving the
+        rounding error that might leave it just short of affordable.
+        """
+        self.advance(seconds)
+        for resource_name, amount in cost.items():
+            resource = self.resources.get(resource_name)
+            if resource is not None and amount > resource.owned >= amount * (1.0 - 1e-9):
+                resource.owned = amount
+
+    def advance(self, seconds):
+        """
+        Collect income for a number of effective seconds of game time. calculate_values() must have
+        been called since the last change to the state. Whenever a resource runs out along the way,
+        the buildings consuming it are slowed down from that moment on.
+        """
+        if self.model.production.has_consumers:
+            for _ in range(MAX_PRODUCTION_CHANGES):
+                until, resource_name = seconds_until_depleted(self.resources)
+                if until > seconds:
+                    break
+                for name, resource in self.resources.items():
+                    self.acquire_resource(name, resource.income * until)
+                self.resources[resource_name].owned = 0.0
+                seconds -= until
+                self.change_speeds()
         for resource_name, resource in self.resources.items():
             self.acquire_resource(resource_name, resource.income * seconds)
-        self.time = current_time
 
     def requirement_is_met(self, unlock):
         """
@@ -533,20 +903,28 @@ class GameInstance(object):
 
     def cost_of_building(self, building_name, number_to_buy=1):
         """Calculate the cost of purchasing a certain number of a building"""
-        # get or create a building
-        building = (
-            self.buildings.get(building_name) or
-            Dicted(
-                owned=0,
-                cost=self.model.buildings[building_name].cost.copy()
-            )
-        )
-        result = {resource: 0.0 for resource in building.cost}
-        for resource, amount in building.cost.items():
-            for n in range(building.owned, building.owned + number_to_buy):
-                result[resource] += amount * self.model.buildings[building_name].cost_factor ** n
+        building = self.buildings.get(building_name)
+        owned = building.owned if building is not None else 0
+        cost = self.effects.lookup('cost', building_name, self.model.buildings[building_name].cost)
+        cost_factor = self.model.buildings[building_name].cost_factor
+        result = {}
+        for resource, amount in cost.items():
+            total = 0.0
+            for n in range(owned, owned + number_to_buy):
+                total += amount * power(cost_factor, n)
+            if type(total) is float and (total == INFINITY or total == -INFINITY):
+                # a product or the sum overflowed before the power alone did, so again without
+                # letting floats run out
+                total = 0.0
+                for n in range(owned, owned + number_to_buy):
+                    total = add(total, multiply(amount, power(cost_factor, n)))
+            result[resource] = total
         return result
 
+    def cost_of_upgrade(self, upgrade_name):
+        """The cost of an upgrade, after the effects on it"""
+        return self.effects.lookup('upgrade_cost', upgrade_name, self.model.upgrades[upgrade_name].cost)
+
     def cost_is_affordable(self, cost):
         """Determine whether a cost is currently affordable"""
         return all(
@@ -554,10 +932,30 @@ class GameInstance(object):
             for resource, amount in cost.items()
         )
 
+    def seconds_until_affordable(self, cost):
+        """
+        Calculate how many effective seconds of income it will take before a cost is affordable, which
+        is infinite if it never will be at the current incomes. calculate_values() must have been called
+        since the last change to the state.
+        """
+        seconds = 0.0
+        for resource_name, amount in cost.items():
+            resource = self.resources.get(resource_name)
+            owned = resource.owned if resource else 0.0
+            if owned >= amount:
+                continue
+            income = resource.income if resource else 0.0
+            maximum = resource.maximum if resource else self.model.resources[resource_name].maximum
+            if income <= 0.0 or (maximum is not None and maximum < amount):
+                return float('inf')
+            seconds = max(seconds, (amount - owned) / income)
+        return seconds
+
     def pay_cost(self, cost):
         """If a cost is affordable, pay the cost and return True. Otherwise, return False."""
         if not self.cost_is_affordable(cost):
             return False
         for resource, amount in cost.items():
-            self.resources[resource].owned -= amount
+            # back to a float if a BigNumber amount fits in one again
+            self.resources[resource].owned = add(self.resources[resource].owned, -amount)
         return True
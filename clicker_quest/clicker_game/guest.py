@@ -0,0 +1,110 @@
+# coding=utf-8
+import calendar
+from datetime import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from clicker_game.archive import archived_user_games
+from clicker_game.models import ClickerGame
+from clicker_game.sharding import user_games
+
+
+"""
+Guest play: games played without signing in, kept in a signed cookie instead of the database.
+
+A guest's save state for a game goes in a cookie of its own, named GUEST_COOKIE_PREFIX and the
+game's id, as compressed json signed with the SECRET_KEY along with the time it was saved. Guests
+play with the same GameModel and GameInstance code as everyone else, and nothing about them is
+written to the database, so anonymous traffic costs no database capacity. The signature stops
+guests from editing their saves, but not from going back to an older one, which is as much as a
+game nobody has signed up for needs.
+
+load_guest_save(request, game_id):
+    (save state, time saved) from the request's cookie for a game, or None if there is no valid,
+    unexpired one.
+
+save_guest_game(response, game_id, data, modified):
+    Set the cookie for a game on a response. Returns False without setting it if the save is
+    too big for a cookie, which only happens to guests far enough into a game to sign up.
+
+adopt_guest_games(request, user):
+    Give a newly registered user a GameInstance for each guest game in the request's cookies.
+    Returns the ids of the games adopted, whose cookies should be deleted.
+
+delete_guest_cookies(response, game_ids):
+    Delete the cookies for some games.
+
+Set CLICKER_GUEST_PLAY to False to send anyone not signed in to the login page instead, and
+CLICKER_GUEST_MAX_AGE to the number of seconds guest games are kept for.
+"""
+
+
+GUEST_COOKIE_PREFIX = 'clicker_guest_'
+GUEST_SALT = 'clicker_game.guest'
+MAX_COOKIE_LENGTH = 4000  # browsers keep cookies up to 4096 bytes, name and attributes included
+
+
+def guest_play_enabled():
+    return getattr(settings, 'CLICKER_GUEST_PLAY', True)
+
+
+def max_age():
+    return getattr(settings, 'CLICKER_GUEST_MAX_AGE', 86400 * 365)
+
+
+def cookie_name(game_id):
+    return '{0}{1}'.format(GUEST_COOKIE_PREFIX, game_id)
+
+
+def load_guest_save(request, game_id):
+    value = request.COOKIES.get(cookie_name(game_id))
+    if value is None:
+        return None
+    try:
+        saved = signing.loads(value, salt=GUEST_SALT, max_age=max_age())
+        return saved['data'], datetime.utcfromtimestamp(saved['modified']).replace(tzinfo=timezone.utc)
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+def save_guest_game(response, game_id, data, modified):
+    timestamp = calendar.timegm(modified.utctimetuple()) + modified.microsecond / 1e6
+    value = signing.dumps({'data': data, 'modified': timestamp}, salt=GUEST_SALT, compress=True)
+    if len(value) > MAX_COOKIE_LENGTH:
+        return False
+    response.set_cookie(
+        cookie_name(game_id), value,
+        max_age=max_age(),
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+    )
+    return True
+
+
+def adopt_guest_games(request, user):
+    saves = {}
+    for name in request.COOKIES:
+        game_id = name[len(GUEST_COOKIE_PREFIX):]
+        if name.startswith(GUEST_COOKIE_PREFIX) and game_id.isdigit():
+            saved = load_guest_save(request, int(game_id))
+            if saved is not None:
+                saves[int(game_id)] = saved
+    adopted = []
+    playing = set(user_games(user.pk).values_list('game_id', flat=True))
+    playing.update(archived_user_games(user.pk).values_list('game_id', flat=True))
+    for game_id, version_id in ClickerGame.objects.filter(pk__in=saves).values_list('pk', 'version_id'):
+        if game_id in playing:
+            continue
+        data, modified = saves[game_id]
+        instance = user_games(user.pk).create(user=user, game_id=game_id, data=data, model_version_id=version_id)
+        # modified is set on creation, so the time the guest game was saved goes in afterwards
+        user_games(user.pk).filter(pk=instance.pk).update(modified=modified)
+        adopted.append(game_id)
+    return adopted
+
+
+def delete_guest_cookies(response, game_ids):
+    for game_id in game_ids:
+        response.delete_cookie(cookie_name(game_id))
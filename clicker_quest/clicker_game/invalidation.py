@@ -0,0 +1,191 @@
+# coding=utf-8
+import logging
+import os
+import select
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from clicker_game.models import ClickerGame
+from clicker_game.registry import registry
+
+
+"""
+Telling every worker process when a game is edited, over Postgres LISTEN/NOTIFY.
+
+Without this, the views fetch each game's last modified time along with the player's game
+instance, and compare it with the game in the registry, to notice games edited in another
+process. Instead, saving or deleting a ClickerGame sends a NOTIFY (when the transaction commits),
+and a listener thread in each worker reloads the game into its registry as soon as it hears it.
+While the listener is connected, the views take the game from the registry without asking the
+database about it.
+
+In case a notification is missed, the listener also compares every game's modified time with
+the registry every CLICKER_MODEL_CHECK_SECONDS, and on (re)connecting. If it loses its connection
+the views go back to checking on each request until it has reconnected. Games are only dropped
+from the registry when the listener hears that they were deleted: the listener's connection may
+not see a game that another connection hasn't committed yet, so a game it can't find is left
+as it is.
+
+This needs Postgres, and CLICKER_MODEL_LISTENER on; otherwise the views check on each request.
+It is off by default, and never on for the test suite.
+
+ModelListener:
+    ensure_started():
+        Start this process's listener thread if it hasn't been. The views do this on each
+        request, so that each worker of a prefork server starts its own after forking.
+
+    listening():
+        Whether the listener is connected, so that the registry is up to date.
+
+    stop():
+        Stop the listener thread, if this process started one, and wait for it to close its
+        connections.
+
+    changed(game_ids, deleted_ids=()):
+        Reload the games with game_ids into the registry, and drop those with deleted_ids.
+
+    check_versions():
+        Reload the games that were modified since the registry loaded them.
+
+listener:
+    The ModelListener used by the views.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'clicker_game_models'
+DELETED = 'deleted:'  # the start of the payload of a game's deletion, before its id
+RECONNECT_SECONDS = 5.0
+
+
+def check_seconds():
+    return getattr(settings, 'CLICKER_MODEL_CHECK_SECONDS', 60.0)
+
+
+def notify(using, payload):
+    if connections[using].vendor == 'postgresql':
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, payload])
+
+
+@receiver(post_save, sender=ClickerGame)
+def notify_game_saved(sender, instance, using, **kwargs):
+    notify(using, str(instance.pk))
+
+
+@receiver(post_delete, sender=ClickerGame)
+def notify_game_deleted(sender, instance, using, **kwargs):
+    notify(using, DELETED + str(instance.pk))
+
+
+class ModelListener(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._wake = None  # a pipe that wakes the thread up to stop, as (read end, write end)
+        self.connected = False
+        self.last_check = 0.0
+
+    def enabled(self):
+        return (getattr(settings, 'CLICKER_MODEL_LISTENER', False) and
+                connections[DEFAULT_DB_ALIAS].vendor == 'postgresql')
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or not self.enabled():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # a forked worker doesn't have its parent's thread, or its connection
+            self._pid = os.getpid()
+            self.connected = False
+            self._stopping.clear()
+            self._wake = os.pipe()
+            self._thread = threading.Thread(target=self.run, name='clicker-model-listener')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def listening(self):
+        return self.connected and self._pid == os.getpid()
+
+    def stop(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._stopping.set()
+            os.write(self._wake[1], b'x')
+            self._thread.join()
+            for end in self._wake:
+                os.close(end)
+            self._pid = self._thread = self._wake = None
+            self.connected = False
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self.listen()
+            except Exception:
+                logger.warning("Lost the game model listener's connection", exc_info=True)
+            self.connected = False
+            self._stopping.wait(RECONNECT_SECONDS)
+
+    def listen(self):
+        import psycopg2
+        params = connections[DEFAULT_DB_ALIAS].get_connection_params()
+        listen_connection = psycopg2.connect(**params)
+        try:
+            listen_connection.autocommit = True
+            with listen_connection.cursor() as cursor:
+                cursor.execute('LISTEN {0}'.format(CHANNEL))
+            # anything edited before now wasn't heard
+            self.check_versions()
+            self.connected = True
+            while not self._stopping.is_set():
+                wait = max(self.last_check + check_seconds() - default_timer(), 0.0)
+                ready = select.select([listen_connection, self._wake[0]], [], [], wait)[0]
+                if listen_connection in ready:
+                    listen_connection.poll()
+                    game_ids, deleted_ids = set(), set()
+                    while listen_connection.notifies:
+                        payload = listen_connection.notifies.pop(0).payload
+                        if payload.startswith(DELETED):
+                            deleted_ids.add(int(payload[len(DELETED):]))
+                        else:
+                            game_ids.add(int(payload))
+                    self.changed(game_ids - deleted_ids, deleted_ids)
+                if default_timer() - self.last_check >= check_seconds():
+                    self.check_versions()
+                # this thread's own Django connection, which would otherwise stay open
+                connection.close()
+        finally:
+            listen_connection.close()
+            connection.close()
+
+    def changed(self, game_ids, deleted_ids=()):
+        # from the primary, since a replica may not have the change yet; a game that isn't
+        # there may just not be committed where this connection can see it, so it stays
+        for game in ClickerGame.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=game_ids):
+            registry.refresh(game)
+        for game_id in deleted_ids:
+            registry.remove(game_id)
+
+    def check_versions(self):
+        self.last_check = default_timer()
+        entries = {entry.game.pk: entry for entry in registry.entries()}
+        modified = dict(ClickerGame.objects.using(DEFAULT_DB_ALIAS).values_list('pk', 'modified'))
+        changed = set(pk for pk, entry in entries.items()
+                      if pk in modified and modified[pk] > entry.game.modified)
+        if changed:
+            logger.info("Reloading games %s, which the listener didn't hear about", sorted(changed))
+            self.changed(changed)
+
+
+listener = ModelListener()
@@ -0,0 +1,472 @@
+# coding=utf-8
+import json
+import math
+import random
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from importlib import import_module
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.db import connections
+from django.utils import six
+from django.utils.crypto import get_random_string
+from django.utils.six.moves import http_client, http_cookies
+from django.utils.six.moves.urllib.parse import urlencode, urlsplit
+
+from clicker_game.game_model import is_click_building
+from clicker_game.registry import registry
+from clicker_game.sharding import user_games
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+
+"""
+Load tests: simulated players playing the site at once, to size the servers by measurement.
+
+Each player is a registered user (made for the run, and deleted after it) playing in a thread of
+its own, picking actions at random from the scenario's mix with a random think time between them:
+
+    page        load the game page
+    poll        poll for the state of the game, like the page does
+    clicks      send a batch of clicks on a click building
+    building    buy one of a building
+    upgrade     buy an upgrade
+    return      come back after a long absence: the game is saved absence_seconds earlier than
+                it really was, so the poll after it fast forwards through the offline decay
+
+Players go through the whole WSGI application, middleware and all, either in-process
+(WSGITransport, which also counts the database queries of each request) or over HTTP to a running
+server (HTTPTransport, which has to share the database with this process, since players log in by
+having sessions made for them).
+
+Scenario(name, **options):
+    The number of players and what they do; see SCENARIO_DEFAULTS for the options. SCENARIOS has
+    the built in ones, and load_scenario(path) reads one from a json file, or a yaml file when
+    PyYAML is installed.
+
+run_load_test(scenario, transport, game=None, keep_players=False):
+    Play a scenario on a ClickerGame (the default game when None), returning a LoadTestReport.
+
+LoadTestReport:
+    as_json():
+        Requests, errors, throughput, latency percentiles (p50, p95, p99) and database queries
+        per request, in all and for each action.
+
+compare_reports(baseline, report, threshold=0.1):
+    Compare two reports (in their json form), returning a row for every action and figure:
+    (action, figure, baseline value, new value, relative change, whether it got worse by more
+    than the threshold).
+"""
+
+
+ACTIONS = ('page', 'poll', 'clicks', 'building', 'upgrade', 'return')
+PERCENTILES = (50, 95, 99)
+
+# option: default
+SCENARIO_DEFAULTS = OrderedDict([
+    ('players', 10),
+    ('seconds', 30.0),  # how long the players play for
+    ('requests_per_player', None),  # or how many requests each one makes
+    ('think_seconds', 1.0),  # mean time between a player's requests, exponentially distributed
+    ('mix', {'page': 1, 'poll': 20, 'clicks': 10, 'building': 4, 'upgrade': 1, 'return': 0.2}),
+    ('absence_seconds', 3 * 86400.0),
+    ('click_burst', 20),
+    ('seed', 0),
+])
+
+SCENARIOS = OrderedDict([
+    ('mixed', {}),
+    ('polling', {'mix': {'poll': 1}, 'think_seconds': 0.5}),
+    ('clicking', {'mix': {'clicks': 4, 'building': 2, 'upgrade': 1, 'poll': 1}}),
+    ('returning', {'mix': {'return': 1, 'page': 1}}),
+    ('saturate', {'think_seconds': 0.0}),
+])
+
+
+class Scenario(object):
+    def __init__(self, name, **options):
+        unknown = set(options) - set(SCENARIO_DEFAULTS)
+        if unknown:
+            raise ValueError("Unknown scenario options: {0}".format(", ".join(sorted(unknown))))
+        self.name = name
+        for option, default in SCENARIO_DEFAULTS.items():
+            setattr(self, option, options.get(option, default))
+        if not self.mix or set(self.mix) - set(ACTIONS) or min(self.mix.values()) < 0:
+            raise ValueError("A scenario's mix gives weights to some of: {0}".format(", ".join(ACTIONS)))
+
+    @classmethod
+    def named(cls, name, **options):
+        if name not in SCENARIOS:
+            raise ValueError("No such scenario: {0}".format(name))
+        return cls(name, **dict(SCENARIOS[name], **options))
+
+    def as_json(self):
+        return OrderedDict(
+            [('name', self.name)] + [(option, getattr(self, option)) for option in SCENARIO_DEFAULTS]
+        )
+
+
+def load_scenario(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError("Reading yaml scenarios needs PyYAML installed")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("A scenario file holds an object of scenario options")
+    data = dict(data)
+    return Scenario(data.pop('name', path), **data)
+
+
+def parse_cookies(headers):
+    """{name: value} from Set-Cookie header values, with None for deleted cookies"""
+    cookies = {}
+    for header in headers:
+        parsed = http_cookies.SimpleCookie()
+        parsed.load(str(header))
+        for name, morsel in parsed.items():
+            deleted = morsel['max-age'] in ('0', 0) or not morsel.value
+            cookies[name] = None if deleted else morsel.value
+    return cookies
+
+
+class WSGITransport(object):
+    """Requests straight to the WSGI application, in this process"""
+    counts_queries = True
+
+    def __init__(self, application=None, host='localhost'):
+        if application is None:
+            # importing it sets the application up
+            from clicker_quest.wsgi import application
+        self.application = application
+        self.host = host
+
+    def request(self, method, path, headers, body=b''):
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': self.host,
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': six.BytesIO(body),
+            'wsgi.errors': six.StringIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace('-', '_')
+            environ[key if key == 'CONTENT_TYPE' else 'HTTP_' + key] = value
+        started = []
+
+        def start_response(status, response_headers, exc_info=None):
+            started.append((int(status.split()[0]), response_headers))
+
+        result = self.application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        status, response_headers = started[0]
+        set_cookies = [value for name, value in response_headers if name.lower() == 'set-cookie']
+        return status, parse_cookies(set_cookies), content
+
+
+class HTTPTransport(object):
+    """Requests over HTTP to a running server, with a connection for each player thread"""
+    counts_queries = False
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.local = threading.local()
+
+    def request(self, method, path, headers, body=b''):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = http_client.HTTPConnection(self.host, self.port, timeout=60)
+            self.local.connection = connection
+        try:
+            connection.request(method, self.prefix + path, body or None, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except Exception:
+            connection.close()
+            self.local.connection = None
+            raise
+        message = response.msg
+        if hasattr(message, 'get_all'):
+            set_cookies = message.get_all('Set-Cookie', [])
+        else:  # python 2
+            set_cookies = message.getheaders('Set-Cookie')
+        return response.status, parse_cookies(set_cookies), content
+
+
+class ActionStats(object):
+    def __init__(self):
+        self.seconds = []
+        self.queries = []
+        self.errors = 0
+
+    def add(self, seconds, queries, ok):
+        self.seconds.append(seconds)
+        if queries is not None:
+            self.queries.append(queries)
+        if not ok:
+            self.errors += 1
+
+    def extend(self, other):
+        self.seconds.extend(other.seconds)
+        self.queries.extend(other.queries)
+        self.errors += other.errors
+
+    def as_json(self, wall_seconds):
+        ordered = sorted(self.seconds)
+        result = OrderedDict([
+            ('requests', len(ordered)),
+            ('errors', self.errors),
+            ('error_rate', float(self.errors) / len(ordered) if ordered else 0.0),
+            ('throughput', len(ordered) / wall_seconds if wall_seconds else 0.0),
+        ])
+        for percentile in PERCENTILES:
+            result['p{0}'.format(percentile)] = nearest_rank(ordered, percentile)
+        result['queries'] = float(sum(self.queries)) / len(self.queries) if self.queries else None
+        return result
+
+
+def nearest_rank(ordered, percentile):
+    if not ordered:
+        return None
+    return ordered[max(0, int(math.ceil(percentile / 100.0 * len(ordered))) - 1)]
+
+
+class LoadTestReport(object):
+    def __init__(self, scenario, transport_name, wall_seconds, actions):
+        self.scenario = scenario
+        self.transport_name = transport_name
+        self.wall_seconds = wall_seconds
+        self.actions = actions  # action: ActionStats
+
+    def as_json(self):
+        total = ActionStats()
+        for stats in self.actions.values():
+            total.extend(stats)
+        return OrderedDict([
+            ('scenario', self.scenario.as_json()),
+            ('transport', self.transport_name),
+            ('seconds', self.wall_seconds),
+            ('total', total.as_json(self.wall_seconds)),
+            ('actions', OrderedDict(
+                (action, self.actions[action].as_json(self.wall_seconds))
+                for action in ACTIONS if action in self.actions
+            )),
+        ])
+
+
+class Player(object):
+    def __init__(self, scenario, transport, user_id, session_key, game, model, seed):
+        self.scenario = scenario
+        self.transport = transport
+        self.user_id = user_id
+        self.game = game
+        self.path = game.get_absolute_url()
+        self.random = random.Random(seed)
+        self.cookies = {settings.SESSION_COOKIE_NAME: session_key}
+        self.stats = {}
+        self.click_buildings = [
+            name for name, building in model.buildings.items() if is_click_building(building)
+        ]
+        self.buildings = [name for name in model.buildings if name not in self.click_buildings]
+        self.upgrades = list(model.upgrades)
+        actions = [action for action in ACTIONS if scenario.mix.get(action)]
+        if not self.click_buildings and 'clicks' in actions:
+            actions.remove('clicks')
+        self.actions = actions
+        self.weights = [scenario.mix[action] for action in actions]
+
+    def pick_action(self):
+        point = self.random.uniform(0, sum(self.weights))
+        for action, weight in zip(self.actions, self.weights):
+            point -= weight
+            if point <= 0:
+                return action
+        return self.actions[-1]
+
+    def send(self, method, data=None, ajax=True):
+        headers = {'Cookie': '; '.join('{0}={1}'.format(*cookie) for cookie in self.cookies.items())}
+        body = b''
+        if ajax:
+            headers['X-Requested-With'] = 'XMLHttpRequest'
+        if method == 'POST':
+            headers['X-CSRFToken'] = self.cookies.get(settings.CSRF_COOKIE_NAME, '')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['Referer'] = 'http://{0}/'.format(getattr(self.transport, 'host', 'localhost'))
+            body = urlencode(data).encode('utf-8')
+        status, cookies, content = self.transport.request(method, self.path, headers, body)
+        for name, value in cookies.items():
+            if value is None:
+                self.cookies.pop(name, None)
+            else:
+                self.cookies[name] = value
+        return status
+
+    def play(self, action):
+        if action == 'page':
+            return self.send('GET', ajax=False)
+        if action == 'poll':
+            return self.send('GET')
+        if action == 'clicks':
+            return self.send('POST', {
+                'clicked': 'clicks',
+                'name': self.random.choice(self.click_buildings),
+                'count': self.random.randint(1, self.scenario.click_burst),
+            })
+        if action == 'building' and self.buildings:
+            return self.send('POST', {'clicked': 'building', 'name': self.random.choice(self.buildings),
+                                      'number_purchased': 1})
+        if action == 'upgrade' and self.upgrades:
+            return self.send('POST', {'clicked': 'upgrade', 'name': self.random.choice(self.upgrades)})
+        if action == 'return':
+            # not timed: the player was away
+            games = user_games(self.user_id).filter(game_id=self.game.pk)
+            for modified in games.values_list('modified', flat=True):
+                games.update(modified=modified - timedelta(seconds=self.scenario.absence_seconds))
+        return self.send('GET')
+
+    def timed(self, action):
+        counting = self.transport.counts_queries
+        if counting:
+            # this thread's own connections, which the request clears the log of anyway
+            for connection in connections.all():
+                connection.queries_log.clear()
+        start = default_timer()
+        try:
+            status = self.play(action)
+        except Exception:
+            status = None
+        seconds = default_timer() - start
+        queries = None
+        if counting:
+            queries = sum(len(connection.queries_log) for connection in connections.all())
+        self.stats.setdefault(action, ActionStats()).add(seconds, queries, status == 200)
+
+    def run(self, deadline):
+        for connection in connections.all():
+            connection.force_debug_cursor = self.transport.counts_queries
+        try:
+            self.timed('page')  # which also gets the csrf cookie
+            made = 1
+            while default_timer() < deadline and made < (self.scenario.requests_per_player or float('inf')):
+                if self.scenario.think_seconds:
+                    self.sleep(self.random.expovariate(1.0 / self.scenario.think_seconds), deadline)
+                self.timed(self.pick_action())
+                made += 1
+        finally:
+            for connection in connections.all():
+                connection.force_debug_cursor = False
+
+    def sleep(self, seconds, deadline):
+        threading.Event().wait(max(0.0, min(seconds, deadline - default_timer())))
+
+
+def run_in_thread(player, deadline):
+    try:
+        player.run(deadline)
+    finally:
+        connections.close_all()
+
+
+def make_players(count):
+    """Registered users with logged in sessions, as [(user id, session key)]"""
+    User = get_user_model()
+    engine = import_module(settings.SESSION_ENGINE)
+    prefix = 'loadtest-{0}-'.format(get_random_string(8))
+    players = []
+    for number in range(count):
+        user = User.objects.create_user('{0}{1}'.format(prefix, number))
+        session = engine.SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        players.append((user.pk, session.session_key))
+    return players
+
+
+def remove_players(players):
+    engine = import_module(settings.SESSION_ENGINE)
+    for user_id, session_key in players:
+        engine.SessionStore(session_key).delete()
+    get_user_model().objects.filter(pk__in=[user_id for user_id, session_key in players]).delete()
+
+
+def run_load_test(scenario, transport, game=None, keep_players=False):
+    entry = registry.get() if game is None else registry.get(str(game.pk))
+    if entry is None:
+        raise ValueError("There is no game to play")
+    accounts = make_players(scenario.players)
+    try:
+        players = [
+            Player(scenario, transport, user_id, session_key, entry.game, entry.model, scenario.seed + number)
+            for number, (user_id, session_key) in enumerate(accounts)
+        ]
+        start = default_timer()
+        deadline = start + scenario.seconds
+        if len(players) == 1:
+            players[0].run(deadline)
+        else:
+            threads = [threading.Thread(target=run_in_thread, args=(player, deadline)) for player in players]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        wall_seconds = default_timer() - start
+    finally:
+        if not keep_players:
+            remove_players(accounts)
+    actions = {}
+    for player in players:
+        for action, stats in player.stats.items():
+            actions.setdefault(action, ActionStats()).extend(stats)
+    return LoadTestReport(scenario, type(transport).__name__, wall_seconds, actions)
+
+
+# figure: whether bigger is better
+COMPARED = OrderedDict([('throughput', True), ('p50', False), ('p95', False), ('p99', False),
+                        ('error_rate', False), ('queries', False)])
+
+
+def compare_reports(baseline, report, threshold=0.1):
+    rows = []
+    for action in ['total'] + list(ACTIONS):
+        old = baseline['total'] if action == 'total' else baseline['actions'].get(action)
+        new = report['total'] if action == 'total' else report['actions'].get(action)
+        if old is None or new is None:
+            continue
+        for figure, bigger_is_better in COMPARED.items():
+            if old.get(figure) is None or new.get(figure) is None:
+                continue
+            if old[figure]:
+                change = (new[figure] - old[figure]) / float(old[figure])
+            else:
+                change = 0.0 if not new[figure] else float('inf')
+            worse = -change if bigger_is_better else change
+            rows.append((action, figure, old[figure], new[figure], change, worse > threshold))
+    return rows
@@ -0,0 +1,29 @@
+# coding=utf-8
+from django.core.management.base import BaseCommand, CommandError
+
+from clicker_game.archive import archive_saturated
+from clicker_game.models import ClickerGame
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the game instances whose games have stopped for good, after being left alone for "
+        "longer than their decay takes to stop, into the compressed archive. They are put back when "
+        "their players return. Safe to run while the site is up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game', help="Slug of the only game to archive instances of")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the games that would be archived")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows scanned per query")
+
+    def handle(self, *args, **options):
+        game = None
+        if options['game']:
+            try:
+                game = ClickerGame.objects.get(slug=options['game'])
+            except ClickerGame.DoesNotExist:
+                raise CommandError("No such game: {0}".format(options['game']))
+        archived = archive_saturated(game=game, dry_run=options['dry_run'], batch_size=options['batch_size'])
+        verb = "Would archive" if options['dry_run'] else "Archived"
+        self.stdout.write("{0} {1} games".format(verb, archived))
@@ -0,0 +1,105 @@
+# coding=utf-8
+import fnmatch
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from clicker_game.allocations import AllocationBudgetExceeded
+from clicker_game.benchmarks import BENCHMARKS, check_budget, example_game_data, measure_benchmark, run_benchmark
+
+
+def format_time(seconds):
+    for unit, size in (('s', 1.0), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= size:
+            return "{0:.2f}{1}".format(seconds / size, unit)
+    return "{0:.0f}ns".format(seconds / 1e-9)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the game engine's hot paths. Name benchmarks (shell-style wildcards work) to run only "
+        "those; --list shows them all. With --allocations, measure their allocations instead, and "
+        "fail if any is over its allocation budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help="Benchmarks to run, like clicks.*")
+        parser.add_argument('--model', help="Game model json file (default: the example game model)")
+        parser.add_argument('--min-seconds', type=float, default=0.2, help="Shortest time for one timed run")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs; the best one is reported")
+        parser.add_argument('--list', action='store_true', help="List the benchmarks and exit")
+        parser.add_argument('--json', action='store_true', help="Print results as json")
+        parser.add_argument('--allocations', action='store_true',
+                            help="Measure allocations (Python 3.4 or later) and check the budgets")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, setup in BENCHMARKS.items():
+                self.stdout.write("{0:<30} {1}".format(name, (setup.__doc__ or "").strip()))
+            return
+        names = [
+            name for name in BENCHMARKS
+            if not options['names'] or any(fnmatch.fnmatch(name, pattern) for pattern in options['names'])
+        ]
+        if not names:
+            raise CommandError("No benchmarks match {0}".format(" ".join(options['names'])))
+        try:
+            if options['model']:
+                with open(options['model']) as f:
+                    json_data = json.load(f)
+            else:
+                json_data = example_game_data()
+        except (IOError, OSError, ValueError) as ex:
+            raise CommandError("Could not read game model: {0}".format(ex))
+
+        if options['allocations']:
+            return self.measure_allocations(names, json_data, options['json'])
+
+        results = []
+        for name in names:
+            try:
+                result = run_benchmark(name, json_data, options['min_seconds'], options['repeat'])
+            except ValidationError as ex:
+                raise CommandError("Invalid game model: {0}".format(ex.messages[0]))
+            except KeyError as ex:
+                # the benchmark needs something the game model does not have
+                self.stderr.write("{0}: skipped, {1}".format(name, ex.args[0]))
+                continue
+            results.append(result)
+            if not options['json']:
+                line = "{0:<30} {1:>10} per call".format(name, format_time(result.seconds))
+                if result.per != 1:
+                    line += ", {0:>10} each of {1}".format(format_time(result.seconds_each), result.per)
+                self.stdout.write(line)
+        if options['json']:
+            self.stdout.write(json.dumps([result.as_json() for result in results], indent=2))
+
+    def measure_allocations(self, names, json_data, as_json):
+        results, over = [], []
+        for name in names:
+            try:
+                result = measure_benchmark(name, json_data)
+            except ValidationError as ex:
+                raise CommandError("Invalid game model: {0}".format(ex.messages[0]))
+            except KeyError as ex:
+                self.stderr.write("{0}: skipped, {1}".format(name, ex.args[0]))
+                continue
+            setup = BENCHMARKS[name]
+            try:
+                check_budget(name, result)
+            except AllocationBudgetExceeded as ex:
+                over.append(str(ex))
+            results.append({
+                'name': name, 'peak_bytes': result.peak_bytes, 'blocks': result.blocks,
+                'max_bytes': setup.max_bytes, 'max_blocks': setup.max_blocks,
+            })
+            if not as_json:
+                self.stdout.write("{0:<34} {1:>8} bytes at most {2:>5} blocks left{3}".format(
+                    name, result.peak_bytes, result.blocks,
+                    "" if setup.max_bytes is None else ", budget {0} bytes {1} blocks".format(
+                        setup.max_bytes, setup.max_blocks)))
+        if as_json:
+            self.stdout.write(json.dumps(results, indent=2))
+        if over:
+            raise CommandError("\n".join(over))
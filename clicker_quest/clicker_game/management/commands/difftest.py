@@ -0,0 +1,64 @@
+# coding=utf-8
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clicker_game.differential import ENGINES, REFERENCE, run_differential
+
+
+class Command(BaseCommand):
+    help = (
+        "Play random game models with random actions on the game engines and the reference engine, "
+        "and compare their save states and client states. Prints each engine's speedup over the "
+        "reference, and the first failing case of each engine, shrunk, as json to reproduce it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cases', type=int, default=100, help="Random game models to play")
+        parser.add_argument('--actions', type=int, default=30, help="Actions to play on each")
+        parser.add_argument('--seed', default='0', help="Seed of the random cases")
+        parser.add_argument('--engines', nargs='*', help="Engines to test, of {0} (default: all)".format(
+            ", ".join(name for name in ENGINES if name != REFERENCE)))
+        parser.add_argument('--tolerance', type=float, default=1e-9, help="Relative difference allowed in numbers")
+        parser.add_argument('--buildings', type=int, default=5, help="Buildings in each game model")
+        parser.add_argument('--upgrades', type=int, default=4, help="Upgrades in each game model")
+        parser.add_argument('--no-shrink', action='store_true', help="Report failing cases as they were found")
+        parser.add_argument('--json', action='store_true', help="Print the report as json")
+
+    def handle(self, *args, **options):
+        unknown = set(options['engines'] or ()) - set(ENGINES)
+        if unknown:
+            raise CommandError("No such engine: {0}".format(", ".join(sorted(unknown))))
+        report = run_differential(
+            cases=options['cases'], actions=options['actions'], seed=options['seed'],
+            engines=options['engines'], tolerance=options['tolerance'],
+            shrink_failures=not options['no_shrink'],
+            buildings=options['buildings'], upgrades=options['upgrades'],
+        )
+        if options['json']:
+            self.stdout.write(json.dumps(report.as_json(), indent=2))
+        else:
+            self.write_report(report)
+        if report.failures:
+            raise CommandError("{0} of {1} engines differ from the reference".format(
+                len(report.failures), len(report.seconds) - 1))
+
+    def write_report(self, report):
+        self.stdout.write("{0} cases of {1} actions".format(report.cases, report.actions))
+        failed = {failure.engine_name for failure in report.failures}
+        self.stdout.write("{0:<20}{1:>10}{2:>10}  {3}".format('engine', 'seconds', 'speedup', 'result'))
+        for name, seconds in report.seconds.items():
+            result = '-' if name == REFERENCE else 'differs' if name in failed else 'ok'
+            self.stdout.write("{0:<20}{1:>10.3f}{2:>9.2f}x  {3}".format(name, seconds, report.speedup(name), result))
+        for failure in report.failures:
+            step, which, path, expected, actual = failure.difference
+            self.stdout.write("")
+            if which == 'error':
+                self.stdout.write("{0} failed on case {1}: {2}".format(failure.engine_name, failure.case, actual))
+            else:
+                self.stdout.write("{0} differs on case {1}, after action {2}, in the {3} state at {4}: "
+                                  "{5!r} instead of {6!r}".format(
+                                      failure.engine_name, failure.case, step, which,
+                                      "/".join(str(key) for key in path), actual, expected))
+            self.stdout.write("model: {0}".format(json.dumps(failure.json_data, sort_keys=True)))
+            self.stdout.write("actions: {0}".format(json.dumps(failure.actions)))
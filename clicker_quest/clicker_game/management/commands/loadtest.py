@@ -0,0 +1,144 @@
+# coding=utf-8
+import glob
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clicker_game.loadtest import (
+    ACTIONS, PERCENTILES, SCENARIOS, HTTPTransport, Scenario, WSGITransport, compare_reports, load_scenario,
+    run_load_test)
+from clicker_game.models import ClickerGame
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    return "{0:.1f}ms".format(seconds * 1000)
+
+
+def format_figure(figure, value):
+    if figure.startswith('p'):
+        return format_seconds(value)
+    if figure == 'error_rate':
+        return "{0:.2%}".format(value)
+    return "{0:.2f}".format(value)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the site with simulated players, in-process or against a running server (--url), "
+        "and report throughput, latency percentiles, queries and errors for each action. Give a "
+        "built in scenario's name or a scenario file (json, or yaml with PyYAML installed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', nargs='?', default='mixed',
+                            help="One of {0}, or a scenario file".format(", ".join(SCENARIOS)))
+        parser.add_argument('--players', type=int, help="Number of players, instead of the scenario's")
+        parser.add_argument('--seconds', type=float, help="How long to play, instead of the scenario's")
+        parser.add_argument('--requests', type=int, help="Requests for each player to make, instead of a time")
+        parser.add_argument('--think', type=float, help="Mean seconds between each player's requests")
+        parser.add_argument('--url', help="Base url of a running server sharing this database, "
+                                          "like http://localhost:8000")
+        parser.add_argument('--host', default='localhost', help="Host name for in-process requests")
+        parser.add_argument('--game', help="Slug of the game to play (default: the default game)")
+        parser.add_argument('--keep-players', action='store_true', help="Keep the players' users and games")
+        parser.add_argument('--save', help="Save the report as json to this file")
+        parser.add_argument('--baseline', help="Compare with the report saved in this file")
+        parser.add_argument('--results-dir', help="Save the report in this directory and compare it with the "
+                                                  "last one saved there for the same scenario")
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help="Relative change counted as a regression in comparisons")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error when a comparison finds a regression")
+        parser.add_argument('--json', action='store_true', help="Print the report as json")
+
+    def handle(self, *args, **options):
+        overrides = {
+            option: options[key]
+            for option, key in (('players', 'players'), ('seconds', 'seconds'),
+                                ('requests_per_player', 'requests'), ('think_seconds', 'think'))
+            if options[key] is not None
+        }
+        try:
+            if options['scenario'] in SCENARIOS:
+                scenario = Scenario.named(options['scenario'], **overrides)
+            else:
+                scenario = load_scenario(options['scenario'])
+                for option, value in overrides.items():
+                    setattr(scenario, option, value)
+        except (IOError, OSError, ValueError) as ex:
+            raise CommandError("Could not read scenario: {0}".format(ex))
+        if options['requests'] is not None and options['seconds'] is None:
+            scenario.seconds = float('inf')
+
+        game = None
+        if options['game']:
+            try:
+                game = ClickerGame.objects.get(slug=options['game'])
+            except ClickerGame.DoesNotExist:
+                raise CommandError("No such game: {0}".format(options['game']))
+        transport = HTTPTransport(options['url']) if options['url'] else WSGITransport(host=options['host'])
+        try:
+            report = run_load_test(scenario, transport, game, options['keep_players']).as_json()
+        except ValueError as ex:
+            raise CommandError(str(ex))
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_report(report)
+
+        baseline_path = options['baseline']
+        if options['results_dir']:
+            pattern = os.path.join(options['results_dir'], '{0}-*.json'.format(os.path.basename(scenario.name)))
+            earlier = sorted(glob.glob(pattern))
+            if earlier and not baseline_path:
+                baseline_path = earlier[-1]
+            if not os.path.isdir(options['results_dir']):
+                os.makedirs(options['results_dir'])
+            saved = pattern.replace('*', time.strftime('%Y%m%d-%H%M%S'))
+            self.save(report, saved)
+        if options['save']:
+            self.save(report, options['save'])
+        if baseline_path:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+            regressions = self.write_comparison(baseline_path, baseline, report, options['threshold'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError("{0} figures got worse by more than {1:.0%}".format(
+                    regressions, options['threshold']))
+
+    def save(self, report, path):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stderr.write("Saved report to {0}".format(path))
+
+    def write_report(self, report):
+        self.stdout.write("{0}: {1} players for {2:.1f}s ({3})".format(
+            report['scenario']['name'], report['scenario']['players'], report['seconds'], report['transport']))
+        columns = ['requests', 'req/s', 'errors'] + ['p{0}'.format(p) for p in PERCENTILES] + ['queries']
+        self.stdout.write("{0:<10}".format('action') + "".join("{0:>10}".format(c) for c in columns))
+        rows = [(action, report['actions'][action]) for action in ACTIONS if action in report['actions']]
+        for action, stats in rows + [('total', report['total'])]:
+            values = [
+                str(stats['requests']),
+                "{0:.1f}".format(stats['throughput']),
+                "{0:.1%}".format(stats['error_rate']),
+            ] + [format_seconds(stats['p{0}'.format(p)]) for p in PERCENTILES] + [
+                "-" if stats['queries'] is None else "{0:.1f}".format(stats['queries'])
+            ]
+            self.stdout.write("{0:<10}".format(action) + "".join("{0:>10}".format(v) for v in values))
+
+    def write_comparison(self, path, baseline, report, threshold):
+        self.stdout.write("Compared with {0}:".format(path))
+        regressions = 0
+        for action, figure, old, new, change, regressed in compare_reports(baseline, report, threshold):
+            if regressed:
+                regressions += 1
+            self.stdout.write("{0:<10}{1:<12}{2:>10} -> {3:>10} {4:>+8.1%}{5}".format(
+                action, figure, format_figure(figure, old), format_figure(figure, new), change,
+                "  worse" if regressed else ""))
+        return regressions
@@ -0,0 +1,25 @@
+# coding=utf-8
+from django.core.management.base import BaseCommand, CommandError
+
+from clicker_game.sharding import rebalance, shards
+
+
+class Command(BaseCommand):
+    help = (
+        "Move game instances onto the shards their users belong on after shards were added, or off "
+        "the default database after sharding was turned on. Safe to run while the site is up, once "
+        "CLICKER_SHARDS and CLICKER_PREVIOUS_SHARDS are set everywhere."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only count the games that would move")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows scanned per query")
+
+    def handle(self, *args, **options):
+        if not shards():
+            raise CommandError("No shards are configured; set DATABASE_SHARD_URLS")
+        moved = rebalance(options['dry_run'], options['batch_size'])
+        verb = "would move" if options['dry_run'] else "moved"
+        for (source, target), games in sorted(moved.items()):
+            self.stdout.write("{0} -> {1}: {2} {3} games".format(source, target, verb, games))
+        self.stdout.write("{0} {1} games in all".format(verb.capitalize(), sum(moved.values())))
@@ -0,0 +1,115 @@
+# coding=utf-8
+import json
+import re
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from clicker_game.game_model import validate_game_model
+from clicker_game.simulator import STRATEGIES, make_strategy, simulate, sweep
+
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'y': 31536000}
+
+
+def parse_duration(text):
+    """Parse a duration like 3600, 90m, 7d or 1y into seconds"""
+    match = re.match(r'^\s*([0-9.]+)\s*([smhdwy]?)\s*$', text)
+    if not match:
+        raise CommandError("Invalid duration: {0}".format(text))
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+
+
+def parse_parameter(text):
+    """Parse a grid parameter like buildings.Cursor.cost_factor=1.1,1.15,1.2"""
+    if '=' not in text:
+        raise CommandError("Parameters look like path=value,value,...: {0}".format(text))
+    path, values = text.split('=', 1)
+    return path, [json.loads(value) for value in values.split(',')]
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "never"
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return "{0:.1f}{1}".format(seconds / size, unit)
+    return "{0:.1f}s".format(seconds)
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate a player of a game model and report unlock times, income and purchases. "
+        "Give --param to sweep a grid of model parameters across a process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help="Path to a game model json file")
+        parser.add_argument('--strategy', default='greedy', choices=list(STRATEGIES))
+        parser.add_argument('--script', help="Json file with the orders for the script strategy")
+        parser.add_argument('--duration', default='1d', help="Game time to simulate, like 3600, 12h, 7d or 1y")
+        parser.add_argument('--clicks-per-second', type=float, default=0.0,
+                            help="How fast the player clicks the model's click buildings")
+        parser.add_argument('--param', action='append', default=[], dest='parameters',
+                            help="Sweep a model parameter: path=value,value,... (may be repeated)")
+        parser.add_argument('--processes', type=int, default=None, help="Process pool size for sweeps")
+        parser.add_argument('--json', action='store_true', help="Print full results as json")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['model']) as f:
+                json_data = json.load(f)
+        except (IOError, OSError, ValueError) as ex:
+            raise CommandError("Could not read game model: {0}".format(ex))
+        orders = None
+        if options['strategy'] == 'script':
+            if not options['script']:
+                raise CommandError("The script strategy needs --script")
+            with open(options['script']) as f:
+                orders = json.load(f)
+        duration = parse_duration(options['duration'])
+
+        try:
+            if options['parameters']:
+                grid = OrderedDict(parse_parameter(text) for text in options['parameters'])
+                results = sweep(
+                    json_data, grid, options['strategy'], duration,
+                    options['clicks_per_second'], orders, options['processes']
+                )
+            else:
+                model = validate_game_model(json_data)
+                results = [({}, simulate(
+                    model, make_strategy(options['strategy'], orders), duration, options['clicks_per_second']
+                ))]
+        except ValidationError as ex:
+            raise CommandError("Invalid game model: {0}".format(ex.messages[0]))
+        except KeyError as ex:
+            raise CommandError("Bad parameter path: {0}".format(ex.args[0]))
+
+        if options['json']:
+            self.stdout.write(json.dumps(
+                [{'parameters': parameters, 'result': result.as_json()} for parameters, result in results],
+                indent=2
+            ))
+            return
+        for parameters, result in results:
+            self.write_report(parameters, result)
+
+    def write_report(self, parameters, result):
+        if parameters:
+            self.stdout.write("=== " + ", ".join(
+                "{0}={1}".format(path, json.dumps(value)) for path, value in parameters.items()
+            ))
+        self.stdout.write("Simulated {0}, {1} purchases, stopped: {2}".format(
+            format_seconds(result.elapsed), len(result.purchases), result.stopped_because
+        ))
+        self.stdout.write("Unlocks:")
+        for key, seconds in result.unlocks.items():
+            self.stdout.write("  {0:>10}  {1}".format(format_seconds(seconds), key))
+        self.stdout.write("Income:")
+        for seconds, income in result.income_curve[::max(1, len(result.income_curve) // 20)]:
+            self.stdout.write("  {0:>10}  {1}".format(format_seconds(seconds), ", ".join(
+                "{0}: {1:.3f}/s".format(name, amount) for name, amount in sorted(income.items())
+            )))
+        self.stdout.write("Final state: {0}".format(json.dumps(result.final_state, sort_keys=True)))
@@ -0,0 +1,381 @@
+# coding=utf-8
+import errno
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+
+"""
+Request metrics for the game site, exported in Prometheus text format.
+
+MetricsRegistry:
+    Counters and histograms keyed by metric name and a tuple of label pairs. Every thread
+    writes only to its own shard of the registry, so recording a value never takes a lock;
+    shards are only summed together when the metrics are exported. The shards of threads that
+    have ended are folded into one retired total, so a server that starts a thread per request
+    doesn't keep a shard for each.
+
+    inc(name, labels, amount=1):
+        Add to a counter.
+
+    observe(name, labels, value):
+        Add a value to a histogram.
+
+    snapshot():
+        Sum the shards of every thread into a single snapshot.
+
+    flush():
+        When CLICKER_METRICS_DIR is set, write this worker's snapshot into that directory
+        (making it if needed) so that whichever worker serves the metrics endpoint can include
+        it. Prefork servers such as gunicorn run each worker in its own process, so they need
+        this. A directory that can't be written to is logged, rather than failing requests.
+
+    render():
+        Render every worker's metrics in Prometheus text exposition format. The snapshot files
+        of workers that have exited are deleted along the way.
+
+RequestMetricsMiddleware:
+    Records latency, database query count and time, response size and errors for every
+    request, labelled by view name and game action. Queries are counted by a thin wrapper
+    around each connection's cursors (see count_queries), without logging them the way
+    Django's debug cursor does.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+DURATION_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BYTES_BOUNDS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# name: (type, help, histogram bounds)
+METRICS = OrderedDict([
+    ('clicker_requests_total', (
+        'counter', "Requests served", None)),
+    ('clicker_request_duration_seconds', (
+        'histogram', "Request latency", DURATION_BOUNDS)),
+    ('clicker_db_queries_total', (
+        'counter', "Database queries made while serving requests", None)),
+    ('clicker_db_query_seconds_total', (
+        'counter', "Time spent in database queries while serving requests", None)),
+    ('clicker_response_bytes', (
+        'histogram', "Response payload size", BYTES_BOUNDS)),
+    ('clicker_errors_total', (
+        'counter', "Requests that raised an exception or returned a server error", None)),
+])
+
+GAME_ACTIONS = ('building', 'upgrade', 'order', 'clicks')
+
+
+class MetricsRegistry(object):
+    def __init__(self, metrics=METRICS):
+        self.metrics = metrics
+        self._local = threading.local()
+        self._shards = []  # [(thread, shard)]
+        self._retired = {}  # the sum of the shards of threads that have ended
+        self._shards_lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._retire_shards()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _retire_shards(self):
+        # a thread that has ended won't write to its shard again; call with the lock held
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                merge_into(self._retired, shard)
+        self._shards = live
+
+    def inc(self, name, labels, amount=1):
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        shard = self._shard()
+        key = (name, labels)
+        histogram = shard.get(key)
+        if histogram is None:
+            bounds = self.metrics[name][2]
+            # bucket counts, then the +Inf bucket, then the sum of observed values
+            histogram = shard[key] = [0] * (len(bounds) + 1) + [0.0]
+        histogram[bisect_left(self.metrics[name][2], value)] += 1
+        histogram[-1] += value
+
+    def snapshot(self):
+        """Sum every thread's shard into one dict of {(name, labels): value}"""
+        with self._shards_lock:
+            self._retire_shards()
+            shards = [shard for thread, shard in self._shards]
+            result = merge_into({}, self._retired)
+        for shard in shards:
+            merge_into(result, shard.copy())
+        return result
+
+    def reset(self):
+        with self._shards_lock:
+            self._retired.clear()
+            for thread, shard in self._shards:
+                shard.clear()
+
+    def flush(self, force=False):
+        """Write this worker's snapshot into CLICKER_METRICS_DIR, at most every so often"""
+        directory = getattr(settings, 'CLICKER_METRICS_DIR', None)
+        if not directory:
+            return
+        now = default_timer()
+        if not force and now - self._last_flush < getattr(settings, 'CLICKER_METRICS_FLUSH_SECONDS', 5.0):
+            return
+        self._last_flush = now
+        try:
+            make_directory(directory)
+            write_snapshot(directory, os.getpid(), self.snapshot())
+        except (IOError, OSError):
+            logger.warning("Couldn't write the metrics snapshot into %s", directory, exc_info=True)
+
+    def collect(self):
+        """Snapshot of every worker: this one's live values plus the files of the others"""
+        result = self.snapshot()
+        directory = getattr(settings, 'CLICKER_METRICS_DIR', None)
+        if directory:
+            for pid, snapshot in read_snapshots(directory):
+                if pid == os.getpid():
+                    continue
+                if process_exists(pid):
+                    merge_into(result, snapshot)
+                else:
+                    remove_snapshot(directory, pid)
+        return result
+
+    def render(self):
+        return render_prometheus(self.collect(), self.metrics)
+
+
+def merge_into(result, snapshot):
+    """Add the values of one snapshot into another"""
+    for key, value in snapshot.items():
+        if isinstance(value, list):
+            if key in result:
+                result[key] = [a + b for a, b in zip(result[key], value)]
+            else:
+                result[key] = list(value)
+        else:
+            result[key] = result.get(key, 0) + value
+    return result
+
+
+def make_directory(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+
+def write_snapshot(directory, pid, snapshot):
+    """Atomically replace the snapshot file for a worker process"""
+    data = [[name, [list(pair) for pair in labels], value] for (name, labels), value in snapshot.items()]
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(temp_path, snapshot_path(directory, pid))
+
+
+def snapshot_path(directory, pid):
+    return os.path.join(directory, 'metrics-{0}.json'.format(pid))
+
+
+def remove_snapshot(directory, pid):
+    try:
+        os.remove(snapshot_path(directory, pid))
+    except OSError:  # another worker got there first
+        pass
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno != errno.ESRCH  # EPERM: it exists, as another user's
+    return True
+
+
+def read_snapshots(directory):
+    """Yield (pid, snapshot) for every worker snapshot file in a directory"""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+            with open(path) as f:
+                data = json.load(f)
+        except (ValueError, IOError, OSError):
+            continue
+        yield pid, {
+            (name, tuple(tuple(pair) for pair in labels)): value
+            for name, labels, value in data
+        }
+
+
+def format_labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    ) + "}"
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus(snapshot, metrics=METRICS):
+    """Render a snapshot in Prometheus text exposition format (version 0.0.4)"""
+    by_name = {}
+    for (name, labels), value in snapshot.items():
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (metric_type, help_text, bounds) in metrics.items():
+        lines.append("# HELP {0} {1}".format(name, help_text))
+        lines.append("# TYPE {0} {1}".format(name, metric_type))
+        for labels, value in sorted(by_name.get(name, ())):
+            if metric_type == 'histogram':
+                cumulative = 0
+                for bound, count in zip(bounds + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append("{0}_bucket{1} {2}".format(
+                        name, format_labels(labels, (('le', bound),)), cumulative
+                    ))
+                lines.append("{0}_sum{1} {2}".format(name, format_labels(labels), format_value(value[-1])))
+                lines.append("{0}_count{1} {2}".format(name, format_labels(labels), cumulative))
+            else:
+                lines.append("{0}{1} {2}".format(name, format_labels(labels), format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+class CountingCursorWrapper(CursorWrapper):
+    """Counts the queries made through a cursor, and their time, into a QueryCounter"""
+    def __init__(self, cursor, db, counter):
+        super(CountingCursorWrapper, self).__init__(cursor, db)
+        self.counter = counter
+
+    def execute(self, sql, params=None):
+        start = default_timer()
+        try:
+            return super(CountingCursorWrapper, self).execute(sql, params)
+        finally:
+            self.counter.count += 1
+            self.counter.seconds += default_timer() - start
+
+    def executemany(self, sql, param_list):
+        start = default_timer()
+        try:
+            return super(CountingCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            self.counter.count += 1
+            self.counter.seconds += default_timer() - start
+
+
+def count_queries(connection):
+    """
+    The QueryCounter of a connection, wrapping its cursors the first time. Connections belong to
+    one thread, so their counters do too.
+    """
+    counter = getattr(connection, '_metrics_counter', None)
+    if counter is None:
+        counter = connection._metrics_counter = QueryCounter()
+        make_cursor, make_debug_cursor = connection.make_cursor, connection.make_debug_cursor
+        connection.make_cursor = lambda cursor: CountingCursorWrapper(make_cursor(cursor), connection, counter)
+        connection.make_debug_cursor = lambda cursor: CountingCursorWrapper(
+            make_debug_cursor(cursor), connection, counter)
+    return counter
+
+
+def request_action(request):
+    """The game action a request performs, for labelling metrics"""
+    if request.method == 'POST':
+        clicked = request.POST.get('clicked')
+        return clicked if clicked in GAME_ACTIONS else 'poll'
+    if request.method == 'GET':
+        return 'poll' if request.is_ajax() else 'page'
+    return 'other'
+
+
+class RequestMetricsMiddleware(object):
+    """Records request metrics into the module registry. Put it first in MIDDLEWARE_CLASSES."""
+    def __init__(self):
+        if not getattr(settings, 'CLICKER_METRICS', True):
+            raise MiddlewareNotUsed()
+        self.registry = registry
+        self.record_queries = getattr(settings, 'CLICKER_METRICS_DB', True)
+
+    def process_request(self, request):
+        request._metrics_start = default_timer()
+        request._metrics_view = 'unknown'
+        request._metrics_action = 'other'
+        if self.record_queries:
+            request._metrics_queries = []
+            for connection in connections.all():
+                counter = count_queries(connection)
+                request._metrics_queries.append((counter, counter.count, counter.seconds))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request._metrics_view = match and match.url_name or getattr(view_func, '__name__', 'unknown')
+        request._metrics_action = request_action(request)
+
+    def process_exception(self, request, exception):
+        request._metrics_failed = True
+
+    def process_response(self, request, response):
+        start = getattr(request, '_metrics_start', None)
+        if start is None:  # an earlier middleware answered before we saw the request
+            return response
+        labels = (('view', request._metrics_view), ('action', request._metrics_action))
+        self.registry.inc('clicker_requests_total', labels)
+        self.registry.observe('clicker_request_duration_seconds', labels, default_timer() - start)
+        if not response.streaming:
+            self.registry.observe('clicker_response_bytes', labels, len(response.content))
+        if getattr(request, '_metrics_failed', False) or response.status_code >= 500:
+            self.registry.inc('clicker_errors_total', labels)
+        if self.record_queries:
+            query_count = 0
+            query_time = 0.0
+            for counter, count_before, seconds_before in request._metrics_queries:
+                query_count += counter.count - count_before
+                query_time += counter.seconds - seconds_before
+            self.registry.inc('clicker_db_queries_total', labels, query_count)
+            self.registry.inc('clicker_db_query_seconds_total', labels, query_time)
+        self.registry.flush()
+        return response
@@ -1,16 +1,54 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
-import json
 from django.db import models
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
-from django.contrib.postgres.forms.jsonb import InvalidJSONInput, JSONField as JSONField_form
+from django.core.urlresolvers import reverse
+from django.utils.text import slugify
 
 from clicker_game.game_model import validate_game_model
+from clicker_game.snapshots import content_hash
 
 # Create your models here.
 
+# the fields of a game, and of each thing in it, that anyone may read (see GameModelVersion.client_data)
+CLIENT_FIELDS = ('name', 'description')
+
+
+class GameModelVersion(models.Model):
+    """
+    A game model as it was published, stored once and never changed, keyed by the hash of its
+    canonical json; anything derived from it can be cached under that hash for good.
+    """
+    content_hash = models.CharField(max_length=64, primary_key=True)
+    game_data = JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def publish(cls, game_data):
+        """The version with this game data, stored if it is new"""
+        version, created = cls.objects.get_or_create(
+            content_hash=content_hash(game_data), defaults={'game_data': game_data})
+        return version
+
+    def client_data(self):
+        """
+        The parts of the model that players are shown anyway: the names and descriptions of the
+        game and of its resources, buildings and upgrades. Costs, unlock requirements and effects
+        stay on the server.
+        """
+        data = {field: self.game_data.get(field) for field in CLIENT_FIELDS}
+        for section in ('resources', 'buildings', 'upgrades'):
+            data[section] = [
+                {field: entry.get(field) for field in CLIENT_FIELDS}
+                for entry in self.game_data.get(section, [])
+            ]
+        return data
+
+    def get_absolute_url(self):
+        return reverse('game_model_version', kwargs={'content_hash': self.content_hash})
+
 
 class ClickerGame(models.Model):
     """Model for a general clicker game."""
@@ -21,6 +59,19 @@ class ClickerGame(models.Model):
     modified = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=200)
+    slug = models.SlugField(max_length=200, unique=True, blank=True,
+                            help_text="Used in the game's url; made from the name if left blank")
+    version = models.ForeignKey(GameModelVersion, on_delete=models.PROTECT, related_name='games',
+                                null=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = unique_slug(self.name, ClickerGame.objects.exclude(pk=self.pk))
+        self.version = GameModelVersion.publish(self.game_data)
+        super(ClickerGame, self).save(*args, **kwargs)
+
+    def get_absolute_url(self):
+        return reverse('game', kwargs={'slug': self.slug})
 
 
 class GameInstance(models.Model):
@@ -28,20 +79,43 @@ class GameInstance(models.Model):
     class meta:
         unique_together = ('user', 'game')
 
+    # no foreign key constraints, since game instances can live on other databases than users
+    # and games (see clicker_game.sharding)
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE,
-                             related_name='games_playing')
-    game = models.ForeignKey(ClickerGame, related_name='running_games')
+                             related_name='games_playing',
+                             db_constraint=False)
+    game = models.ForeignKey(ClickerGame, related_name='running_games', db_constraint=False)
+    # the version of the game's model it was last played under
+    model_version = models.ForeignKey(GameModelVersion, on_delete=models.DO_NOTHING, related_name='+',
+                                      null=True, editable=False, db_constraint=False)
     data = JSONField()
     modified = models.DateTimeField(auto_now_add=True)
     created = models.DateTimeField(auto_now_add=True)
 
 
-# customize json form field dump inside django to make it readable in forms
-def prepare_value(self, value):
-    if isinstance(value, InvalidJSONInput):
-        return value
-    return json.dumps(value, sort_keys=True, indent=4)
+class ArchivedGameInstance(models.Model):
+    """
+    A game instance nobody has played since its game stopped for good, kept compressed out of
+    the GameInstance table until its player comes back (see clicker_game.archive)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+',
+                             db_constraint=False)
+    game = models.ForeignKey(ClickerGame, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    model_version = models.ForeignKey(GameModelVersion, on_delete=models.DO_NOTHING, related_name='+',
+                                      null=True, db_constraint=False)
+    compressed_data = models.BinaryField()
+    created = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+
+def unique_slug(name, queryset):
+    """Slugify a name, adding a number if it is taken in a queryset"""
+    base = slugify(name)[:190] or 'game'
+    slug = base
+    number = 1
+    while queryset.filter(slug=slug).exists():
+        number += 1
+        slug = '{0}-{1}'.format(base, number)
+    return slug
 
-# patch
-JSONField_form.prepare_value = prepare_value
@@ -0,0 +1,154 @@
+# coding=utf-8
+from clicker_game.effects import ADD
+
+
+"""
+Production limited by supply: buildings that consume a resource which has run out slow down.
+
+A building consumes a resource when its income of it is negative. While a resource it consumes
+still has some left, it runs at full speed. Once the resource is down to nothing, only as much can
+be consumed as is being produced, so every building consuming it runs at the same fraction of its
+full speed: the resource's supply over its demand (at most 1). A building that consumes several
+resources that have run out goes at the speed of the scarcest, and a slowed building produces less
+too, which can starve whatever consumes its products in turn.
+
+The speeds are the fixed point of that rule over the whole graph of producers and consumers,
+found by going through the consumers in production order (producers before their consumers, where
+there are no loops) and lowering speeds until nothing changes. Speeds only ever go down, so this
+converges, and without loops it takes a single pass.
+
+Between changes the incomes are constant, so a game instance integrates production exactly by
+advancing to the moment the next resource runs out, solving the speeds again, and carrying on (see
+GameInstance.advance).
+
+ProductionGraph(model):
+    The production order of a GameModel's buildings. A GameModel makes its graph the first time
+    it is needed; see GameModel.production.
+
+    has_consumers:
+        Whether any building can consume anything. When none can, no solving is needed.
+
+    solve(buildings, resources):
+        Return {building name: speed} for the buildings running slower than full speed, given
+        the buildings of a game instance (names to objects with owned and income, the income
+        per building after effects) and its resources (names to objects with owned).
+
+seconds_until_depleted(resources):
+    The number of seconds until the first of some resources (names to objects with owned and
+    income) runs out at their current incomes, and its name: (inf, None) if none of them will.
+"""
+
+
+INFINITY = float('inf')
+MAX_SWEEPS = 100  # passes through the consumers before the speeds are taken as settled
+SETTLED = 1e-12  # speeds changing by less than this are settled
+
+
+class ProductionGraph(object):
+    def __init__(self, model):
+        # resource: buildings that could produce / consume it
+        producers = {}
+        consumers = {}
+        for building in model.buildings.values():
+            for resource_name in possible_incomes(model, building, positive=True):
+                producers.setdefault(resource_name, []).append(building.name)
+            for resource_name in possible_incomes(model, building, positive=False):
+                consumers.setdefault(resource_name, []).append(building.name)
+        self.has_consumers = bool(consumers)
+
+        # producers before consumers: buildings go in once everything producing what they consume
+        # is in, in model order; loops are broken by taking the first building left
+        waiting_on = {
+            building.name: set(
+                producer
+                for resource_name in possible_incomes(model, building, positive=False)
+                for producer in producers.get(resource_name, ())
+                if producer != building.name
+            )
+            for building in model.buildings.values()
+        }
+        self.order = []
+        left = list(model.buildings)
+        while left:
+            ready = [name for name in left if not waiting_on[name]] or left[:1]
+            for name in ready:
+                self.order.append(name)
+                left.remove(name)
+                for other in left:
+                    waiting_on[other].discard(name)
+
+    def solve(self, buildings, resources):
+        # demand for resources that have run out, at full speed
+        demand = {}
+        # (name, building, resources run out that it consumes), in production order
+        consumers = []
+        for name in self.order:
+            building = buildings.get(name)
+            if building is None or not building.owned:
+                continue
+            inputs = []
+            for resource_name, income in building.income.items():
+                if income < 0:
+                    resource = resources.get(resource_name)
+                    if resource is None or resource.owned <= 0:
+                        inputs.append(resource_name)
+                        demand[resource_name] = demand.get(resource_name, 0.0) - income * building.owned
+            if inputs:
+                consumers.append((name, building, inputs))
+        if not consumers:
+            return {}
+        # resource: the position of the first consumer of it, to know when a pass has to be repeated
+        first_consumer = {}
+        for position, (name, building, inputs) in enumerate(consumers):
+            for resource_name in inputs:
+                first_consumer.setdefault(resource_name, position)
+
+        supply = dict.fromkeys(demand, 0.0)
+        for building in buildings.values():
+            for resource_name, income in building.income.items():
+                if income > 0 and resource_name in supply:
+                    supply[resource_name] += income * building.owned
+
+        speeds = {}
+        for _ in range(MAX_SWEEPS):
+            settled = True
+            for position, (name, building, inputs) in enumerate(consumers):
+                speed = 1.0
+                for resource_name in inputs:
+                    speed = min(speed, max(0.0, supply[resource_name]) / demand[resource_name])
+                old = speeds.get(name, 1.0)
+                if speed < old - SETTLED:
+                    speeds[name] = speed
+                    # a slower building produces less for its consumers, which need another pass
+                    # if this one has been through them already
+                    for resource_name, income in building.income.items():
+                        if income > 0 and resource_name in supply:
+                            supply[resource_name] += income * building.owned * (speed - old)
+                            if first_consumer[resource_name] <= position:
+                                settled = False
+            if settled:
+                break
+        return speeds
+
+
+def possible_incomes(model, building, positive):
+    """Resources a building produces (or consumes), from its income and the income effects on it"""
+    sign = 1 if positive else -1
+    result = set(resource_name for resource_name, income in building.income.items() if income * sign > 0)
+    for (kind, name, resource_name), stages in model.effects.contributions.items():
+        if kind == 'income' and name == building.name:
+            if any(amount * sign > 0 for index, amount in stages[ADD]):
+                result.add(resource_name)
+    return result
+
+
+def seconds_until_depleted(resources):
+    seconds = INFINITY
+    first = None
+    for resource_name, resource in resources.items():
+        if resource.income < 0 and resource.owned > 0:
+            until = resource.owned / -resource.income
+            if until < seconds:
+                seconds = float(until)
+                first = resource_name
+    return seconds, first
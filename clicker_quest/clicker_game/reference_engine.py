@@ -0,0 +1,560 @@
+# coding=utf-8
+from clicker_game.bignum import add, from_json, power, to_json
+from clicker_game.effects import MULTIPLIER, STAGES
+from clicker_game.game_model import MAX_ORDER_PURCHASES, MAX_ORDER_UP_TO, MAX_ORDERS, MAX_PRODUCTION_CHANGES, \
+    Dicted, clear_rounding_errors, is_click_building, seconds_to_fast_forward
+from clicker_game.production import seconds_until_depleted
+from clicker_game.timing import NULL_TIMER
+
+
+"""
+The reference game engine: how game instances behave, kept as a plain and unoptimized copy of
+clicker_game.game_model.GameInstance as it was when the differential tests (see
+clicker_game.differential) were written, for faster engines to be checked against.
+
+It is deliberately slow and simple, and should not be changed to follow changes in game_model.py
+unless they are meant to change what games do. It differs from GameInstance only in taking no
+shortcuts:
+
+    - every calculate_values() evaluates every effect from scratch, with no EffectState levels
+      or caches of values seen before;
+    - when a resource runs out, the incomes are added up again from every building instead of
+      being adjusted by the change in speed;
+    - clicks always calculate the values again.
+
+It shares the GameModel (what the json description means), the production graph's solver, the
+decay curves and the number arithmetic with the game engine.
+
+ReferenceModel(model):
+    Wraps a GameModel.
+
+    load_game_instance(instance_data, instance_time, timer=NULL_TIMER):
+        A ReferenceInstance, with the same methods as GameInstance.
+"""
+
+
+class ReferenceModel(object):
+    def __init__(self, model):
+        self.model = model
+
+    def load_game_instance(self, game_instance, game_instance_time, timer=NULL_TIMER):
+        return ReferenceInstance(self.model, game_instance, game_instance_time, timer)
+
+
+def effect_tables(model, upgrades, buildings):
+    """Every {resource: value} table changed by effects, for the upgrades and buildings owned"""
+    pipeline = model.effects
+    levels = [1 if name in upgrades else 0 for name in pipeline.upgrade_sources] + [
+        buildings[name].owned if name in buildings else 0 for name in pipeline.building_sources
+    ]
+    tables = {}
+    for key, resource_names in pipeline.table_resources.items():
+        table = dict(pipeline.base_tables[key])
+        for resource_name in resource_names:
+            target = key + (resource_name,)
+            stages = []
+            for stage in range(len(STAGES)):
+                if stage == MULTIPLIER:
+                    value = 1.0
+                    for index, amount in pipeline.contributions[target][stage]:
+                        value = value * power(amount, levels[index])
+                else:
+                    value = 0.0
+                    for index, amount in pipeline.contributions[target][stage]:
+                        value += amount * levels[index]
+                stages.append(value)
+            add_value, add_multiplier, multiplier = stages
+            value = (pipeline.base[target] + add_value) * (1.0 + add_multiplier) * multiplier
+            if value:
+                table[resource_name] = value
+            else:
+                table.pop(resource_name, None)
+        tables[key] = table
+    return tables
+
+
+class ReferenceInstance(object):
+    def __init__(self, model, instance_data, instance_time, timer=NULL_TIMER):
+        self.model = model
+        self.time = instance_time
+        self.timer = timer
+        self.resources = instance_data.get('resources') or {}
+        self.buildings = instance_data.get('buildings') or {}
+        self.upgrades = set(instance_data.get('upgrades', ()))
+        self.orders = [dict(order) for order in instance_data.get('orders', ())]
+        self.tables = {}
+        # building: speed, for buildings slowed down by a shortage of what they consume
+        self.speeds = {}
+        # clicks are limited by the time since the state was saved, however many actions follow
+        self.saved_time = instance_time
+        self.clicks_since_saved = 0
+        # convert to python objects
+        self.resources = {name: Dicted(owned=from_json(count)) for name, count in self.resources.items()}
+        self.buildings = {name: Dicted(owned=count) for name, count in self.buildings.items()}
+
+    def get_current_state(self, current_time):
+        """
+        Read a game state object, advance it forwards in time to the current time, and return the
+        (modified game state, and data to pass to the client) in a tuple
+        """
+        self.fast_forward(current_time)
+        return self.save_state_json(), self.client_state_json()
+
+    def purchase_building(self, current_time, building_name, number_purchased):
+        """
+        Read a game state object, advance it forwards in time to the current time, purchase the specified
+        buildings if possible, and return the (modified game state, and data to pass to the client) in a tuple
+        """
+        self.fast_forward(current_time)
+        self.try_purchase_building(building_name, number_purchased)
+        return self.save_state_json(), self.client_state_json()
+
+    def purchase_upgrade(self, current_time, upgrade_name):
+        """
+        Read a game state object, advance it forwards in time to the current time, purchase the specified
+        upgrade if possible, and return the (modified game state, and data to pass to the client) in a tuple
+        """
+        self.fast_forward(current_time)
+        self.try_purchase_upgrade(upgrade_name)
+        return self.save_state_json(), self.client_state_json()
+
+    def record_clicks(self, current_time, building_name, clicks, max_clicks_per_second):
+        """
+        Read a game state object, advance it forwards in time to the current time, apply a batch of
+        clicks on a click building, and return the (modified game state, and data to pass to the client)
+        in a tuple. Clicks beyond max_clicks_per_second for the time since the instance was loaded are
+        ignored, counting the clicks already recorded on this instance.
+        """
+        elapsed = (current_time - self.saved_time).total_seconds()
+        clicks = min(clicks, int(max_clicks_per_second * elapsed) - self.clicks_since_saved)
+        self.fast_forward(current_time)
+        if self.try_click(building_name, clicks):
+            self.clicks_since_saved += clicks
+        return self.save_state_json(), self.client_state_json()
+
+    def record_click_batch(self, current_time, clicks, max_clicks_per_second):
+        """Fast forward, then record clicks on each building in turn"""
+        elapsed = (current_time - self.saved_time).total_seconds()
+        allowed = int(max_clicks_per_second * elapsed) - self.clicks_since_saved
+        self.fast_forward(current_time)
+        for building_name, count in clicks:
+            count = min(count, allowed)
+            if self.try_click(building_name, count):
+                self.clicks_since_saved += count
+                allowed -= count
+        return self.save_state_json(), self.client_state_json()
+
+    def place_order(self, current_time, order):
+        """
+        Read a game state object, advance it forwards in time to the current time, add a standing order
+        if it is valid, and return the (modified game state, and data to pass to the client) in a tuple.
+        An order for the same building or upgrade as an existing one replaces it.
+        """
+        self.fast_forward(current_time)
+        order = self.clean_order(order)
+        if order is not None:
+            self.orders = [existing for existing in self.orders if not self.same_order(existing, order)]
+            if len(self.orders) < MAX_ORDERS:
+                self.orders.append(order)
+                # the order may be affordable already
+                self.fill_orders(0.0)
+        return self.save_state_json(), self.client_state_json()
+
+    def cancel_order(self, current_time, order):
+        """
+        Like place_order, but removes the standing order for the same building or upgrade as the one
+        given instead.
+        """
+        self.fast_forward(current_time)
+        self.orders = [existing for existing in self.orders if not self.same_order(existing, order)]
+        return self.save_state_json(), self.client_state_json()
+
+    def clean_order(self, order):
+        """Return a standing order in its stored form, or None if it is not a valid order"""
+        if not isinstance(order, dict):
+            return None
+        if 'building' in order:
+            building = self.model.buildings.get(order['building'])
+            try:
+                up_to = int(order.get('up_to'))
+            except (TypeError, ValueError):
+                return None
+            if building is None or is_click_building(building) or not 0 < up_to <= MAX_ORDER_UP_TO:
+                return None
+            return {'building': building.name, 'up_to': up_to}
+        if 'upgrade' in order:
+            if order['upgrade'] not in self.model.upgrades:
+                return None
+            return {'upgrade': order['upgrade']}
+        return None
+
+    @staticmethod
+    def same_order(a, b):
+        return a.get('building') == b.get('building') and a.get('upgrade') == b.get('upgrade')
+
+    def try_purchase_building(self, building_name, number_purchased):
+        """Purchase some buildings right now if possible, and return whether they were purchased"""
+        if (
+            building_name in self.model.buildings and
+            self.requirement_is_met(self.model.buildings[building_name].unlock) and
+            self.pay_cost(self.cost_of_building(building_name, number_to_buy=number_purchased))
+        ):
+            self.acquire_building(building_name, number_purchased)
+            self.calculate_values()
+            return True
+        return False
+
+    def try_click(self, building_name, clicks):
+        """
+        Click a click building a number of times right now, and return whether it was clicked. Every
+        click costs the same, so this takes the same time for any number of clicks.
+        """
+        building = self.model.buildings.get(building_name)
+        if (
+            building is None or
+            clicks <= 0 or
+            not is_click_building(building) or
+            not self.requirement_is_met(building.unlock)
+        ):
+            return False
+        for resource_name, amount in self.cost_of_building(building_name, 1).items():
+            self.acquire_resource(resource_name, -amount * clicks)
+        self.acquire_building(building_name, clicks)
+        self.calculate_values()
+        return True
+
+    def try_purchase_upgrade(self, upgrade_name):
+        """Purchase an upgrade right now if possible, and return whether it was purchased"""
+        if (
+            upgrade_name in self.model.upgrades and
+            upgrade_name not in self.upgrades and
+            self.requirement_is_met(self.model.upgrades[upgrade_name].unlock) and
+            self.pay_cost(self.cost_of_upgrade(upgrade_name))
+        ):
+            self.acquire_upgrade(upgrade_name)
+            self.calculate_values()
+            return True
+        return False
+
+    def save_state_json(self):
+        """Return the save state json object for this game state, boiled down to its minimum"""
+        result = {}
+        if self.resources:
+            result['resources'] = {
+                name: to_json(resource.owned)
+                for name, resource in self.resources.items()
+                if resource.owned
+            }
+        if self.buildings:
+            result['buildings'] = {
+                name: building.owned
+                for name, building in self.buildings.items()
+                if building.owned
+            }
+        if self.upgrades:
+            result['upgrades'] = list(self.upgrades)
+        if self.orders:
+            result['orders'] = [dict(order) for order in self.orders]
+        return result
+
+    def client_state_json(self):
+        """
+        Return the information about the game state suitable for the client side JS to render
+        the page we want the user to see
+        """
+        with self.timer.phase('client_state'):
+            result = {
+                'resources': [],
+                'buildings': [],
+                'upgrades': [],
+            }
+            # resources
+            for resource in self.model.resources.values():
+                owned = self.resources.get(resource.name)
+                if owned and (owned.owned or owned.income) and (not owned.maximum == 0):
+                    result['resources'].append({
+                        'name': resource.name,
+                        'description': resource.description,
+                        'owned': owned.owned,
+                        'income': owned.income,
+                        'maximum': owned.maximum,
+                    })
+
+            # buildings
+            for building in self.model.buildings.values():
+                owned = building.name in self.buildings and self.buildings[building.name].owned or 0
+                income = owned and self.buildings[building.name].income or building.income
+                if owned or self.requirement_is_met(building.unlock):
+                    result['buildings'].append({
+                        'name': building.name,
+                        'description': building.description,
+                        'owned': owned,
+                        'cost': self.cost_of_building(building.name, 1),
+                        'cost10': self.cost_of_building(building.name, 10),
+                        'income': income,
+                    })
+
+            # upgrades
+            for upgrade in self.model.upgrades.values():
+                if upgrade.name in self.upgrades or self.requirement_is_met(upgrade.unlock):
+                    result['upgrades'].append({
+                        'name': upgrade.name,
+                        'description': upgrade.description,
+                        'owned': upgrade.name in self.upgrades,
+                        'cost': self.cost_of_upgrade(upgrade.name),
+                    })
+
+            # standing orders
+            if self.orders:
+                result['orders'] = [dict(order) for order in self.orders]
+
+            # production slowed by shortages, and how long until the next resource runs out
+            if self.model.production.has_consumers:
+                until, resource_name = seconds_until_depleted(self.resources)
+                result['production'] = {
+                    'speeds': dict(self.speeds),
+                    'runs_out': {'resource': resource_name, 'seconds': until} if resource_name else None,
+                }
+
+            return result
+
+    def calculate_values(self):
+        with self.timer.phase('calculate_values'):
+            self.tables = effect_tables(self.model, self.upgrades, self.buildings)
+
+            # resource incomes, costs and storage per building type
+            for name, building in self.buildings.items():
+                model_building = self.model.buildings[name]
+                building.income = self.lookup('income', name, model_building.income)
+                building.cost = self.lookup('cost', name, model_building.cost)
+                building.storage = self.lookup('storage', name, model_building.storage)
+
+            # reset resources maximums and incomes
+            for name, resource in self.resources.items():
+                resource.income = 0.0
+                resource.maximum = self.model.resources[name].maximum
+
+            # slow down buildings consuming resources that have run out
+            production = self.model.production
+            self.speeds = production.solve(self.buildings, self.resources) if production.has_consumers else {}
+
+            # calculate total storage and income right now
+            speeds = self.speeds
+            for name, building in self.buildings.items():
+                for resource, storage in building.storage.items():
+                    self.acquire_storage(resource, storage * building.owned)
+                speed = speeds.get(name, 1.0)
+                for resource, income in building.income.items():
+                    self.acquire_income(resource, income * building.owned * speed)
+
+    def lookup(self, kind, name, base):
+        return self.tables.get((kind, name), base)
+
+    def change_speeds(self):
+        """Solve the building speeds again after a resource has run out, and add up the incomes again"""
+        self.speeds = self.model.production.solve(self.buildings, self.resources)
+        for resource in self.resources.values():
+            resource.income = 0.0
+        flows = {}
+        for name, building in self.buildings.items():
+            speed = self.speeds.get(name, 1.0)
+            for resource, income in building.income.items():
+                self.acquire_income(resource, income * building.owned * speed)
+                flows[resource] = flows.get(resource, 0.0) + abs(income * building.owned * speed)
+        clear_rounding_errors(self.resources, flows)
+
+    def acquire_resource(self, resource_name, amount):
+        """Add an amount of a resource to the state"""
+        if resource_name not in self.resources:
+            self.resources[resource_name] = Dicted(owned=0.0, maximum=self.model.resources[resource_name].maximum)
+        cap = self.resources[resource_name].maximum
+        self.resources[resource_name].owned = max(0.0, min(
+            add(self.resources[resource_name].owned, amount),
+            float('inf') if cap is None else cap
+        ))
+
+    def acquire_storage(self, resource_name, storage):
+        """Add an amount of storage for a resource to the state"""
+        if resource_name not in self.resources:
+            self.resources[resource_name] = Dicted(
+                owned=0.0,
+                income=0.0,
+                maximum=self.model.resources[resource_name].maximum
+            )
+        self.resources[resource_name].maximum += storage
+
+    def acquire_income(self, resource_name, income):
+        """Add an amount of income to the calculated state"""
+        if resource_name not in self.resources:
+            self.resources[resource_name] = Dicted(
+                owned=0.0,
+                income=0.0,
+                maximum=self.model.resources[resource_name].maximum
+            )
+        self.resources[resource_name].income += income
+
+    def acquire_building(self, building_name, number):
+        """Add a number of buildings to the state"""
+        if building_name not in self.buildings:
+            self.buildings[building_name] = Dicted(owned=0)
+        self.buildings[building_name].owned += number
+
+    def acquire_upgrade(self, upgrade_name):
+        """Add an upgrade to this game state"""
+        self.upgrades.add(upgrade_name)
+
+    def fast_forward(self, current_time):
+        """Fast forward the time of the game state to the given time"""
+        with self.timer.phase('fast_forward'):
+            self.calculate_values()
+            seconds = seconds_to_fast_forward(current_time - self.time, self.model.decay)
+            if self.orders:
+                seconds = self.fill_orders(seconds)
+            self.advance(seconds)
+            self.time = current_time
+
+    def fill_orders(self, seconds):
+        """
+        Advance through up to a number of effective seconds of game time, buying whatever the standing
+        orders call for at the exact moment it becomes affordable. Incomes only change when something is
+        bought, so this jumps from one purchase to the next instead of stepping through time. Finished
+        orders are removed. Returns the number of seconds left over after the last purchase.
+        """
+        for _ in range(MAX_ORDER_PURCHASES):
+            next_order = None
+            for order in list(self.orders):
+                if 'upgrade' in order:
+                    if order['upgrade'] in self.upgrades:
+                        self.orders.remove(order)
+                        continue
+                    unlock = self.model.upgrades[order['upgrade']].unlock
+                    cost = self.cost_of_upgrade(order['upgrade'])
+                else:
+                    building = self.buildings.get(order['building'])
+                    if building and building.owned >= order['up_to']:
+                        self.orders.remove(order)
+                        continue
+                    unlock = self.model.buildings[order['building']].unlock
+                    cost = self.cost_of_building(order['building'], 1)
+                if not self.requirement_is_met(unlock):
+                    continue
+                wait = self.seconds_until_affordable(cost)
+                if wait <= seconds and (next_order is None or wait < next_order[0]):
+                    next_order = (wait, order, cost)
+            if next_order is None:
+                break
+            wait, order, cost = next_order
+            if self.model.production.has_consumers:
+                # incomes change when something runs out, so look again from there
+                until, resource_name = seconds_until_depleted(self.resources)
+                if until < wait:
+                    self.advance(until)
+                    seconds -= until
+                    continue
+            self.advance_to_afford(cost, wait)
+            seconds -= wait
+            if 'upgrade' in order:
+                bought = self.try_purchase_upgrade(order['upgrade'])
+            else:
+                bought = self.try_purchase_building(order['building'], 1)
+            if not bought:  # pragma: no cover
+                self.orders.remove(order)
+        return seconds
+
+    def advance_to_afford(self, cost, seconds):
+        """
+        Advance by the number of seconds that seconds_until_affordable() gave for a cost, forgiving the
+        rounding error that might leave it just short of affordable.
+        """
+        self.advance(seconds)
+        for resource_name, amount in cost.items():
+            resource = self.resources.get(resource_name)
+            if resource is not None and amount > resource.owned >= amount * (1.0 - 1e-9):
+                resource.owned = amount
+
+    def advance(self, seconds):
+        """
+        Collect income for a number of effective seconds of game time. calculate_values() must have
+        been called since the last change to the state. Whenever a resource runs out along the way,
+        the buildings consuming it are slowed down from that moment on.
+        """
+        if self.model.production.has_consumers:
+            for _ in range(MAX_PRODUCTION_CHANGES):
+                until, resource_name = seconds_until_depleted(self.resources)
+                if until > seconds:
+                    break
+                for name, resource in self.resources.items():
+                    self.acquire_resource(name, resource.income * until)
+                self.resources[resource_name].owned = 0.0
+                seconds -= until
+                self.change_speeds()
+        for resource_name, resource in self.resources.items():
+            self.acquire_resource(resource_name, resource.income * seconds)
+
+    def requirement_is_met(self, unlock):
+        """
+        Take a data block from the game model that specifies the required buildings and upgrades
+        to unlock a specific thing and return True if those requirements are met (False otherwise).
+        """
+        if 'buildings' in unlock:
+            if not all(
+                building in self.buildings and self.buildings[building].owned >= count
+                for building, count in unlock['buildings'].items()
+            ):
+                return False
+        if 'upgrades' in unlock:
+            if not all(
+                upgrade in self.upgrades
+                for upgrade in unlock['upgrades']
+            ):
+                return False
+        return True
+
+    def cost_of_building(self, building_name, number_to_buy=1):
+        """Calculate the cost of purchasing a certain number of a building"""
+        building = self.buildings.get(building_name)
+        owned = building.owned if building is not None else 0
+        cost = self.lookup('cost', building_name, self.model.buildings[building_name].cost)
+        result = {resource: 0.0 for resource in cost}
+        for resource, amount in cost.items():
+            for n in range(owned, owned + number_to_buy):
+                result[resource] += amount * power(self.model.buildings[building_name].cost_factor, n)
+        return result
+
+    def cost_of_upgrade(self, upgrade_name):
+        """The cost of an upgrade, after the effects on it"""
+        return self.lookup('upgrade_cost', upgrade_name, self.model.upgrades[upgrade_name].cost)
+
+    def cost_is_affordable(self, cost):
+        """Determine whether a cost is currently affordable"""
+        return all(
+            resource in self.resources and self.resources[resource].owned >= amount
+            for resource, amount in cost.items()
+        )
+
+    def seconds_until_affordable(self, cost):
+        """
+        Calculate how many effective seconds of income it will take before a cost is affordable, which
+        is infinite if it never will be at the current incomes. calculate_values() must have been called
+        since the last change to the state.
+        """
+        seconds = 0.0
+        for resource_name, amount in cost.items():
+            resource = self.resources.get(resource_name)
+            owned = resource.owned if resource else 0.0
+            if owned >= amount:
+                continue
+            income = resource.income if resource else 0.0
+            maximum = resource.maximum if resource else self.model.resources[resource_name].maximum
+            if income <= 0.0 or (maximum is not None and maximum < amount):
+                return float('inf')
+            seconds = max(seconds, (amount - owned) / income)
+        return seconds
+
+    def pay_cost(self, cost):
+        """If a cost is affordable, pay the cost and return True. Otherwise, return False."""
+        if not self.cost_is_affordable(cost):
+            return False
+        for resource, amount in cost.items():
+            self.resources[resource].owned -= amount
+        return True
@@ -0,0 +1,160 @@
+# coding=utf-8
+import threading
+from timeit import default_timer
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from clicker_game.models import ClickerGame
+from clicker_game.snapshots import content_hash, snapshot
+from clicker_game.timing import histograms
+
+
+"""
+In-process registry of the playable games, so that finding a game and its compiled GameModel costs
+no queries and no parsing on each request.
+
+GameRegistry:
+    get(key=None):
+        Return the GameEntry for a game slug or id, or for the default game (the oldest one) when
+        key is None. Returns None if there is no such game. Every game is loaded in one query the
+        first time, and its model compiled (or taken from the snapshot) the first time it is
+        used; a key that is not found reloads them, at most once a second.
+
+    entries():
+        The GameEntry of every game loaded.
+
+    check(entry, game):
+        Compare an entry with a ClickerGame record fetched along with something else (such as a
+        game instance, with select_related and game_data deferred), and return an up to date
+        entry, reloading the game only when it has been modified since it was compiled. This is
+        how other worker processes notice games being edited.
+
+    warm_start():
+        Load every game, compiling only the models that the snapshot file doesn't have (see
+        clicker_game.snapshots) and saving it if any were, and return how long that took.
+        Models already in the snapshot are left there until a request needs them. The
+        WSGI entry point does this when CLICKER_WARM_START is on, so that new worker processes
+        are ready before their first request instead of slow on it.
+
+    refresh(game), remove(game_id), clear():
+        Replace, drop or forget entries. Saving or deleting a ClickerGame does this in the same
+        process through signals.
+
+GameEntry:
+    The ClickerGame record (game), the hash of its game data (content_hash) and its compiled
+    GameModel (model), shared with any other game with the same data.
+
+registry:
+    The GameRegistry used by the views.
+"""
+
+
+MISS_RELOAD_SECONDS = 1.0
+
+
+class GameEntry(object):
+    __slots__ = ('game', 'content_hash', '_model')
+
+    def __init__(self, game):
+        self.game = game
+        self.content_hash = game.version_id or content_hash(game.game_data)
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = snapshot.model(self.game.game_data, self.content_hash)
+        return self._model
+
+
+class GameRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = None
+        self._by_slug = {}
+        self._last_load = None
+
+    def load(self):
+        entries = [GameEntry(game) for game in ClickerGame.objects.order_by('pk')]
+        with self._lock:
+            self._by_id = {entry.game.pk: entry for entry in entries}
+            self._by_slug = {entry.game.slug: entry for entry in entries}
+            self._last_load = default_timer()
+        snapshot.retain(entry.content_hash for entry in entries)
+
+    def entries(self):
+        with self._lock:
+            return list((self._by_id or {}).values())
+
+    def warm_start(self):
+        start = default_timer()
+        self.load()
+        for entry in self.entries():
+            snapshot.prepare(entry.game.game_data, entry.content_hash)
+        snapshot.save()
+        seconds = default_timer() - start
+        histograms.observe('startup.warm_start', seconds)
+        return seconds
+
+    def get(self, key=None):
+        if self._by_id is None:
+            self.load()
+        entry = self._find(key)
+        if entry is None and default_timer() - self._last_load >= MISS_RELOAD_SECONDS:
+            self.load()
+            entry = self._find(key)
+        return entry
+
+    def _find(self, key):
+        by_id = self._by_id
+        if key is None:
+            return by_id[min(by_id)] if by_id else None
+        entry = self._by_slug.get(key)
+        if entry is None and str(key).isdigit():
+            entry = by_id.get(int(key))
+        return entry
+
+    def check(self, entry, game):
+        # a replica may be behind the game already compiled, which is kept then
+        if game.modified <= entry.game.modified:
+            return entry
+        # from the database the game came from, which is at least as up to date
+        return self.refresh(ClickerGame.objects.db_manager(game._state.db).get(pk=game.pk))
+
+    def refresh(self, game):
+        entry = GameEntry(game)
+        with self._lock:
+            if self._by_id is not None:
+                old = self._by_id.get(game.pk)
+                if old is not None:
+                    self._by_slug.pop(old.game.slug, None)
+                self._by_id[game.pk] = entry
+                self._by_slug[game.slug] = entry
+                snapshot.retain(other.content_hash for other in self._by_id.values())
+        return entry
+
+    def remove(self, game_id):
+        with self._lock:
+            if self._by_id is not None:
+                old = self._by_id.pop(game_id, None)
+                if old is not None:
+                    self._by_slug.pop(old.game.slug, None)
+
+    def clear(self):
+        with self._lock:
+            self._by_id = None
+            self._by_slug = {}
+
+
+registry = GameRegistry()
+
+
+@receiver(post_save, sender=ClickerGame)
+def game_saved(sender, instance, **kwargs):
+    registry.refresh(instance)
+
+
+@receiver(post_delete, sender=ClickerGame)
+def game_deleted(sender, instance, **kwargs):
+    registry.remove(instance.pk)
@@ -0,0 +1,116 @@
+# coding=utf-8
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+
+"""
+Read replica routing: reads go to the databases in CLICKER_REPLICAS, writes to the primary.
+
+Replicas run a little behind the primary, so reads that have to see the latest writes are pinned
+to the primary instead:
+
+    - every read in a request that isn't a GET, HEAD or OPTIONS request, since those are the
+      requests that read something in order to change it;
+    - every read in a request after it has written anything;
+    - every read for CLICKER_REPLICA_LAG_SECONDS after a request from the same browser wrote
+      anything, so players never see their game from before their last click. The time is kept
+      in a cookie, which covers every worker process and server;
+    - every read inside a pin_to_primary() block, which views use around reads they are about
+      to write back.
+
+Everything else, like loading game models into the registry and polling the state of a game
+(see MainView.poll), reads from a replica picked at random. With no replicas configured,
+everything uses the primary as before.
+
+ReplicaRouter:
+    The database router, for DATABASE_ROUTERS.
+
+ReplicaMiddleware:
+    Sets up the pinning for each request, and the cookie after it. Put it in MIDDLEWARE_CLASSES
+    before anything that reads the database.
+
+pin_to_primary():
+    Context manager pinning the reads inside it to the primary.
+
+is_pinned():
+    Whether reads are pinned to the primary right now.
+"""
+
+
+PIN_COOKIE = 'clicker_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'CLICKER_REPLICAS', [])
+
+
+def lag_seconds():
+    return getattr(settings, 'CLICKER_REPLICA_LAG_SECONDS', 5.0)
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False) or getattr(_state, 'wrote', False)
+
+
+@contextmanager
+def pin_to_primary():
+    was_pinned = getattr(_state, 'pinned', False)
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = was_pinned
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        if 'instance' in hints:  # related objects come from wherever the instance did
+            return None
+        aliases = replicas()
+        if not aliases or is_pinned():
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware(object):
+    def __init__(self):
+        if not replicas():
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        _state.pinned = request.method not in SAFE_METHODS or time.time() < pinned_until
+        _state.wrote = False
+
+    def process_response(self, request, response):
+        if getattr(_state, 'wrote', False):
+            lag = lag_seconds()
+            response.set_cookie(PIN_COOKIE, repr(time.time() + lag), max_age=int(lag) + 1, httponly=True)
+        _state.pinned = False
+        _state.wrote = False
+        return response
@@ -0,0 +1,262 @@
+# coding=utf-8
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from clicker_game.models import ArchivedGameInstance, ClickerGame, GameInstance
+from clicker_game.routers import pin_to_primary
+
+
+"""
+Horizontal sharding of game instances by user.
+
+Every poll and click rewrites a GameInstance row, so with CLICKER_SHARDS set (from
+DATABASE_SHARD_URLS) the rows go on several databases instead of one: all of a user's game
+instances live on the shard that jump_hash(user id) picks, and everything else (users, sessions,
+the ClickerGame definitions) stays on the default database. No query ever touches more than one
+shard, so write throughput grows with the number of shards.
+
+Jump consistent hashing moves as few users as possible when shards are added: going from n to
+n + 1 shards moves 1 / (n + 1) of them, all onto the new shard. Shards must only ever be added at
+the end of CLICKER_SHARDS. Rebalancing is online:
+
+    1. Set CLICKER_PREVIOUS_SHARDS to the old list and CLICKER_SHARDS to the new one, everywhere.
+       A user whose games are not on their new shard yet has them moved there the first time
+       they are loaded (see fetch_user_game).
+    2. Run "manage.py rebalance_shards" to move everyone else's.
+    3. Unset CLICKER_PREVIOUS_SHARDS.
+
+Turning sharding on works the same way, with the default database standing in for the previous
+shards: while CLICKER_PREVIOUS_SHARDS is empty, games not found on a user's shard are looked for
+there, and rebalance_shards moves everything left on it.
+
+Rows are inserted with new ids when they move, so GameInstance ids are only unique per shard.
+
+jump_hash(key, buckets):
+    The bucket (0 to buckets - 1) of an integer key, by Lamping and Veach's jump consistent hash.
+
+shard_for_user(user_id), previous_shard_for_user(user_id):
+    The alias of a user's shard, under CLICKER_SHARDS or CLICKER_PREVIOUS_SHARDS; None when not
+    sharded, so that other routers (such as the replica router) still choose. A user's previous
+    shard is the default database when there were no previous shards.
+
+user_games(user_id):
+    A queryset of a user's game instances, on their shard.
+
+fetch_user_game(user_id, game_id, queryset=None):
+    Get a user's instance of a game from their shard, moving it from the previous shard first
+    if it is still there, and restoring it if it was archived (see clicker_game.archive).
+    queryset can add select_related and the like.
+
+move_user_games(user_id, source, target):
+    Move a user's game instances, and archived game instances, from one database to another,
+    holding the locks instance_lock takes for them on the target. Returns how many game instances
+    were moved.
+
+rebalance(dry_run=False, batch_size=1000):
+    Move the games of every user not on their shard (or only count them), from the shards and,
+    when sharding was just turned on, the default database, as the rebalance_shards command does.
+
+iterate_game_instances(queryset=None, batch_size=1000):
+    Every game instance on every shard (or the filtered ones, given a queryset), fetched in
+    batches in id order from one shard after another, for batch jobs.
+
+ShardRouter:
+    The database router, for DATABASE_ROUTERS ahead of the replica router. It sends the writes
+    of each game instance to its user's shard, and related games and users back to the default
+    database. Querysets have no instance to go by, so use user_games() or .using() for them.
+"""
+
+
+SHARDED_MODELS = (GameInstance, ArchivedGameInstance)
+
+
+def shards():
+    return getattr(settings, 'CLICKER_SHARDS', [])
+
+
+def previous_shards():
+    return getattr(settings, 'CLICKER_PREVIOUS_SHARDS', [])
+
+
+def jump_hash(key, buckets):
+    bucket = -1
+    jump = 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def pick_shard(aliases, user_id):
+    if not aliases:
+        return None
+    return aliases[jump_hash(int(user_id), len(aliases))]
+
+
+def shard_for_user(user_id):
+    return pick_shard(shards(), user_id)
+
+
+def previous_shard_for_user(user_id):
+    if not shards():
+        return None
+    # before there were any shards, every game instance was on the default database
+    return pick_shard(previous_shards(), user_id) or DEFAULT_DB_ALIAS
+
+
+def previous_locations():
+    """The databases game instances may still be on besides the shards"""
+    if not shards() or previous_shards() or DEFAULT_DB_ALIAS in shards():
+        return []
+    return [DEFAULT_DB_ALIAS]
+
+
+def user_games(user_id):
+    alias = shard_for_user(user_id)
+    queryset = GameInstance.objects.all() if alias is None else GameInstance.objects.using(alias)
+    return queryset.filter(user_id=user_id)
+
+
+def fetch_user_game(user_id, game_id, queryset=None):
+    if queryset is None:
+        queryset = user_games(user_id)
+    try:
+        return queryset.get(game_id=game_id)
+    except GameInstance.DoesNotExist:
+        from clicker_game.archive import restore_user_game  # which imports this module
+        previous = previous_shard_for_user(user_id)
+        current = shard_for_user(user_id)
+        moved = previous is not None and previous != current and move_user_games(user_id, previous, current)
+        if not restore_user_game(user_id, game_id) and not moved:
+            raise
+    with pin_to_primary():  # just written
+        return queryset.get(game_id=game_id)
+
+
+def move_user_games(user_id, source, target):
+    moved = 0
+    # the target commits first, so the games are never missing from both
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        connection = connections[target]
+        if connection.vendor == 'postgresql' and getattr(settings, 'CLICKER_ADVISORY_LOCKS', True):
+            # the locks instance_lock takes on the user's shard for each of their games, before
+            # any row locks on the source, in the same order as everything else takes them
+            game_ids = sorted(set(
+                GameInstance.objects.using(source).filter(user_id=user_id).values_list('game_id', flat=True)
+            ))
+            with connection.cursor() as cursor:
+                for game_id in game_ids:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [game_id, user_id])
+        rows = list(GameInstance.objects.using(source).select_for_update().filter(user_id=user_id))
+        playing = set(
+            GameInstance.objects.using(target).filter(user_id=user_id).values_list('game_id', flat=True)
+        )
+        for row in rows:
+            if row.game_id in playing:  # already moved, or started again on the target
+                continue
+            moved_row = GameInstance.objects.using(target).create(
+                user_id=row.user_id, game_id=row.game_id, data=row.data, model_version_id=row.model_version_id
+            )
+            # modified and created are set on creation, so the originals go in afterwards
+            GameInstance.objects.using(target).filter(pk=moved_row.pk).update(
+                modified=row.modified, created=row.created
+            )
+            moved += 1
+        GameInstance.objects.using(source).filter(pk__in=[row.pk for row in rows]).delete()
+        archived = list(ArchivedGameInstance.objects.using(source).select_for_update().filter(user_id=user_id))
+        ArchivedGameInstance.objects.using(source).filter(pk__in=[row.pk for row in archived]).delete()
+        for row in archived:
+            row.pk = None
+            row.save(using=target, force_insert=True)
+    return moved
+
+
+def iterate_game_instances(queryset=None, batch_size=1000):
+    if queryset is None:
+        queryset = GameInstance.objects.all()
+    for alias in shards() or [queryset.db]:
+        last_pk = 0
+        while True:
+            batch = list(queryset.using(alias).filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            for game_instance in batch:
+                yield game_instance
+            if len(batch) < batch_size:
+                break
+            last_pk = batch[-1].pk
+
+
+def rebalance(dry_run=False, batch_size=1000):
+    """Move every user whose games are not on their shard, returning {(source, target): games moved}"""
+    moved = {}
+    for source in shards() + previous_locations():
+        misplaced = set()
+        last_pk = 0
+        while True:
+            batch = list(
+                GameInstance.objects.using(source).filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'user_id')[:batch_size]
+            )
+            misplaced.update(user_id for pk, user_id in batch if shard_for_user(user_id) != source)
+            if len(batch) < batch_size:
+                break
+            last_pk = batch[-1][0]
+        for user_id in sorted(misplaced):
+            target = shard_for_user(user_id)
+            if dry_run:
+                games = GameInstance.objects.using(source).filter(user_id=user_id).count()
+            else:
+                games = move_user_games(user_id, source, target)
+            moved[(source, target)] = moved.get((source, target), 0) + games
+    return moved
+
+
+def is_sharded(instance):
+    return isinstance(instance, GameInstance) and instance._state.db in shards()
+
+
+class ShardRouter(object):
+    def route(self, model, hints):
+        if not shards():
+            return None
+        instance = hints.get('instance')
+        if model in SHARDED_MODELS:
+            if isinstance(instance, SHARDED_MODELS) and instance.user_id is not None:
+                return shard_for_user(instance.user_id)
+            if isinstance(instance, get_user_model()):  # user.games_playing
+                return shard_for_user(instance.pk)
+        elif is_sharded(instance):  # the game or user of a game instance
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(obj1) or is_sharded(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in shards():
+            return None
+        # the shards only hold game instances
+        return app_label == 'clicker_game' and model_name in ('gameinstance', 'archivedgameinstance')
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+@receiver(pre_delete, sender=ClickerGame)
+def delete_sharded_instances(sender, instance, **kwargs):
+    """Deletion only cascades within a database, so the game instances on the shards go first"""
+    for alias in shards():
+        for model in SHARDED_MODELS:
+            if sender is ClickerGame:
+                model.objects.using(alias).filter(game_id=instance.pk).delete()
+            else:
+                model.objects.using(alias).filter(user_id=instance.pk).delete()
@@ -0,0 +1,356 @@
+# coding=utf-8
+import copy
+import itertools
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from clicker_game.game_model import is_click_building, validate_game_model
+
+
+"""
+Offline balance simulator for game models.
+
+Plays a game model with a scripted player strategy and reports when each building and upgrade
+was unlocked and purchased and how income grew. The simulated player is always active, so the
+offline decay curve never applies.
+
+Incomes only change when something is purchased, so rather than ticking the clock the simulator
+asks the strategy what it wants to buy next, works out how long it will take to afford it, and
+jumps straight there. A year of game time costs one step per purchase.
+
+simulate(model, strategy, duration, clicks_per_second=0.0):
+    Run one simulation and return a SimulationResult.
+
+STRATEGIES:
+    The built-in strategies by name: 'greedy' (best return on investment), 'cheapest' (lowest
+    total cost first), and 'script' (a fixed list of orders).
+
+sweep(json_data, grid, strategy_name, duration, ...):
+    Run a simulation for every combination of the values in a parameter grid, across a process
+    pool, and return a list of (parameters, SimulationResult).
+"""
+
+
+EPOCH = datetime(2000, 1, 1)
+INFINITY = float('inf')
+
+
+class Purchase(object):
+    """Something a strategy wants to buy: kind is 'building' or 'upgrade'"""
+    __slots__ = ('kind', 'name')
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+    def cost(self, instance):
+        if self.kind == 'building':
+            return instance.cost_of_building(self.name, 1)
+        return instance.cost_of_upgrade(self.name)
+
+    def buy(self, instance):
+        if self.kind == 'building':
+            return instance.try_purchase_building(self.name, 1)
+        return instance.try_purchase_upgrade(self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, Purchase) and (self.kind, self.name) == (other.kind, other.name)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.kind, self.name))
+
+    def __repr__(self):  # pragma: no cover
+        return "Purchase({0!r}, {1!r})".format(self.kind, self.name)
+
+
+def available_purchases(instance):
+    """Every building and upgrade that can be bought right now or by waiting, clicks excluded"""
+    result = []
+    for building in instance.model.buildings.values():
+        if not is_click_building(building) and instance.requirement_is_met(building.unlock):
+            result.append(Purchase('building', building.name))
+    for upgrade in instance.model.upgrades.values():
+        if upgrade.name not in instance.upgrades and instance.requirement_is_met(upgrade.unlock):
+            result.append(Purchase('upgrade', upgrade.name))
+    return result
+
+
+def total_income(instance):
+    return sum(resource.income for resource in instance.resources.values())
+
+
+class Strategy(object):
+    """
+    A simulated player. next_purchase() is given the running Simulation and returns the Purchase to
+    make next, or None to stop playing.
+    """
+    def next_purchase(self, simulation):  # pragma: no cover
+        raise NotImplementedError
+
+
+class CheapestFirst(Strategy):
+    """Always buy whatever has the lowest total cost among the things that can be afforded eventually"""
+    def next_purchase(self, simulation):
+        instance = simulation.instance
+        best = None
+        for purchase in available_purchases(instance):
+            cost = purchase.cost(instance)
+            if instance.seconds_until_affordable(cost) == INFINITY:
+                continue
+            total = sum(cost.values())
+            if best is None or total < best[0]:
+                best = (total, purchase)
+        return best and best[1]
+
+
+class GreedyROI(Strategy):
+    """
+    Buy whatever pays for itself soonest: the least time spent waiting to afford it plus the time its
+    extra income takes to earn back its cost.
+    """
+    def next_purchase(self, simulation):
+        instance = simulation.instance
+        income = total_income(instance)
+        best = None
+        for purchase in available_purchases(instance):
+            cost = purchase.cost(instance)
+            wait = instance.seconds_until_affordable(cost)
+            if wait == INFINITY:
+                continue
+            gain = self.income_gain(simulation, purchase, income)
+            if gain <= 0.0:
+                continue
+            payback = wait + sum(cost.values()) / gain
+            if best is None or payback < best[0]:
+                best = (payback, purchase)
+        return best and best[1]
+
+    @staticmethod
+    def income_gain(simulation, purchase, income):
+        """The total income a purchase would add"""
+        instance = simulation.instance
+        if purchase.kind == 'building':
+            owned = instance.buildings.get(purchase.name)
+            incomes = owned.income if owned else instance.model.buildings[purchase.name].income
+            return sum(incomes.values())
+        trial = instance.model.load_game_instance(instance.save_state_json(), instance.time)
+        trial.acquire_upgrade(purchase.name)
+        # with the clicks, like the income it is compared with
+        simulation.refresh(trial)
+        return total_income(trial) - income
+
+
+class Scripted(Strategy):
+    """
+    Buy things in a fixed order, then stop. Orders are dicts like {"building": "Cursor", "count": 5}
+    or {"upgrade": "Reinforced index finger"}.
+    """
+    def __init__(self, orders):
+        self.orders = list(orders)
+        self.position = 0
+        self.bought = 0
+
+    def next_purchase(self, simulation):
+        while self.position < len(self.orders):
+            order = self.orders[self.position]
+            if 'upgrade' in order:
+                if order['upgrade'] in simulation.instance.upgrades:
+                    self.position += 1
+                    continue
+                return Purchase('upgrade', order['upgrade'])
+            if self.bought >= order.get('count', 1):
+                self.position += 1
+                self.bought = 0
+                continue
+            return Purchase('building', order['building'])
+        return None
+
+    def purchased(self, purchase):
+        if purchase.kind == 'building':
+            self.bought += 1
+
+
+STRATEGIES = OrderedDict([
+    ('greedy', GreedyROI),
+    ('cheapest', CheapestFirst),
+    ('script', Scripted),
+])
+
+
+class SimulationResult(object):
+    def __init__(self):
+        # 'building:name' or 'upgrade:name': seconds when it first became available
+        self.unlocks = OrderedDict()
+        # (seconds, kind, name) for every purchase
+        self.purchases = []
+        # (seconds, {resource: income}) at the start and after every purchase
+        self.income_curve = []
+        self.final_state = None
+        self.elapsed = 0.0
+        self.stopped_because = None
+
+    def time_to_unlock(self, kind, name):
+        return self.unlocks.get('{0}:{1}'.format(kind, name))
+
+    def as_json(self):
+        return OrderedDict([
+            ('elapsed', self.elapsed),
+            ('stopped_because', self.stopped_because),
+            ('unlocks', self.unlocks),
+            ('purchases', [list(purchase) for purchase in self.purchases]),
+            ('income_curve', [[seconds, income] for seconds, income in self.income_curve]),
+            ('final_state', self.final_state),
+        ])
+
+
+class Simulation(object):
+    def __init__(self, model, strategy, clicks_per_second=0.0, start_state=None):
+        self.model = model
+        self.strategy = strategy
+        self.instance = model.load_game_instance(
+            model.new_game if start_state is None else start_state, EPOCH
+        )
+        self.elapsed = 0.0
+        self.result = SimulationResult()
+        # clicking the click buildings is simulated as a steady income
+        self.click_income = {}
+        for building in model.buildings.values():
+            if is_click_building(building):
+                for resource_name, amount in building.cost.items():
+                    self.click_income[resource_name] = (
+                        self.click_income.get(resource_name, 0.0) - amount * clicks_per_second
+                    )
+
+    def refresh(self, instance=None):
+        """Work out the income of the game instance (or another one of it), clicks included"""
+        instance = instance or self.instance
+        instance.calculate_values()
+        for resource_name, income in self.click_income.items():
+            if income:
+                instance.acquire_income(resource_name, income)
+
+    def wait(self, seconds, cost=None):
+        if seconds > 0.0:
+            if cost is None:
+                self.instance.advance(seconds)
+            else:
+                self.instance.advance_to_afford(cost, seconds)
+            self.elapsed += seconds
+            self.instance.time = EPOCH + timedelta(seconds=self.elapsed)
+
+    def record(self):
+        result = self.result
+        for building in self.model.buildings.values():
+            key = 'building:' + building.name
+            if key not in result.unlocks and self.instance.requirement_is_met(building.unlock):
+                result.unlocks[key] = self.elapsed
+        for upgrade in self.model.upgrades.values():
+            key = 'upgrade:' + upgrade.name
+            if key not in result.unlocks and self.instance.requirement_is_met(upgrade.unlock):
+                result.unlocks[key] = self.elapsed
+        result.income_curve.append((self.elapsed, {
+            name: resource.income for name, resource in self.instance.resources.items()
+        }))
+
+    def run(self, duration, max_purchases=1000000):
+        """Play until the duration has passed, the strategy stops, or nothing more can be afforded"""
+        self.refresh()
+        self.record()
+        result = self.result
+        while True:
+            if len(result.purchases) >= max_purchases:
+                result.stopped_because = 'purchase limit'
+                break
+            purchase = self.strategy.next_purchase(self)
+            if purchase is None:
+                result.stopped_because = 'strategy finished'
+                break
+            cost = purchase.cost(self.instance)
+            wait = self.instance.seconds_until_affordable(cost)
+            if wait == INFINITY:
+                result.stopped_because = 'cannot afford {0} {1}'.format(purchase.kind, purchase.name)
+                break
+            if self.elapsed + wait > duration:
+                result.stopped_because = 'time'
+                break
+            self.wait(wait, cost)
+            if not purchase.buy(self.instance):
+                result.stopped_because = 'cannot buy {0} {1}'.format(purchase.kind, purchase.name)
+                break
+            if hasattr(self.strategy, 'purchased'):
+                self.strategy.purchased(purchase)
+            self.refresh()
+            result.purchases.append((self.elapsed, purchase.kind, purchase.name))
+            self.record()
+        self.wait(duration - self.elapsed)
+        result.elapsed = self.elapsed
+        result.final_state = self.instance.save_state_json()
+        return result
+
+
+def simulate(model, strategy, duration, clicks_per_second=0.0, start_state=None):
+    """Run one simulation of a GameModel for a duration in seconds"""
+    return Simulation(model, strategy, clicks_per_second, start_state).run(duration)
+
+
+def make_strategy(name, orders=None):
+    if name == 'script':
+        return Scripted(orders or ())
+    return STRATEGIES[name]()
+
+
+def apply_parameter(json_data, path, value):
+    """
+    Set a value in a game model description by a dotted path, where resources, buildings and
+    upgrades are looked up by name: for example 'buildings.Cursor.cost_factor' or
+    'upgrades.Ambidextrous.cost.cookies'.
+    """
+    keys = path.split('.')
+    target = json_data
+    for index, key in enumerate(keys[:-1]):
+        if isinstance(target, list):
+            matches = [thing for thing in target if thing.get('name') == key]
+            if not matches:
+                raise KeyError("Nothing named {0} in {1}".format(key, '.'.join(keys[:index])))
+            target = matches[0]
+        else:
+            target = target[key]
+    target[keys[-1]] = value
+
+
+def parameter_grid(grid):
+    """Every combination of a dict of {path: [values]}, as a list of OrderedDicts"""
+    paths = list(grid)
+    return [
+        OrderedDict(zip(paths, values))
+        for values in itertools.product(*(grid[path] for path in paths))
+    ]
+
+
+def _run_grid_point(args):
+    json_data, parameters, strategy_name, orders, duration, clicks_per_second = args
+    json_data = copy.deepcopy(json_data)
+    for path, value in parameters.items():
+        apply_parameter(json_data, path, value)
+    model = validate_game_model(json_data)
+    return parameters, simulate(model, make_strategy(strategy_name, orders), duration, clicks_per_second)
+
+
+def sweep(json_data, grid, strategy_name, duration, clicks_per_second=0.0, orders=None, processes=None):
+    """Simulate every point of a parameter grid, in parallel when processes is not 1"""
+    jobs = [
+        (json_data, parameters, strategy_name, orders, duration, clicks_per_second)
+        for parameters in parameter_grid(grid)
+    ]
+    if processes == 1 or len(jobs) <= 1:
+        return [_run_grid_point(job) for job in jobs]
+    pool = Pool(processes)
+    try:
+        return pool.map(_run_grid_point, jobs)
+    finally:
+        pool.close()
+        pool.join()
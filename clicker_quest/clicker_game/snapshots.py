@@ -0,0 +1,250 @@
+# coding=utf-8
+import glob
+import hashlib
+import hmac
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+from clicker_game.encoding import model_fragments
+from clicker_game.game_model import GameModel
+
+
+"""
+Compiled game models, built once per model content and kept in an on-disk snapshot that every
+worker process on the host starts from.
+
+Compiling a game model (GameModel, its effect pipeline, production graph and pre-encoded client
+fragments) takes a few milliseconds for a large one, which every new worker process would pay on
+its first requests for each game. Compiled models are instead looked up by the hash of the
+model's canonical json, and with CLICKER_MODEL_SNAPSHOT set to a file path, the compiled models
+are pickled into that file so that new workers load them in a fraction of the time. A model is
+only compiled again when its content changes.
+
+Workers map the snapshot file read-only rather than reading it, and only unpickle a model the
+first time they serve its game, so starting a worker costs the models of the games it plays, not
+every game on the site. What this saves is start-up time, not memory: each worker still unpickles
+its own copy of every model it serves, and the pages of the file it has touched only stay shared
+between workers until the operating system drops them from its cache. The file is replaced (never
+written in place) when it is saved, and a worker that meets a model missing from the file it has
+mapped looks for a newer file and maps that instead; models taken from the old one stay valid.
+
+The snapshot is signed with the SECRET_KEY, and tied to the source code of this app: a
+snapshot that was tampered with, or written by other code, is ignored and rebuilt.
+
+content_hash(json_data):
+    The sha256 hex digest of a model's canonical json (sorted keys, no whitespace).
+
+ModelSnapshot:
+    load():
+        Map the snapshot file, if there is a valid one, and return how many models it has. The
+        app does this when it starts up.
+
+    model(json_data, key=None):
+        The compiled GameModel for a model description (whose content hash is key, if known),
+        from memory, the snapshot or compiling it. Models with the same content share one
+        GameModel.
+
+    prepare(json_data, key=None):
+        Make sure the next save includes the model, compiling it if the snapshot doesn't
+        have it, without unpickling it if the snapshot does.
+
+    retain(keep):
+        Forget every model but those with the content hashes in keep.
+
+    save():
+        Write the snapshot file, if anything changed since it was loaded or saved, and map it.
+
+snapshot:
+    The ModelSnapshot used by the registry; see GameRegistry.warm_start.
+"""
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SALT = 'clicker_game.snapshots'
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+HEADER = struct.Struct('>Q')  # length of the pickled index that follows it
+SIGN_CHUNK = 1 << 20
+
+_code_version = []
+
+
+def content_hash(json_data):
+    canonical = json.dumps(json_data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def compile_model(json_data):
+    model = GameModel(json_data)
+    # the lazily compiled parts too, so that they go in the snapshot
+    model.effects
+    model.production
+    model_fragments(model)
+    return model
+
+
+def code_version():
+    """A hash of this app's source code, since compiled models depend on it"""
+    if not _code_version:
+        digest = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(APP_DIR, '*.py'))):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _code_version.append(digest.hexdigest())
+    return _code_version[0]
+
+
+def file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime
+
+
+class ModelSnapshot(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}  # content hash: GameModel used in this process
+        self._mapped = None  # the mapped snapshot file
+        self._identity = None  # and which file that was
+        self._index = {}  # content hash: (offset, length) of its pickle in the mapped file
+        self._changed = False
+
+    def path(self):
+        return getattr(settings, 'CLICKER_MODEL_SNAPSHOT', None)
+
+    def signature(self, chunks):
+        signer = salted_hmac(SNAPSHOT_SALT, b'')
+        for chunk in chunks:
+            signer.update(chunk)
+        return signer.hexdigest().encode('ascii')
+
+    def load(self):
+        with self._lock:
+            self._map(self.path())
+            return len(self._index)
+
+    def _map(self, path):
+        """Map the snapshot file in place of the one mapped before, if it's valid"""
+        identity = file_identity(path) if path else None
+        if identity is None or identity == self._identity:
+            return
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError) as ex:
+            logger.warning("Ignoring the game model snapshot %s: %s", path, ex)
+            return
+        try:
+            start = mapped.find(b'\n') + 1
+            signature = self.signature(mapped[i:i + SIGN_CHUNK] for i in range(start, len(mapped), SIGN_CHUNK))
+            if not start or not hmac.compare_digest(mapped[:start - 1], signature):
+                raise ValueError("bad signature")
+            length, = HEADER.unpack_from(mapped, start)
+            offset = start + HEADER.size
+            version, index = pickle.loads(mapped[offset:offset + length])
+        except Exception as ex:
+            mapped.close()
+            logger.warning("Ignoring the game model snapshot %s: %s", path, ex)
+            return
+        if version != code_version():
+            mapped.close()
+            return
+        if self._mapped is not None:
+            self._mapped.close()
+        self._mapped, self._identity = mapped, identity
+        base = offset + length
+        self._index = {key: (base + start, size) for key, (start, size) in index.items()}
+
+    def _read(self, key):
+        start, length = self._index[key]
+        return self._mapped[start:start + length]
+
+    def model(self, json_data, key=None):
+        if key is None:
+            key = content_hash(json_data)
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            if key not in self._models:
+                if key not in self._index:
+                    self._map(self.path())  # another process may have saved a newer snapshot
+                if key in self._index:
+                    self._models[key] = pickle.loads(self._read(key))
+            model = self._models.get(key)
+        if model is None:
+            model = compile_model(json_data)
+            with self._lock:
+                model = self._models.setdefault(key, model)
+                self._changed = True
+        return model
+
+    def prepare(self, json_data, key=None):
+        if key is None:
+            key = content_hash(json_data)
+        if key not in self._index or not self.path():
+            self.model(json_data, key)
+
+    def retain(self, keep):
+        keep = set(keep)
+        with self._lock:
+            for models in (self._models, self._index):
+                for key in set(models) - keep:
+                    del models[key]
+                    self._changed = True
+
+    def save(self):
+        path = self.path()
+        with self._lock:
+            if not path or not self._changed:
+                return False
+            pickles = {key: self._read(key) for key in self._index}
+            for key, model in self._models.items():
+                if key not in pickles:
+                    pickles[key] = pickle.dumps(model, pickle.HIGHEST_PROTOCOL)
+            self._changed = False
+        index, offset = {}, 0
+        for key in sorted(pickles):
+            index[key] = (offset, len(pickles[key]))
+            offset += len(pickles[key])
+        header = pickle.dumps((code_version(), index), pickle.HIGHEST_PROTOCOL)
+        chunks = [HEADER.pack(len(header)), header] + [pickles[key] for key in sorted(pickles)]
+        # written to a temporary file and renamed, so readers never see half a snapshot, and
+        # processes that have mapped the old one keep it until they move on to this one
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                f.write(self.signature(chunks) + b'\n')
+                for chunk in chunks:
+                    f.write(chunk)
+            os.rename(temporary, path)
+        except Exception:
+            os.unlink(temporary)
+            raise
+        with self._lock:
+            self._map(path)
+        return True
+
+    def clear(self):
+        with self._lock:
+            if self._mapped is not None:
+                self._mapped.close()
+            self._models = {}
+            self._mapped = self._identity = None
+            self._index = {}
+            self._changed = False
+
+
+snapshot = ModelSnapshot()
@@ -3,13 +3,25 @@
 (function(module) {
   var game_data;
   var templates = {};
+  // clicks on click buildings not yet sent to the server, by building name
+  var pending_clicks = {};
+  var clicks_in_flight = null;
+  // timer for fetching the game again when a resource runs out
+  var refresh_timer = null;
+  // seconds the game state rendered into the page is good for; an older page is fetched again
+  var MAX_PAGE_AGE = 60;
 
+  // numbers too big for javascript come from the server as strings like "1.5e512"
   Handlebars.registerHelper('costFormat', function(number) {
-    return number.toFixed(2);
+    return typeof number === 'string' ? number : number.toFixed(2);
   });
 
   Handlebars.registerHelper('incomeFormat', function(number) {
-    return number.toFixed(3);
+    return typeof number === 'string' ? number : number.toFixed(3);
+  });
+
+  Handlebars.registerHelper('percentFormat', function(number) {
+    return (number * 100).toFixed(0) + '%';
   });
 
   // document.ready
@@ -18,39 +30,156 @@
     ['resource', 'building', 'upgrade'].forEach(function(ele) {
       templates[ele] = Handlebars.compile($('#' + ele + "_template").text());
     });
-    $.ajax({
+    var page_state = rendered_state();
+    if (page_state) {
+      start_game(page_state.data, page_state.time);
+    } else {
+      fetch_game().done(function(data) {
+        start_game(data);
+      });
+    }
+  });
+
+  function start_game(data, time) {
+    game_data = data;
+    redraw_game(time);
+    setInterval(update_resources, 100);
+    setInterval(send_clicks, 1000);
+  }
+
+  /* the game state the server rendered into the page, and the time it was
+  current at, or null if the page may be out of date: when it was shown again
+  from the browser's history, or is older than MAX_PAGE_AGE by our clock */
+  function rendered_state() {
+    var element = document.getElementById('game_state');
+    if (!element || !element.textContent) {
+      return null;
+    }
+    if (window.performance && performance.navigation &&
+        performance.navigation.type === performance.navigation.TYPE_BACK_FORWARD) {
+      return null;
+    }
+    var time = parseFloat(element.getAttribute('data-time'));
+    var now = new Date().getTime() / 1000;
+    if (!(now - time < MAX_PAGE_AGE)) {
+      return null;
+    }
+    // a clock a little behind the server's would count up from the future
+    return {data: JSON.parse(element.textContent), time: Math.min(time, now)};
+  }
+
+  // get the current game state from the server
+  function fetch_game() {
+    return $.ajax({
       type: 'GET',
-      url: '/',  // TODO update this url
+      url: window.location.pathname,
       dataType: 'json',
-    }).done(function(data) {
-      game_data = data;
-      redraw_game();
-      setInterval(update_resources, 100);
     });
-  });
+  }
 
 
   $('section').on('click', 'li', function(){
-    var li_type = $(this).data('type')
-    if (li_type === 'building' || li_type === 'upgrade') {
-      $.ajax({
-        type: 'POST',
-        url: '/',  // TODO update this url
-        headers: {"X-CSRFToken": getCookie('csrftoken')},
-        data: {
-          clicked: li_type,
-          name: $(this).data('name'),
-          number_purchased: 1
-        },
-        dataType: 'json'
-      }).done(function(data) {
-        game_data = data;
-        redraw_game();
+    var li_type = $(this).data('type');
+    var name = $(this).data('name');
+    if (li_type === 'building' && is_click_building(name)) {
+      count_click(name);
+    } else if (li_type === 'building' || li_type === 'upgrade') {
+      // send any clicks first so the purchase can spend what they earned
+      send_clicks().always(function() {
+        $.ajax({
+          type: 'POST',
+          url: window.location.pathname,
+          headers: {"X-CSRFToken": getCookie('csrftoken')},
+          data: {
+            clicked: li_type,
+            name: name,
+            number_purchased: 1
+          },
+          dataType: 'json'
+        }).done(function(data) {
+          game_data = data;
+          redraw_game();
+        });
       });
     };
   });
 
 
+  /* a click building costs nothing and gives resources instead, so it is
+  clicked rather than bought */
+  function is_click_building(name) {
+    var building = game_data.buildings.find(function(building) {
+      return building.name === name;
+    });
+    return building !== undefined && Object.keys(building.cost).every(function(resource) {
+      return building.cost[resource] <= 0;
+    });
+  }
+
+  /* count a click locally and show its resources straight away, including
+  ones the game hasn't had yet; the server hears about clicks in batches from
+  send_clicks */
+  function count_click(name) {
+    var building = game_data.buildings.find(function(building) {
+      return building.name === name;
+    });
+    pending_clicks[name] = (pending_clicks[name] || 0) + 1;
+    Object.keys(building.cost).forEach(function(resource_name) {
+      var amount = building.cost[resource_name];
+      if (typeof amount !== 'number') {
+        return;
+      }
+      var resource = game_data.resources.find(function(resource) {
+        return resource.name === resource_name;
+      });
+      if (resource === undefined) {
+        resource = {name: resource_name, owned: 0, income: 0, maximum: null};
+        game_data.resources.push(resource);
+        resource.displayed = resource.owned;
+        draw_element(resource, 'resource');
+      }
+      if (typeof resource.owned === 'number') {
+        resource.owned -= amount;
+      }
+    });
+  }
+
+  /* send the pending clicks on every building in one request, and return a
+  promise for when they have been sent */
+  function send_clicks() {
+    if (clicks_in_flight) {
+      return clicks_in_flight;
+    }
+    var names = Object.keys(pending_clicks);
+    if (names.length === 0) {
+      return $.when();
+    }
+    var counts = names.map(function(name) {
+      return pending_clicks[name];
+    });
+    pending_clicks = {};
+    clicks_in_flight = $.ajax({
+      type: 'POST',
+      url: window.location.pathname,
+      headers: {"X-CSRFToken": getCookie('csrftoken')},
+      // name=a&count=1&name=b&count=2 rather than name[]=a...
+      traditional: true,
+      data: {
+        clicked: 'clicks',
+        name: names,
+        count: counts
+      },
+      dataType: 'json'
+    }).done(function(data) {
+      game_data = data;
+      redraw_game();
+    }).always(function() {
+      clicks_in_flight = null;
+    });
+    return clicks_in_flight;
+  }
+
+
   // From Django AJAX page:  https://docs.djangoproject.com/en/1.9/ref/csrf/#ajax
   function getCookie(name) {
     var cookieValue = null;
@@ -69,19 +198,23 @@
   }
 
   /* delete all the objects on the page and remake them
-  with our new game data */
-  function redraw_game() {
-    // mark the game data with the time it arrived
-    game_data.time = new Date().getTime() / 1000;
+  with our new game data, which was current at a time or has just arrived */
+  function redraw_game(time) {
+    game_data.time = time || new Date().getTime() / 1000;
     // delete and redraw resources
     $('#resource_ul').empty();
     game_data.resources.forEach(function(resource) {
       resource.displayed = resource.owned;
       draw_element(resource, 'resource');
     });
-    // delete and redraw buildings
+    // delete and redraw buildings, with the speeds of any slowed down by a shortage
+    var speeds = game_data.production ? game_data.production.speeds : {};
     $('#building_ul').empty();
     game_data.buildings.forEach(function(building) {
+      if (speeds[building.name] !== undefined) {
+        building.slowed = true;
+        building.speed = speeds[building.name];
+      }
       draw_element(building, 'building');
     });
     // delete and redraw upgrades
@@ -89,6 +222,22 @@
     game_data.upgrades.forEach(function(upgrade) {
       draw_element(upgrade, 'upgrade');
     });
+    schedule_refresh();
+  }
+
+  /* the incomes from the server hold until a resource runs out, when the
+  buildings consuming it slow down; fetch the new speeds then */
+  function schedule_refresh() {
+    clearTimeout(refresh_timer);
+    var runs_out = game_data.production && game_data.production.runs_out;
+    if (runs_out && runs_out.seconds < 86400) {
+      refresh_timer = setTimeout(function() {
+        fetch_game().done(function(data) {
+          game_data = data;
+          redraw_game();
+        });
+      }, runs_out.seconds * 1000 + 100);
+    }
   }
 
   //  draw element into page.  template name defaults to element name
@@ -105,8 +254,9 @@
     // replace the resource amounts in the dom elements with the
     // value at our current time
     game_data.resources.forEach(function(resource) {
+        var amount = calc_resource(resource, time_passed);
         resource.element.find('.displayed').text(
-          calc_resource(resource, time_passed).toFixed(2)
+          typeof amount === 'string' ? amount : amount.toFixed(2)
         );
     });
   }
@@ -114,6 +264,10 @@
   /* calculate the amount of resources we have now, a given amount
   of time after the game data was last updated */
   function calc_resource(resource, time_passed) {
+    if (typeof resource.owned === 'string') {
+      // too big to count up here; shown as the server sent it
+      return resource.owned;
+    }
     var current_amount = resource.owned + time_passed * resource.income;
     if (current_amount < 0) {
       current_amount = 0;
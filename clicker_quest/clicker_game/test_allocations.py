@@ -0,0 +1,130 @@
+# coding=utf-8
+import gc
+from unittest import skipIf
+from django.http import HttpResponse
+from django.test import Client, TestCase, override_settings
+
+from clicker_game.allocations import (
+    AllocationBudgetExceeded, AllocationProfile, AllocationTimer, GCTimer, measure_allocations, profile, tracemalloc)
+from clicker_game.models import ClickerGame
+from clicker_game.registry import registry
+from clicker_game.tests import TEST_GAME, UserFactory
+from clicker_game.timing import PhaseHistograms
+
+
+def make_strings(number):
+    # not dicts, which the interpreter keeps some of to reuse rather than allocating them
+    return [str(i) * 10 for i in range(number)]
+
+
+@skipIf(tracemalloc is None, "tracemalloc needs Python 3.4 or later")
+class AllocationTimerTest(TestCase):
+    def setUp(self):
+        if not tracemalloc.is_tracing():
+            self.addCleanup(tracemalloc.stop)
+        self.profile = AllocationProfile()
+        self.timer = AllocationTimer(histograms=PhaseHistograms(), profile=self.profile)
+
+    def test_phase_allocations(self):
+        with self.timer.phase('calculate_values'):
+            kept = make_strings(1000)
+        size, blocks = self.timer.allocations['calculate_values']
+        self.assertGreaterEqual(blocks, 1000)
+        self.assertGreater(size, 1000 * 50)
+        lines = [line for line in self.timer.lines if line[0] == __file__.rstrip('c')]
+        self.assertTrue(lines)
+        del kept
+
+    def test_nested_phases_count_lines_once(self):
+        with self.timer.phase('fast_forward'):
+            with self.timer.phase('calculate_values'):
+                kept = make_strings(100)
+        self.assertGreaterEqual(self.timer.allocations['calculate_values'][1], 100)
+        self.assertGreaterEqual(self.timer.allocations['fast_forward'][1], 100)
+        self.assertLess(sum(blocks for size, blocks in self.timer.lines.values()), 200)
+        del kept
+
+    def test_garbage_collections(self):
+        with self.timer.phase('fast_forward'):
+            gc.collect()
+        self.assertEqual(self.timer.gc_collections[2], 1)
+        self.assertGreater(self.timer.gc_seconds, 0.0)
+        response = self.timer.finish(HttpResponse())
+        self.assertIn('gc;dur=', response['Server-Timing'])
+        # collections after the request aren't counted
+        gc.collect()
+        self.assertEqual(self.timer.gc_collections[2], 1)
+
+    def test_profile(self):
+        with self.timer.phase('client_state'):
+            kept = make_strings(10)
+        self.timer.finish(HttpResponse())
+        snapshot = self.profile.snapshot()
+        self.assertEqual(snapshot['requests'], 1)
+        self.assertGreaterEqual(snapshot['phases']['client_state']['blocks'], 10)
+        self.assertTrue(snapshot['lines'])
+        self.profile.reset()
+        self.assertEqual(self.profile.snapshot()['requests'], 0)
+        del kept
+
+    def test_budget(self):
+        result = measure_allocations(lambda: make_strings(1000), calls=3)
+        self.assertGreater(result.peak_bytes, 1000 * 50)
+        result.check(max_bytes=result.peak_bytes, max_blocks=result.blocks)
+        with self.assertRaises(AllocationBudgetExceeded):
+            result.check(max_bytes=1000)
+        with self.assertRaises(AllocationBudgetExceeded):
+            result.check(max_blocks=result.blocks - 1)
+
+    def test_leaks_are_counted(self):
+        kept = []
+        result = measure_allocations(lambda: make_strings(100), calls=5)
+        leaking = measure_allocations(lambda: kept.append(make_strings(100)), calls=5)
+        self.assertGreaterEqual(leaking.blocks - result.blocks, 500)
+
+
+class GCTimerTest(TestCase):
+    def test_garbage_collections(self):
+        allocation_profile = AllocationProfile()
+        timer = GCTimer(profile=allocation_profile)
+        with timer.phase('fast_forward'):
+            gc.collect()
+        response = timer.finish(HttpResponse())
+        self.assertIn('gc;dur=', response['Server-Timing'])
+        self.assertEqual(allocation_profile.snapshot()['gc']['collections'][2], 1)
+        self.assertEqual(allocation_profile.snapshot()['phases'], {})
+
+
+@skipIf(tracemalloc is None, "tracemalloc needs Python 3.4 or later")
+class AllocationRequestTest(TestCase):
+    def setUp(self):
+        if not tracemalloc.is_tracing():
+            self.addCleanup(tracemalloc.stop)
+        self.user = UserFactory.create()
+        ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name='Test Game')
+        registry.clear()
+        profile.reset()
+
+    # without the model listener, whose own connection can't see this test's uncommitted game
+    @override_settings(CLICKER_TIMING=True, CLICKER_PHASE_TIMER='clicker_game.allocations.AllocationTimer',
+                       CLICKER_MODEL_LISTENER=False)
+    def test_profiled_request(self):
+        c = Client()
+        c.force_login(self.user)
+        c.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        profile.reset()
+        response = c.post('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn('gc;dur=', response['Server-Timing'])
+        snapshot = profile.snapshot()
+        self.assertEqual(snapshot['requests'], 1)
+        self.assertIn('client_state', snapshot['phases'])
+
+        self.user.is_staff = True
+        self.user.save()
+        response = c.get('/debug/allocations/')
+        self.assertEqual(response.json()['requests'], 1)
+
+    def test_dump_is_for_staff(self):
+        c = Client()
+        c.force_login(self.user)
+        self.assertEqual(c.get('/debug/allocations/').status_code, 302)
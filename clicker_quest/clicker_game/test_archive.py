@@ -0,0 +1,81 @@
+# coding=utf-8
+from datetime import timedelta
+
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from clicker_game.archive import archive_game_instance, archive_saturated, archived_user_games, restore_user_game
+from clicker_game.models import ArchivedGameInstance, ClickerGame, GameInstance
+from clicker_game.registry import registry
+from clicker_game.routers import ReplicaMiddleware
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+STATE = {'resources': {'quests': 5}, 'buildings': {'Quest Maker': 1}, 'upgrades': []}
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.game = ClickerGame.objects.create(owner=UserFactory.create(), game_data=TEST_GAME, name="Quest Clicker")
+        registry.clear()
+        self.user = UserFactory.create()
+
+    def play(self, user, days_ago):
+        instance = GameInstance.objects.create(user=user, game=self.game, data=STATE)
+        GameInstance.objects.filter(pk=instance.pk).update(modified=self.now - timedelta(days=days_ago))
+        return GameInstance.objects.get(pk=instance.pk)
+
+    def final_state(self, instance):
+        model = registry.get().model
+        return model.load_game_instance(instance.data, instance.modified).get_current_state(self.now)[0]
+
+    def test_only_saturated_games_are_archived(self):
+        away = self.play(self.user, 8)
+        playing = self.play(UserFactory.create(), 6)
+        self.assertEqual(archive_saturated(self.now, dry_run=True), 1)
+        self.assertEqual(archive_saturated(self.now), 1)
+        self.assertFalse(GameInstance.objects.filter(pk=away.pk).exists())
+        self.assertTrue(GameInstance.objects.filter(pk=playing.pk).exists())
+        self.assertEqual(archived_user_games(self.user.pk).count(), 1)
+        self.assertEqual(archive_saturated(self.now), 0)
+
+    @override_settings(CLICKER_REPLICAS=['no_such_replica'])
+    def test_scanned_on_the_primary(self):
+        self.play(self.user, 8)
+        # as in a process that hasn't written anything, whose reads would go to the replica
+        middleware = ReplicaMiddleware()
+        middleware.process_request(RequestFactory().get('/'))
+        try:
+            self.assertEqual(archive_saturated(self.now, dry_run=True), 1)
+        finally:
+            middleware.process_response(None, HttpResponse())
+
+    def test_deleted_game_is_skipped(self):
+        self.play(self.user, 8)
+        deleted = ClickerGame(pk=self.game.pk + 1)
+        self.assertEqual(archive_saturated(self.now, game=deleted), 0)
+
+    def test_not_archived_if_played_meanwhile(self):
+        found = self.play(self.user, 8)
+        GameInstance.objects.filter(pk=found.pk).update(modified=self.now)
+        self.assertFalse(archive_game_instance(found, self.now))
+        self.assertFalse(ArchivedGameInstance.objects.exists())
+
+    def test_restored_on_return(self):
+        instance = self.play(self.user, 30)
+        final = self.final_state(instance)
+        archive_saturated(self.now)
+        c = Client()
+        c.force_login(self.user)
+        response = c.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        restored = GameInstance.objects.get(user=self.user)
+        self.assertEqual(restored.data['resources'], final['resources'])
+        self.assertEqual(restored.created, instance.created)
+        self.assertGreaterEqual(restored.modified, self.now)
+        self.assertFalse(archived_user_games(self.user.pk).exists())
+
+    def test_restore_without_archive(self):
+        self.assertFalse(restore_user_game(self.user.pk, self.game.pk))
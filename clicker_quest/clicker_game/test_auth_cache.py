@@ -0,0 +1,110 @@
+# coding=utf-8
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from clicker_game.auth_cache import KEY_PREFIX, pack_user
+from clicker_game.models import ClickerGame
+from clicker_game.registry import registry
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(
+    CACHES=CACHES,
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    CLICKER_AUTH_CACHE='default',
+)
+class CachedAuthenticationTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.user = UserFactory.create()
+        self.user.set_password('a password')
+        self.user.save()
+        ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Quest Clicker")
+        registry.clear()
+        registry.get()
+        self.client = Client()
+        self.client.login(username=self.user.username, password='a password')
+
+    def assertQueries(self, number, request):
+        # leaving out the savepoints of transactions, and the advisory lock that queues a
+        # player's actions on Postgres
+        with CaptureQueriesContext(connection) as context:
+            response = request()
+        queries = [query['sql'] for query in context.captured_queries
+                   if 'SAVEPOINT' not in query['sql'] and 'pg_advisory' not in query['sql']]
+        self.assertEqual(len(queries), number, queries)
+        return response
+
+    def get(self):
+        return self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def buy(self):
+        return self.client.post(
+            '/', {'clicked': 'building', 'name': 'Quest Maker', 'number_purchased': 1},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def test_game_requests_only_query_the_game(self):
+        self.get()
+        # a poll reads the game, and a purchase reads and saves it
+        self.assertTrue(self.assertQueries(1, self.get).wsgi_request.user.is_authenticated())
+        self.assertEqual(self.assertQueries(2, self.buy).status_code, 200)
+
+    def test_saving_the_user_forgets_them(self):
+        self.get()
+        self.assertIsNotNone(caches['default'].get(KEY_PREFIX + str(self.user.pk)))
+        self.user.first_name = "Changed"
+        self.user.save()
+        self.assertIsNone(caches['default'].get(KEY_PREFIX + str(self.user.pk)))
+        self.assertEqual(self.get().wsgi_request.user.first_name, "Changed")
+
+    def test_password_change_ends_sessions(self):
+        self.get()
+        self.user.set_password('another password')
+        self.user.save()
+        self.assertFalse(self.get().wsgi_request.user.is_authenticated())
+
+    def test_stale_user_is_checked_against_the_session(self):
+        self.get()
+        # as if the password were changed in a process whose cache this one doesn't share
+        user = type(self.user).objects.get(pk=self.user.pk)
+        user.set_password('another password')
+        caches['default'].set(KEY_PREFIX + str(self.user.pk), pack_user(user))
+        self.assertFalse(self.get().wsgi_request.user.is_authenticated())
+
+    def test_password_is_not_cached(self):
+        self.get()
+        self.assertNotIn(self.user.password, caches['default'].get(KEY_PREFIX + str(self.user.pk)))
+        user = self.get().wsgi_request.user
+        with self.assertNumQueries(1):
+            self.assertEqual(user.password, self.user.password)
+
+    def test_saving_a_cached_user(self):
+        self.get()
+        user = self.get().wsgi_request.user
+        user.first_name = "Changed"
+        user.save()
+        self.assertIsNone(caches['default'].get(KEY_PREFIX + str(self.user.pk)))
+        self.assertTrue(type(self.user).objects.get(pk=self.user.pk).check_password('a password'))
+
+    def test_logout_forgets_the_user(self):
+        self.get()
+        self.client.get('/logout/')
+        self.assertIsNone(caches['default'].get(KEY_PREFIX + str(self.user.pk)))
+        self.assertFalse(self.get().wsgi_request.user.is_authenticated())
+
+    def test_outdated_entries_are_ignored(self):
+        self.get()
+        caches['default'].set(KEY_PREFIX + str(self.user.pk), ('default', self.user.pk))
+        self.assertEqual(self.get().wsgi_request.user, self.user)
+
+    @override_settings(CLICKER_AUTH_CACHE=None, SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_without_cache(self):
+        self.get()
+        # the session, the user, and the game
+        self.assertTrue(self.assertQueries(3, self.get).wsgi_request.user.is_authenticated())
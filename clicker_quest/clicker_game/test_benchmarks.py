@@ -0,0 +1,34 @@
+# coding=utf-8
+import json
+from unittest import skipIf
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from clicker_game.allocations import tracemalloc
+from clicker_game.benchmarks import BENCHMARKS, check_budget, example_game_data, measure_benchmark, run_benchmark
+
+
+class BenchmarkTest(TestCase):
+    def test_every_benchmark_runs(self):
+        json_data = example_game_data()
+        for name in BENCHMARKS:
+            result = run_benchmark(name, json_data, min_seconds=0.0, repeat=1)
+            self.assertEqual(result.calls, 1)
+            self.assertGreater(result.seconds, 0.0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('benchmark', 'clicks.try_click', min_seconds=0.001, repeat=1, json=True, stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual([result['name'] for result in results], ['clicks.try_click'])
+
+    @skipIf(tracemalloc is None, "tracemalloc needs Python 3.4 or later")
+    def test_allocation_budgets(self):
+        if not tracemalloc.is_tracing():
+            self.addCleanup(tracemalloc.stop)
+        json_data = example_game_data()
+        budgeted = [name for name, setup in BENCHMARKS.items() if setup.max_bytes is not None]
+        self.assertIn('clicks.try_click', budgeted)
+        for name in budgeted:
+            check_budget(name, measure_benchmark(name, json_data))
@@ -0,0 +1,170 @@
+# coding=utf-8
+import json
+import math
+from datetime import datetime, timedelta
+from django.test import TestCase
+
+from clicker_game.bignum import BigNumber, add, from_json, multiply, power, to_json
+from clicker_game.encoding import FragmentEncoder, StandardEncoder
+from clicker_game.game_model import validate_game_model
+
+
+class BigNumberTest(TestCase):
+    def assertClose(self, big, value, places=12):
+        # with the mantissa kept normalized by every operation
+        self.assertTrue(0.5 <= abs(big.mantissa) < 1.0, big)
+        self.assertAlmostEqual(float(big) / value, 1.0, places=places)
+
+    def assertCloseLog(self, big, log10, places=12):
+        self.assertAlmostEqual(big.log10(), log10, places=places)
+
+    def test_matches_floats(self):
+        values = [3.5, -2.25, 1e-300, 7.0, 1e200, -1e150, 0.1]
+        for a in values:
+            for b in values:
+                if a + b:
+                    self.assertClose(BigNumber(a) + BigNumber(b), a + b)
+                    self.assertClose(BigNumber(a) + b, a + b)
+                    self.assertClose(a + BigNumber(b), a + b)
+                if a - b:
+                    self.assertClose(BigNumber(a) - BigNumber(b), a - b)
+                    self.assertClose(BigNumber(a) - b, a - b)
+                    self.assertClose(a - BigNumber(b), a - b)
+                if 1e-300 < abs(a * b) < 1e300:
+                    self.assertClose(BigNumber(a) * b, a * b)
+                    self.assertClose(BigNumber(a) * BigNumber(b), a * b)
+                if 1e-300 < abs(a / b) < 1e300:
+                    self.assertClose(a / BigNumber(b), a / b)
+                self.assertEqual(BigNumber(a) < b, a < b)
+                self.assertEqual(a <= BigNumber(b), a <= b)
+                self.assertEqual(BigNumber(a) == BigNumber(b), a == b)
+        self.assertEqual(BigNumber(5.0) - 5.0, 0.0)
+        self.assertFalse(BigNumber(0.0))
+
+    def test_beyond_floats(self):
+        big = BigNumber(1e300) * 1e300
+        self.assertTrue(str(big).startswith("1.0000000000000"))
+        self.assertTrue(str(big).endswith("e600"))
+        self.assertEqual(float(big), float('inf'))
+        self.assertAlmostEqual(big.log10(), 600.0)
+        self.assertGreater(big, 1e308)
+        self.assertLess(big, float('inf'))
+        self.assertGreater(big, -float('inf'))
+        self.assertClose(big / 1e300, 1e300)
+        self.assertEqual(big - big, 0.0)
+        self.assertEqual(big + 1.0, big)
+        self.assertEqual(max(0.0, min(big, float('inf'))), big)
+        self.assertAlmostEqual((big ** 0.5).log10(), 300.0)
+        self.assertGreater(-big, float('-inf'))
+        self.assertLess(-big, -1e308)
+
+    def test_string_round_trip(self):
+        for text in ("1.5e512", "-4e1000", "9.99e308", "1e-400"):
+            self.assertEqual(str(BigNumber.parse(text)), text)
+        number = BigNumber(1.0 / 3.0) * 1e300 * 1e300
+        self.assertEqual(BigNumber.parse(str(number)), number)
+        with self.assertRaises(ValueError):
+            BigNumber.parse("lots")
+
+    def test_power(self):
+        self.assertEqual(power(1.15, 10), 1.15 ** 10)
+        self.assertIsInstance(power(1.15, 10), float)
+        self.assertAlmostEqual(power(1.15, 6000).log10(), 6000 * math.log10(1.15), places=9)
+        self.assertAlmostEqual(power(2, 2000).log2(), 2000)
+
+    def test_add(self):
+        self.assertEqual(add(1.0, 2.0), 3.0)
+        self.assertAlmostEqual(add(1e308, 1e308).log10(), math.log10(2) + 308)
+        self.assertEqual(add(float('inf'), 1.0), float('inf'))
+        # back to a float once it fits in one
+        self.assertIs(type(add(BigNumber(1e308) * 10.0, -9e308)), float)
+
+    def test_multiply(self):
+        self.assertEqual(multiply(15.0, 2.0), 30.0)
+        self.assertAlmostEqual(multiply(15.0, 1.7e308).log10(), math.log10(15 * 1.7) + 308)
+        self.assertEqual(multiply(float('inf'), 2.0), float('inf'))
+        self.assertEqual(multiply(BigNumber(1e300) * 1e10, 1e-10), 1e300)
+
+    def test_json(self):
+        self.assertEqual(to_json(BigNumber(2.5)), 2.5)
+        self.assertEqual(to_json(BigNumber.parse("4e600")), "4e600")
+        self.assertEqual(to_json(3), 3)
+        self.assertAlmostEqual(from_json("1e600").log10(), 600.0)
+        self.assertEqual(from_json(2.5), 2.5)
+
+
+class LateGameTest(TestCase):
+    def setUp(self):
+        self.model = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "cookies"}],
+            'buildings': [{
+                'name': "farm",
+                'cost': {"cookies": 10.0},
+                'cost_factor': 1.15,
+                'income': {"cookies": 1.0},
+            }],
+            'upgrades': [],
+            'new_game': {},
+        })
+        self.time = datetime(2000, 1, 1)
+
+    def test_costs_beyond_floats(self):
+        instance = self.model.load_game_instance(
+            {'resources': {"cookies": "1e400"}, 'buildings': {"farm": 6000}}, self.time
+        )
+        save, client = instance.purchase_building(self.time + timedelta(seconds=1), "farm", 1)
+        # 10 * 1.15 ** 6000 is about 3.9e365
+        self.assertEqual(save['buildings'], {"farm": 6001})
+        remaining = BigNumber.parse(save['resources']["cookies"])
+        self.assertAlmostEqual(remaining.log10(), 400.0)
+        self.assertIsInstance(client['buildings'][0]['cost']["cookies"], BigNumber)
+        for encoder in (FragmentEncoder(), StandardEncoder()):
+            encoded = json.loads(encoder.encode(self.model, client).decode('utf-8'))
+            self.assertTrue(encoded['buildings'][0]['cost']["cookies"].endswith("e365"))
+
+    def test_unaffordable_big_cost(self):
+        instance = self.model.load_game_instance(
+            {'resources': {"cookies": 1e300}, 'buildings': {"farm": 6000}}, self.time
+        )
+        save, client = instance.purchase_building(self.time, "farm", 1)
+        self.assertEqual(save, {'resources': {"cookies": 1e300}, 'buildings': {"farm": 6000}})
+
+    def test_costs_overflowing_floats_one_step_at_a_time(self):
+        # 15 * 1.15 ** n overflows a float from about 5052 Cursors on, before 1.15 ** n does
+        model = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "cookies"}],
+            'buildings': [{'name': "Cursor", 'cost': {"cookies": 15.0}, 'cost_factor': 1.15}],
+            'upgrades': [],
+            'new_game': {},
+        })
+        for owned in range(5040, 5080, 5):
+            instance = model.load_game_instance({'buildings': {"Cursor": owned}}, self.time)
+            instance.calculate_values()
+            for number in (1, 10):
+                cost = instance.cost_of_building("Cursor", number)["cookies"]
+                self.assertAlmostEqual(
+                    BigNumber(cost).log10(),
+                    math.log10(sum(15.0 * 1.15 ** (n - owned) for n in range(owned, owned + number))) +
+                    owned * math.log10(1.15),
+                    places=9
+                )
+            client = instance.get_current_state(self.time)[1]
+            for encoder in (FragmentEncoder(), StandardEncoder()):
+                text = encoder.encode(model, client).decode('utf-8')
+                self.assertNotIn('Infinity', text)
+                json.loads(text)
+
+    def test_resources_grow_past_floats(self):
+        instance = self.model.load_game_instance(
+            {'resources': {"cookies": 1.7e308}, 'buildings': {"farm": 1}}, self.time
+        )
+        instance.calculate_values()
+        instance.acquire_income("cookies", 1e306)
+        instance.advance(100.0)
+        self.assertIsInstance(instance.resources["cookies"].owned, BigNumber)
+        self.assertAlmostEqual(instance.resources["cookies"].owned.log10(), math.log10(2.7) + 308)
+        self.assertEqual(instance.save_state_json()['resources']["cookies"], "2.7e308")
@@ -0,0 +1,159 @@
+# coding=utf-8
+import datetime
+import threading
+import time
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+
+from clicker_game import views
+from clicker_game.coalescing import SingleFlight, instance_lock
+from clicker_game.models import ClickerGame, GameInstance
+from clicker_game.registry import registry
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+class SingleFlightTest(TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.executions = []
+        self.release = threading.Event()
+
+    def execute(self, close_batch):
+        # hold the batch open until the test has queued everything
+        self.release.wait(5)
+        actions = close_batch()
+        self.executions.append(actions)
+        return [action() for action in actions]
+
+    def wait_for_queue(self, key, length):
+        for _ in range(500):
+            batch = self.flight._open.get(key)
+            if batch is not None and len(batch.actions) == length:
+                return
+            time.sleep(0.01)
+        self.fail("actions were never queued")
+
+    def test_single_caller(self):
+        self.release.set()
+        self.assertEqual(self.flight.run('key', lambda: 1, self.execute), [1])
+        self.assertEqual(self.flight._open, {})
+        self.assertEqual(self.flight._running, {})
+
+    def test_concurrent_callers_share_one_execution(self):
+        results = {}
+
+        def call(n):
+            results[n] = self.flight.run('key', lambda: n, self.execute)
+
+        threads = [threading.Thread(target=call, args=(0,))]
+        threads[0].start()
+        self.wait_for_queue('key', 1)
+        for n in range(1, 4):
+            threads.append(threading.Thread(target=call, args=(n,)))
+            threads[-1].start()
+            self.wait_for_queue('key', n + 1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.executions), 1)
+        self.assertEqual(results, {n: [0, 1, 2, 3] for n in range(4)})
+
+    def test_keys_are_separate(self):
+        self.release.set()
+        self.flight.run('a', lambda: 1, self.execute)
+        self.flight.run('b', lambda: 2, self.execute)
+        self.assertEqual(len(self.executions), 2)
+
+    def test_next_batch_waits_for_previous(self):
+        order = []
+        closed = threading.Event()
+
+        def slow(close_batch):
+            close_batch()
+            closed.set()
+            time.sleep(0.05)
+            order.append('first')
+
+        def fast(close_batch):
+            close_batch()
+            order.append('second')
+
+        first = threading.Thread(target=self.flight.run, args=('key', None, slow))
+        first.start()
+        closed.wait(5)
+        self.flight.run('key', None, fast)
+        first.join()
+        self.assertEqual(order, ['first', 'second'])
+
+    def test_error_reaches_every_caller(self):
+        errors = []
+
+        def fail(close_batch):
+            self.release.wait(5)
+            close_batch()
+            raise ValueError("no")
+
+        def call():
+            try:
+                self.flight.run('key', None, fail)
+            except ValueError as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=call) for _ in range(2)]
+        threads[0].start()
+        self.wait_for_queue('key', 1)
+        threads[1].start()
+        self.wait_for_queue('key', 2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(self.flight._open, {})
+        self.assertEqual(self.flight._running, {})
+
+    @override_settings(CLICKER_SINGLE_FLIGHT=False)
+    def test_off(self):
+        self.release.set()
+        self.assertEqual(self.flight.run('key', lambda: 1, self.execute), [1])
+        self.assertEqual(self.flight._running, {})
+
+
+class InstanceLockTest(TestCase):
+    def test_runs_in_a_transaction(self):
+        with instance_lock(1, 2):
+            self.assertTrue(connection.in_atomic_block)
+
+
+class RecordingFlight(SingleFlight):
+    def __init__(self):
+        super(RecordingFlight, self).__init__()
+        self.keys = []
+
+    def run(self, key, action, execute):
+        self.keys.append(key)
+        return super(RecordingFlight, self).run(key, action, execute)
+
+
+class PageLoadTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.game = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Quest Clicker")
+        registry.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.addCleanup(setattr, views, 'single_flight', views.single_flight)
+        self.flight = views.single_flight = RecordingFlight()
+
+    def test_saved_like_a_post(self):
+        # a page load saves the game, so it queues behind any post for it rather than racing it
+        self.assertEqual(self.client.get('/').status_code, 200)
+        self.assertEqual(self.flight.keys, [(self.user.pk, self.game.pk)])
+        self.assertTrue(GameInstance.objects.filter(user=self.user).exists())
+
+    def test_poll_that_saves(self):
+        GameInstance.objects.create(user=self.user, game=self.game, data=self.game.game_data['new_game'])
+        GameInstance.objects.update(modified=self.game.modified - datetime.timedelta(days=1))
+        self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(self.flight.keys, [(self.user.pk, self.game.pk)])
+        self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(len(self.flight.keys), 1)  # just saved, so only read
@@ -0,0 +1,148 @@
+# coding=utf-8
+import math
+from datetime import datetime, timedelta
+from unittest import skipIf
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from clicker_game import decay
+from clicker_game.decay import (
+    DEFAULT_DECAY,
+    ExponentialDecay,
+    LinearDecay,
+    PiecewiseLinearDecay,
+    StepDecay,
+    TableDecay,
+    decay_curve,
+)
+from clicker_game.game_model import validate_game_model
+
+
+def integrate(curve, seconds, steps=20000):
+    """Numerically integrate a curve's speed, measured as differences of effective_seconds"""
+    width = float(seconds) / steps
+    return sum(
+        curve.effective_seconds((i + 1) * width) - curve.effective_seconds(i * width)
+        for i in range(steps)
+    )
+
+
+class DecayCurveTest(TestCase):
+    def setUp(self):
+        self.curves = [
+            DEFAULT_DECAY,
+            decay_curve({'type': "exponential", 'full_speed': 100, 'half_life': 50}),
+            decay_curve({'type': "piecewise", 'points': [[0, 1], [100, 1], [200, 0.5], [300, 0.25]]}),
+            decay_curve({'type': "step", 'points': [[0, 1], [100, 0.5], [200, 0]]}),
+            decay_curve({'type': "table", 'interval': 60, 'speeds': [1, 0.75, 0.5, 0.5, 0.1]}),
+        ]
+        self.times = [0, 0.5, 59.9, 60, 100, 150, 199.5, 200, 250, 300, 1000, 86400 * 3, 86400 * 30]
+
+    def test_default_is_linear(self):
+        self.assertIsInstance(DEFAULT_DECAY, LinearDecay)
+        self.assertIs(decay_curve(None), DEFAULT_DECAY)
+        self.assertEqual(decay_curve({'type': "linear"}).decay, DEFAULT_DECAY.decay)
+
+    def test_exponential(self):
+        curve = ExponentialDecay(100.0, 50.0)
+        self.assertEqual(curve.effective_seconds(50), 50)
+        self.assertAlmostEqual(curve.effective_seconds(150), 100 + 50 / math.log(2) / 2)
+        self.assertAlmostEqual(curve.effective_seconds(1e9), 100 + 50 / math.log(2))
+
+    def test_piecewise(self):
+        curve = PiecewiseLinearDecay([0.0, 100.0, 200.0], [1.0, 1.0, 0.5])
+        self.assertEqual(curve.effective_seconds(100), 100)
+        self.assertAlmostEqual(curve.effective_seconds(200), 175)
+        self.assertAlmostEqual(curve.effective_seconds(300), 225)
+
+    def test_step(self):
+        curve = decay_curve({'type': "step", 'points': [[0, 1], [100, 0.5], [200, 0]]})
+        self.assertIsInstance(curve, StepDecay)
+        self.assertAlmostEqual(curve.effective_seconds(150), 125)
+        self.assertAlmostEqual(curve.effective_seconds(10000), 150)
+
+    def test_saturation(self):
+        self.assertEqual(DEFAULT_DECAY.saturation_seconds, 86400 * 7)
+        self.assertIsNone(self.curves[1].saturation_seconds)
+        self.assertIsNone(self.curves[2].saturation_seconds)
+        self.assertEqual(self.curves[3].saturation_seconds, 200)
+        for curve in (DEFAULT_DECAY, self.curves[3]):
+            saturation = curve.saturation_seconds
+            self.assertEqual(curve.effective_seconds(saturation), curve.effective_seconds(saturation * 10))
+            self.assertLess(curve.effective_seconds(saturation * 0.99), curve.effective_seconds(saturation))
+
+    def test_table_matches_piecewise(self):
+        table = TableDecay(60.0, [1.0, 0.75, 0.5, 0.5, 0.1])
+        piecewise = PiecewiseLinearDecay([0.0, 60.0, 120.0, 180.0, 240.0], [1.0, 0.75, 0.5, 0.5, 0.1])
+        for seconds in self.times:
+            self.assertAlmostEqual(table.effective_seconds(seconds), piecewise.effective_seconds(seconds))
+
+    def test_closed_forms_integrate(self):
+        for curve in self.curves:
+            self.assertAlmostEqual(integrate(curve, 400), curve.effective_seconds(400), places=6)
+
+    def test_never_faster_than_real_time(self):
+        for curve in self.curves:
+            previous = 0.0
+            for seconds in self.times:
+                effective = curve.effective_seconds(seconds)
+                self.assertLessEqual(effective, seconds + 1e-9)
+                self.assertGreaterEqual(effective, previous - 1e-9)
+                previous = effective
+            self.assertEqual(curve.effective_seconds(-5), 0)
+
+    @skipIf(decay.numpy is None, "numpy is not installed")
+    def test_vectorized_matches_scalar(self):
+        for curve in self.curves:
+            many = curve.effective_seconds_many(self.times + [-5])
+            self.assertEqual(len(many), len(self.times) + 1)
+            for seconds, effective in zip(self.times + [-5], many):
+                self.assertAlmostEqual(effective, curve.effective_seconds(seconds))
+
+    def test_invalid_curves(self):
+        for data in (
+            "linear",
+            {'type': "nonexistent"},
+            {'type': "linear", 'decay': -1},
+            {'type': "exponential", 'full_speed': 100},
+            {'type': "piecewise", 'points': []},
+            {'type': "piecewise", 'points': [[10, 1]]},
+            {'type': "piecewise", 'points': [[0, 1], [0, 0.5]]},
+            {'type': "step", 'points': [[0, 2]]},
+            {'type': "table", 'interval': 0, 'speeds': [1]},
+            {'type': "table", 'interval': 60, 'speeds': ["fast"]},
+        ):
+            with self.assertRaises(ValidationError):
+                decay_curve(data)
+
+
+class GameDecayTest(TestCase):
+    def game_data(self, **extra):
+        data = {
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "minerals"}],
+            'buildings': [],
+            'upgrades': [],
+            'new_game': {'resources': {"minerals": 0.0}},
+        }
+        data.update(extra)
+        return data
+
+    def test_game_curve_used_for_fast_forward(self):
+        model = validate_game_model(self.game_data(
+            buildings=[{'name': "miner", 'cost': {"minerals": 1}, 'cost_factor': 1.1, 'income': {"minerals": 2.0}}],
+            new_game={'buildings': {"miner": 1}},
+            decay={'type': "step", 'points': [[0, 1], [100, 0]]},
+        ))
+        time = datetime(2000, 1, 1)
+        instance = model.load_game_instance(model.new_game, time)
+        save, client = instance.get_current_state(time + timedelta(days=30))
+        self.assertEqual(save['resources'], {"minerals": 200.0})
+
+    def test_invalid_curve_fails_validation(self):
+        with self.assertRaises(ValidationError):
+            validate_game_model(self.game_data(decay={'type': "nonexistent"}))
+
+    def test_default_curve(self):
+        self.assertIs(validate_game_model(self.game_data()).decay, DEFAULT_DECAY)
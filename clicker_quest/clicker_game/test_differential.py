@@ -0,0 +1,71 @@
+# coding=utf-8
+import json
+import random
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from clicker_game.bignum import BigNumber
+from clicker_game.decay import LinearDecay
+from clicker_game.differential import (
+    ENGINES, engine_difference, first_difference, random_actions, random_model, run_differential, run_sequence)
+from clicker_game.game_model import GameModel, validate_game_model
+
+
+def no_decay_engine(json_data):
+    """An engine with a bug: games never slow down while nobody plays them"""
+    model = GameModel(json_data)
+    model.decay = LinearDecay(full_speed=1e12)
+    return model
+
+
+class DifferentialTest(TestCase):
+    def setUp(self):
+        ENGINES['no decay'] = no_decay_engine
+        self.addCleanup(ENGINES.pop, 'no decay')
+
+    def test_engines_agree(self):
+        report = run_differential(cases=10, actions=20, seed='test', engines=['game_model'])
+        self.assertEqual(report.failures, [])
+        self.assertEqual(list(report.seconds), ['reference', 'game_model'])
+        self.assertGreater(report.speedup('game_model'), 0.0)
+
+    def test_random_cases(self):
+        rng = random.Random(1)
+        for _ in range(20):
+            json_data = random_model(rng)
+            validate_game_model(json_data)
+            actions = random_actions(rng, json_data, 10)
+            self.assertEqual(len(actions), 10)
+            self.assertEqual(len(run_sequence('reference', json_data, actions)), 10)
+
+    def test_tolerance(self):
+        self.assertIsNone(first_difference({'a': [1.0, "x"]}, {'a': [1.0 + 1e-12, "x"]}))
+        self.assertEqual(first_difference({'a': [1.0]}, {'a': [1.1]}), (('a', 0), 1.0, 1.1))
+        self.assertIsNone(first_difference({'a': 1e-15}, {}))
+        self.assertIsNone(first_difference(["u1", "u0"], ["u0", "u1"]))
+        self.assertIsNone(first_difference("1.5e400", BigNumber.parse("1.5e400") * (1 + 1e-12)))
+        self.assertIsNotNone(first_difference("1.5e400", "1.5e401"))
+
+    def test_failures_are_shrunk(self):
+        report = run_differential(cases=5, actions=30, seed='test', engines=['no decay'])
+        failure, = report.failures
+        self.assertEqual(failure.engine_name, 'no decay')
+        self.assertLess(len(failure.actions), 30)
+        # the shrunk case still fails, and needs a wait for the decay to make a difference
+        self.assertIsNotNone(engine_difference('no decay', failure.json_data, failure.actions))
+        self.assertGreater(max(action[1] for action in failure.actions), 0.0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('difftest', cases=2, actions=5, engines=['game_model'], stdout=out)
+        self.assertIn("game_model", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('difftest', cases=5, actions=30, seed='test', engines=['no decay'], stdout=StringIO())
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('difftest', cases=5, actions=30, seed='test', engines=['no decay'], json=True,
+                         no_shrink=True, stdout=out)
+        failure, = json.loads(out.getvalue())['failures']
+        self.assertEqual(len(failure['actions']), 30)
@@ -0,0 +1,230 @@
+# coding=utf-8
+from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from clicker_game.game_model import validate_game_model
+
+
+def game_model(upgrades=(), building_effects=None, resources=None):
+    json_data = {
+        'name': "game",
+        'description': "a game",
+        'resources': resources or [{'name': "cookies"}, {'name': "gold"}],
+        'buildings': [
+            {'name': "cursor", 'cost': {"cookies": 10.0}, 'cost_factor': 1.0, 'income': {"cookies": 1.0}},
+            {'name': "mine", 'cost': {"cookies": 100.0}, 'cost_factor': 1.0, 'income': {"gold": 2.0}},
+            {'name': "farm", 'cost': {"cookies": 50.0, "gold": 5.0}, 'cost_factor': 1.0, 'income': {"cookies": 4.0}},
+        ],
+        'upgrades': [{'name': "nothing", 'cost': {"cookies": 1000.0}}] + list(upgrades),
+        'new_game': {},
+    }
+    if building_effects:
+        json_data['buildings'][2]['effects'] = building_effects
+    return validate_game_model(json_data)
+
+
+def upgrade(name, **effects):
+    result = {'name': name, 'cost': {"cookies": 1.0}}
+    result.update(effects)
+    return result
+
+
+TIME = datetime(2000, 1, 1)
+
+
+class EffectStagesTest(TestCase):
+    def instance(self, model, upgrades, buildings=None):
+        instance = model.load_game_instance({
+            'buildings': buildings or {"cursor": 1, "mine": 1, "farm": 1},
+            'upgrades': upgrades,
+        }, TIME)
+        instance.calculate_values()
+        return instance
+
+    def test_stages(self):
+        model = game_model([
+            upgrade("more", buildings={"cursor": {'income': {"cookies": {'add': 2.0}}}}),
+            upgrade("common a", buildings={"cursor": {'income': {"cookies": {'add_multiplier': 0.5}}}}),
+            upgrade("common b", buildings={"cursor": {'income': {"cookies": {'add_multiplier': 0.5}}}}),
+            upgrade("double a", buildings={"cursor": {'income': {"cookies": {'multiplier': 2.0}}}}),
+            upgrade("double b", buildings={"cursor": {'income': {"cookies": {'multiplier': 2.0}}}}),
+        ])
+        self.assertEqual(self.instance(model, []).buildings["cursor"].income, {"cookies": 1.0})
+        self.assertEqual(self.instance(model, ["more"]).buildings["cursor"].income, {"cookies": 3.0})
+        self.assertEqual(
+            self.instance(model, ["common a", "common b"]).buildings["cursor"].income, {"cookies": 2.0}
+        )
+        self.assertEqual(
+            self.instance(model, ["double a", "double b"]).buildings["cursor"].income, {"cookies": 4.0}
+        )
+        instance = self.instance(model, ["more", "common a", "common b", "double a", "double b"])
+        self.assertEqual(instance.buildings["cursor"].income, {"cookies": (1.0 + 2.0) * 2.0 * 4.0})
+        self.assertEqual(instance.resources["cookies"].income, 24.0 + 4.0)
+
+    def test_add_new_value(self):
+        model = game_model([
+            upgrade("gold cursors", buildings={"cursor": {'income': {"gold": {'add': 0.5}}}}),
+        ])
+        instance = self.instance(model, ["gold cursors"])
+        self.assertEqual(instance.buildings["cursor"].income, {"cookies": 1.0, "gold": 0.5})
+        self.assertEqual(instance.resources["gold"].income, 2.5)
+
+    def test_zero_values_are_left_out(self):
+        model = game_model([
+            upgrade("free farms", buildings={"farm": {'cost': {"gold": {'multiplier': 0.0}}}}),
+        ])
+        instance = self.instance(model, ["free farms"])
+        self.assertEqual(instance.cost_of_building("farm"), {"cookies": 50.0})
+
+    def test_unowned_building_cost(self):
+        model = game_model([
+            upgrade("cheap mines", buildings={"mine": {'cost': {"cookies": {'multiplier': 0.5}}}}),
+        ])
+        instance = self.instance(model, ["cheap mines"], {"cursor": 1})
+        self.assertEqual(instance.cost_of_building("mine", 2), {"cookies": 100.0})
+
+    def test_upgrade_cost(self):
+        model = game_model([
+            upgrade("haggling", upgrades={"nothing": {'cost': {"cookies": {'multiplier': 0.1}}}}),
+        ])
+        instance = model.load_game_instance({'resources': {"cookies": 101.0}, 'upgrades': ["haggling"]}, TIME)
+        save, client = instance.purchase_upgrade(TIME, "nothing")
+        self.assertEqual(save['resources'], {"cookies": 1.0})
+        self.assertIn("nothing", save['upgrades'])
+
+    def test_upgrade_cost_sent_to_client(self):
+        model = game_model([
+            upgrade("haggling", upgrades={"nothing": {'cost': {"cookies": {'add': -500.0}}}}),
+        ])
+        save, client = model.load_game_instance({'upgrades': ["haggling"]}, TIME).get_current_state(TIME)
+        costs = {entry['name']: entry['cost'] for entry in client['upgrades']}
+        self.assertEqual(costs["nothing"], {"cookies": 500.0})
+
+    def test_global_income(self):
+        model = game_model([
+            upgrade("cookie boost", **{'global': {'income': {"cookies": {'add_multiplier': 1.0}}}}),
+            upgrade("cursor boost", buildings={"cursor": {'income': {"cookies": {'add_multiplier': 1.0}}}}),
+        ])
+        instance = self.instance(model, ["cookie boost", "cursor boost"])
+        # the common multiplier is shared by global and particular effects
+        self.assertEqual(instance.buildings["cursor"].income, {"cookies": 3.0})
+        self.assertEqual(instance.buildings["farm"].income, {"cookies": 8.0})
+        self.assertEqual(instance.buildings["mine"].income, {"gold": 2.0})
+
+    def test_global_costs(self):
+        model = game_model([
+            upgrade("sale", **{'global': {
+                'building_cost': {"cookies": {'multiplier': 0.5}},
+                'upgrade_cost': {"cookies": {'multiplier': 0.25}},
+            }}),
+        ])
+        instance = self.instance(model, ["sale"])
+        self.assertEqual(instance.cost_of_building("farm"), {"cookies": 25.0, "gold": 5.0})
+        self.assertEqual(instance.cost_of_building("mine"), {"cookies": 50.0})
+        self.assertEqual(instance.cost_of_upgrade("nothing"), {"cookies": 250.0})
+
+    def test_building_effects(self):
+        model = game_model(building_effects={
+            'buildings': {"cursor": {'income': {"cookies": {'add': 0.1}}}},
+            'global': {'income': {"gold": {'multiplier': 1.5}}},
+        })
+        instance = self.instance(model, [], {"cursor": 10, "mine": 1, "farm": 2})
+        self.assertAlmostEqual(instance.buildings["cursor"].income["cookies"], 1.2)
+        self.assertEqual(instance.buildings["mine"].income, {"gold": 2.0 * 1.5 * 1.5})
+        instance.acquire_building("farm", 1)
+        instance.calculate_values()
+        self.assertAlmostEqual(instance.buildings["cursor"].income["cookies"], 1.3)
+        self.assertAlmostEqual(instance.resources["gold"].income, 2.0 * 1.5 ** 3)
+
+    def test_only_changed_values_are_evaluated(self):
+        model = game_model([
+            upgrade("cursor boost", buildings={"cursor": {'income': {"cookies": {'multiplier': 2.0}}}}),
+            upgrade("mine boost", buildings={"mine": {'income': {"gold": {'multiplier': 2.0}}}}),
+        ])
+        instance = self.instance(model, ["cursor boost"])
+        cursor_income = instance.buildings["cursor"].income
+        instance.acquire_upgrade("mine boost")
+        instance.calculate_values()
+        self.assertIs(instance.buildings["cursor"].income, cursor_income)
+        self.assertEqual(instance.buildings["mine"].income, {"gold": 4.0})
+
+    def test_target_without_levels_beside_changed_one(self):
+        # found by the differential tests: the gold cost of the farm is only changed by an unowned
+        # upgrade when the sale changes its cookie cost
+        model = game_model([
+            upgrade("gold rush", buildings={"farm": {'cost': {"gold": {'multiplier': 0.5}}}}),
+            upgrade("sale", **{'global': {'building_cost': {"cookies": {'multiplier': 0.5}}}}),
+        ])
+        instance = self.instance(model, ["sale"])
+        self.assertEqual(instance.cost_of_building("farm"), {"cookies": 25.0, "gold": 5.0})
+
+    def test_instances_share_known_values(self):
+        model = game_model([
+            upgrade("cursor boost", buildings={"cursor": {'income': {"cookies": {'multiplier': 2.0}}}}),
+        ])
+        first = self.instance(model, ["cursor boost"])
+        second = self.instance(model, ["cursor boost"])
+        self.assertIs(first.buildings["cursor"].income, second.buildings["cursor"].income)
+
+    def test_no_effects(self):
+        model = game_model()
+        instance = self.instance(model, [])
+        self.assertEqual(model.effects.no_levels, ())
+        self.assertIs(instance.buildings["cursor"].income, model.buildings["cursor"].income)
+
+
+class EffectValidationTest(TestCase):
+    def dont_validate(self, message, upgrades=(), building_effects=None, resources=None):
+        with self.assertRaises(ValidationError) as context:
+            game_model(upgrades, building_effects, resources)
+        self.assertIn(message, context.exception.args[0])
+
+    def test_valid(self):
+        game_model(
+            [
+                upgrade("a", buildings={"cursor": {'income': {"cookies": {'add': 1, 'add_multiplier': 0.5}}}}),
+                upgrade("b", upgrades={"a": {'cost': {"cookies": {'multiplier': 0.5}}}}),
+                upgrade("c", **{'global': {'upgrade_cost': {"cookies": {'multiplier': 0.9}}}}),
+            ],
+            {'global': {'income': {"cookies": {'add_multiplier': 0.01}}}},
+        )
+
+    def test_nonexistent_upgrade(self):
+        self.dont_validate(
+            "affects nonexistent upgrade",
+            [upgrade("a", upgrades={"b": {'cost': {"cookies": {'multiplier': 0.5}}}})],
+        )
+
+    def test_unknown_upgrade_effect(self):
+        self.dont_validate(
+            "Unknown effect specified",
+            [upgrade("a", upgrades={"nothing": {'income': {"cookies": {'multiplier': 0.5}}}})],
+        )
+
+    def test_unknown_global_group(self):
+        self.dont_validate(
+            "Unknown global effect group",
+            [upgrade("a", **{'global': {'everything': {"cookies": {'multiplier': 0.5}}}})],
+        )
+
+    def test_global_add(self):
+        self.dont_validate(
+            "Global effects cannot add",
+            [upgrade("a", **{'global': {'income': {"cookies": {'add': 1}}}})],
+        )
+
+    def test_storage_of_unlimited_resource(self):
+        self.dont_validate(
+            "affects storage for an unlimited resource",
+            [upgrade("a", buildings={"cursor": {'storage': {"cookies": {'add': 1}}}})],
+        )
+
+    def test_building_effects(self):
+        self.dont_validate(
+            "Building farm affects nonexistent building",
+            building_effects={'buildings': {"barn": {'income': {"cookies": {'add': 1}}}}},
+        )
+
+    def test_unknown_building_effects_key(self):
+        self.dont_validate("Unknown key in effects of building", building_effects={'upgrade': {}})
@@ -0,0 +1,117 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import json
+from datetime import datetime, timedelta
+from django.test import TestCase, override_settings
+
+from clicker_game.encoding import (
+    FragmentEncoder,
+    StandardEncoder,
+    model_fragments,
+    game_response,
+    page_json,
+)
+from clicker_game.game_model import validate_game_model
+
+
+class FragmentEncoderTest(TestCase):
+    def setUp(self):
+        self.model = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [
+                {'name': "minerals", 'description': "rocks \"quoted\" </script>"},
+                {'name': "gås", 'maximum': 100.0},
+            ],
+            'buildings': [
+                {
+                    'name': "miner",
+                    'description': "digs ☃",
+                    'cost': {"minerals": 10.0},
+                    'cost_factor': 1.1,
+                    'income': {"minerals": 5.0},
+                },
+                {
+                    'name': "extractor",
+                    'cost': {"minerals": 50},
+                    'cost_factor': 1.5,
+                    'income': {"gås": 0.1},
+                    'storage': {"gås": 10.0},
+                },
+            ],
+            'upgrades': [
+                {
+                    'name': "better mining",
+                    'description': "mine more",
+                    'cost': {"minerals": 20.0},
+                    'buildings': {"miner": {'income': {"minerals": {'multiplier': 3.0}}}},
+                },
+            ],
+            'new_game': {
+                'resources': {"minerals": 100.0},
+                'buildings': {"miner": 2, "extractor": 1},
+            },
+        })
+        self.time = datetime(2000, 1, 1)
+        instance = self.model.load_game_instance(self.model.new_game, self.time)
+        self.save, self.client = instance.get_current_state(self.time + timedelta(seconds=7))
+
+    def assertEncodesLikeJson(self, client_state):
+        encoded = FragmentEncoder().encode(self.model, client_state)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(json.loads(encoded.decode('utf-8')), client_state)
+        self.assertEqual(
+            json.loads(encoded.decode('utf-8')),
+            json.loads(StandardEncoder().encode(self.model, client_state).decode('utf-8'))
+        )
+
+    def test_client_state(self):
+        self.assertEncodesLikeJson(self.client)
+
+    def test_empty_state(self):
+        self.assertEqual(FragmentEncoder().encode(self.model, {}), b'{}')
+
+    def test_uses_static_fragments(self):
+        fragments = model_fragments(self.model)
+        fragments.buildings["miner"] = '{"name": "miner", "description": "from the fragment", "owned": '
+        encoded = json.loads(FragmentEncoder().encode(self.model, self.client).decode('utf-8'))
+        self.assertEqual(encoded['buildings'][0]['description'], "from the fragment")
+
+    def test_fragments_made_once(self):
+        self.assertIs(model_fragments(self.model), model_fragments(self.model))
+
+    def test_changed_static_values_are_encoded(self):
+        self.client['buildings'][0]['description'] = "changed"
+        self.client['upgrades'][0]['cost'] = {"minerals": 1.0}
+        self.assertEncodesLikeJson(self.client)
+
+    def test_unknown_names_and_keys(self):
+        self.client['buildings'].append({'name': "nonexistent", 'owned': 2, 'extra': [1, None, True]})
+        self.client['something else'] = {"minerals": 1.5, 'other': False}
+        self.assertEncodesLikeJson(self.client)
+
+    def test_owned_upgrade(self):
+        self.client['upgrades'][0]['owned'] = True
+        self.assertEncodesLikeJson(self.client)
+
+    def test_special_floats(self):
+        self.client['resources'][0]['owned'] = float('inf')
+        encoded = FragmentEncoder().encode(self.model, self.client)
+        self.assertIn(b'"owned": Infinity', encoded)
+
+    def test_ascii_output(self):
+        encoded = FragmentEncoder().encode(self.model, self.client)
+        encoded.decode('ascii')
+
+    @override_settings(CLICKER_RESPONSE_ENCODER='clicker_game.encoding.StandardEncoder')
+    def test_pluggable_encoder(self):
+        response = game_response(self.model, self.client)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, StandardEncoder().encode(self.model, self.client))
+
+    def test_page_json(self):
+        encoded = page_json(self.model, self.client)
+        self.assertNotIn('</script>', encoded)
+        self.assertNotIn('<', encoded)
+        self.assertEqual(json.loads(encoded), self.client)
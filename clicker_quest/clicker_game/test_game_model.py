@@ -3,11 +3,10 @@ from datetime import datetime, timedelta
 from django.core.exceptions import ValidationError
 from django.test import TestCase
 
+from clicker_game.decay import DECAY_TIME, FULL_SPEED_TIME
 from clicker_game.game_model import (
     validate_game_model,
     seconds_to_fast_forward,
-    FULL_SPEED_TIME,
-    DECAY_TIME,
 )
 
 
@@ -1264,3 +1263,194 @@ class GameModelTestCase(TestCase):
         )
         # money should not have gone down
         self.assertEqual(current_minerals, self.instance.resources["minerals"].owned)
+
+    def test_advance(self):
+        self.instance.acquire_building("miner", 2)
+        self.instance.calculate_values()
+        self.instance.advance(3.0)
+        self.assertEqual(self.instance.resources["minerals"].owned, 16.0 + 30.0)
+        self.assertEqual(self.instance.time, self.time)
+
+    def test_seconds_until_affordable(self):
+        self.instance.acquire_building("miner", 1)
+        self.instance.calculate_values()
+        self.assertEqual(self.instance.seconds_until_affordable({"minerals": 10.0}), 0.0)
+        self.assertEqual(self.instance.seconds_until_affordable({"minerals": 26.0}), 2.0)
+        # no gas income
+        self.assertEqual(self.instance.seconds_until_affordable({"gas": 1.0}), float('inf'))
+        # more than the storage cap
+        self.instance.acquire_income("gas", 1.0)
+        self.assertEqual(self.instance.seconds_until_affordable({"gas": 50.0}), 50.0)
+        self.assertEqual(self.instance.seconds_until_affordable({"gas": 101.0}), float('inf'))
+
+    def test_try_purchase(self):
+        self.instance.calculate_values()
+        self.assertTrue(self.instance.try_purchase_building("miner", 1))
+        self.assertFalse(self.instance.try_purchase_building("miner", 1))
+        self.assertFalse(self.instance.try_purchase_upgrade("gas extraction"))
+        self.assertEqual(self.instance.resources["minerals"].income, 5.0)
+        self.assertEqual(self.instance.save_state_json(), {
+            'resources': {"minerals": 6.0},
+            'buildings': {"miner": 1},
+        })
+
+    def test_standing_order_bought_when_affordable(self):
+        self.instance.purchase_building(self.time, "miner", 1)
+        save, client = self.instance.place_order(self.time, {'building': "miner", 'up_to': "3"})
+        self.assertEqual(save['orders'], [{'building': "miner", 'up_to': 3}])
+        self.assertEqual(client['orders'], [{'building': "miner", 'up_to': 3}])
+        save, client = self.instance.get_current_state(self.time + timedelta(seconds=100))
+        # 6 minerals left at 5/s: the second miner (11) comes after 1 second, then the third
+        # (12.1) 1.21 seconds later at 10/s, and the rest of the time is at 15/s
+        self.assertEqual(save['buildings'], {"miner": 3})
+        self.assertAlmostEqual(save['resources']["minerals"], 15.0 * (100 - 1 - 1.21))
+        # the order is finished
+        self.assertNotIn('orders', save)
+        self.assertNotIn('orders', client)
+
+    def test_standing_order_waits_for_unlock(self):
+        self.instance.purchase_building(self.time, "miner", 1)
+        self.instance.place_order(self.time, {'upgrade': "gas extraction"})
+        self.instance.place_order(self.time, {'building': "miner", 'up_to': 2})
+        save, client = self.instance.get_current_state(self.time + timedelta(seconds=100))
+        # second miner after 1 second unlocks gas extraction, which costs 60 at 10/s
+        self.assertEqual(save['upgrades'], ["gas extraction"])
+        self.assertAlmostEqual(save['resources']["minerals"], 10.0 * (100 - 1 - 6))
+        self.assertNotIn('orders', save)
+
+    def test_standing_order_affordable_at_once(self):
+        self.instance.place_order(self.time, {'building': "miner", 'up_to': 1})
+        self.assertEqual(self.instance.buildings["miner"].owned, 1)
+        self.assertEqual(self.instance.orders, [])
+
+    def test_standing_orders_survive_save(self):
+        save, client = self.instance.place_order(self.time, {'building': "extractor", 'up_to': 5})
+        instance = self.game.load_game_instance(save, self.time)
+        self.assertEqual(instance.orders, [{'building': "extractor", 'up_to': 5}])
+        save, client = instance.place_order(self.time, {'building': "extractor", 'up_to': 2})
+        self.assertEqual(save['orders'], [{'building': "extractor", 'up_to': 2}])
+        save, client = instance.cancel_order(self.time, {'building': "extractor"})
+        self.assertNotIn('orders', save)
+
+    def test_invalid_standing_orders(self):
+        for order in (
+            {'building': "nonexistent", 'up_to': 2},
+            {'building': "miner"},
+            {'building': "miner", 'up_to': "many"},
+            {'building': "miner", 'up_to': 0},
+            {'upgrade': "nonexistent"},
+            {'something': "else"},
+            "not an order",
+        ):
+            save, client = self.instance.place_order(self.time, order)
+            self.assertNotIn('orders', save)
+
+
+class ClickBatchTestCase(TestCase):
+    def setUp(self):
+        self.game = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "cookies"}],
+            'buildings': [
+                {
+                    'name': "click",
+                    'cost': {"cookies": -1},
+                    'cost_factor': 1,
+                },
+                {
+                    'name': "grandma",
+                    'cost': {"cookies": 10.0},
+                    'cost_factor': 1.1,
+                    'income': {"cookies": 1.0},
+                },
+            ],
+            'upgrades': [
+                {
+                    'name': "double clicks",
+                    'cost': {"cookies": 5.0},
+                    'buildings': {"click": {'cost': {"cookies": {'multiplier': 2.0}}}},
+                },
+            ],
+            'new_game': {'resources': {"cookies": 10.0}},
+        })
+        self.time = datetime(2000, 1, 1)
+        self.instance = self.game.load_game_instance(self.game.new_game, self.time)
+
+    def test_record_clicks(self):
+        save, client = self.instance.record_clicks(self.time + timedelta(seconds=10), "click", 50, 20)
+        self.assertEqual(save, {'resources': {"cookies": 60.0}, 'buildings': {"click": 50}})
+        save, client = self.instance.record_clicks(self.time + timedelta(seconds=20), "click", 50, 20)
+        self.assertEqual(save, {'resources': {"cookies": 110.0}, 'buildings': {"click": 100}})
+
+    def test_click_batch(self):
+        clicks = [("click", 20), ("grandma", 5), ("click", 30)]
+        save, client = self.instance.record_click_batch(self.time + timedelta(seconds=2), clicks, 20)
+        # the batch shares the 40 clicks allowed for the time
+        self.assertEqual(save, {'resources': {"cookies": 50.0}, 'buildings': {"click": 40}})
+
+    def test_clicks_skip_calculating_unchanged_values(self):
+        self.instance.record_clicks(self.time + timedelta(seconds=1), "click", 5, 20)
+        self.assertTrue(self.instance.values_current)
+        calculations = []
+        self.instance.calculate_values = lambda: calculations.append(True)
+        self.instance.record_click_batch(self.time + timedelta(seconds=2), [("click", 5), ("click", 5)], 20)
+        self.assertEqual(calculations, [])
+
+    def test_clicks_limited_by_time_since_saved(self):
+        save, client = self.instance.record_clicks(self.time + timedelta(seconds=1.5), "click", 1000, 20)
+        self.assertEqual(save['buildings'], {"click": 30})
+        self.assertEqual(save['resources'], {"cookies": 40.0})
+
+    def test_clicks_use_upgraded_cost(self):
+        self.instance.purchase_upgrade(self.time, "double clicks")
+        self.instance.try_click("click", 1)
+        self.instance.try_click("click", 10)
+        self.assertEqual(self.instance.resources["cookies"].owned, 5.0 + 22.0)
+        self.assertEqual(self.instance.buildings["click"].owned, 11)
+
+    def test_only_click_buildings_are_clicked(self):
+        self.instance.calculate_values()
+        self.assertFalse(self.instance.try_click("grandma", 5))
+        self.assertFalse(self.instance.try_click("nonexistent", 5))
+        self.assertFalse(self.instance.try_click("click", 0))
+        self.assertFalse(self.instance.try_click("click", -5))
+        self.assertEqual(self.instance.save_state_json(), {'resources': {"cookies": 10.0}})
+
+    def test_clicks_earn_income_from_effects(self):
+        # found by the differential tests, like the next one
+        game = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "cookies"}],
+            'buildings': [
+                {'name': "click", 'cost': {"cookies": -1}, 'cost_factor': 1},
+                {'name': "oven", 'cost': {"cookies": 10.0}, 'cost_factor': 1.1,
+                 'effects': {'buildings': {"click": {'income': {"cookies": {'add': 0.5}}}}}},
+            ],
+            'upgrades': [],
+            'new_game': {'buildings': {"click": 1, "oven": 1}},
+        })
+        instance = game.load_game_instance(game.new_game, self.time)
+        instance.calculate_values()
+        instance.try_click("click", 10)
+        self.assertEqual(instance.resources["cookies"].income, 0.5 * 11)
+
+    def test_clicks_restock_slowed_production(self):
+        game = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "cookies"}, {'name': "crumbs"}],
+            'buildings': [
+                {'name': "click", 'cost': {"cookies": -1}, 'cost_factor': 1},
+                {'name': "grinder", 'cost': {}, 'cost_factor': 1.1, 'income': {"cookies": -1.0, "crumbs": 1.0}},
+            ],
+            'upgrades': [],
+            'new_game': {'buildings': {"click": 1, "grinder": 1}},
+        })
+        instance = game.load_game_instance(game.new_game, self.time)
+        instance.calculate_values()
+        self.assertEqual(instance.speeds, {"grinder": 0.0})
+        instance.try_click("click", 10)
+        self.assertEqual(instance.speeds, {})
+        self.assertEqual(instance.resources["crumbs"].income, 1.0)
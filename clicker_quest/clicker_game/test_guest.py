@@ -0,0 +1,70 @@
+# coding=utf-8
+from django.test import TestCase, Client, override_settings
+
+from clicker_game.guest import cookie_name
+from clicker_game.models import ClickerGame, GameInstance
+from clicker_game.registry import registry
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+class GuestPlayTest(TestCase):
+    def setUp(self):
+        self.owner = UserFactory.create()
+        self.game = ClickerGame.objects.create(owner=self.owner, game_data=TEST_GAME, name="Quest Clicker")
+        registry.clear()
+        registry.get()
+        self.client = Client()
+        self.cookie = cookie_name(self.game.pk)
+
+    def buy(self):
+        return self.client.post(
+            '/', {'clicked': 'building', 'name': 'Quest Maker', 'number_purchased': 1},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+
+    def owned(self, response, name='Quest Maker'):
+        return [building for building in response.json()['buildings'] if building['name'] == name][0]['owned']
+
+    def test_new_guest_game(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertTemplateUsed(response, 'index.html')
+        self.assertIn(self.cookie, response.cookies)
+        self.assertTrue(response.cookies[self.cookie]['httponly'])
+
+    def test_guest_game_carries_on(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.buy()
+        self.assertEqual(self.owned(response), 1)
+        response = self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(self.owned(response), 1)
+        self.assertFalse(GameInstance.objects.exists())
+
+    def test_tampered_cookie_starts_over(self):
+        self.client.get('/')
+        self.buy()
+        value = self.client.cookies[self.cookie].value
+        self.client.cookies[self.cookie] = value[:-1] + ('A' if value[-1] != 'A' else 'B')
+        response = self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(self.owned(response), 0)
+
+    @override_settings(CLICKER_GUEST_PLAY=False)
+    def test_guest_play_off(self):
+        self.assertRedirects(self.client.get('/'), '/accounts/login/', fetch_redirect_response=False)
+        self.assertEqual(self.buy().status_code, 403)
+
+    def test_registration_keeps_guest_game(self):
+        self.client.get('/')
+        self.buy()
+        response = self.client.post('/accounts/register/', {
+            'username': 'guest', 'email': 'guest@example.com',
+            'password1': 'a guest password', 'password2': 'a guest password',
+        })
+        self.assertEqual(response.status_code, 302)
+        instance = GameInstance.objects.get(user__username='guest')
+        self.assertEqual(instance.game_id, self.game.pk)
+        self.assertEqual(instance.data['buildings'], {'Quest Maker': 1})
+        self.assertEqual(response.cookies[self.cookie].value, '')
+        response = self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(self.owned(response), 1)
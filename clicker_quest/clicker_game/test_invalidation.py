@@ -0,0 +1,106 @@
+# coding=utf-8
+import datetime
+import os
+import time
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from clicker_game.invalidation import ModelListener, listener
+from clicker_game.models import ClickerGame, GameInstance
+from clicker_game.registry import registry
+from clicker_game.tests import TEST_GAME, UserFactory
+from clicker_game.views import fetch_game_instance
+
+
+class ModelListenerTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.game = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Quest Clicker")
+        registry.clear()
+        registry.get()
+        self.listener = ModelListener()
+
+    def tearDown(self):
+        listener.connected = False
+        listener._pid = None
+
+    def test_changed_games_are_reloaded(self):
+        # edited without signals, as if by another process
+        ClickerGame.objects.filter(pk=self.game.pk).update(name="Renamed")
+        self.listener.changed({self.game.pk})
+        self.assertEqual(registry.get().game.name, "Renamed")
+
+    def test_deleted_games_are_dropped(self):
+        ClickerGame.objects.filter(pk=self.game.pk).delete()
+        self.listener.changed(set(), {self.game.pk})
+        self.assertEqual(registry.entries(), [])
+
+    def test_missing_games_are_kept(self):
+        # as if the game weren't committed where the listener's connection could see it, and
+        # without the signal that drops it from the registry
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {0} WHERE id = %s'.format(ClickerGame._meta.db_table), [self.game.pk])
+        self.listener.changed({self.game.pk})
+        self.listener.check_versions()
+        self.assertEqual(registry.get().game, self.game)
+
+    def test_check_versions(self):
+        with self.assertNumQueries(1):
+            self.listener.check_versions()
+        later = self.game.modified + datetime.timedelta(seconds=1)
+        ClickerGame.objects.filter(pk=self.game.pk).update(name="Renamed", modified=later)
+        self.listener.check_versions()
+        self.assertEqual(registry.get().game.name, "Renamed")
+
+    def test_not_started_without_postgres(self):
+        self.listener.ensure_started()
+        self.assertFalse(self.listener.listening())
+
+    def test_off_unless_turned_on(self):
+        self.assertFalse(self.listener.enabled())
+
+    def test_no_game_query_while_listening(self):
+        GameInstance.objects.create(user=self.user, game=self.game, data={})
+        entry = registry.get()
+        listener.connected = True
+        listener._pid = os.getpid()
+        with self.assertNumQueries(1):
+            db_instance = fetch_game_instance(self.user, entry)
+        self.assertIs(db_instance.game, entry.game)
+        self.assertIs(registry.check(entry, db_instance.game), entry)
+
+
+@skipUnless(connection.vendor == 'postgresql', "LISTEN/NOTIFY needs Postgres")
+@override_settings(CLICKER_MODEL_LISTENER=True)
+class ModelNotificationTest(TransactionTestCase):
+    # the listener has connections of its own, so what it hears about has to be committed
+    def setUp(self):
+        self.game = ClickerGame.objects.create(owner=UserFactory.create(), game_data=TEST_GAME,
+                                               name="Quest Clicker")
+        registry.clear()
+        registry.get()
+        self.listener = ModelListener()
+        self.listener.ensure_started()
+        self.addCleanup(self.listener.stop)
+        self.wait_for(self.listener.listening)
+
+    def wait_for(self, condition):
+        deadline = time.time() + 10
+        while not condition():
+            self.assertLess(time.time(), deadline, "The listener didn't catch up")
+            time.sleep(0.01)
+
+    def test_edited_games_are_reloaded(self):
+        self.game.name = "Renamed"
+        self.game.save()
+        self.wait_for(lambda: registry.get().game.name == "Renamed")
+        self.game.delete()
+        self.wait_for(lambda: registry.entries() == [])
+
+    def test_stop(self):
+        thread = self.listener._thread
+        self.listener.stop()
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(self.listener.listening())
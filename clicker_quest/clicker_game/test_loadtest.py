@@ -0,0 +1,64 @@
+# coding=utf-8
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase
+
+from clicker_game.loadtest import Scenario, WSGITransport, compare_reports, parse_cookies, run_load_test
+from clicker_game.models import ClickerGame, GameInstance
+from clicker_game.registry import registry
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+def report_json(p50, throughput, errors=0):
+    stats = {'requests': 100, 'throughput': throughput, 'error_rate': errors / 100.0,
+             'p50': p50, 'p95': p50 * 2, 'p99': p50 * 3, 'queries': 4.0}
+    return {'total': stats, 'actions': {'poll': stats}}
+
+
+class LoadTestRunTest(TransactionTestCase):
+    # the WSGI application closes the connection after each request, as it does outside tests,
+    # and the players' threads have connections of their own, so the data has to be committed
+    def setUp(self):
+        owner = UserFactory.create()
+        ClickerGame.objects.create(owner=owner, game_data=TEST_GAME, name="Quest Clicker")
+        registry.clear()
+
+    def test_in_process(self):
+        scenario = Scenario(
+            "test", players=1, requests_per_player=12, seconds=60.0, think_seconds=0.0,
+            mix={'poll': 2, 'building': 1, 'upgrade': 1, 'return': 1},
+        )
+        users = User.objects.count()
+        report = run_load_test(scenario, WSGITransport()).as_json()
+        self.assertEqual(report['total']['requests'], 12)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertGreater(report['total']['queries'], 0)
+        self.assertEqual(report['actions']['page']['requests'], 1)
+        self.assertLessEqual(set(report['actions']), {'page', 'poll', 'building', 'upgrade', 'return'})
+        self.assertLessEqual(report['total']['p50'], report['total']['p99'])
+        # the players are gone afterwards
+        self.assertEqual(User.objects.count(), users)
+        self.assertFalse(GameInstance.objects.exists())
+
+
+class LoadTestTest(TestCase):
+    def test_scenario_options(self):
+        self.assertEqual(Scenario.named('polling', players=3).players, 3)
+        with self.assertRaises(ValueError):
+            Scenario("bad", player=3)
+        with self.assertRaises(ValueError):
+            Scenario("bad", mix={'dance': 1})
+
+    def test_compare(self):
+        rows = compare_reports(report_json(0.010, 100.0), report_json(0.013, 95.0))
+        worse = set((action, figure) for action, figure, old, new, change, regressed in rows if regressed)
+        self.assertIn(('poll', 'p50'), worse)
+        self.assertIn(('total', 'p99'), worse)
+        self.assertNotIn(('total', 'throughput'), worse)
+        self.assertNotIn(('total', 'queries'), worse)
+
+    def test_cookies(self):
+        cookies = parse_cookies([
+            'csrftoken=abc; expires=Thu, 01-Jan-2099 00:00:00 GMT; Max-Age=31449600; Path=/',
+            'clicker_guest_1=""; expires=Thu, 01-Jan-1970 00:00:00 GMT; Max-Age=0; Path=/',
+        ])
+        self.assertEqual(cookies, {'csrftoken': 'abc', 'clicker_guest_1': None})
@@ -0,0 +1,203 @@
+# coding=utf-8
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+
+from clicker_game.metrics import (
+    MetricsRegistry,
+    count_queries,
+    logger as metrics_logger,
+    registry,
+    merge_into,
+    render_prometheus,
+    write_snapshot,
+    read_snapshots,
+)
+from clicker_game.tests import TEST_GAME, UserFactory
+from clicker_game.models import ClickerGame, GameInstance
+from clicker_game.registry import registry as game_registry
+
+
+LABELS = (('view', 'game_page'), ('action', 'poll'))
+
+
+class MetricsRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        self.registry.inc('clicker_requests_total', LABELS)
+        self.registry.inc('clicker_requests_total', LABELS, 2)
+        self.assertEqual(self.registry.snapshot(), {('clicker_requests_total', LABELS): 3})
+
+    def test_histogram(self):
+        self.registry.observe('clicker_request_duration_seconds', LABELS, 0.003)
+        self.registry.observe('clicker_request_duration_seconds', LABELS, 100.0)
+        histogram = self.registry.snapshot()[('clicker_request_duration_seconds', LABELS)]
+        self.assertEqual(histogram[2], 1)  # the 5ms bucket
+        self.assertEqual(histogram[-2], 1)  # the +Inf bucket
+        self.assertAlmostEqual(histogram[-1], 100.003)
+
+    def test_threads_are_summed(self):
+        def work():
+            for _ in range(1000):
+                self.registry.inc('clicker_requests_total', LABELS)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.registry.snapshot()[('clicker_requests_total', LABELS)], 4000)
+
+    def test_ended_threads_are_retired(self):
+        def work():
+            self.registry.inc('clicker_requests_total', LABELS)
+
+        for _ in range(5):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+        self.registry.inc('clicker_requests_total', LABELS)
+        self.assertEqual(self.registry.snapshot()[('clicker_requests_total', LABELS)], 6)
+        self.assertEqual(len(self.registry._shards), 1)
+
+    def test_merge(self):
+        result = {('a', ()): 1, ('h', ()): [1, 0, 1.0]}
+        merge_into(result, {('a', ()): 2, ('h', ()): [0, 1, 2.5], ('b', ()): 1})
+        self.assertEqual(result, {('a', ()): 3, ('h', ()): [1, 1, 3.5], ('b', ()): 1})
+
+
+class PrometheusFormatTest(TestCase):
+    def test_render(self):
+        text = render_prometheus({
+            ('clicker_requests_total', LABELS): 3,
+            ('clicker_request_duration_seconds', LABELS): [1, 2] + [0] * 10 + [1, 5.5],
+        })
+        self.assertIn("# TYPE clicker_requests_total counter\n", text)
+        self.assertIn('clicker_requests_total{view="game_page",action="poll"} 3\n', text)
+        self.assertIn("# TYPE clicker_request_duration_seconds histogram\n", text)
+        self.assertIn(
+            'clicker_request_duration_seconds_bucket{view="game_page",action="poll",le="0.0025"} 3\n',
+            text
+        )
+        self.assertIn(
+            'clicker_request_duration_seconds_bucket{view="game_page",action="poll",le="+Inf"} 4\n',
+            text
+        )
+        self.assertIn('clicker_request_duration_seconds_sum{view="game_page",action="poll"} 5.5\n', text)
+        self.assertIn('clicker_request_duration_seconds_count{view="game_page",action="poll"} 4\n', text)
+
+    def test_label_escaping(self):
+        text = render_prometheus({('clicker_requests_total', (('view', 'a"b\\c'),)): 1})
+        self.assertIn('clicker_requests_total{view="a\\"b\\\\c"} 1\n', text)
+
+
+class MultiProcessTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot_files_round_trip(self):
+        snapshot = {('clicker_requests_total', LABELS): 3}
+        write_snapshot(self.directory, 1234, snapshot)
+        self.assertEqual(list(read_snapshots(self.directory)), [(1234, snapshot)])
+
+    def test_collect_other_workers(self):
+        # this process's parent, and a process that has exited
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        write_snapshot(self.directory, os.getppid(), {('clicker_requests_total', LABELS): 3})
+        write_snapshot(self.directory, exited.pid, {('clicker_requests_total', LABELS): 4})
+        local = MetricsRegistry()
+        local.inc('clicker_requests_total', LABELS)
+        with override_settings(CLICKER_METRICS_DIR=self.directory):
+            self.assertEqual(local.collect(), {('clicker_requests_total', LABELS): 4})
+            self.assertEqual([pid for pid, snapshot in read_snapshots(self.directory)], [os.getppid()])
+            local.flush(force=True)
+            self.assertEqual(len(list(read_snapshots(self.directory))), 2)
+
+    def test_flush_makes_directory(self):
+        directory = os.path.join(self.directory, 'metrics')
+        with override_settings(CLICKER_METRICS_DIR=directory):
+            MetricsRegistry().flush(force=True)
+        self.assertEqual(len(list(read_snapshots(directory))), 1)
+
+    def test_flush_into_unwritable_directory(self):
+        path = os.path.join(self.directory, 'a file')
+        open(path, 'w').close()
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        metrics_logger.addHandler(handler)
+        metrics_logger.propagate = False
+        try:
+            with override_settings(CLICKER_METRICS_DIR=path):
+                MetricsRegistry().flush(force=True)
+        finally:
+            metrics_logger.removeHandler(handler)
+            metrics_logger.propagate = True
+        self.assertEqual(len(records), 1)
+
+
+class RequestMetricsMiddlewareTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.game = ClickerGame(owner=self.user, game_data=TEST_GAME, name='Quest Clicker')
+        self.game.save()
+        GameInstance(user=self.user, game=self.game, data={}).save()
+        registry.reset()
+        game_registry.clear()
+
+    def test_request_recorded(self):
+        c = Client()
+        c.force_login(self.user)
+        c.post('/', {'clicked': 'building', 'name': 'Quest Maker', 'number_purchased': 1},
+               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        labels = (('view', 'game_page'), ('action', 'building'))
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot[('clicker_requests_total', labels)], 1)
+        self.assertGreater(snapshot[('clicker_db_queries_total', labels)], 0)
+        self.assertGreater(snapshot[('clicker_response_bytes', labels)][-1], 0)
+        self.assertNotIn(('clicker_errors_total', labels), snapshot)
+
+    def test_queries_are_counted_without_logging(self):
+        counter = count_queries(connection)
+        count = counter.count
+        ClickerGame.objects.count()
+        self.assertEqual(counter.count, count + 1)
+        self.assertFalse(connection.queries_logged)
+        c = Client()
+        c.force_login(self.user)
+        c.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertFalse(connection.force_debug_cursor)
+
+    @override_settings(CLICKER_METRICS_TOKEN='a token')
+    def test_metrics_endpoint(self):
+        c = Client()
+        c.force_login(self.user)
+        c.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        response = c.get('/metrics', HTTP_AUTHORIZATION='Bearer a token')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b'clicker_requests_total{view="game_page",action="poll"} 1\n',
+            response.content
+        )
+        self.assertEqual(c.get('/metrics', HTTP_AUTHORIZATION='Bearer another token').status_code, 404)
+
+    def test_metrics_endpoint_not_public(self):
+        # not even from the local address that a reverse proxy's requests come from
+        self.assertEqual(Client().get('/metrics').status_code, 404)
+        self.assertEqual(Client(REMOTE_ADDR='203.0.113.9').get('/metrics').status_code, 404)
+
+    @override_settings(CLICKER_METRICS_ALLOWED_IPS=['192.0.2.1'])
+    def test_metrics_endpoint_allowed_addresses(self):
+        self.assertEqual(Client(REMOTE_ADDR='192.0.2.1').get('/metrics').status_code, 200)
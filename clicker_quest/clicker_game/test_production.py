@@ -0,0 +1,120 @@
+# coding=utf-8
+from datetime import datetime, timedelta
+from django.test import TestCase
+
+from clicker_game.benchmarks import chain_game_data
+from clicker_game.game_model import validate_game_model
+
+
+TIME = datetime(2000, 1, 1)
+
+
+def mill_model(extra_buildings=()):
+    return validate_game_model({
+        'name': "mill",
+        'description': "a game",
+        'resources': [{'name': "water"}, {'name': "flour"}, {'name': "sacks"}],
+        'buildings': [
+            {'name': "well", 'cost': {}, 'cost_factor': 1.0, 'income': {"water": 0.5}},
+            {'name': "mill", 'cost': {}, 'cost_factor': 1.0, 'income': {"water": -1.0, "flour": 1.0}},
+            {'name': "bakery", 'cost': {"flour": 50.0}, 'cost_factor': 1.0, 'income': {}},
+        ] + list(extra_buildings),
+        'upgrades': [],
+        'new_game': {},
+    })
+
+
+class ProductionTest(TestCase):
+    def test_no_consumers(self):
+        model = validate_game_model(dict(chain_game_data(0), new_game={'buildings': {"well": 1}}))
+        self.assertFalse(model.production.has_consumers)
+        save, client = model.load_game_instance(model.new_game, TIME).get_current_state(TIME)
+        self.assertNotIn('production', client)
+
+    def test_full_speed_while_stocked(self):
+        instance = mill_model().load_game_instance(
+            {'resources': {"water": 10.0}, 'buildings': {"well": 1, "mill": 1}}, TIME
+        )
+        instance.calculate_values()
+        self.assertEqual(instance.speeds, {})
+        self.assertEqual(instance.resources["water"].income, -0.5)
+
+    def test_slows_when_run_out(self):
+        instance = mill_model().load_game_instance(
+            {'resources': {"water": 10.0}, 'buildings': {"well": 1, "mill": 1}}, TIME
+        )
+        save, client = instance.get_current_state(TIME + timedelta(seconds=100))
+        # 20 seconds at full speed until the water runs out, then half speed
+        self.assertAlmostEqual(save['resources']["flour"], 20.0 + 40.0)
+        self.assertNotIn("water", save['resources'])
+        self.assertEqual(instance.speeds, {"mill": 0.5})
+        self.assertEqual(client['production'], {'speeds': {"mill": 0.5}, 'runs_out': None})
+
+    def test_client_told_when_something_runs_out(self):
+        instance = mill_model().load_game_instance(
+            {'resources': {"water": 10.0}, 'buildings': {"well": 1, "mill": 1}}, TIME
+        )
+        save, client = instance.get_current_state(TIME + timedelta(seconds=5))
+        self.assertEqual(client['production']['speeds'], {})
+        self.assertEqual(client['production']['runs_out'], {'resource': "water", 'seconds': 15.0})
+
+    def test_nothing_to_consume(self):
+        instance = mill_model().load_game_instance({'buildings': {"mill": 3}}, TIME)
+        save, client = instance.get_current_state(TIME + timedelta(seconds=100))
+        self.assertEqual(instance.speeds, {"mill": 0.0})
+        self.assertEqual(save.get('resources', {}), {})
+
+    def test_scarcest_input(self):
+        model = mill_model([
+            {'name': "packer", 'cost': {}, 'cost_factor': 1.0,
+             'income': {"flour": -2.0, "water": -0.25, "sacks": 1.0}},
+        ])
+        instance = model.load_game_instance({'buildings': {"well": 1, "mill": 1, "packer": 1}}, TIME)
+        instance.calculate_values()
+        # water: 0.5 supplied for 1.25 wanted; flour: the slowed mill's 0.4 for 2 wanted
+        self.assertAlmostEqual(instance.speeds["mill"], 0.4)
+        self.assertAlmostEqual(instance.speeds["packer"], 0.2)
+        self.assertAlmostEqual(instance.resources["sacks"].income, 0.2)
+
+    def test_run_out_stays_run_out(self):
+        # found by the differential tests: slowing 14 mills down left the water earning 3.6e-15 a
+        # second, so that it was not run out the next time the game was loaded
+        model = mill_model([
+            {'name': "spring", 'cost': {}, 'cost_factor': 1.0, 'income': {"water": 4.75}},
+            {'name': "pump", 'cost': {}, 'cost_factor': 1.0, 'income': {"water": -2.327, "flour": 9.347}},
+        ])
+        instance = model.load_game_instance(
+            {'resources': {"water": 10007.432647100644}, 'buildings': {"spring": 1, "pump": 14}}, TIME
+        )
+        save, client = instance.get_current_state(TIME + timedelta(seconds=3600))
+        self.assertEqual(instance.resources["water"].income, 0.0)
+        self.assertNotIn("water", save['resources'])
+        save, client = model.load_game_instance(save, TIME).get_current_state(TIME)
+        self.assertAlmostEqual(client['production']['speeds']["pump"], 4.75 / (2.327 * 14))
+
+    def test_chain(self):
+        model = validate_game_model(chain_game_data(5))
+        instance = model.load_game_instance(model.new_game, TIME)
+        instance.calculate_values()
+        self.assertEqual(instance.speeds, {"building {0}".format(i): 0.5 for i in range(5)})
+        self.assertEqual(model.production.order, ["well"] + ["building {0}".format(i) for i in range(5)])
+
+    def test_chain_runs_out_one_by_one(self):
+        model = validate_game_model(chain_game_data(3))
+        state = dict(model.new_game, resources={"water": 10.0, "product 0": 10.0, "product 1": 10.0})
+        instance = model.load_game_instance(state, TIME)
+        save, client = instance.get_current_state(TIME + timedelta(seconds=1000))
+        # each stock lasts 20 seconds once the link before it slows to half speed
+        self.assertAlmostEqual(save['resources']["product 2"], 60.0 + 0.5 * 940.0)
+        self.assertEqual(len(instance.speeds), 3)
+
+    def test_order_waits_for_slowed_production(self):
+        instance = mill_model().load_game_instance({
+            'resources': {"water": 10.0},
+            'buildings': {"well": 1, "mill": 1},
+            'orders': [{'building': "bakery", 'up_to': 1}],
+        }, TIME)
+        instance.fast_forward(TIME + timedelta(seconds=100))
+        # 50 flour takes 20 seconds at full speed and 60 at half, leaving 20 seconds of half speed
+        self.assertEqual(instance.buildings["bakery"].owned, 1)
+        self.assertAlmostEqual(instance.resources["flour"].owned, 10.0)
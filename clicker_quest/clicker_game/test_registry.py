@@ -0,0 +1,90 @@
+# coding=utf-8
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+
+from clicker_game.models import ClickerGame, GameInstance
+from clicker_game.registry import registry
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+class GameRegistryTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.first = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Quest Clicker")
+        self.second = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Quest Clicker")
+        registry.clear()
+
+    def test_unique_slugs(self):
+        self.assertEqual(self.first.slug, "quest-clicker")
+        self.assertEqual(self.second.slug, "quest-clicker-2")
+        self.assertEqual(self.second.get_absolute_url(), "/games/quest-clicker-2/")
+
+    def test_lookup(self):
+        self.assertEqual(registry.get().game.pk, self.first.pk)
+        self.assertEqual(registry.get("quest-clicker-2").game.pk, self.second.pk)
+        self.assertEqual(registry.get(str(self.second.pk)).game.pk, self.second.pk)
+        self.assertIsNone(registry.get("nonexistent"))
+
+    def test_no_queries_once_loaded(self):
+        entry = registry.get("quest-clicker")
+        with self.assertNumQueries(0):
+            self.assertIs(registry.get("quest-clicker"), entry)
+            self.assertIs(registry.get(), entry)
+            self.assertIs(registry.get("quest-clicker").model, entry.model)
+
+    def test_saved_games_are_refreshed(self):
+        registry.get()
+        self.second.name = "Renamed"
+        self.second.slug = "renamed"
+        self.second.save()
+        third = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Third")
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.get("renamed").game.name, "Renamed")
+            self.assertIsNone(registry.get("quest-clicker-2"))
+            self.assertEqual(registry.get("third").game.pk, third.pk)
+        third.delete()
+        registry._last_load = 0.0
+        self.assertIsNone(registry.get("third"))
+
+    def test_check_reloads_modified_games(self):
+        entry = registry.get()
+        with self.assertNumQueries(0):
+            self.assertIs(registry.check(entry, self.first), entry)
+        ClickerGame.objects.filter(pk=self.first.pk).update(name="Changed elsewhere")
+        changed = ClickerGame.objects.get(pk=self.first.pk)
+        changed.modified = changed.modified.replace(year=changed.modified.year + 1)
+        self.assertEqual(registry.check(entry, changed).game.name, "Changed elsewhere")
+
+
+class GameUrlTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.game = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Quest Clicker")
+        GameInstance.objects.create(user=self.user, game=self.game, data={'resources': {'quests': 316}})
+        registry.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def play(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                url, {'clicked': 'building', 'name': 'Quest Maker', 'number_purchased': 1},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+            )
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_game_url(self):
+        response = self.client.get('/games/quest-clicker/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['resources'][0]['name'], 'quests')
+        self.assertEqual(self.client.get('/games/nonexistent/').status_code, 404)
+
+    def test_more_games_add_no_queries(self):
+        self.play('/games/quest-clicker/')
+        queries = self.play('/games/quest-clicker/')
+        for n in range(5):
+            ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Game {0}".format(n))
+        self.assertEqual(len(self.play('/games/quest-clicker/')), len(queries))
+        # the game comes along with the game instance
+        self.assertFalse([sql for sql in queries if 'FROM "clicker_game_clickergame"' in sql])
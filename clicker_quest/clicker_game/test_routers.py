@@ -0,0 +1,98 @@
+# coding=utf-8
+import datetime
+import time
+
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.utils import timezone
+
+from clicker_game.models import ClickerGame, GameInstance
+from clicker_game.registry import registry
+from clicker_game.routers import PIN_COOKIE, ReplicaMiddleware, ReplicaRouter, is_pinned, pin_to_primary
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+@override_settings(CLICKER_REPLICAS=['replica_0'], CLICKER_REPLICA_LAG_SECONDS=5.0)
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.middleware = ReplicaMiddleware()
+        self.factory = RequestFactory()
+        self.start(self.factory.get('/'))
+
+    def tearDown(self):
+        self.middleware.process_response(None, HttpResponse())
+
+    def start(self, request):
+        self.middleware.process_request(request)
+
+    def test_reads_go_to_replicas(self):
+        self.assertEqual(self.router.db_for_read(GameInstance), 'replica_0')
+        self.assertEqual(self.router.db_for_write(GameInstance), 'default')
+
+    def test_reads_after_a_write_are_pinned(self):
+        self.router.db_for_write(GameInstance)
+        self.assertTrue(is_pinned())
+        self.assertEqual(self.router.db_for_read(GameInstance), 'default')
+
+    def test_pin_to_primary(self):
+        with pin_to_primary():
+            self.assertEqual(self.router.db_for_read(ClickerGame), 'default')
+        self.assertEqual(self.router.db_for_read(ClickerGame), 'replica_0')
+
+    def test_related_objects_follow_their_instance(self):
+        self.assertIsNone(self.router.db_for_read(ClickerGame, instance=GameInstance()))
+
+    def test_no_migrations_on_replicas(self):
+        self.assertFalse(self.router.allow_migrate('replica_0', 'clicker_game'))
+        self.assertIsNone(self.router.allow_migrate('default', 'clicker_game'))
+
+    def test_unsafe_requests_are_pinned(self):
+        self.start(self.factory.post('/'))
+        self.assertEqual(self.router.db_for_read(GameInstance), 'default')
+
+    def test_pinned_after_writing(self):
+        self.router.db_for_write(GameInstance)
+        response = self.middleware.process_response(None, HttpResponse())
+        self.assertFalse(is_pinned())
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = response.cookies[PIN_COOKIE].value
+        self.start(request)
+        self.assertEqual(self.router.db_for_read(GameInstance), 'default')
+        request.COOKIES[PIN_COOKIE] = repr(time.time() - 1)
+        self.start(request)
+        self.assertEqual(self.router.db_for_read(GameInstance), 'replica_0')
+
+    @override_settings(CLICKER_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertEqual(self.router.db_for_read(GameInstance), 'default')
+
+
+class StatePollTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.game = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name="Quest Clicker")
+        self.saved = timezone.now() - datetime.timedelta(seconds=60)
+        self.instance = GameInstance.objects.create(
+            user=self.user, game=self.game, data={'resources': {'quests': 316}})
+        GameInstance.objects.filter(pk=self.instance.pk).update(modified=self.saved)
+        registry.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def modified(self):
+        return GameInstance.objects.get(pk=self.instance.pk).modified
+
+    def test_poll_does_not_save(self):
+        response = self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['resources'][0]['name'], 'quests')
+        self.assertEqual(self.modified(), self.saved)
+
+    def test_page_load_saves(self):
+        self.client.get('/')
+        self.assertGreater(self.modified(), self.saved)
+
+    @override_settings(CLICKER_POLL_SAVE_SECONDS=30)
+    def test_old_game_is_saved(self):
+        self.client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertGreater(self.modified(), self.saved)
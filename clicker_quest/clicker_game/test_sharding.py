@@ -0,0 +1,145 @@
+# coding=utf-8
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase, override_settings
+
+from clicker_game.models import ArchivedGameInstance, ClickerGame, GameInstance
+from clicker_game.sharding import (
+    SHARDED_MODELS, ShardRouter, fetch_user_game, iterate_game_instances, jump_hash, previous_shard_for_user,
+    rebalance, shard_for_user, user_games
+)
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+SHARDS = ['shard_0', 'shard_1', 'shard_2']
+NEW_SHARD = 'test_shard'
+
+
+class JumpHashTest(TestCase):
+    def test_stable(self):
+        self.assertEqual([jump_hash(key, 1) for key in range(10)], [0] * 10)
+        self.assertEqual([jump_hash(key, 10) for key in range(100)], [jump_hash(key, 10) for key in range(100)])
+
+    def test_even(self):
+        counts = [0] * 4
+        for key in range(10000):
+            counts[jump_hash(key, 4)] += 1
+        for count in counts:
+            self.assertAlmostEqual(count / 10000.0, 0.25, delta=0.03)
+
+    def test_adding_a_bucket_moves_only_onto_it(self):
+        moved = 0
+        for key in range(10000):
+            before, after = jump_hash(key, 4), jump_hash(key, 5)
+            if before != after:
+                self.assertEqual(after, 4)
+                moved += 1
+        self.assertAlmostEqual(moved / 10000.0, 0.2, delta=0.03)
+
+
+@override_settings(CLICKER_SHARDS=SHARDS)
+class ShardRouterTest(TestCase):
+    def setUp(self):
+        self.router = ShardRouter()
+
+    def test_game_instances_go_to_their_users_shard(self):
+        instance = GameInstance(user_id=7, game_id=1)
+        self.assertIn(shard_for_user(7), SHARDS)
+        self.assertEqual(self.router.db_for_write(GameInstance, instance=instance), shard_for_user(7))
+        self.assertEqual(self.router.db_for_read(GameInstance, instance=User(pk=7)), shard_for_user(7))
+        self.assertEqual(user_games(7).db, shard_for_user(7))
+
+    def test_related_objects_go_to_the_default_database(self):
+        instance = GameInstance(user_id=7, game_id=1)
+        instance._state.db = shard_for_user(7)
+        self.assertEqual(self.router.db_for_read(ClickerGame, instance=instance), 'default')
+        self.assertTrue(self.router.allow_relation(instance, ClickerGame()))
+
+    def test_everything_else_is_left_to_other_routers(self):
+        self.assertIsNone(self.router.db_for_read(ClickerGame))
+        self.assertIsNone(self.router.db_for_read(GameInstance))
+
+    def test_shards_only_hold_game_instances(self):
+        self.assertTrue(self.router.allow_migrate('shard_1', 'clicker_game', 'gameinstance'))
+        self.assertFalse(self.router.allow_migrate('shard_1', 'clicker_game', 'clickergame'))
+        self.assertFalse(self.router.allow_migrate('shard_1', 'auth', 'user'))
+        self.assertIsNone(self.router.allow_migrate('default', 'auth', 'user'))
+
+    @override_settings(CLICKER_SHARDS=[])
+    def test_not_sharded(self):
+        self.assertIsNone(shard_for_user(7))
+        self.assertIsNone(self.router.db_for_write(GameInstance, instance=GameInstance(user_id=7)))
+
+
+class ShardIteratorTest(TestCase):
+    def test_batches(self):
+        owner = UserFactory.create()
+        game = ClickerGame.objects.create(owner=owner, game_data=TEST_GAME, name="Quest Clicker")
+        users = [UserFactory.create() for _ in range(5)]
+        for user in users:
+            GameInstance.objects.create(user=user, game=game, data={})
+        found = [instance.user_id for instance in iterate_game_instances(batch_size=2)]
+        self.assertEqual(found, [user.pk for user in users])
+        queryset = GameInstance.objects.filter(user_id__in=[users[1].pk, users[3].pk])
+        self.assertEqual(len(list(iterate_game_instances(queryset, batch_size=1))), 2)
+
+
+@override_settings(CLICKER_SHARDS=[NEW_SHARD], CLICKER_PREVIOUS_SHARDS=[])
+class TurningShardingOnTest(TestCase):
+    """The game instances already on the default database move onto the first shard"""
+    @classmethod
+    def setUpClass(cls):
+        super(TurningShardingOnTest, cls).setUpClass()
+        # a test database of its own for the shard, which the settings don't have, on the same
+        # kind of database as the default one
+        connections.databases[NEW_SHARD] = dict(connections.databases[DEFAULT_DB_ALIAS], TEST={})
+        cls.old_name = connections[NEW_SHARD].settings_dict['NAME']
+        connections[NEW_SHARD].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[NEW_SHARD].creation.destroy_test_db(cls.old_name, verbosity=0)
+        delattr(connections._connections, NEW_SHARD)
+        del connections.databases[NEW_SHARD]
+        super(TurningShardingOnTest, cls).tearDownClass()
+
+    def setUp(self):
+        owner = UserFactory.create()
+        self.game = ClickerGame.objects.create(owner=owner, game_data=TEST_GAME, name="Quest Clicker")
+        self.user = UserFactory.create()
+        self.instance = GameInstance.objects.using(DEFAULT_DB_ALIAS).create(
+            user=self.user, game=self.game, data={'clicks': 5}
+        )
+        stopped = ClickerGame.objects.create(owner=owner, game_data=TEST_GAME, name="Stopped Clicker")
+        ArchivedGameInstance.objects.using(DEFAULT_DB_ALIAS).create(
+            user=self.user, game=stopped, compressed_data=b'', created=self.instance.created
+        )
+        # the shard isn't rolled back with the default database
+        for model in SHARDED_MODELS:
+            self.addCleanup(model.objects.using(NEW_SHARD).all().delete)
+
+    def assertMoved(self):
+        self.assertFalse(GameInstance.objects.using(DEFAULT_DB_ALIAS).filter(user=self.user).exists())
+        self.assertFalse(ArchivedGameInstance.objects.using(DEFAULT_DB_ALIAS).filter(user=self.user).exists())
+        moved = GameInstance.objects.using(NEW_SHARD).get(user_id=self.user.pk)
+        self.assertEqual(moved.data, {'clicks': 5})
+        self.assertEqual(moved.created, self.instance.created)
+        self.assertEqual(ArchivedGameInstance.objects.using(NEW_SHARD).filter(user_id=self.user.pk).count(), 1)
+
+    def test_previous_shard_is_the_default_database(self):
+        self.assertEqual(shard_for_user(self.user.pk), NEW_SHARD)
+        self.assertEqual(previous_shard_for_user(self.user.pk), DEFAULT_DB_ALIAS)
+        with self.settings(CLICKER_SHARDS=[]):
+            self.assertIsNone(previous_shard_for_user(self.user.pk))
+
+    def test_moved_when_loaded(self):
+        instance = fetch_user_game(self.user.pk, self.game.pk)
+        self.assertEqual(instance._state.db, NEW_SHARD)
+        self.assertMoved()
+
+    def test_rebalance(self):
+        self.assertEqual(rebalance(dry_run=True), {(DEFAULT_DB_ALIAS, NEW_SHARD): 1})
+        self.assertTrue(GameInstance.objects.using(DEFAULT_DB_ALIAS).filter(user=self.user).exists())
+        self.assertEqual(rebalance(), {(DEFAULT_DB_ALIAS, NEW_SHARD): 1})
+        self.assertMoved()
+        self.assertEqual(rebalance(), {})
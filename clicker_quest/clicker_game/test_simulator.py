@@ -0,0 +1,169 @@
+# coding=utf-8
+import json
+import os
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from clicker_game.game_model import validate_game_model
+from clicker_game.simulator import (
+    CheapestFirst,
+    GreedyROI,
+    Purchase,
+    Scripted,
+    Simulation,
+    apply_parameter,
+    parameter_grid,
+    simulate,
+    sweep,
+)
+
+
+EXAMPLE_MODEL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'example_game_model.json'
+)
+
+
+def game_data():
+    return {
+        'name': "game",
+        'description': "a game",
+        'resources': [{'name': "minerals"}],
+        'buildings': [
+            {
+                'name': "click",
+                'cost': {"minerals": -1},
+                'cost_factor': 1,
+            },
+            {
+                'name': "miner",
+                'cost': {"minerals": 10.0},
+                'cost_factor': 2.0,
+                'income': {"minerals": 1.0},
+            },
+            {
+                'name': "drill",
+                'cost': {"minerals": 100.0},
+                'cost_factor': 2.0,
+                'income': {"minerals": 20.0},
+            },
+        ],
+        'upgrades': [
+            {
+                'name': "better miners",
+                'unlock': {'buildings': {"miner": 1}},
+                'cost': {"minerals": 15.0},
+                'buildings': {"miner": {'income': {"minerals": {'multiplier': 3.0}}}},
+            },
+        ],
+        'new_game': {'resources': {"minerals": 10.0}},
+    }
+
+
+class SimulatorTest(TestCase):
+    def setUp(self):
+        self.model = validate_game_model(game_data())
+
+    def test_scripted_jumps_to_purchase_times(self):
+        result = simulate(self.model, Scripted([
+            {'building': "miner", 'count': 2},
+            {'upgrade': "better miners"},
+        ]), 3600)
+        # the first miner is affordable at once, the second costs 20 at 1/s, the upgrade 15 at 2/s
+        self.assertEqual(
+            [(round(seconds, 6), kind, name) for seconds, kind, name in result.purchases],
+            [
+                (0.0, 'building', "miner"),
+                (20.0, 'building', "miner"),
+                (27.5, 'upgrade', "better miners"),
+            ]
+        )
+        self.assertEqual(result.stopped_because, 'strategy finished')
+        self.assertEqual(result.elapsed, 3600)
+        self.assertEqual(result.time_to_unlock('upgrade', "better miners"), 0.0)
+        self.assertEqual(result.income_curve[-1][1], {"minerals": 6.0})
+        self.assertAlmostEqual(result.final_state['resources']["minerals"], 6.0 * (3600 - 27.5))
+
+    def test_stuck_without_income(self):
+        result = simulate(self.model, Scripted([{'building': "drill"}]), 3600)
+        self.assertEqual(result.purchases, [])
+        self.assertEqual(result.stopped_because, "cannot afford building drill")
+
+    def test_clicks_are_income(self):
+        result = simulate(self.model, Scripted([{'building': "drill"}]), 3600, clicks_per_second=2.0)
+        self.assertEqual(result.purchases, [(45.0, 'building', "drill")])
+
+    def test_cheapest_first(self):
+        result = simulate(self.model, CheapestFirst(), 60)
+        self.assertEqual(result.purchases[0][1:], ('building', "miner"))
+        self.assertEqual(result.purchases[1][1:], ('upgrade', "better miners"))
+        self.assertEqual(result.stopped_because, 'time')
+
+    def test_greedy_never_clicks(self):
+        result = simulate(self.model, GreedyROI(), 86400.0)
+        self.assertTrue(result.purchases)
+        self.assertNotIn("click", [name for seconds, kind, name in result.purchases])
+        times = [seconds for seconds, kind, name in result.purchases]
+        self.assertEqual(times, sorted(times))
+
+    def test_greedy_upgrade_gain_with_clicks(self):
+        for clicks_per_second in (0.0, 5.0):
+            simulation = Simulation(self.model, GreedyROI(), clicks_per_second)
+            Purchase('building', "miner").buy(simulation.instance)
+            simulation.refresh()
+            income = sum(resource.income for resource in simulation.instance.resources.values())
+            # tripling the miner's income of 1/s, however fast the player clicks
+            self.assertEqual(GreedyROI.income_gain(simulation, Purchase('upgrade', "better miners"), income), 2.0)
+
+    def test_greedy_example_model_year(self):
+        with open(EXAMPLE_MODEL) as f:
+            model = validate_game_model(json.load(f))
+        result = simulate(model, GreedyROI(), 365 * 86400.0, clicks_per_second=1.0)
+        self.assertEqual(result.stopped_because, 'time')
+        self.assertGreater(len(result.purchases), 100)
+        self.assertIsNotNone(result.time_to_unlock('upgrade', "Radium reactors"))
+
+
+class ParameterSweepTest(TestCase):
+    def test_apply_parameter(self):
+        data = game_data()
+        apply_parameter(data, 'buildings.miner.cost_factor', 1.5)
+        apply_parameter(data, 'upgrades.better miners.cost.minerals', 5)
+        self.assertEqual(data['buildings'][1]['cost_factor'], 1.5)
+        self.assertEqual(data['upgrades'][0]['cost'], {"minerals": 5})
+        with self.assertRaises(KeyError):
+            apply_parameter(data, 'buildings.nothing.cost_factor', 1.5)
+
+    def test_grid(self):
+        self.assertEqual(
+            [dict(point) for point in parameter_grid({'a': [1, 2], 'b': [3]})],
+            [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+        )
+
+    def test_sweep(self):
+        results = sweep(
+            game_data(), {'buildings.miner.cost': [{"minerals": 10.0}, {"minerals": 5.0}]}, 'script', 60,
+            orders=[{'building': "miner", 'count': 2}], processes=1
+        )
+        self.assertEqual([result.purchases[1][0] for parameters, result in results], [20.0, 5.0])
+
+
+class SimulateCommandTest(TestCase):
+    def test_report(self):
+        out = StringIO()
+        call_command('simulate', EXAMPLE_MODEL, duration='1h', clicks_per_second=1.0, stdout=out)
+        self.assertIn("Simulated 1.0h", out.getvalue())
+        self.assertIn("upgrade:Reinforced index finger", out.getvalue())
+
+    def test_json_sweep(self):
+        out = StringIO()
+        call_command(
+            'simulate', EXAMPLE_MODEL, duration='10m', clicks_per_second=1.0, json=True,
+            parameters=['buildings.Cursor.cost_factor=1.1,1.2'], processes=2, stdout=out
+        )
+        results = json.loads(out.getvalue())
+        self.assertEqual(
+            [result['parameters'] for result in results],
+            [{'buildings.Cursor.cost_factor': 1.1}, {'buildings.Cursor.cost_factor': 1.2}]
+        )
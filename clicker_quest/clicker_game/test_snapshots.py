@@ -0,0 +1,117 @@
+# coding=utf-8
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from django.test import TestCase, override_settings
+
+from clicker_game.models import ClickerGame
+from clicker_game.registry import registry
+from clicker_game.snapshots import ModelSnapshot, content_hash, snapshot
+from clicker_game.tests import TEST_GAME, UserFactory
+
+
+class ContentHashTest(TestCase):
+    def test_key_order_does_not_matter(self):
+        forwards = OrderedDict(sorted(TEST_GAME.items()))
+        backwards = OrderedDict(sorted(TEST_GAME.items(), reverse=True))
+        self.assertEqual(content_hash(forwards), content_hash(backwards))
+        self.assertEqual(content_hash(TEST_GAME), content_hash(dict(TEST_GAME)))
+
+    def test_content_does(self):
+        changed = dict(TEST_GAME, new_game={})
+        self.assertNotEqual(content_hash(changed), content_hash(TEST_GAME))
+
+
+class ModelSnapshotTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'models.snapshot')
+        self.overrides = override_settings(CLICKER_MODEL_SNAPSHOT=self.path)
+        self.overrides.enable()
+
+    def tearDown(self):
+        self.overrides.disable()
+        shutil.rmtree(self.directory)
+        snapshot.clear()
+
+    def test_same_content_shares_a_model(self):
+        first = ModelSnapshot()
+        self.assertIs(first.model(TEST_GAME), first.model(dict(TEST_GAME)))
+
+    def test_round_trip(self):
+        first = ModelSnapshot()
+        model = first.model(TEST_GAME)
+        self.assertTrue(first.save())
+        self.assertFalse(first.save())  # nothing new
+        second = ModelSnapshot()
+        self.assertEqual(second.load(), 1)
+        loaded = second.model(TEST_GAME)
+        self.assertIsNot(loaded, model)
+        self.assertEqual(sorted(loaded.buildings), sorted(model.buildings))
+        self.assertFalse(second.save())
+
+    def test_tampered_snapshot_is_ignored(self):
+        first = ModelSnapshot()
+        first.model(TEST_GAME)
+        first.save()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(data[:-1] + b'!')
+        self.assertEqual(ModelSnapshot().load(), 0)
+        with self.settings(SECRET_KEY='another'):
+            with open(self.path, 'wb') as f:
+                f.write(data)
+            self.assertEqual(ModelSnapshot().load(), 0)
+
+    def test_models_are_unpickled_when_used(self):
+        first = ModelSnapshot()
+        first.model(TEST_GAME)
+        first.save()
+        second = ModelSnapshot()
+        second.load()
+        second.prepare(TEST_GAME)
+        self.assertFalse(second.save())  # nothing compiled or unpickled
+        second.model(TEST_GAME)
+        self.assertFalse(second.save())
+
+    def test_newer_snapshot_is_mapped(self):
+        other_game = dict(TEST_GAME, new_game={})
+        writer = ModelSnapshot()
+        writer.model(TEST_GAME)
+        writer.save()
+        reader = ModelSnapshot()
+        self.assertEqual(reader.load(), 1)
+        old = reader.model(TEST_GAME)
+        writer.model(other_game)
+        writer.save()
+        # taken from the new file rather than compiled, and the old model still works
+        reader.model(other_game)
+        self.assertFalse(reader.save())
+        self.assertEqual(reader.load(), 2)
+        self.assertIs(reader.model(TEST_GAME), old)
+        self.assertEqual(list(old.buildings), ['Quest Maker'])
+
+    def test_retain(self):
+        first = ModelSnapshot()
+        first.model(TEST_GAME)
+        first.save()
+        first.retain([])
+        self.assertTrue(first.save())
+        self.assertEqual(ModelSnapshot().load(), 0)
+
+    def test_warm_start(self):
+        owner = UserFactory.create()
+        game = ClickerGame.objects.create(owner=owner, game_data=TEST_GAME, name="Quest Clicker")
+        snapshot.clear()
+        registry.clear()
+        registry.warm_start()
+        self.assertTrue(os.path.exists(self.path))
+        with self.assertNumQueries(0):
+            entry = registry.get(game.slug)
+        self.assertEqual(entry.content_hash, content_hash(TEST_GAME))
+        fresh = ModelSnapshot()
+        self.assertEqual(fresh.load(), 1)
+        self.assertIs(fresh.model(TEST_GAME, entry.content_hash), fresh.model(TEST_GAME))
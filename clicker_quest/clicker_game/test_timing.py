@@ -0,0 +1,133 @@
+# coding=utf-8
+from datetime import datetime, timedelta
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+
+from clicker_game.game_model import validate_game_model
+from clicker_game.timing import (
+    NULL_TIMER,
+    PhaseTimer,
+    PhaseHistograms,
+    get_request_timer,
+)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class PhaseTimerTest(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.histograms = PhaseHistograms()
+        self.timer = PhaseTimer(histograms=self.histograms)
+        self.timer.clock = self.clock
+
+    def test_records_phase(self):
+        with self.timer.phase('fetch'):
+            self.clock.now += 0.002
+        self.assertEqual(list(self.timer.phases), ['fetch'])
+        self.assertAlmostEqual(self.timer.phases['fetch'], 0.002)
+
+    def test_repeated_phases_are_summed(self):
+        for _ in range(3):
+            with self.timer.phase('fetch'):
+                self.clock.now += 0.001
+        self.assertAlmostEqual(self.timer.phases['fetch'], 0.003)
+
+    def test_phase_recorded_on_exception(self):
+        with self.assertRaises(ValueError):
+            with self.timer.phase('save'):
+                self.clock.now += 0.5
+                raise ValueError
+        self.assertAlmostEqual(self.timer.phases['save'], 0.5)
+
+    def test_server_timing_header(self):
+        with self.timer.phase('fetch'):
+            self.clock.now += 0.0015
+        with self.timer.phase('save'):
+            self.clock.now += 0.25
+        self.assertEqual(
+            self.timer.server_timing_header(),
+            "fetch;dur=1.500, save;dur=250.000"
+        )
+
+    def test_finish_sets_header_and_histograms(self):
+        with self.timer.phase('fetch'):
+            self.clock.now += 0.003
+        response = self.timer.finish(HttpResponse())
+        self.assertEqual(response['Server-Timing'], "fetch;dur=3.000")
+        snapshot = self.histograms.snapshot()
+        self.assertEqual(snapshot['phases']['fetch']['count'], 1)
+        self.assertAlmostEqual(snapshot['phases']['fetch']['total_ms'], 3.0)
+
+    def test_finish_without_phases(self):
+        response = self.timer.finish(HttpResponse())
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class NullTimerTest(TestCase):
+    def test_does_nothing(self):
+        with NULL_TIMER.phase('fetch'):
+            pass
+        response = NULL_TIMER.finish(HttpResponse())
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(NULL_TIMER.server_timing_header(), "")
+
+    @override_settings(CLICKER_TIMING=False)
+    def test_disabled_by_setting(self):
+        self.assertIs(get_request_timer(), NULL_TIMER)
+
+    @override_settings(CLICKER_TIMING=True, CLICKER_PHASE_TIMER='clicker_game.timing.PhaseTimer')
+    def test_enabled_by_setting(self):
+        timer = get_request_timer()
+        self.assertIsInstance(timer, PhaseTimer)
+        self.assertIsNotNone(timer.histograms)
+
+
+class PhaseHistogramsTest(TestCase):
+    def test_buckets(self):
+        histograms = PhaseHistograms(bounds_ms=(1.0, 10.0))
+        histograms.observe('fetch', 0.0005)
+        histograms.observe('fetch', 0.005)
+        histograms.observe('fetch', 0.005)
+        histograms.observe('fetch', 5.0)
+        phase = histograms.snapshot()['phases']['fetch']
+        self.assertEqual(phase['buckets'], [1, 2, 1])
+        self.assertEqual(phase['count'], 4)
+        self.assertAlmostEqual(phase['max_ms'], 5000.0)
+
+    def test_reset(self):
+        histograms = PhaseHistograms()
+        histograms.observe('fetch', 0.001)
+        histograms.reset()
+        self.assertEqual(histograms.snapshot()['phases'], {})
+
+
+class GameInstancePhasesTest(TestCase):
+    def test_instance_phases(self):
+        model = validate_game_model({
+            'name': "game",
+            'description': "a game",
+            'resources': [{'name': "minerals"}],
+            'buildings': [{
+                'name': "miner",
+                'cost': {"minerals": 10.0},
+                'cost_factor': 1.1,
+                'income': {"minerals": 5.0},
+            }],
+            'upgrades': [],
+            'new_game': {'resources': {"minerals": 16.0}},
+        })
+        timer = PhaseTimer()
+        time = datetime(2000, 1, 1)
+        instance = model.load_game_instance(model.new_game, time, timer)
+        instance.purchase_building(time + timedelta(seconds=1), "miner", 1)
+        self.assertEqual(
+            set(timer.phases),
+            {'load', 'fast_forward', 'calculate_values', 'client_state'}
+        )
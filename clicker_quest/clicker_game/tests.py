@@ -1,9 +1,18 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.core.exceptions import ValidationError
 from django.conf import settings
-from clicker_game.models import ClickerGame, GameInstance
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from clicker_game.models import ClickerGame, GameInstance, GameModelVersion
+from clicker_game.game_model import GameModel
+from clicker_game.views import game_action
+from clicker_game.registry import registry
 import factory
+import copy
 import datetime
+import json
+import time
 # Create your tests here.
 
 TEST_GAME = {
@@ -91,6 +100,52 @@ class ClickerGameTest(TestCase):
         self.assertIsInstance(self.game.created, datetime.datetime)
 
 
+class GameModelVersionTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory.create()
+        self.game = ClickerGame.objects.create(owner=self.user, game_data=TEST_GAME, name='Test Game')
+        registry.clear()
+
+    def test_versions_are_stored_once(self):
+        first = self.game.version
+        self.assertEqual(len(first.content_hash), 64)
+        ClickerGame.objects.create(owner=self.user, game_data=copy.deepcopy(TEST_GAME), name='Copy')
+        self.game.name = 'Renamed'
+        self.game.save()
+        self.assertEqual(self.game.version, first)
+        self.assertEqual(GameModelVersion.objects.count(), 1)
+
+    def test_edits_make_new_versions(self):
+        first = self.game.version
+        self.game.game_data = dict(TEST_GAME, description='Edited')
+        self.game.save()
+        self.assertNotEqual(self.game.version, first)
+        self.assertEqual(GameModelVersion.objects.get(pk=first.pk).game_data, TEST_GAME)
+        self.assertEqual(registry.get().content_hash, self.game.version_id)
+
+    def test_instances_record_their_version(self):
+        c = Client()
+        c.force_login(self.user)
+        c.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(GameInstance.objects.get(user=self.user).model_version, self.game.version)
+
+    def test_model_data_is_cacheable(self):
+        url = self.game.version.get_absolute_url()
+        response = Client().get(url)
+        self.assertEqual(response.json(), {
+            'name': 'Test Game',
+            'description': 'Click thing to make quest',
+            'resources': [{'name': 'quests', 'description': 'The All Important Quest'}],
+            'buildings': [{'name': 'Quest Maker', 'description': 'Makes Quests'}],
+            'upgrades': [{'name': 'fleagal power', 'description': 'Harness The Power of <0>'}],
+        })
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        response = Client().get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(Client().get(url.replace(url[-9:-5], '0000')).status_code, 404)
+
+
 class GameValidationTest(TestCase):
     def test_invalid_game_fails_to_save(self):
         user = UserFactory.create()
@@ -137,6 +192,7 @@ class MainViewTest(TestCase):
         self.game_rules.save()
         self.game_instance = GameInstance(user=self.user, game=self.game_rules, data=self.db_json)
         self.game_instance.save()
+        registry.clear()
 
     def test_get_request_html(self):
         c = Client()
@@ -145,6 +201,20 @@ class MainViewTest(TestCase):
         self.assertTemplateUsed(response, 'index.html')
         self.assertIsInstance(response.context['game'], dict)
 
+    def test_get_request_html_has_game_state(self):
+        c = Client()
+        c.force_login(self.user)
+        c.get('/')
+        # the page is all the front end needs to start, and the game is saved once
+        with CaptureQueriesContext(connection) as queries:
+            response = c.get('/')
+        game_queries = [query for query in queries.captured_queries if 'clicker_game_gameinstance' in query['sql']]
+        self.assertEqual(len(game_queries), 2)  # fetched and saved
+        self.assertContains(response, 'id="game_state"')
+        self.assertEqual(json.loads(response.context['game_json']), response.context['game'])
+        self.assertAlmostEqual(
+            float(response.context['game_time']), time.time(), delta=60)
+
     def test_get_request_ajax(self):
         c = Client()
         c.force_login(self.user)
@@ -177,3 +247,76 @@ class MainViewTest(TestCase):
             '/',
             HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertTrue(response.json())
+
+    @override_settings(CLICKER_TIMING=True)
+    def test_server_timing_header(self):
+        c = Client()
+        c.force_login(self.user)
+        response = c.post(
+            '/',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn('fast_forward;dur=', response['Server-Timing'])
+        self.assertIn('save;dur=', response['Server-Timing'])
+
+    def test_server_timing_off_by_default(self):
+        c = Client()
+        c.force_login(self.user)
+        response = c.post(
+            '/',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_post_order(self):
+        c = Client()
+        c.force_login(self.user)
+        response = c.post(
+            '/',
+            {'clicked': 'order', 'type': 'upgrade', 'name': 'fleagal power'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        # the upgrade stays locked until there are 5 quest makers
+        self.assertEqual(response.json()['orders'], [{'upgrade': 'fleagal power'}])
+        response = c.post(
+            '/',
+            {'clicked': 'order', 'type': 'upgrade', 'name': 'fleagal power', 'cancel': 'true'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertNotIn('orders', response.json())
+
+    def test_post_clicks(self):
+        self.game_rules.game_data = copy.deepcopy(self.game_json)
+        self.game_rules.game_data['buildings'].append({
+            'name': 'Quest Clicker',
+            'description': 'Click for Quests',
+            'cost': {'quests': -1},
+            'cost_factor': 1,
+        })
+        self.game_rules.save()
+        self.game_instance.modified = timezone.now() - datetime.timedelta(seconds=10)
+        self.game_instance.save()
+        c = Client()
+        c.force_login(self.user)
+        response = c.post(
+            '/',
+            {'clicked': 'clicks', 'name': 'Quest Clicker', 'count': 5},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        owned = {building['name']: building['owned'] for building in response.json()['buildings']}
+        self.assertEqual(owned['Quest Clicker'], 5)
+        makers = owned['Quest Maker']
+        # the clicks on every building since the last batch come in one request
+        GameInstance.objects.filter(pk=self.game_instance.pk).update(
+            modified=timezone.now() - datetime.timedelta(seconds=10))
+        response = c.post(
+            '/',
+            {'clicked': 'clicks', 'name': ['Quest Clicker', 'Quest Maker', 'Quest Clicker'], 'count': [2, 4, 3]},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        owned = {building['name']: building['owned'] for building in response.json()['buildings']}
+        self.assertEqual(owned['Quest Clicker'], 10)
+        self.assertEqual(owned['Quest Maker'], makers)  # not a click building
+
+    def test_queued_requests_play_in_order(self):
+        game_instance = GameModel(self.game_json).load_game_instance(self.db_json, timezone.now())
+        later = timezone.now()
+        game_action({'clicked': 'building', 'name': 'Quest Maker', 'number_purchased': '1'}, later)(game_instance)
+        # an older request queued behind it never winds the clock back
+        db_json, front_end_json = game_action({}, later - datetime.timedelta(seconds=5))(game_instance)
+        self.assertEqual(game_instance.time, later)
+        self.assertEqual(db_json['buildings'], {'Quest Maker': 3})
@@ -0,0 +1,180 @@
+# coding=utf-8
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+from timeit import default_timer
+
+
+"""
+Per-phase timing instrumentation for game requests.
+
+NULL_TIMER:
+    The timer used when instrumentation is disabled. Its phases are a shared do-nothing
+    context manager, so an uninstrumented request only pays for the `with` statement.
+
+PhaseTimer:
+    Records the wall time spent in each named phase of one request. Phases may nest (the
+    time spent in calculate_values is also counted inside fast_forward) and may repeat, in
+    which case their durations are summed.
+
+    phase(name):
+        Context manager timing a block of code as the named phase.
+
+    server_timing_header():
+        Render the recorded phases as a Server-Timing header value.
+
+    finish(response):
+        Attach the Server-Timing header to a response and add the phase durations to the
+        process-wide histograms.
+
+PhaseHistograms:
+    In-process aggregate of phase durations with fixed logarithmic buckets. The module-level
+    `histograms` instance is what the timings debug view dumps.
+
+get_request_timer():
+    Return a new timer of the class named by the CLICKER_PHASE_TIMER setting if
+    CLICKER_TIMING is on, or NULL_TIMER otherwise.
+"""
+
+
+# upper bounds of the histogram buckets, in milliseconds
+BUCKET_BOUNDS_MS = (
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0
+)
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class NullTimer(object):
+    """Timer that records nothing, for when instrumentation is turned off."""
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def server_timing_header(self):
+        return ""
+
+    def finish(self, response):
+        return response
+
+
+NULL_TIMER = NullTimer()
+
+
+class _Phase(object):
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.timer.clock()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.record(self.name, self.timer.clock() - self.start)
+        return False
+
+
+class PhaseTimer(object):
+    """Records how long each named phase of a single request took."""
+    enabled = True
+    clock = staticmethod(default_timer)
+
+    def __init__(self, histograms=None):
+        self.phases = OrderedDict()
+        self.histograms = histograms
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing_header(self):
+        return ", ".join(
+            "{0};dur={1:.3f}".format(name, seconds * 1000.0)
+            for name, seconds in self.phases.items()
+        )
+
+    def finish(self, response):
+        if self.phases:
+            response['Server-Timing'] = self.server_timing_header()
+            if self.histograms is not None:
+                self.histograms.observe_all(self.phases)
+        return response
+
+
+class PhaseHistograms(object):
+    """Thread safe, process-wide histograms of phase durations."""
+    def __init__(self, bounds_ms=BUCKET_BOUNDS_MS):
+        self.bounds_ms = tuple(bounds_ms)
+        self._lock = Lock()
+        self._phases = OrderedDict()
+
+    def observe_all(self, phases):
+        """Add a dict of {phase name: seconds} to the histograms"""
+        with self._lock:
+            for name, seconds in phases.items():
+                self._observe(name, seconds)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._observe(name, seconds)
+
+    def _observe(self, name, seconds):
+        if name not in self._phases:
+            self._phases[name] = {
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'buckets': [0] * (len(self.bounds_ms) + 1),
+            }
+        phase = self._phases[name]
+        ms = seconds * 1000.0
+        phase['count'] += 1
+        phase['total_ms'] += ms
+        phase['max_ms'] = max(phase['max_ms'], ms)
+        phase['buckets'][bisect_left(self.bounds_ms, ms)] += 1
+
+    def snapshot(self):
+        """Return a json-friendly copy of the histograms"""
+        with self._lock:
+            return {
+                'bounds_ms': list(self.bounds_ms),
+                'phases': OrderedDict(
+                    (name, dict(phase, buckets=list(phase['buckets'])))
+                    for name, phase in self._phases.items()
+                ),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._phases.clear()
+
+
+histograms = PhaseHistograms()
+
+
+def get_request_timer():
+    """Make the timer for a new request according to the CLICKER_TIMING settings"""
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+
+    if not getattr(settings, 'CLICKER_TIMING', False):
+        return NULL_TIMER
+    timer_class = getattr(settings, 'CLICKER_PHASE_TIMER', 'clicker_game.timing.PhaseTimer')
+    return import_string(timer_class)(histograms=histograms)
@@ -1,15 +1,36 @@
+import calendar
+
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponseRedirect
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, Http404
 from django.views.generic import View
-from clicker_game.models import GameInstance, ClickerGame
-import clicker_game.game_model as gm
+from clicker_game.models import ClickerGame, GameInstance, GameModelVersion
+from clicker_game.timing import get_request_timer, histograms
+from clicker_game.allocations import profile as allocation_profile
+from clicker_game.metrics import registry as metrics_registry
+from clicker_game.registry import registry
+from clicker_game.encoding import game_response, page_json
+from clicker_game.coalescing import instance_lock, single_flight
+from clicker_game.routers import pin_to_primary
+from clicker_game.sharding import fetch_user_game, shard_for_user, user_games
+from clicker_game.invalidation import listener
+from clicker_game.guest import (
+    adopt_guest_games, delete_guest_cookies, guest_play_enabled, load_guest_save, save_guest_game)
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.contrib.auth import logout
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import etag
 from registration.backends.simple.views import RegistrationView
 # Create your views here.
 
+MODEL_VERSION_MAX_AGE = 86400 * 365
+
 # The starting resources/buildings/etc for a new game.
 
 
@@ -17,71 +38,220 @@ class MainView(View):
     """The View Used for a clicker game.
 
     if a user is logged in it returns their game instance.
-    Otherwise give a new game instance.
+    Otherwise it plays a guest game kept in a cookie (see clicker_game.guest).
     All post requests are done by ajax requests.
     """
     template_name = 'index.html'
 
-    def get(self, request):
+    @method_decorator(ensure_csrf_cookie)
+    def get(self, request, slug=None):
         current_time = timezone.now()
-        current_game = ClickerGame.objects.all()[0]
-        game_model_data = current_game.game_data
-        game_model = gm.GameModel(game_model_data)
+        if not request.user.is_authenticated() and guest_play_enabled():
+            return self.play_as_guest(request, slug, game_action({}, current_time))
         if request.user.is_authenticated():
-            try:  # To get the user's current game
-                db_instance = GameInstance.objects.get(user=request.user,
-                                                        game=current_game)
-                game_instance = game_model.load_game_instance(
-                    db_instance.data,
-                    db_instance.modified)
-            except ObjectDoesNotExist:  # make a new game instance
-                db_instance = GameInstance(user=request.user, game=current_game)
-                game_instance = game_model.load_game_instance(
-                    game_model.new_game, current_time)
-            db_json, front_end_json = game_instance.get_current_state(
-                current_time)
-            db_instance.data = db_json
-            db_instance.modified = current_time
-            db_instance.save()
+            timer = get_request_timer()
+            entry = get_game_entry(slug)
+            if request.is_ajax():
+                response = self.poll(request, entry, current_time, timer)
+                if response is not None:
+                    return timer.finish(response)
+            # saved under the game's lock, like a post, so it can't write over one
+            game_model, front_end_json, state_time = self.play(
+                request, entry, game_action({}, current_time), current_time, timer)
             if request.is_ajax():
-                game = front_end_json
-                return JsonResponse(game)
+                with timer.phase('encode'):
+                    response = game_response(game_model, front_end_json)
             else:
-                return render(request, self.template_name, {'game': front_end_json})
+                with timer.phase('render'):
+                    response = self.render_game(request, game_model, front_end_json, state_time)
+            return timer.finish(response)
         else:
             return HttpResponseRedirect('/accounts/login/')
 
-    def post(self, request):
-        # Set up the current game instance
+    def post(self, request, slug=None):
         current_time = timezone.now()
-        current_game = ClickerGame.objects.all()[0]
-        game_model_data = current_game.game_data
-        game_model = gm.GameModel(game_model_data)
-        db_instance = GameInstance.objects.get(user=request.user,
-                                                game=current_game)
-        game_instance = game_model.load_game_instance(db_instance.data,
-                                                      db_instance.modified)
-        #import pdb; pdb.set_trace()
-        if request.POST.get('clicked') == 'building':
-            building_name = request.POST.get('name')
-            number_purchased = request.POST.get('number_purchased')
-            db_json, front_end_json = game_instance.purchase_building(
-                current_time, building_name, int(number_purchased))
-        elif request.POST.get('clicked') == 'upgrade':
-            upgrade_name = request.POST.get('name')
-            db_json, front_end_json = game_instance.purchase_upgrade(
-                current_time, upgrade_name)
+        if not request.user.is_authenticated():
+            if not guest_play_enabled():
+                return HttpResponseForbidden()
+            return self.play_as_guest(request, slug, game_action(request.POST, current_time))
+        timer = get_request_timer()
+        entry = get_game_entry(slug)
+        action = game_action(request.POST, current_time)
+        game_model, front_end_json, state_time = self.play(request, entry, action, current_time, timer)
+        with timer.phase('encode'):
+            response = game_response(game_model, front_end_json)
+        return timer.finish(response)
+
+    def play(self, request, entry, action, current_time, timer):
+        """
+        Play an action on the user's game, starting a new one as of current_time if they have
+        none, and save it. Returns the game model, the client state and the time of the state.
+        """
+        def play_batch(close_batch):
+            # Set up the current game instance
+            with instance_lock(request.user.pk, entry.game.pk), pin_to_primary():
+                try:
+                    with timer.phase('fetch'):
+                        db_instance = fetch_game_instance(request.user, entry)
+                    game_entry = registry.check(entry, db_instance.game)
+                    game_instance = game_entry.model.load_game_instance(
+                        db_instance.data,
+                        db_instance.modified,
+                        timer)
+                except ObjectDoesNotExist:  # make a new game instance
+                    game_entry = entry
+                    db_instance = GameInstance(user=request.user, game=entry.game)
+                    game_instance = entry.model.load_game_instance(
+                        entry.model.new_game, current_time, timer)
+                # Requests that came in for this game meanwhile are played
+                # on the same instance, in order
+                for queued_action in close_batch():
+                    db_json, front_end_json = queued_action(game_instance)
+                # Save new info to the database, return the new values to the front end
+                db_instance.data = db_json
+                db_instance.modified = game_instance.time
+                db_instance.model_version_id = game_entry.content_hash
+                with timer.phase('save'):
+                    db_instance.save()
+            return game_entry.model, front_end_json, game_instance.time
+
+        return single_flight.run((request.user.pk, entry.game.pk), action, play_batch)
+
+    def poll(self, request, entry, current_time, timer):
+        """
+        Respond to a poll for the current state of a user's game without saving it, reading it
+        from a replica when there are any. Returns None when the game has to be saved: when it
+        is new, or was saved long enough ago that the offline decay matters.
+        """
+        try:
+            with timer.phase('fetch'):
+                db_instance = fetch_game_instance(request.user, entry)
+        except ObjectDoesNotExist:
+            return None
+        entry = registry.check(entry, db_instance.game)
+        seconds = (current_time - db_instance.modified).total_seconds()
+        max_seconds = getattr(settings, 'CLICKER_POLL_SAVE_SECONDS', 3600)
+        if not 0 <= seconds < max_seconds or entry.model.decay.effective_seconds(seconds) != seconds:
+            return None
+        game_instance = entry.model.load_game_instance(db_instance.data, db_instance.modified, timer)
+        db_json, front_end_json = game_instance.get_current_state(current_time)
+        with timer.phase('encode'):
+            return game_response(entry.model, front_end_json)
+
+    def render_game(self, request, model, front_end_json, time):
+        """
+        Render the game page with the client state in it, as of a time, so the front end
+        starts from it rather than asking for it again
+        """
+        return render(request, self.template_name, {
+            'game': front_end_json,
+            'game_json': page_json(model, front_end_json),
+            'game_time': '{0:.3f}'.format(calendar.timegm(time.utctimetuple()) + time.microsecond / 1e6),
+        })
+
+    def play_as_guest(self, request, slug, action):
+        """Play an action on a guest's game, kept in a signed cookie rather than the database"""
+        timer = get_request_timer()
+        entry = get_game_entry(slug)
+        saved = load_guest_save(request, entry.game.pk)
+        if saved is None:
+            game_instance = entry.model.load_game_instance(
+                entry.model.new_game, timezone.now(), timer)
+        else:
+            game_instance = entry.model.load_game_instance(saved[0], saved[1], timer)
+        db_json, front_end_json = action(game_instance)
+        if request.method == 'POST' or request.is_ajax():
+            with timer.phase('encode'):
+                response = game_response(entry.model, front_end_json)
         else:
-            db_json, front_end_json = game_instance.get_current_state(
-                current_time)
-        # Save new info to the database, return the new values to the front end
-        db_instance.data = db_json
-        db_instance.modified = current_time
-        db_instance.save()
-        game = front_end_json
-        return JsonResponse(game)
+            with timer.phase('render'):
+                response = self.render_game(request, entry.model, front_end_json, game_instance.time)
+        with timer.phase('save'):
+            save_guest_game(response, entry.game.pk, db_json, game_instance.time)
+        return timer.finish(response)
+
+
+def get_game_entry(slug):
+    """The registry entry of the game with a slug, or the default game"""
+    listener.ensure_started()
+    entry = registry.get(slug)
+    if entry is None:
+        raise Http404("No such game")
+    return entry
+
+
+def fetch_game_instance(user, entry):
+    """
+    Get a user's instance of a game along with the game in a single query,
+    leaving out the game data that the registry has already compiled
+    """
+    if listener.listening():
+        # the registry hears about edited games, so they needn't be checked here
+        db_instance = fetch_user_game(user.pk, entry.game.pk)
+        db_instance.game = entry.game
+        return db_instance
+    if shard_for_user(user.pk) is None:
+        return fetch_user_game(user.pk, entry.game.pk, user_games(user.pk).select_related(
+            'game').defer('game__game_data'))
+    # the game is on another database than the user's shard, so it takes a query of its own
+    db_instance = fetch_user_game(user.pk, entry.game.pk)
+    db_instance.game = ClickerGame.objects.defer('game_data').get(pk=entry.game.pk)
+    return db_instance
+
+
+def game_action(post, current_time):
+    """
+    Return a function that plays the action a post request asks for on a game
+    instance, and returns the (game state, client data) tuple. The request is
+    read here, so a bad one fails on its own rather than in a batch.
+    """
+    # a request queued behind another one may be a little older than it
+    def now(game_instance):
+        return max(current_time, game_instance.time)
+
+    if post.get('clicked') == 'building':
+        building_name = post.get('name')
+        number_purchased = int(post.get('number_purchased'))
+        return lambda game_instance: game_instance.purchase_building(
+            now(game_instance), building_name, number_purchased)
+    elif post.get('clicked') == 'upgrade':
+        upgrade_name = post.get('name')
+        return lambda game_instance: game_instance.purchase_upgrade(
+            now(game_instance), upgrade_name)
+    elif post.get('clicked') == 'clicks':
+        # a name and a count for each building clicked since the last batch
+        clicks = [(name, int(count)) for name, count in zip(post.getlist('name'), post.getlist('count'))]
+        max_clicks = getattr(settings, 'CLICKER_MAX_CLICKS_PER_SECOND', 20)
+        return lambda game_instance: game_instance.record_click_batch(
+            now(game_instance), clicks, max_clicks)
+    elif post.get('clicked') == 'order':
+        order = {
+            post.get('type'): post.get('name'),
+            'up_to': post.get('up_to'),
+        }
+        if post.get('cancel'):
+            return lambda game_instance: game_instance.cancel_order(
+                now(game_instance), order)
+        return lambda game_instance: game_instance.place_order(
+            now(game_instance), order)
+    return lambda game_instance: game_instance.get_current_state(
+        now(game_instance))
+
 
 class UserRegistration(RegistrationView):
+    adopted = ()
+
+    def register(self, form):
+        user = super(UserRegistration, self).register(form)
+        # games played as a guest carry on as the new user's
+        self.adopted = adopt_guest_games(self.request, user)
+        return user
+
+    def form_valid(self, form):
+        response = super(UserRegistration, self).form_valid(form)
+        delete_guest_cookies(response, self.adopted)
+        return response
+
     def get_success_url(self, user):
         return reverse_lazy('game_page')
 
@@ -93,3 +263,42 @@ def logged_in(request):
 def logged_out(request):
     logout(request)
     return HttpResponseRedirect(reverse('game_page'))
+
+
+@staff_member_required
+def phase_timings(request):
+    """Dump the in-process phase timing histograms of this worker as json."""
+    return JsonResponse(histograms.snapshot())
+
+
+@staff_member_required
+def allocations(request):
+    """Dump the in-process allocation profile of this worker as json; see clicker_game.allocations."""
+    return JsonResponse(allocation_profile.snapshot())
+
+
+def prometheus_metrics(request):
+    """
+    Request metrics of every worker in Prometheus text format, for scrapers that send the
+    CLICKER_METRICS_TOKEN as a bearer token, or come from CLICKER_METRICS_ALLOWED_IPS.
+    """
+    token = getattr(settings, 'CLICKER_METRICS_TOKEN', None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not (token and constant_time_compare(authorization, 'Bearer ' + token) or
+            request.META.get('REMOTE_ADDR') in getattr(settings, 'CLICKER_METRICS_ALLOWED_IPS', ())):
+        raise Http404
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@cache_control(public=True, max_age=MODEL_VERSION_MAX_AGE, immutable=True)
+@etag(lambda request, content_hash: content_hash)
+def game_model_version(request, content_hash):
+    """
+    What players see of a published version of a game model, which never changes, so caches can
+    keep it for good. This is public, so it leaves out everything but names and descriptions.
+    """
+    try:
+        version = GameModelVersion.objects.get(pk=content_hash)
+    except GameModelVersion.DoesNotExist:
+        raise Http404("No such game model")
+    return JsonResponse(version.client_data())
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import sys
 import dj_database_url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -42,11 +43,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'clicker_game.metrics.RequestMetricsMiddleware',
+    'clicker_game.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'clicker_game.auth_cache.CachedAuthenticationMiddleware',
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -81,6 +84,79 @@ DATABASES = {
         default=os.environ.get('DATABASE_URL'))
 }
 
+# Read replicas, as a comma separated list of database urls (sqlite ones work as stand-ins
+# locally). Reads that don't need the latest writes go to them; see clicker_game/routers.py.
+# After a request writes, that browser's reads stay on the primary for CLICKER_REPLICA_LAG_SECONDS,
+# which should be longer than the replicas ever lag behind.
+
+CLICKER_REPLICAS = []
+for number, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = 'replica_{0}'.format(number)
+    DATABASES[alias] = dict(dj_database_url.parse(url.strip()), TEST={'MIRROR': 'default'})
+    CLICKER_REPLICAS.append(alias)
+CLICKER_REPLICA_LAG_SECONDS = float(os.environ.get('CLICKER_REPLICA_LAG_SECONDS', 5))
+
+# Game instance shards, as a comma separated list of database urls: each user's game instances
+# are kept on one of them, and everything else on the default database; see
+# clicker_game/sharding.py. Only ever add shards at the end, and while rebalancing set
+# CLICKER_PREVIOUS_SHARD_COUNT to the number there were before.
+
+CLICKER_SHARDS = []
+for number, url in enumerate(filter(None, os.environ.get('DATABASE_SHARD_URLS', '').split(','))):
+    alias = 'shard_{0}'.format(number)
+    DATABASES[alias] = dj_database_url.parse(url.strip())
+    CLICKER_SHARDS.append(alias)
+CLICKER_PREVIOUS_SHARDS = CLICKER_SHARDS[:int(os.environ.get('CLICKER_PREVIOUS_SHARD_COUNT', 0))]
+DATABASE_ROUTERS = ['clicker_game.sharding.ShardRouter', 'clicker_game.routers.ReplicaRouter']
+
+# Ajax polls for the state of a game read it without saving it (from a replica when there are
+# any) until it was last saved this many seconds ago, or its game's offline decay would start
+# slowing it down.
+
+CLICKER_POLL_SAVE_SECONDS = 3600
+
+# Compiled game models are kept in this file (see clicker_game/snapshots.py) so that new
+# worker processes load them instead of compiling them, and with CLICKER_WARM_START on the
+# WSGI entry point loads every game before the first request comes in. Workers map the file
+# read-only and only load the models of the games they serve, each into its own memory.
+
+CLICKER_MODEL_SNAPSHOT = os.environ.get('CLICKER_MODEL_SNAPSHOT')
+CLICKER_WARM_START = os.environ.get('CLICKER_WARM_START') != "False"
+
+# With Postgres and CLICKER_MODEL_LISTENER set to True, each worker listens for games being
+# edited (see clicker_game/invalidation.py) instead of checking the game on each request, and
+# checks them all every so often in case it missed one. It is never on for the test suite,
+# whose uncommitted data the listener's own connections can't see.
+
+CLICKER_MODEL_LISTENER = os.environ.get('CLICKER_MODEL_LISTENER') == "True" and sys.argv[1:2] != ['test']
+CLICKER_MODEL_CHECK_SECONDS = 60.0
+
+# Sessions and logged in users, which every game request reads, are kept in the cache when
+# CLICKER_CACHE_LOCATION names a shared cache (memcached through python-memcached, unless
+# CLICKER_CACHE_BACKEND names another), so game requests only
+# query for their game instance (see clicker_game/auth_cache.py), and on Postgres its lock. A cache of each process's own
+# wouldn't hear about logouts and password changes in the others, so without one sessions
+# and users come from the database. CLICKER_SESSION_ENGINE can also be set to
+# 'django.contrib.sessions.backends.signed_cookies', which needs no cache, but can't end
+# copies of a session on logout. SessionAuthenticationMiddleware turns on the check that
+# ends sessions when their user's password changes.
+
+CLICKER_CACHE_LOCATION = os.environ.get('CLICKER_CACHE_LOCATION')
+if CLICKER_CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': os.environ.get(
+                'CLICKER_CACHE_BACKEND', 'django.core.cache.backends.memcached.MemcachedCache'),
+            'LOCATION': CLICKER_CACHE_LOCATION.split(','),
+        }
+    }
+SESSION_ENGINE = os.environ.get('CLICKER_SESSION_ENGINE', (
+    'django.contrib.sessions.backends.cached_db' if CLICKER_CACHE_LOCATION
+    else 'django.contrib.sessions.backends.db'
+))
+CLICKER_AUTH_CACHE = 'default' if CLICKER_CACHE_LOCATION else None
+CLICKER_AUTH_CACHE_SECONDS = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -121,3 +197,52 @@ USE_TZ = True
 STATIC_URL = "/static/"
 STATIC_ROOT = "static"
 STATICFILES_DIRS = []
+
+
+# Game request instrumentation
+# Per-phase timings are sent in a Server-Timing header and aggregated in-process
+# when this is on; see clicker_game/timing.py. Set CLICKER_PHASE_TIMER to
+# 'clicker_game.allocations.GCTimer' to time garbage collection pauses too, or to
+# 'clicker_game.allocations.AllocationTimer' for allocation profiling (not for production).
+
+CLICKER_TIMING = os.environ.get('CLICKER_TIMING') == "True"
+CLICKER_PHASE_TIMER = os.environ.get('CLICKER_PHASE_TIMER', 'clicker_game.timing.PhaseTimer')
+
+# Request metrics, served in Prometheus format at /metrics to scrapers that send
+# CLICKER_METRICS_TOKEN as a bearer token, or come from one of the comma separated
+# CLICKER_METRICS_ALLOWED_IPS. Neither is set by default, so /metrics answers no one. Behind
+# a reverse proxy on the same host every request comes from 127.0.0.1, so listing it there
+# makes the metrics public; use the token instead.
+# Set CLICKER_METRICS_DIR to a directory shared by all the worker processes of a
+# prefork server (such as gunicorn) so that /metrics covers every worker.
+
+CLICKER_METRICS = os.environ.get('CLICKER_METRICS') != "False"
+CLICKER_METRICS_DB = os.environ.get('CLICKER_METRICS_DB') != "False"
+CLICKER_METRICS_DIR = os.environ.get('CLICKER_METRICS_DIR')
+CLICKER_METRICS_FLUSH_SECONDS = 5.0
+CLICKER_METRICS_TOKEN = os.environ.get('CLICKER_METRICS_TOKEN')
+CLICKER_METRICS_ALLOWED_IPS = list(filter(None, os.environ.get('CLICKER_METRICS_ALLOWED_IPS', '').split(',')))
+
+# Game responses
+# The fragment encoder splices in json for the static parts of each game model that it
+# encodes only once; clicker_game.encoding.StandardEncoder is the plain json encoder
+
+CLICKER_RESPONSE_ENCODER = 'clicker_game.encoding.FragmentEncoder'
+
+# Clicks on click buildings are counted by the client and sent in batches; batches are
+# capped at this many clicks per second since the player's game was last saved
+
+CLICKER_MAX_CLICKS_PER_SECOND = 20
+
+# Concurrent requests for one player's game are played in order on a single load and
+# save (see clicker_game/coalescing.py). Advisory locks make the worker processes take
+# turns with each game as well when the database is Postgres.
+
+CLICKER_SINGLE_FLIGHT = os.environ.get('CLICKER_SINGLE_FLIGHT') != "False"
+CLICKER_ADVISORY_LOCKS = os.environ.get('CLICKER_ADVISORY_LOCKS') != "False"
+
+# Guests play without signing in, with their games kept in signed cookies instead of the
+# database (see clicker_game/guest.py); signing up keeps the games they have played.
+
+CLICKER_GUEST_PLAY = os.environ.get('CLICKER_GUEST_PLAY') != "False"
+CLICKER_GUEST_MAX_AGE = 86400 * 365
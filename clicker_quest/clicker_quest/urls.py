@@ -15,11 +15,18 @@ Including another URLconf
 """
 from django.conf.urls import url, include
 from django.contrib import admin
-from clicker_game.views import MainView, UserRegistration, logged_in, logged_out
+from clicker_game.views import (
+    MainView, UserRegistration, allocations, game_model_version, logged_in, logged_out, phase_timings,
+    prometheus_metrics)
 
 urlpatterns = [
     url(r'^$', MainView.as_view(), name='game_page'),
+    url(r'^games/(?P<slug>[-\w]+)/$', MainView.as_view(), name='game'),
+    url(r'^models/(?P<content_hash>[0-9a-f]{64})\.json$', game_model_version, name='game_model_version'),
     url(r'^admin/', admin.site.urls),
+    url(r'^debug/timings/$', phase_timings, name='phase_timings'),
+    url(r'^debug/allocations/$', allocations, name='allocations'),
+    url(r'^metrics$', prometheus_metrics, name='metrics'),
     url(r'^logout/$', logged_out),
     url(r'^accounts/profile/$', logged_in),
     url(r'^accounts/register', UserRegistration.as_view(), name='register'),
@@ -7,10 +7,20 @@ For more information on this file, see
 https://docs.djangoproject.com/en/1.9/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "clicker_quest.settings")
 
 application = get_wsgi_application()
+
+# compile (or load from the snapshot) every game's model before serving the first request
+if getattr(settings, 'CLICKER_WARM_START', False):
+    from clicker_game.registry import registry
+    try:
+        logging.getLogger('clicker_game').info("Warm start took %.3fs", registry.warm_start())
+    except Exception:
+        logging.getLogger('clicker_game').warning("Warm start failed", exc_info=True)